@@ -0,0 +1,6 @@
+// Null benchmark, for measuring the overhead of the iterations runner.
+
+class NullBenchmark implements BaseKrunEntry {
+    public void run_iter(int param) {
+    }
+}
@@ -0,0 +1,7 @@
+/* Null benchmark, for measuring the overhead of the iterations runner */
+
+void
+run_iter(int param)
+{
+    (void) param;
+}
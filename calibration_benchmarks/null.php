@@ -0,0 +1,7 @@
+<?php
+// Null benchmark, for measuring the overhead of the iterations runner.
+
+function run_iter($n) {
+}
+
+?>
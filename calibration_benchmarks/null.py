@@ -0,0 +1,5 @@
+# Null benchmark, for measuring the overhead of the iterations runner.
+
+
+def run_iter(n):
+    pass
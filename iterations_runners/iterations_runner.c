@@ -1,6 +1,12 @@
 /*
  * Iterations runner for C benchmarks.
  *
+ * libkruntime stores the measurements of each iteration, and they are handed
+ * to Krun at the end by krun_export_store() (see krun/results_channel.py).
+ *
+ * Each iteration calls the benchmark as many times as Krun asks for in
+ * KRUN_INNER_REPEATS (once by default).
+ *
  * Code style here is KNF, but with 4 spaces instead of tabs.
  */
 
@@ -23,32 +29,6 @@
 
 // Private protos
 int convert_str_to_int(char *s);
-void emit_per_core_data(char *name, int num_cores, int num_iters, uint64_t **data);
-
-void
-emit_per_core_data(char *name, int num_cores, int num_iters, uint64_t **data)
-{
-    int core, iter_num;
-
-    fprintf(stdout, "\"%s\": [", name);
-    for (core = 0; core < num_cores; core++) {
-        fprintf(stdout, "[");
-
-        for (iter_num = 0; iter_num < num_iters; iter_num++) {
-            fprintf(stdout, "%" PRIu64, data[core][iter_num]);
-
-            if (iter_num < num_iters - 1) {
-                fprintf(stdout, ", ");
-            }
-        }
-
-        fprintf(stdout, "]");
-        if (core < num_cores - 1) {
-            fprintf(stdout, ", ");
-        }
-    }
-    fprintf(stdout, "]");
-}
 
 int
 convert_str_to_int(char *s)
@@ -86,12 +66,12 @@ main(int argc, char **argv)
 {
     char     *krun_benchmark = 0;
     int       krun_total_iters = 0, krun_param = 0, krun_iter_num = 0;
-    int       krun_debug = 0, krun_num_cores = 0, krun_core, krun_instrument = 0;
+    int       krun_inner_repeats = 0, krun_next_repeats = 0;
+    int       krun_repeat_num = 0;
+    double    krun_batch_start = 0;
+    int       krun_debug = 0, krun_instrument = 0;
     void     *krun_dl_handle = 0;
     int     (*krun_bench_func)(int); /* func ptr to benchmark entry */
-    double   *krun_wallclock_times = NULL;
-    uint64_t **krun_cycle_counts = NULL, **krun_aperf_counts = NULL;
-    uint64_t **krun_mperf_counts = NULL;
 
     if (argc < 5) {
         usage();
@@ -107,8 +87,7 @@ main(int argc, char **argv)
         usage();
     }
 
-    krun_init();
-    krun_num_cores = krun_get_num_cores();
+    krun_init_iters(krun_total_iters);
 
     krun_dl_handle = dlopen(krun_benchmark, RTLD_NOW | RTLD_LOCAL);
     if (krun_dl_handle == NULL) {
@@ -123,30 +102,25 @@ main(int argc, char **argv)
         goto clean;
     }
 
-    /* Allocate arrays */
-    krun_wallclock_times = krun_xcalloc(krun_total_iters, sizeof(double));
-    krun_cycle_counts = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
-    krun_aperf_counts = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
-    krun_mperf_counts = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
-    for (krun_core = 0; krun_core < krun_num_cores; krun_core++) {
-        krun_cycle_counts[krun_core] =
-            krun_xcalloc(krun_total_iters, sizeof(uint64_t));
-        krun_aperf_counts[krun_core] =
-            krun_xcalloc(krun_total_iters, sizeof(uint64_t));
-        krun_mperf_counts[krun_core] =
-            krun_xcalloc(krun_total_iters, sizeof(uint64_t));
-    }
-
-    /* Set default values */
-    for (krun_iter_num = 0; krun_iter_num < krun_total_iters;
-            krun_iter_num++) {
-        for (krun_core = 0; krun_core < krun_num_cores; krun_core++) {
-            krun_cycle_counts[krun_core][krun_iter_num] = 0;
-            krun_aperf_counts[krun_core][krun_iter_num] = 0;
-            krun_mperf_counts[krun_core][krun_iter_num] = 0;
-        }
-        krun_wallclock_times[krun_iter_num] = 0;
+    /*
+     * In auto mode, find how many calls make an iteration long enough, in
+     * batches which aren't measured.
+     */
+    krun_inner_repeats = krun_get_inner_repeats();
+    if (krun_inner_repeats == 0) {
+        krun_next_repeats = 1;
+        do {
+            krun_inner_repeats = krun_next_repeats;
+            krun_batch_start = krun_clock_gettime_monotonic();
+            for (krun_repeat_num = 0; krun_repeat_num < krun_inner_repeats;
+                krun_repeat_num++) {
+                (void) (*krun_bench_func)(krun_param);
+            }
+            krun_next_repeats = krun_next_inner_repeats(krun_inner_repeats,
+                krun_clock_gettime_monotonic() - krun_batch_start);
+        } while (krun_next_repeats != krun_inner_repeats);
     }
+    krun_set_inner_repeats(krun_inner_repeats);
 
     /* Main loop */
     for (krun_iter_num = 0; krun_iter_num < krun_total_iters;
@@ -159,63 +133,18 @@ main(int argc, char **argv)
 
         /* Start timed section */
         krun_measure(0);
-        (void) (*krun_bench_func)(krun_param);
+        for (krun_repeat_num = 0; krun_repeat_num < krun_inner_repeats;
+            krun_repeat_num++) {
+            (void) (*krun_bench_func)(krun_param);
+        }
         krun_measure(1);
         /* End timed section */
-
-        /* Extract and store wallclock data from libkruntime */
-        krun_wallclock_times[krun_iter_num] =
-            krun_get_wallclock(1) - krun_get_wallclock(0);
-
-        /* Same for per-core measurements */
-        for (krun_core = 0; krun_core < krun_num_cores; krun_core++ ) {
-            krun_cycle_counts[krun_core][krun_iter_num] =
-                krun_get_core_cycles(1, krun_core) -
-                krun_get_core_cycles(0, krun_core);
-            krun_aperf_counts[krun_core][krun_iter_num] =
-                krun_get_aperf(1, krun_core) - krun_get_aperf(0, krun_core);
-            krun_mperf_counts[krun_core][krun_iter_num] =
-                krun_get_mperf(1, krun_core) - krun_get_mperf(0, krun_core);
-        }
-    }
-
-    /* Emit results */
-    fprintf(stdout, "{ \"wallclock_times\": [");
-    for (krun_iter_num = 0; krun_iter_num < krun_total_iters;
-        krun_iter_num++) {
-        fprintf(stdout, "%f", krun_wallclock_times[krun_iter_num]);
-
-        if (krun_iter_num < krun_total_iters - 1) {
-            fprintf(stdout, ", ");
-        }
     }
-    fprintf(stdout, "], ");
-
-    emit_per_core_data("core_cycle_counts", krun_num_cores, krun_total_iters,
-            krun_cycle_counts);
-    fprintf(stdout, ", ");
 
-    emit_per_core_data("aperf_counts", krun_num_cores, krun_total_iters,
-            krun_aperf_counts);
-    fprintf(stdout, ", ");
-
-    emit_per_core_data("mperf_counts", krun_num_cores, krun_total_iters,
-            krun_mperf_counts);
-
-    fprintf(stdout, "}\n");
+    /* Hand the measurements stored by libkruntime to Krun */
+    krun_export_store();
 
 clean:
-    /* Free up allocations */
-    for (krun_core = 0; krun_core < krun_num_cores; krun_core++) {
-        free(krun_cycle_counts[krun_core]);
-        free(krun_aperf_counts[krun_core]);
-        free(krun_mperf_counts[krun_core]);
-    }
-    free(krun_wallclock_times);
-    free(krun_cycle_counts);
-    free(krun_aperf_counts);
-    free(krun_mperf_counts);
-
     if (krun_dl_handle != NULL) {
         dlclose(krun_dl_handle);
     }
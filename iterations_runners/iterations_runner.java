@@ -4,7 +4,6 @@
 // This is not quite ideal. We should use CLOCK_MONOTONIC_RAW instead.
 // For this reason we use JNI to make a call to clock_gettime() ourselves.
 
-import java.util.Arrays;
 import java.util.List;
 
 // Instrumentation imports
@@ -132,6 +131,7 @@ class IterationsRunner {
     }
 
     public static native void JNI_krun_init();
+    public static native void JNI_krun_init_iters(int iterations);
     public static native void JNI_krun_done();
     public static native void JNI_krun_measure(int mindex);
     public static native double JNI_krun_get_wallclock(int mindex);
@@ -140,27 +140,11 @@ class IterationsRunner {
     public static native long JNI_krun_get_aperf(int mindex, int core);
     public static native long JNI_krun_get_mperf(int mindex, int core);
     public static native int JNI_krun_get_num_cores();
-
-    /* Prints signed longs for the per-core measurements */
-    private static void emitPerCoreResults(String name, int numCores, long[][] array) {
-        System.out.print("\"" + name + "\": [");
-
-        for (int core = 0; core < numCores; core++) {
-            System.out.print("[");
-            for (int i = 0; i < array[core].length; i++) {
-                System.out.print(Long.toUnsignedString(array[core][i]));
-
-                if (i < array[core].length - 1) {
-                    System.out.print(", ");
-                }
-            }
-            System.out.print("]");
-            if (core < numCores - 1) {
-                System.out.print(", ");
-            }
-        }
-        System.out.print("]");
-    }
+    public static native void JNI_krun_export_store();
+    public static native int JNI_krun_get_inner_repeats();
+    public static native int JNI_krun_next_inner_repeats(int innerRepeats,
+        double elapsed);
+    public static native void JNI_krun_set_inner_repeats(int innerRepeats);
 
     public static void usage() {
         System.out.println("usage: iterations_runner <benchmark> " +
@@ -206,34 +190,30 @@ class IterationsRunner {
         Object instance = constructors[0].newInstance();
         BaseKrunEntry ke = (BaseKrunEntry) instance; // evil
 
-        IterationsRunner.JNI_krun_init();
-        int numCores = IterationsRunner.JNI_krun_get_num_cores();
-
-        double[] wallclockTimes = new double[iterations];
-        Arrays.fill(wallclockTimes, 0);
-
-        /*
-         * Core-cycle/aperf/mperf values are unsigned 64-bit, whereas Java long
-         * is signed 64-bit. We are safe since:
-         *
-         *   - The only arithmetic we use is subtract, which is the same
-         *     operation regardless of sign (due to two's compliment).
-         *
-         *   - Comaprisons use Long.compareUnsigned.
-         *
-         *   - We print the result using toUnsignedString, thus interpreting
-         *     the number as unsigned.
-         */
-        long[][] cycleCounts = new long[numCores][iterations];
-        long[][] aperfCounts = new long[numCores][iterations];
-        long[][] mperfCounts = new long[numCores][iterations];
-
-        /* longs default to zero, but we explicitely zero to force allocation */
-        for (int core = 0; core < numCores; core++) {
-            Arrays.fill(cycleCounts[core], 0);
-            Arrays.fill(aperfCounts[core], 0);
-            Arrays.fill(mperfCounts[core], 0);
+        // libkruntime stores the measurements of each iteration in
+        // JNI_krun_measure(1).
+        IterationsRunner.JNI_krun_init_iters(iterations);
+
+        // Each iteration calls the benchmark as many times as Krun asks for
+        // in KRUN_INNER_REPEATS. In auto mode, find how many calls make an
+        // iteration long enough, in batches which aren't measured.
+        int innerRepeats = IterationsRunner.JNI_krun_get_inner_repeats();
+        if (innerRepeats == 0) {
+            int nextRepeats = 1;
+            while (nextRepeats != innerRepeats) {
+                innerRepeats = nextRepeats;
+                double batchStart =
+                    IterationsRunner.JNI_krun_clock_gettime_monotonic();
+                for (int j = 0; j < innerRepeats; j++) {
+                    ke.run_iter(param);
+                }
+                nextRepeats = IterationsRunner.JNI_krun_next_inner_repeats(
+                    innerRepeats,
+                    IterationsRunner.JNI_krun_clock_gettime_monotonic() -
+                    batchStart);
+            }
         }
+        IterationsRunner.JNI_krun_set_inner_repeats(innerRepeats);
 
         for (int i = 0; i < iterations; i++) {
             if (debug) {
@@ -242,7 +222,9 @@ class IterationsRunner {
 
             // Start timed section
             IterationsRunner.JNI_krun_measure(0);
-            ke.run_iter(param);
+            for (int j = 0; j < innerRepeats; j++) {
+                ke.run_iter(param);
+            }
             IterationsRunner.JNI_krun_measure(1);
             // End timed section
 
@@ -254,45 +236,11 @@ class IterationsRunner {
                 System.err.flush();
                 sb.setLength(0);  // clear
             }
-
-            // Extract measurements
-            wallclockTimes[i] = IterationsRunner.JNI_krun_get_wallclock(1) -
-                IterationsRunner.JNI_krun_get_wallclock(0);
-
-            for (int core = 0; core < numCores; core++) {
-                cycleCounts[core][i] =
-                    IterationsRunner.JNI_krun_get_core_cycles(1, core) -
-                    IterationsRunner.JNI_krun_get_core_cycles(0, core);
-                aperfCounts[core][i] =
-                    IterationsRunner.JNI_krun_get_aperf(1, core) -
-                    IterationsRunner.JNI_krun_get_aperf(0, core);
-                mperfCounts[core][i] =
-                    IterationsRunner.JNI_krun_get_mperf(1, core) -
-                    IterationsRunner.JNI_krun_get_mperf(0, core);
-            }
         }
 
+        // Hand the measurements to Krun
+        System.out.flush();
+        IterationsRunner.JNI_krun_export_store();
         IterationsRunner.JNI_krun_done();
-
-        // Emit measurements
-        System.out.print("{");
-
-        System.out.print("\"wallclock_times\": [");
-        for (int i = 0; i < iterations; i++) {
-            System.out.print(wallclockTimes[i]);
-            if (i < iterations - 1) {
-                System.out.print(", ");
-            }
-        }
-        System.out.print("], ");
-
-        // per-core measurements
-        IterationsRunner.emitPerCoreResults("core_cycle_counts", numCores, cycleCounts);
-        System.out.print(", ");
-        IterationsRunner.emitPerCoreResults("aperf_counts", numCores, aperfCounts);
-        System.out.print(", ");
-        IterationsRunner.emitPerCoreResults("mperf_counts", numCores, mperfCounts);
-
-        System.out.print("}\n");
     }
 }
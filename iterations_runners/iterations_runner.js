@@ -6,6 +6,20 @@
 //   krun_get_num_cores()
 //   krun_get_{core_cycles,aperf,mperf}_double()
 //   krun_get_wallclock()
+//
+// and, if possible, to:
+//
+//   krun_get_deltas_double(iter, wallclock_times, core_cycles, aperf, mperf)
+//
+// which stores one iteration's deltas at index 'iter' of the given
+// Float64Array and arrays of (per-core) Float64Arrays, in one call. Better
+// still is if the VM offers:
+//
+//   krun_init_iters(num_iters)
+//   krun_export_store()
+//
+// in which case libkruntime stores the measurements itself, and hands them to
+// Krun at the end, so the runner needn't keep or print any.
 
 function emitPerCoreResults(name, num_cores, ary) {
     write('"' + name + '": [')
@@ -26,6 +40,28 @@ function emitPerCoreResults(name, num_cores, ary) {
     write("]")
 }
 
+function emitResults() {
+    write("{")
+
+    write('"wallclock_times": [')
+    for (BM_i = 0; BM_i < BM_n_iters; BM_i++) {
+        write(BM_wallclock_times[BM_i]);
+
+        if (BM_i < BM_n_iters - 1) {
+            write(", ")
+        }
+    }
+    write("], ")
+
+    emitPerCoreResults("core_cycle_counts", BM_num_cores, BM_cycle_counts)
+    write(", ")
+    emitPerCoreResults("aperf_counts", BM_num_cores, BM_aperf_counts)
+    write(", ")
+    emitPerCoreResults("mperf_counts", BM_num_cores, BM_mperf_counts)
+
+    write("}")
+}
+
 function usage() {
     throw "\nusage: iterations_runner.js <benchmark> <# of iterations> " +
           "<benchmark param>\n       <debug flag> [instrumentation dir] [key] " +
@@ -49,12 +85,22 @@ if (BM_instrument && (this.arguments.length != 7)) {
 
 load(BM_entry_point);
 
-krun_init();
-var BM_num_cores = krun_get_num_cores();
+var BM_store = typeof krun_init_iters === "function" &&
+    typeof krun_export_store === "function";
+var BM_num_cores = 0;
+var BM_batched_deltas = typeof krun_get_deltas_double === "function";
+
+if (BM_store) {
+    // libkruntime stores the measurements of each iteration in krun_measure(1).
+    krun_init_iters(BM_n_iters);
+} else {
+    krun_init();
+    BM_num_cores = krun_get_num_cores();
+}
 
-// Pre-allocate and fill arrays.
+// Pre-allocate and fill arrays (empty if libkruntime stores the measurements).
 // We use typed arrays to encourage type stability.
-var BM_wallclock_times = new Float64Array(BM_n_iters);
+var BM_wallclock_times = new Float64Array(BM_store ? 0 : BM_n_iters);
 BM_wallclock_times.fill(-0.0);
 
 var BM_cycle_counts = new Array(BM_num_cores);
@@ -83,7 +129,17 @@ for (BM_i = 0; BM_i < BM_n_iters; BM_i++) {
     krun_measure(1);
     // End timed section
 
+    if (BM_store) {
+        continue;  // Already stored by libkruntime
+    }
+
     // Compute deltas
+    if (BM_batched_deltas) {
+        krun_get_deltas_double(BM_i, BM_wallclock_times, BM_cycle_counts,
+                               BM_aperf_counts, BM_mperf_counts);
+        continue;
+    }
+
     BM_wallclock_times[BM_i] = krun_get_wallclock(1) - krun_get_wallclock(0);
 
     for (BM_core = 0; BM_core < BM_num_cores; BM_core++) {
@@ -99,25 +155,10 @@ for (BM_i = 0; BM_i < BM_n_iters; BM_i++) {
     }
 }
 
-krun_done();
-
-// Emit measurements
-write("{")
-
-write('"wallclock_times": [')
-for (BM_i = 0; BM_i < BM_n_iters; BM_i++) {
-    write(BM_wallclock_times[BM_i]);
-
-    if (BM_i < BM_n_iters - 1) {
-        write(", ")
-    }
+if (BM_store) {
+    krun_export_store();
+    krun_done();
+} else {
+    krun_done();
+    emitResults();
 }
-write("], ")
-
-emitPerCoreResults("core_cycle_counts", BM_num_cores, BM_cycle_counts)
-write(", ")
-emitPerCoreResults("aperf_counts", BM_num_cores, BM_aperf_counts)
-write(", ")
-emitPerCoreResults("mperf_counts", BM_num_cores, BM_mperf_counts)
-
-write("}")
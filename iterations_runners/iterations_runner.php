@@ -7,6 +7,12 @@
  *  krun_get_num_cores();
  *  krun_get_wallclock();
  *  krun_get_{core_cycles,aperf,mperf}_double();
+ *
+ * If the VM also offers:
+ *  krun_init_iters();
+ *  krun_export_store();
+ * then libkruntime stores the measurements itself, and hands them to Krun at
+ * the end, so the runner needn't keep or print any.
  */
 
 function usage() {
@@ -42,6 +48,29 @@ if (!function_exists("run_iter")) {
     throw new RuntimeException("Benchmark is missing a 'run_iter' function");
 }
 
+if (function_exists("krun_init_iters") &&
+        function_exists("krun_export_store")) {
+    // libkruntime stores the measurements of each iteration in krun_measure(1).
+    krun_init_iters((int) $BM_iters);
+
+    for ($BM_i = 0; $BM_i < $BM_iters; $BM_i++) {
+        if ($BM_debug) {
+            fprintf(STDERR, "[iterations_runner.php] iteration %d/%d\n", $BM_i + 1, $BM_iters);
+        }
+
+        // Start timed section
+        krun_measure(0);
+        run_iter($BM_param);
+        krun_measure(1);
+        // End timed section
+    }
+
+    flush();
+    krun_export_store();
+    krun_done();
+    exit(0);
+}
+
 krun_init();
 $BM_num_cores = krun_get_num_cores();
 
@@ -6,33 +6,37 @@ Executes a benchmark many times within a single process.
 usage: iterations_runner.py <benchmark> <# of iterations> <benchmark param>
            <debug flag> [instrumentation dir] [key] [key pexec index]
 
-Arguments in [] are for instrumentation mode only."""
+Arguments in [] are for instrumentation mode only.
 
-import array, cffi, sys, imp, os
+libkruntime stores the measurements, and hands them to Krun at the end (see
+krun_export_store()). Each iteration calls the benchmark as many times as Krun
+asks for in KRUN_INNER_REPEATS (once by default)."""
+
+import cffi, sys, imp, os
 
 
 ffi = cffi.FFI()
 
 ffi.cdef("""
-    void krun_init(void);
+    void krun_init_iters(int);
     void krun_done(void);
-    double krun_measure(int);
-    uint64_t krun_get_num_cores(void);
-    double krun_get_wallclock(int);
-    uint64_t krun_get_core_cycles(int, int);
-    uint64_t krun_get_aperf(int, int);
-    uint64_t krun_get_mperf(int, int);
+    void krun_measure(int);
+    void krun_export_store(void);
+    int krun_get_inner_repeats(void);
+    int krun_next_inner_repeats(int, double);
+    void krun_set_inner_repeats(int);
+    double krun_clock_gettime_monotonic(void);
 """)
 libkruntime = ffi.dlopen("libkruntime.so")
 
-krun_init = libkruntime.krun_init
+krun_init_iters = libkruntime.krun_init_iters
 krun_done = libkruntime.krun_done
 krun_measure = libkruntime.krun_measure
-krun_get_num_cores = libkruntime.krun_get_num_cores
-krun_get_wallclock = libkruntime.krun_get_wallclock
-krun_get_core_cycles = libkruntime.krun_get_core_cycles
-krun_get_aperf = libkruntime.krun_get_aperf
-krun_get_mperf = libkruntime.krun_get_mperf
+krun_export_store = libkruntime.krun_export_store
+krun_get_inner_repeats = libkruntime.krun_get_inner_repeats
+krun_next_inner_repeats = libkruntime.krun_next_inner_repeats
+krun_set_inner_repeats = libkruntime.krun_set_inner_repeats
+krun_clock_gettime_monotonic = libkruntime.krun_clock_gettime_monotonic
 
 def usage():
     print(__doc__)
@@ -64,17 +68,23 @@ if __name__ == "__main__":
 
     # OK, all is well, let's run.
 
-    krun_init()
-    num_cores = krun_get_num_cores()
-
-    # Pre-allocate result lists
-    wallclock_times = array.array("d", [-0.0] * iters)
-    # Although we can't be sure what size "L" actually is, if we generate ints
-    # it can't store, an OverflowError results, so there's no chance of silent
-    # truncation.
-    cycle_counts = [array.array("L", [0] * iters) for _ in range(num_cores)]
-    aperf_counts = [array.array("L", [0] * iters) for _ in range(num_cores)]
-    mperf_counts = [array.array("L", [0] * iters) for _ in range(num_cores)]
+    # libkruntime stores the measurements of each iteration in krun_measure(1).
+    krun_init_iters(iters)
+
+    # In auto mode, find how many calls make an iteration long enough, in
+    # batches which aren't measured.
+    inner_repeats = krun_get_inner_repeats()
+    if inner_repeats == 0:
+        next_repeats = 1
+        while next_repeats != inner_repeats:
+            inner_repeats = next_repeats
+            batch_start = krun_clock_gettime_monotonic()
+            for _ in xrange(inner_repeats):
+                bench_func(param)
+            next_repeats = krun_next_inner_repeats(
+                inner_repeats, krun_clock_gettime_monotonic() - batch_start)
+    krun_set_inner_repeats(inner_repeats)
+    repeats = xrange(inner_repeats)
 
     # Main loop
     for i in xrange(iters):
@@ -86,25 +96,14 @@ if __name__ == "__main__":
 
         # Start timed section
         krun_measure(0)
-        bench_func(param)
+        if inner_repeats == 1:
+            bench_func(param)
+        else:
+            for _ in repeats:
+                bench_func(param)
         krun_measure(1)
         # End timed section
 
-        # Extract/check/store wallclock time
-        wallclock_times[i] = krun_get_wallclock(1) - krun_get_wallclock(0)
-
-        # Extract/check/store per-core data
-        for core in xrange(num_cores):
-            cycle_counts[core][i] = (
-                krun_get_core_cycles(1, core) -
-                krun_get_core_cycles(0, core))
-            aperf_counts[core][i] = (
-                krun_get_aperf(1, core) -
-                krun_get_aperf(0, core))
-            mperf_counts[core][i] = (
-                krun_get_mperf(1, core) -
-                krun_get_mperf(0, core))
-
         # In instrumentation mode, write an iteration separator to stderr.
         if instrument:
             sys.stderr.write("@@@ END_IN_PROC_ITER: %d\n" % i)
@@ -116,15 +115,6 @@ if __name__ == "__main__":
             sys.stderr.write("@@@ JIT_TIME: %s\n" % jit_time)
             sys.stderr.flush()
 
+    sys.stdout.flush()
+    krun_export_store()
     krun_done()
-
-    import json
-    js = {
-        "wallclock_times": list(wallclock_times),
-        # You can't JSON encode a typed array, so convert to lists.
-        "core_cycle_counts": [list(a) for a in cycle_counts],
-        "aperf_counts": [list(a) for a in aperf_counts],
-        "mperf_counts": [list(a) for a in mperf_counts],
-    }
-
-    sys.stdout.write("%s\n" % json.dumps(js))
@@ -6,6 +6,12 @@
 #   krun_get_core_cycles()
 #   krun_get_aperf()
 #   krun_get_mperf()
+#
+# If the VM also offers:
+#   krun_init_iters()
+#   krun_export_store()
+# then libkruntime stores the measurements itself, and hands them to Krun at
+# the end, so the runner needn't keep or print any.
 
 # defined this way so we don't measure the conditional platform check.
 if /linux/ =~ RUBY_PLATFORM then
@@ -44,6 +50,30 @@ if __FILE__ == $0
 
     require("#{benchmark}")
 
+    if defined?(krun_init_iters) and defined?(krun_export_store) then
+        # libkruntime stores the measurements of each iteration in
+        # krun_measure(1).
+        krun_init_iters(iters)
+
+        for iter_num in 0..iters - 1 do
+            if debug then
+                STDERR.write "[iterations_runner.rb] iteration #{iter_num + 1}/#{iters}\n"
+                STDERR.flush
+            end
+
+            # Start timed section
+            krun_measure(0)
+            run_iter(param)
+            krun_measure(1)
+            # End timed section
+        end
+
+        STDOUT.flush
+        krun_export_store()
+        krun_done()
+        Kernel.exit(0)
+    end
+
     krun_init();
     num_cores = krun_get_num_cores()
 
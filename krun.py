@@ -10,10 +10,15 @@ import argparse, locale, logging, os, sys, traceback
 from logging import debug, info, warn
 
 import krun.util as util
-from krun.config import Config
+from krun.config import Config, RESULTS_FILE_EXTENSIONS
 from krun.platform import detect_platform
-from krun.results import Results
+from krun.results import Results, RESULTS_READ_ERRORS
+from krun.dump import dump_results, DumpFilter
 from krun.scheduler import ExecutionScheduler, ManifestManager
+from krun.shard import ShardCoordinator
+from krun.simulate import (parse_estimate, print_simulation, simulate_session,
+                           DEFAULT_TRIALS)
+from krun.calibrate import calibrate, print_calibration
 from krun import ABS_TIME_FORMAT
 from krun.mail import Mailer
 
@@ -101,13 +106,70 @@ def create_arg_parser():
                         required=False,
                         help=("Print the starting_temperatures section of " +
                               "a Krun results file to STDOUT"))
+    parser.add_argument("--dump-cores", action="store_const",
+                        dest="dump", const="pexec_cores", required=False,
+                        help=("Print the CPUs each process execution was "
+                              "pinned to in throughput mode to STDOUT"))
+    parser.add_argument("--dump-inner-repeats", action="store_const",
+                        dest="dump", const="pexec_inner_repeats",
+                        required=False,
+                        help=("Print how many times each process execution "
+                              "called the benchmark per in-process iteration, "
+                              "where more than once, to STDOUT"))
     parser.add_argument("--dump-data", action="store_const",
                         dest="dump", const="data", required=False,
                         help=("Print the data section of " +
                               "a Krun results file to STDOUT"))
+    parser.add_argument("--filter-keys", metavar="GLOB", default="*",
+                        help=("With --dump-data or --dump-etas, only dump "
+                              "benchmark keys matching GLOB, e.g. "
+                              "'nbody:*:default-*'"))
+    parser.add_argument("--filter-pexecs", metavar="RANGE", default=None,
+                        help=("With --dump-data or --dump-etas, only dump "
+                              "process executions in RANGE. RANGE is a "
+                              "zero-based index 'N', an inclusive range "
+                              "'N-M', or 'N-' for N onwards"))
+    parser.add_argument("--filter-sections", metavar="SECTIONS",
+                        default=None,
+                        help=("With --dump-data, only dump the given "
+                              "comma-separated measurement sections, e.g. "
+                              "'wallclock_times,aperf_counts'"))
+    parser.add_argument("--verify-results", action="store_true",
+                        default=False,
+                        help=("Check the integrity of every process "
+                              "execution in a Krun results file"))
     parser.add_argument("--info", action="store_true",
                         help=("Print session info for specified "
                               "config file and exit"))
+    parser.add_argument("--simulate", action="store_true", default=False,
+                        help=("Simulate a session of the specified config "
+                              "file, printing how long it would take, and "
+                              "exit"))
+    parser.add_argument("--simulate-from", metavar="RESULTS", default=None,
+                        help=("With --simulate, take durations from the "
+                              "results file of an earlier session"))
+    parser.add_argument("--estimate", metavar="NAME=SECS", action="append",
+                        default=[], dest="estimates",
+                        help=("With --simulate, estimate the duration of a "
+                              "phase (reboot, startup_wait, temp_wait, "
+                              "pre_hooks or post_hooks) or of the process "
+                              "executions of benchmark keys matching a glob, "
+                              "e.g. 'nbody:*:*=30' or 'reboot=60-90'. May be "
+                              "repeated"))
+    parser.add_argument("--simulate-trials", metavar="N", type=int,
+                        default=DEFAULT_TRIALS,
+                        help=("With --simulate, the number of times to "
+                              "simulate the session (default %d)" %
+                              DEFAULT_TRIALS))
+    parser.add_argument("--calibrate", action="store_true", default=False,
+                        help=("Measure the overhead of the iterations runner "
+                              "of each VM in the specified config file, with "
+                              "a null benchmark, record it next to the "
+                              "results file, and exit"))
+    parser.add_argument("--shard-dir", metavar="DIR", default=None,
+                        help=("Run one shard of a campaign planned with "
+                              "scripts/shard.py in the shared directory DIR. "
+                              "Only used when starting a new session."))
     parser.add_argument("--hardware-reboots", action="store_true", default=False,
                         help=("Reboot physical hardware before each benchmark "
                               "execution. Off by default."))
@@ -133,10 +195,11 @@ def create_arg_parser():
     filename_help = ("Krun configuration or results file. FILENAME should" +
                      " be a configuration file when running benchmarks " +
                      "(e.g. experiment.krun) and a results file " +
-                     "(e.g. experiment_results.json.bz2) when calling " +
+                     "(e.g. experiment_results.json.bz2 or " +
+                     "experiment_results.bin) when calling " +
                      "krun with --dump-config, --dump_audit, " +
-                     "--dump-reboots, --dump-etas, --dump-temps, or"
-                     "--dump-data")
+                     "--dump-reboots, --dump-etas, --dump-temps, "
+                     "--dump-cores, --dump-data or --verify-results")
     parser.add_argument("filename", action="store", # Required by default.
                         metavar="FILENAME",
                         help=(filename_help))
@@ -146,8 +209,41 @@ def create_arg_parser():
 def main(parser):
     args = parser.parse_args()
 
+    if args.verify_results:
+        if not args.filename.endswith(RESULTS_FILE_EXTENSIONS):
+            usage(parser)
+        Results.ok_to_instantiate = True
+        results = Results(None, None, results_file=args.filename)
+        results.integrity_check(full=True)  # Calls fatal() on failure.
+        info("Results file '%s' passed integrity checks" % args.filename)
+        sys.exit(0)
+
+    if args.dump in ("data", "eta_estimates"):
+        if not args.filename.endswith(RESULTS_FILE_EXTENSIONS):
+            usage(parser)
+        sections = None
+        if args.filter_sections is not None:
+            sections = args.filter_sections.split(",")
+        try:
+            flt = DumpFilter(args.filter_keys, args.filter_pexecs, sections)
+        except ValueError as e:
+            util.fatal(str(e))
+        # The results file is decoded, and the output written, a piece at a
+        # time, so that huge results files can be dumped. The output is
+        # ASCII, so unlike the other dumps, needs no encoding.
+        try:
+            dump_results(args.filename, args.dump, sys.stdout, flt)
+        except RESULTS_READ_ERRORS as e:
+            util.fatal("can't read %s: %s" % (args.filename, e))
+        sys.stdout.write("\n")
+        sys.exit(0)
+    elif args.filter_keys != "*" or args.filter_pexecs is not None or \
+            args.filter_sections is not None:
+        util.fatal("--filter-* options only apply to --dump-data and "
+                   "--dump-etas")
+
     if args.dump is not None:
-        if not args.filename.endswith(".json.bz2"):
+        if not args.filename.endswith(RESULTS_FILE_EXTENSIONS):
             usage(parser)
         else:
             Results.ok_to_instantiate = True
@@ -179,6 +275,31 @@ def main(parser):
         util.print_session_info(config)
         return
 
+    if args.simulate:
+        # Nor does simulation mode.
+        try:
+            estimates = [parse_estimate(spec) for spec in args.estimates]
+        except ValueError as e:
+            util.fatal(str(e))
+        if args.simulate_trials < 1:
+            util.fatal("--simulate-trials must be at least 1")
+        print_simulation(*simulate_session(config, args.simulate_from,
+                                           estimates, args.simulate_trials))
+        return
+    elif args.simulate_from is not None or args.estimates:
+        util.fatal("--simulate-from and --estimate only apply to --simulate")
+
+    if args.calibrate:
+        # Calibration runs only the null benchmarks, not the session.
+        platform = detect_platform(None, config)
+        platform.quick_mode = args.quick
+        platform.no_user_change = args.no_user_change
+        platform.no_tickless_check = args.no_tickless_check
+        platform.no_pstate_check = args.no_pstate_check
+        platform.check_preliminaries()
+        print_calibration(calibrate(config, platform, dry_run=args.dry_run))
+        return
+
     manifest_filename = ManifestManager.get_filename(config)
     on_first_invocation = not (os.path.isfile(manifest_filename) and
                                os.stat(manifest_filename).st_size > 0)
@@ -220,6 +341,9 @@ def inner_main(mailer, on_first_invocation, config, args):
     envlog_dir = util.get_envlog_dir(config)
     envlog_dir_exists = os.path.exists(envlog_dir)
 
+    temps_dir = util.get_temperature_trace_dir(config)
+    temps_dir_exists = os.path.exists(temps_dir)
+
     if out_file_exists and not os.path.isfile(out_file):
         util.fatal(
             "Output file '%s' exists but is not a regular file" % out_file)
@@ -234,6 +358,9 @@ def inner_main(mailer, on_first_invocation, config, args):
     if envlog_dir_exists and on_first_invocation:
         util.fatal("Env log dir '%s' exists." % envlog_dir)
 
+    if temps_dir_exists and on_first_invocation:
+        util.fatal("Temperature trace dir '%s' exists." % temps_dir)
+
     if not out_file_exists and not on_first_invocation:
         util.fatal("No results file to resume. Expected '%s'" % out_file)
 
@@ -282,7 +409,12 @@ def inner_main(mailer, on_first_invocation, config, args):
             platform_temps[sensor] = tup[1]
         platform.starting_temperatures = platform_temps
     else:
-        manifest = ManifestManager(config, platform, new_file=True)
+        schedule = None
+        if args.shard_dir is not None:
+            coordinator = ShardCoordinator(args.shard_dir)
+            schedule = coordinator.shard_schedule(coordinator.claim(config))
+        manifest = ManifestManager(config, platform, new_file=True,
+                                   schedule=schedule)
         if manifest.num_execs_left == 0:
             # No executions, or all skipped
             fatal("Empty schedule!")
@@ -0,0 +1,106 @@
+"""Adaptive stopping: deciding when a key has had enough process executions.
+
+After each completed process execution, the steady-state performance of each
+process execution of the key is summarised as the mean of its later in-process
+iterations. A bootstrap confidence interval (CI) of the mean of these
+summaries is then computed. Once the CI is narrow enough relative to the mean,
+further process executions are unlikely to change our estimate much, and the
+key's remaining process executions can be skipped.
+"""
+
+import random
+import zlib
+
+# The fraction of in-process iterations, from the end, considered to be in
+# the steady state. Krun doesn't know where warmup ends, so this errs on the
+# side of caution.
+STEADY_STATE_FRACTION = 0.5
+
+BOOTSTRAP_RESAMPLES = 1000
+
+
+def steady_state_mean(wallclock_times):
+    """Summarise one process execution's wall-clock times"""
+
+    num_steady = max(1, int(len(wallclock_times) * STEADY_STATE_FRACTION))
+    steady = wallclock_times[-num_steady:]
+    return sum(steady) / float(len(steady))
+
+
+def summarise_pexec(wallclock_times, inner_repeats=1):
+    """Summarise one process execution's wall-clock times as the steady-state
+    time of one call of the benchmark, or None if there are no times. The
+    summaries are recorded in the results as the process executions are
+    added, so that deciding whether to stop doesn't need the measurements."""
+
+    if len(wallclock_times) == 0:
+        return None
+    return steady_state_mean(wallclock_times) / inner_repeats
+
+
+def bootstrap_ci(values, confidence, rng, resamples=BOOTSTRAP_RESAMPLES):
+    """Returns a (lower, upper) percentile bootstrap confidence interval for
+    the mean of 'values'."""
+
+    num = len(values)
+    means = sorted(sum(rng.choice(values) for _ in xrange(num)) / float(num)
+                   for _ in xrange(resamples))
+    alpha = 1.0 - confidence
+    lower_idx = int(alpha / 2 * resamples)
+    upper_idx = min(resamples - 1, int((1.0 - alpha / 2) * resamples))
+    return means[lower_idx], means[upper_idx]
+
+
+def relative_ci_width(key, pexecs_wallclock_times, confidence,
+                      pexecs_inner_repeats=None):
+    """Returns the width of the CI of the steady-state mean of the given
+    process executions' wall-clock times, relative to the mean. If given,
+    'pexecs_inner_repeats' says how many times each process execution called
+    the benchmark per iteration, and its summary is divided by that.
+
+    The random number generator is seeded from the key and the number of
+    process executions, so that the decision is reproducible."""
+
+    if pexecs_inner_repeats is None:
+        pexecs_inner_repeats = [1] * len(pexecs_wallclock_times)
+    summaries = [summarise_pexec(wcts, repeats) for wcts, repeats
+                 in zip(pexecs_wallclock_times, pexecs_inner_repeats)]
+    return summaries_ci_width(key, summaries, confidence)
+
+
+def summaries_ci_width(key, summaries, confidence):
+    """As relative_ci_width(), but given the summaries of the process
+    executions (see summarise_pexec())."""
+
+    overall_mean = sum(summaries) / float(len(summaries))
+    if overall_mean <= 0:
+        return float("inf")
+    rng = random.Random(zlib.crc32("%s:%d" % (key, len(summaries))))
+    lower, upper = bootstrap_ci(summaries, confidence, rng)
+    return (upper - lower) / overall_mean
+
+
+def should_stop(key, pexec_flags, pexecs_wallclock_times, config,
+                pexecs_inner_repeats=None):
+    """Decide if a key's process executions can stop, given the flags,
+    wall-clock times (and optionally inner repeats) of those run so far.
+    Returns a pair '(stop, width)', where 'width' is the relative CI width, or
+    None if it was not computed."""
+
+    if pexecs_inner_repeats is None:
+        pexecs_inner_repeats = [1] * len(pexec_flags)
+    summaries = [summarise_pexec(wcts, repeats) for wcts, repeats
+                 in zip(pexecs_wallclock_times, pexecs_inner_repeats)]
+    return should_stop_summaries(key, pexec_flags, summaries, config)
+
+
+def should_stop_summaries(key, pexec_flags, pexec_summaries, config):
+    """As should_stop(), but given the summaries of the process executions
+    (see summarise_pexec()) rather than their wall-clock times."""
+
+    completed = [summary for flag, summary in zip(pexec_flags, pexec_summaries)
+                 if flag == "C" and summary is not None]
+    if len(completed) < config.ADAPTIVE_MIN_EXECUTIONS:
+        return False, None
+    width = summaries_ci_width(key, completed, config.ADAPTIVE_CONFIDENCE)
+    return width < config.ADAPTIVE_CI_WIDTH, width
@@ -18,6 +18,9 @@ class Audit(object):
     def __setitem__(self, key, value):
         self._audit[key] = value
 
+    def get(self, key, default=None):
+        return self._audit.get(key, default)
+
     def __unicode__(self):
         s = ""
         # important that the sections are sorted, for diffing
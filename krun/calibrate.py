@@ -0,0 +1,177 @@
+"""Measuring the overhead Krun's harness adds to each in-process iteration.
+
+Every in-process iteration pays for more than the benchmark: the calls into
+libkruntime (which may go through a slow FFI), the reading of the counters,
+and the runner's own loop. To quantify this floor, calibration mode (krun.py
+--calibrate) runs a null benchmark, whose run_iter() does nothing, through
+the iterations runner of each VM in the config. It takes
+CALIBRATION_PEXECS process executions of CALIBRATION_ITERATIONS iterations
+each, and records the distribution of the per-iteration wallclock times and
+core cycle counts in a sidecar file next to the results file (see
+Config.calibration_filename()). The audit is left alone, so calibrating
+doesn't stop a session from being resumed.
+
+Analyses can subtract the floor from the measurements, and, if a sidecar
+exists when the session runs, Krun warns of benchmarks whose iterations take
+less than CALIBRATION_FLOOR_RATIO times the floor of their VM.
+"""
+
+import json
+import os
+
+from logging import debug, info, warn
+
+from krun import EntryPoint
+from krun.eta import percentile
+from krun.util import (check_and_parse_execution_results,
+                       del_envlog_tempfile, fatal, get_git_version,
+                       run_shell_cmd, ExecutionFailed)
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+CALIBRATION_DIR = os.path.join(DIR, "..", "calibration_benchmarks")
+
+# Percentiles of the per-iteration measurements recorded in the sidecar.
+PERCENTILES = (5, 50, 95)
+
+
+def summarise(values):
+    """Summarise the distribution of the non-empty 'values'"""
+
+    values = list(values)
+    summary = {
+        "n": len(values),
+        "min": min(values),
+        "max": max(values),
+        "mean": sum(values) / float(len(values)),
+    }
+    for pct in PERCENTILES:
+        summary["p%d" % pct] = percentile(values, pct)
+    return summary
+
+
+def calibrate_vm(config, platform, vm_name, vm_def):
+    """Run the null benchmark under 'vm_def', returning a dict summarising
+    its per-iteration wallclock times and (per-core) core cycle counts, or
+    None if the VM has no null benchmark or it failed"""
+
+    if vm_def.CALIBRATION_BENCHMARK is None:
+        warn("No null benchmark for VM '%s', not calibrating it" % vm_name)
+        return None
+
+    vm_def.set_platform(platform)
+    entry_point = EntryPoint(vm_def.CALIBRATION_BENCHMARK)
+    key = "null:%s:calibration" % vm_name
+    wallclock_times = []
+    core_cycle_counts = []
+    for pexec_idx in xrange(config.CALIBRATION_PEXECS):
+        info("Calibrating '%s' (process execution %d/%d)" %
+             (vm_name, pexec_idx + 1, config.CALIBRATION_PEXECS))
+        stdout, stderr, rc, envlog_filename, timed_out = \
+            vm_def.run_exec(entry_point, config.CALIBRATION_ITERATIONS, 0,
+                            config.HEAP_LIMIT, config.STACK_LIMIT, key,
+                            pexec_idx, force_dir=CALIBRATION_DIR,
+                            sync_disks=False)
+        if vm_def.dry_run:
+            return None
+        del_envlog_tempfile(envlog_filename, platform)
+        try:
+            if timed_out:
+                warn("Calibrating '%s' timed out" % vm_name)
+                return None
+            measurements = check_and_parse_execution_results(
+                stdout, stderr, rc, config, key, sanity_check=True,
+                channel=vm_def.results_channel)
+        except ExecutionFailed as e:
+            warn("Calibrating '%s' failed: %s" % (vm_name, e.message))
+            return None
+        finally:
+            vm_def.close_results_channel()
+
+        wallclock_times.extend(measurements["wallclock_times"])
+        for core, counts in enumerate(measurements["core_cycle_counts"]):
+            if core == len(core_cycle_counts):
+                core_cycle_counts.append([])
+            core_cycle_counts[core].extend(counts)
+
+    return {
+        "wallclock_times": summarise(wallclock_times),
+        "core_cycle_counts": [summarise(counts)
+                              for counts in core_cycle_counts],
+    }
+
+
+def calibrate(config, platform, dry_run=False):
+    """Calibrate each VM in 'config' (for --calibrate), and write the
+    outcome to the calibration sidecar. Returns the outcome."""
+
+    calibration = {
+        "krun_version": get_git_version(),
+        "uname": run_shell_cmd("uname -a")[0],
+        "iterations": config.CALIBRATION_ITERATIONS,
+        "process_executions": config.CALIBRATION_PEXECS,
+        "vms": {},
+    }
+    for vm_name, vm_info in sorted(config.VMS.iteritems()):
+        vm_def = vm_info["vm_def"]
+        vm_def.dry_run = dry_run
+        outcome = calibrate_vm(config, platform, vm_name, vm_def)
+        if outcome is not None:
+            calibration["vms"][vm_name] = outcome
+
+    if not dry_run:
+        filename = config.calibration_filename()
+        with open(filename, "w") as f:
+            json.dump(calibration, f, indent=2, sort_keys=True)
+        debug("Wrote calibration to %s" % filename)
+    return calibration
+
+
+def load_calibration(config):
+    """Load the calibration sidecar of 'config', or return None if there
+    isn't one"""
+
+    filename = config.calibration_filename()
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except ValueError as e:
+        fatal("can't read calibration file %s: %s" % (filename, e))
+
+
+def near_floor(calibration, vm_name, wallclock_times, ratio):
+    """If the median of 'wallclock_times' is less than 'ratio' times the
+    median per-iteration overhead of 'vm_name', return the overhead, else
+    None"""
+
+    vm_calibration = calibration["vms"].get(vm_name)
+    if vm_calibration is None or not wallclock_times:
+        return None
+    floor = vm_calibration["wallclock_times"]["p50"]
+    if percentile(wallclock_times, 50) < ratio * floor:
+        return floor
+    return None
+
+
+def print_calibration(calibration):
+    """Prints the outcome of calibrate()"""
+
+    print("\nHarness Overhead")
+    print("================\n")
+    print("Null benchmark: %d process executions of %d iterations per VM.\n" %
+          (calibration["process_executions"], calibration["iterations"]))
+    if not calibration["vms"]:
+        print("No VMs calibrated!")
+        return
+
+    print("%-20s %12s %12s %12s %14s" %
+          ("VM", "p5 (us)", "median (us)", "p95 (us)", "median cycles"))
+    for vm_name, outcome in sorted(calibration["vms"].iteritems()):
+        wallclock = outcome["wallclock_times"]
+        # The null benchmark runs on one core, so report the busiest.
+        cycles = max([core["p50"] for core in outcome["core_cycle_counts"]] or
+                     [None])
+        print("%-20s %12.3f %12.3f %12.3f %14s" %
+              (vm_name, wallclock["p5"] * 1e6, wallclock["p50"] * 1e6,
+               wallclock["p95"] * 1e6, "-" if cycles is None else cycles))
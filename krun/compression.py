@@ -0,0 +1,180 @@
+"""Compression codecs for results, journal and instrumentation files.
+
+A codec is selected with a spec string of the form "name" or "name:level",
+e.g. "bz2", "gzip:1" or "none". Files written with any codec can be read
+back without knowing the codec, as it is detected from the file's magic
+bytes.
+"""
+
+import bz2
+import gzip
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma  # pip install backports.lzma
+    except ImportError:
+        lzma = None
+
+
+class Codec(object):
+    """Abstract compression codec"""
+
+    name = None
+    extension = None  # Appended to file names.
+    magic = None  # Leading bytes of files written with this codec.
+    default_level = None
+    levels = ()
+
+    def __init__(self, level=None):
+        if level is None:
+            level = self.default_level
+        if level not in self.levels:
+            raise ValueError("bad compression level for %s: %s" %
+                             (self.name, level))
+        self.level = level
+
+    def __str__(self):
+        if self.level is None:
+            return self.name
+        return "%s:%d" % (self.name, self.level)
+
+    def open(self, filename, mode):
+        """Open a file for (de)compression. mode is "r" or "w"."""
+        raise NotImplementedError("abstract")
+
+    def compress(self, data):
+        raise NotImplementedError("abstract")
+
+    def decompress(self, data):
+        raise NotImplementedError("abstract")
+
+
+class Bz2Codec(Codec):
+    name = "bz2"
+    extension = ".bz2"
+    magic = "BZh"
+    default_level = 9
+    levels = range(1, 10)
+
+    def open(self, filename, mode):
+        return bz2.BZ2File(filename, mode, compresslevel=self.level)
+
+    def compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    extension = ".gz"
+    magic = "\x1f\x8b"
+    default_level = 6
+    levels = range(1, 10)
+
+    def open(self, filename, mode):
+        return gzip.GzipFile(filename, mode + "b", compresslevel=self.level)
+
+    def compress(self, data):
+        # wbits of 16 + MAX_WBITS asks zlib for a gzip header and trailer.
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class XzCodec(Codec):
+    name = "xz"
+    extension = ".xz"
+    magic = "\xfd7zXZ\x00"
+    default_level = 6
+    levels = range(0, 10)
+
+    def __init__(self, level=None):
+        if lzma is None:
+            raise ValueError("the xz codec needs the lzma module "
+                             "(on Python 2.7: pip install backports.lzma)")
+        Codec.__init__(self, level)
+
+    def open(self, filename, mode):
+        if mode == "w":
+            return lzma.LZMAFile(filename, mode, preset=self.level)
+        return lzma.LZMAFile(filename, mode)
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+
+class NoCodec(Codec):
+    """Uncompressed"""
+
+    name = "none"
+    extension = ""
+    levels = (None,)
+
+    def open(self, filename, mode):
+        return open(filename, mode + "b")
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+CODECS = dict((cls.name, cls) for cls in
+              (Bz2Codec, GzipCodec, XzCodec, NoCodec))
+DEFAULT_CODEC = "bz2"
+
+
+def get_codec(spec):
+    """Make a codec from a spec string (e.g. "gzip:6").
+
+    Raises ValueError if the spec is invalid or the codec is unavailable."""
+
+    if ":" in spec:
+        name, level = spec.split(":", 1)
+        try:
+            level = int(level)
+        except ValueError:
+            raise ValueError("bad compression level: %s" % spec)
+    else:
+        name, level = spec, None
+
+    try:
+        cls = CODECS[name]
+    except KeyError:
+        raise ValueError("unknown compression codec '%s'. Choose from: %s" %
+                         (name, ", ".join(sorted(CODECS))))
+    return cls(level)
+
+
+def detect_codec(filename):
+    """Make a codec suitable for reading the given file, based on the first
+    few bytes of the file. Files with no known magic are uncompressed."""
+
+    with open(filename, "rb") as f:
+        head = f.read(8)
+    for cls in (Bz2Codec, GzipCodec, XzCodec):
+        if head.startswith(cls.magic):
+            return cls()
+    return NoCodec()
+
+
+def codec_for_filename(filename):
+    """Make a codec based on the extension of a filename. Used when there is
+    no config to say which codec to use."""
+
+    for cls in (Bz2Codec, GzipCodec, XzCodec):
+        if filename.endswith(cls.extension):
+            return cls()
+    return NoCodec()
@@ -4,11 +4,26 @@ import sys
 import traceback
 
 from krun import LOGFILE_FILENAME_TIME_FORMAT
-from krun.util import fatal
+from krun.compression import CODECS, DEFAULT_CODEC, get_codec
+from krun.schedule_policy import DEFAULT_SCHEDULE_POLICY, get_schedule_policy
+from krun.readiness import DEFAULT_READINESS_DETECTORS, get_readiness_detector
+from krun.util import fatal, CHILD_OUTPUT_READERS
 
 # XXX Add the rest of the required fields
 CHECK_FIELDS = ["HEAP_LIMIT", "STACK_LIMIT"]
 
+# Maps the allowed values of RESULTS_FORMAT to results file extensions.
+# JSON results files also get the extension of the compression codec.
+RESULTS_FORMAT_EXTENSIONS = {
+    "json": ".json",  # Archival format.
+    "binary": ".bin",  # Binary container, see krun/results.py.
+}
+
+# All extensions a results file might have.
+RESULTS_FILE_EXTENSIONS = tuple(
+    [".json" + codec.extension for codec in CODECS.itervalues()] +
+    [RESULTS_FORMAT_EXTENSIONS["binary"]])
+
 class Config(object):
     """All configuration for a Krun benchmark.
     Includes CLI args as well as configuration from .krun files.
@@ -21,6 +36,8 @@ class Config(object):
         self.VMS = dict()
         self.VARIANTS = dict()
         self.BENCHMARKS = dict()
+        self.INNER_REPEATS = dict()
+        self.INNER_REPEATS_TARGET = 0.001
         self.SKIP = list()
         self.N_EXECUTIONS = 1
         self.filename = config_file
@@ -32,7 +49,27 @@ class Config(object):
         self.AMPERF_RATIO_BOUNDS = None
         self.PRE_EXECUTION_CMDS = []
         self.POST_EXECUTION_CMDS = []
+        self.RESULTS_FOLD_INTERVAL = None
         self.EXECUTION_TIMEOUT = None
+        self.CHILD_OUTPUT_READER = "select"
+        self.RESULTS_CHANNEL = "mmap"
+        self.RESULTS_FORMAT = "json"
+        self.COMPRESSION_CODEC = DEFAULT_CODEC
+        self.KEEP_RESULTS_BACKUP = False
+        self.MANIFEST_INDEX = False
+        self.SCHEDULE_POLICY = DEFAULT_SCHEDULE_POLICY
+        self.ADAPTIVE_CI_WIDTH = None
+        self.ADAPTIVE_MIN_EXECUTIONS = 5
+        self.ADAPTIVE_CONFIDENCE = 0.99
+        self.THROUGHPUT_PEXECS = None
+        self.STARTUP_READINESS_DETECTORS = list(DEFAULT_READINESS_DETECTORS)
+        self.STARTUP_QUIET_SECONDS = 10
+        self.STARTUP_MAX_WAIT_SECONDS = 2 * 60
+        self.HEATER_CPUS = None
+        self.HEATER_DUTY_CYCLE = 1.0
+        self.CALIBRATION_ITERATIONS = 1000
+        self.CALIBRATION_PEXECS = 3
+        self.CALIBRATION_FLOOR_RATIO = 10
 
         # config defaults (callbacks)
         self.custom_dmesg_whitelist = None
@@ -91,14 +128,134 @@ class Config(object):
                 fatal("AMPERF_RATIO_BOUNDS and AMPERF_BUSY_THRESHOLD must either "
                       "both be defined in the config file, or neither")
 
+        if self.RESULTS_FOLD_INTERVAL is not None and \
+                self.RESULTS_FOLD_INTERVAL < 0:
+            fatal("RESULTS_FOLD_INTERVAL must be None or at least zero")
+
+        if self.CHILD_OUTPUT_READER not in CHILD_OUTPUT_READERS:
+            fatal("CHILD_OUTPUT_READER must be one of: %s" %
+                  ", ".join(sorted(CHILD_OUTPUT_READERS)))
+
+        if self.RESULTS_CHANNEL not in ("mmap", "json"):
+            fatal("RESULTS_CHANNEL must be one of: json, mmap")
+
+        if self.RESULTS_FORMAT not in RESULTS_FORMAT_EXTENSIONS:
+            fatal("RESULTS_FORMAT must be one of: %s" %
+                  ", ".join(sorted(RESULTS_FORMAT_EXTENSIONS)))
+
+        try:
+            get_codec(self.COMPRESSION_CODEC)
+        except ValueError as e:
+            fatal("bad COMPRESSION_CODEC: %s" % e)
+
+        try:
+            get_schedule_policy(self.SCHEDULE_POLICY)
+        except ValueError as e:
+            fatal("bad SCHEDULE_POLICY: %s" % e)
+
+        if self.ADAPTIVE_CI_WIDTH is not None:
+            if self.ADAPTIVE_CI_WIDTH <= 0:
+                fatal("ADAPTIVE_CI_WIDTH must be greater than zero")
+            if not 2 <= self.ADAPTIVE_MIN_EXECUTIONS <= self.N_EXECUTIONS:
+                fatal("ADAPTIVE_MIN_EXECUTIONS must be at least 2 and at "
+                      "most N_EXECUTIONS")
+            if not 0 < self.ADAPTIVE_CONFIDENCE < 1:
+                fatal("ADAPTIVE_CONFIDENCE must be between 0 and 1")
+
+        if self.THROUGHPUT_PEXECS is not None:
+            if not isinstance(self.THROUGHPUT_PEXECS, int) or \
+                    self.THROUGHPUT_PEXECS < 1:
+                fatal("THROUGHPUT_PEXECS must be a positive integer")
+            for vm_name, vm_info in self.VMS.iteritems():
+                if vm_info["vm_def"].instrument:
+                    fatal("VM '%s' is instrumented, which is not supported "
+                          "with THROUGHPUT_PEXECS" % vm_name)
+
+        for spec in self.STARTUP_READINESS_DETECTORS:
+            try:
+                get_readiness_detector(spec)
+            except ValueError as e:
+                fatal("bad STARTUP_READINESS_DETECTORS: %s" % e)
+        if not 0 <= self.STARTUP_QUIET_SECONDS <= \
+                self.STARTUP_MAX_WAIT_SECONDS:
+            fatal("STARTUP_QUIET_SECONDS must be between 0 and "
+                  "STARTUP_MAX_WAIT_SECONDS")
+
+        if self.HEATER_CPUS is not None:
+            if not self.HEATER_CPUS or \
+                    not all(isinstance(cpu, int) and cpu >= 0
+                            for cpu in self.HEATER_CPUS):
+                fatal("HEATER_CPUS must be a non-empty list of CPU numbers")
+        if not 0 < self.HEATER_DUTY_CYCLE <= 1:
+            fatal("HEATER_DUTY_CYCLE must be greater than 0 and at most 1")
+
+        for bench, inner_repeats in self.INNER_REPEATS.iteritems():
+            if bench not in self.BENCHMARKS:
+                fatal("INNER_REPEATS names unknown benchmark '%s'" % bench)
+            if inner_repeats != "auto" and \
+                    (not isinstance(inner_repeats, int) or inner_repeats < 1):
+                fatal("INNER_REPEATS of '%s' must be a positive integer or "
+                      "\"auto\"" % bench)
+            if inner_repeats == 1:
+                continue
+            for vm_name, vm_info in self.VMS.iteritems():
+                if vm_info["vm_def"].SUPPORTS_INNER_REPEATS:
+                    continue
+                for variant in vm_info["variants"]:
+                    if not self.should_skip(
+                            ":".join((bench, vm_name, variant))):
+                        fatal("VM '%s' can't repeat benchmarks within an "
+                              "iteration, so INNER_REPEATS of '%s' must be 1 "
+                              "(or skip it)" % (vm_name, bench))
+        if not self.INNER_REPEATS_TARGET > 0:
+            fatal("INNER_REPEATS_TARGET must be greater than zero")
+
+        for name in ("CALIBRATION_ITERATIONS", "CALIBRATION_PEXECS"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or value < 1:
+                fatal("%s must be a positive integer" % name)
+        if self.CALIBRATION_FLOOR_RATIO is not None and \
+                self.CALIBRATION_FLOOR_RATIO <= 0:
+            fatal("CALIBRATION_FLOOR_RATIO must be greater than zero")
+
     def log_filename(self, resume=False):
         assert self.filename.endswith(".krun")
         return self.filename[:-5] + ".log"
 
+    def codec(self):
+        """The compression codec for results and instrumentation data."""
+        return get_codec(self.COMPRESSION_CODEC)
+
+    def schedule_policy(self):
+        """The policy for ordering the process executions of a new
+        manifest."""
+        return get_schedule_policy(self.SCHEDULE_POLICY)
+
+    def execution_mode(self):
+        """Describes how process executions are run, for the audit."""
+        if self.THROUGHPUT_PEXECS is None:
+            return "isolated"
+        return "throughput (%d concurrent process executions)" % \
+            self.THROUGHPUT_PEXECS
+
+    def inner_repeats(self, benchmark):
+        """How many times the iterations runner calls 'benchmark' in each
+        measured in-process iteration: a positive integer, or "auto"."""
+        return self.INNER_REPEATS.get(benchmark, 1)
+
+    def calibration_filename(self):
+        """The sidecar file recording the overhead of the iterations runners
+        (see krun.calibrate)"""
+        assert self.filename.endswith(".krun")
+        return self.filename[:-5] + "_calibration.json"
+
     def results_filename(self):  # FIXME: was called output_name in util
         """Makes a result file name based upon the config file name."""
         assert self.filename.endswith(".krun")
-        return self.filename[:-5] + "_results.json.bz2"
+        ext = RESULTS_FORMAT_EXTENSIONS[self.RESULTS_FORMAT]
+        if self.RESULTS_FORMAT == "json":
+            ext += self.codec().extension
+        return self.filename[:-5] + "_results" + ext
 
     def should_skip(self, this_key):
         """Decides if 'this_key' is a benchmark key that will be skipped"""
@@ -0,0 +1,287 @@
+"""Streaming dumps of the measurements and ETA estimates in results files.
+
+Results.dump() needs a whole results file in memory. Here results files are
+instead decoded incrementally and output is written as it is produced, so that
+dumping (say) one benchmark's wall-clock times needs memory for only one
+process execution at a time. Measurements which are filtered out are skipped
+over without being decoded.
+"""
+
+import fnmatch
+import json
+import os
+import re
+
+from krun.compression import detect_codec
+from krun.json_stream import JSONStream, iter_array, iter_object
+from krun.results import (BinaryResultsReader, MEASUREMENT_SECTIONS,
+                          is_binary_results_file, iter_journal,
+                          journal_filename, unpack_journal_payload,
+                          _json_default)
+from krun.util import fatal
+
+def parse_pexec_range(spec):
+    """Parse a range of process execution indices, which is one of "N", "N-M"
+    (both inclusive) or "N-" (N onwards). Returns a pair '(start, stop)',
+    where 'stop' is exclusive, or None if unbounded.
+
+    Raises ValueError if the spec is invalid."""
+
+    match = re.match(r"^(\d+)(?:(-)(\d*))?$", spec)
+    if not match:
+        raise ValueError("bad process execution range: %s" % spec)
+    start = int(match.group(1))
+    if match.group(2) is None:
+        return start, start + 1
+    elif match.group(3) == "":
+        return start, None
+    stop = int(match.group(3)) + 1
+    if stop <= start:
+        raise ValueError("empty process execution range: %s" % spec)
+    return start, stop
+
+
+class DumpFilter(object):
+    """Selects which keys, process executions and measurement sections are
+    dumped. By default, everything is."""
+
+    def __init__(self, key_glob="*", pexec_range=None, sections=None):
+        self.key_glob = key_glob
+        if pexec_range is None:
+            self.start, self.stop = 0, None
+        else:
+            self.start, self.stop = parse_pexec_range(pexec_range)
+        if sections is None:
+            sections = MEASUREMENT_SECTIONS
+        for section in sections:
+            if section not in MEASUREMENT_SECTIONS:
+                raise ValueError("unknown measurement section '%s'. Choose "
+                                 "from: %s" %
+                                 (section, ", ".join(MEASUREMENT_SECTIONS)))
+        self.sections = frozenset(sections)
+
+    def want_key(self, key):
+        return fnmatch.fnmatchcase(key, self.key_glob)
+
+    def want_pexec(self, pexec_idx):
+        return self.start <= pexec_idx and \
+            (self.stop is None or pexec_idx < self.stop)
+
+    def past_pexecs(self, pexec_idx):
+        """Returns True if no process executions from 'pexec_idx' onwards are
+        wanted."""
+        return self.stop is not None and pexec_idx >= self.stop
+
+
+class _Journal(object):
+    """An index of the process executions in a results journal, which have
+    not yet been folded into the results file."""
+
+    def __init__(self, results_file):
+        self.filename = journal_filename(results_file)
+        self.records = dict()
+        if os.path.exists(self.filename):
+            for header, offset in iter_journal(self.filename):
+                key = header.get("key")
+                if key is not None:
+                    self.records.setdefault(key, []).append((header, offset))
+
+    def values(self, section, key, num_pexecs, flt):
+        """Yield the given section's values for each wanted process
+        execution of 'key' in the journal. 'num_pexecs' is the number of
+        process executions of 'key' in the results file."""
+
+        records = self.records.get(key, [])
+        if not records:
+            return
+        with open(self.filename, "rb") as f:
+            for header, offset in records:
+                pexec_idx = header["pexec_idx"]
+                if pexec_idx < num_pexecs:
+                    continue  # Already in the results file.
+                elif pexec_idx > num_pexecs:
+                    fatal("results journal skips process executions: "
+                          "%s: %d vs %d" % (key, pexec_idx, num_pexecs))
+                num_pexecs += 1
+                if not flt.want_pexec(pexec_idx):
+                    continue
+                if section == "eta_estimates":
+                    yield header["eta_estimate"]
+                else:
+                    f.seek(offset)
+                    payload = f.read(header["payload_len"])
+                    yield unpack_journal_payload(header, payload)[section]
+
+
+def _json_sections(stream, sections, journal, flt):
+    """Yield '(section, keys)' pairs for each of the wanted sections of a JSON
+    results file, where 'keys' yields '(key, values)' pairs."""
+
+    remaining = set(sections)
+    for section in iter_object(stream):
+        if section in remaining:
+            yield section, _json_keys(stream, section, journal, flt)
+            remaining.remove(section)
+            if not remaining:
+                return  # Don't bother decoding the rest of the file.
+        elif section in MEASUREMENT_SECTIONS:
+            for key in iter_object(stream):
+                stream.skip_value()
+        else:
+            stream.value()
+
+
+def _json_keys(stream, section, journal, flt):
+    for key in iter_object(stream):
+        if flt.want_key(key):
+            yield key, _json_values(stream, section, key, journal, flt)
+        else:
+            stream.skip_value()
+
+
+def _json_values(stream, section, key, journal, flt):
+    num_pexecs = 0
+    for pexec_idx in iter_array(stream):
+        if flt.past_pexecs(pexec_idx):
+            stream.skip_close()
+            return  # Nothing in the journal is wanted either.
+        elif flt.want_pexec(pexec_idx):
+            yield stream.value()
+        else:
+            stream.skip_value()
+        num_pexecs = pexec_idx + 1
+    for value in journal.values(section, key, num_pexecs, flt):
+        yield value
+
+
+def _binary_sections(reader, sections, journal, flt):
+    """As _json_sections(), but for a binary results container."""
+
+    for section in sorted(sections):
+        if section == "eta_estimates":
+            keys = reader.header[section]
+        else:
+            keys = reader.index[section]
+        yield section, ((key, _binary_values(reader, section, key, journal,
+                                             flt))
+                        for key in sorted(keys) if flt.want_key(key))
+
+
+def _binary_values(reader, section, key, journal, flt):
+    if section == "eta_estimates":
+        etas = reader.header[section][key]
+        num_pexecs = len(etas)
+        read = etas.__getitem__
+    else:
+        num_pexecs = reader.num_pexecs(key)
+        read = lambda pexec_idx: \
+            reader.read_measurements(section, key, pexec_idx)
+    stop = num_pexecs
+    if flt.stop is not None:
+        stop = min(stop, flt.stop)
+    for pexec_idx in xrange(flt.start, stop):
+        yield read(pexec_idx)
+    for value in journal.values(section, key, num_pexecs, flt):
+        yield value
+
+
+def _write_lists(out, keys, indent):
+    """Write a JSON object mapping keys to lists, from an iterator of
+    '(key, values)' pairs. Each value is written on a line of its own."""
+
+    out.write("{")
+    first_key = True
+    for key, values in keys:
+        out.write("%s\n%s%s: [" % ("" if first_key else ",",
+                                   "  " * (indent + 1), json.dumps(key)))
+        first_value = True
+        for value in values:
+            out.write("%s\n%s%s" % ("" if first_value else ",",
+                                    "  " * (indent + 2),
+                                    json.dumps(value, default=_json_default)))
+            first_value = False
+        if not first_value:
+            out.write("\n%s" % ("  " * (indent + 1)))
+        out.write("]")
+        first_key = False
+    if not first_key:
+        out.write("\n%s" % ("  " * indent))
+    out.write("}")
+
+
+def _write_sections(out, sections):
+    out.write("{")
+    first = True
+    for section, keys in sections:
+        out.write("%s\n  %s: " % ("" if first else ",", json.dumps(section)))
+        _write_lists(out, keys, 1)
+        first = False
+    if not first:
+        out.write("\n")
+    out.write("}")
+
+
+def iter_sections(results_file, sections, flt=None):
+    """Iterate over the given sections of a results file (and its journal),
+    yielding '(section, keys)' pairs, where 'keys' yields '(key, values)'
+    pairs, and 'values' yields the section's value for each process
+    execution. The process executions are selected by a DumpFilter.
+
+    Each iterator must be exhausted before the next item of the enclosing
+    iterator is requested."""
+
+    if flt is None:
+        flt = DumpFilter()
+    journal = _Journal(results_file)
+    if is_binary_results_file(results_file):
+        reader = BinaryResultsReader(results_file)
+        try:
+            for item in _binary_sections(reader, sections, journal, flt):
+                yield item
+        finally:
+            reader.close()
+    else:
+        with detect_codec(results_file).open(results_file, "r") as f:
+            for item in _json_sections(JSONStream(f), sections, journal,
+                                       flt):
+                yield item
+
+
+def read_eta_estimates(results_file):
+    """Read the ETA estimates of a results file, without loading any
+    measurements. Returns a dict mapping keys to lists of estimates."""
+
+    return dict((key, list(values)) for _, keys in
+                iter_sections(results_file, ["eta_estimates"])
+                for key, values in keys)
+
+
+def dump_results(results_file, what, out, flt=None):
+    """Write part of a results file (and its journal) to the file object 'out'
+    as JSON. 'what' is either "data", for the measurements, or
+    "eta_estimates". The process executions written are selected by a
+    DumpFilter.
+
+    The output is the same as that of Results.dump(), albeit formatted more
+    compactly."""
+
+    if flt is None:
+        flt = DumpFilter()
+    if what == "data":
+        sections = flt.sections
+    else:
+        assert what == "eta_estimates"
+        sections = [what]
+    _write_dump(out, what, iter_sections(results_file, sections, flt))
+
+
+def _write_dump(out, what, sections):
+    if what == "data":
+        _write_sections(out, sections)
+    else:
+        written = False
+        for section, keys in sections:
+            _write_lists(out, keys, 0)
+            written = True
+        if not written:  # Older results files may lack the section.
+            out.write("{}")
@@ -0,0 +1,149 @@
+"""Estimating how long the rest of a benchmarking session will take.
+
+Besides the process executions themselves, each run of Krun (i.e. each
+reboot cycle) spends time in several phases:
+
+  reboot        from the results being saved by the previous run, to this
+                run starting (i.e. shutting down, rebooting and starting Krun)
+  startup_wait  waiting for the system to settle after boot
+  temp_wait     waiting for the temperature sensors to settle
+  pre_hooks     running PRE_EXECUTION_CMDS
+  post_hooks    running POST_EXECUTION_CMDS
+
+The time spent in each phase is stored in the results (see
+Results.pexec_phases), separately from each process execution's own
+duration (the ETA estimates). The ETA is the sum, over the outstanding
+process executions and runs, of robust (median) estimates of each. Those
+phases are often dominated by a few outliers (e.g. a slow boot), to which the
+median, unlike the mean, is insensitive.
+
+The spread of each estimate (from the median absolute deviation) gives a
+prediction interval around the ETA, which accounts both for the variation of
+the individual durations, and for the uncertainty of the medians themselves
+when there are only a few samples.
+"""
+
+import math
+
+PHASES = ("reboot", "startup_wait", "temp_wait", "pre_hooks", "post_hooks")
+
+# Scales the median absolute deviation to the standard deviation of a normal
+# distribution.
+MAD_TO_SIGMA = 1.4826
+
+# The variance of the median of n normal samples is roughly pi / 2 times that
+# of their mean.
+MEDIAN_VARIANCE_FACTOR = math.pi / 2
+
+# Two-sided 90% prediction interval.
+INTERVAL_Z = 1.645
+INTERVAL_PERCENT = 90
+
+
+def median(seq):
+    if len(seq) == 0:
+        raise ValueError("Cannot calculate median of empty sequence.")
+    seq = sorted(seq)
+    mid = len(seq) // 2
+    if len(seq) % 2 == 1:
+        return float(seq[mid])
+    return (seq[mid - 1] + seq[mid]) / 2.0
+
+
+def percentile(seq, pct):
+    """The nearest-rank 'pct'th percentile of the non-empty 'seq'"""
+
+    seq = sorted(seq)
+    rank = int(math.ceil(pct / 100.0 * len(seq)))
+    return seq[max(0, rank - 1)]
+
+
+def robust_stats(samples):
+    """Returns '(median, sigma, num_samples)' for a list of durations, where
+    sigma is estimated from the median absolute deviation, or None if there
+    are no samples."""
+
+    if not samples:
+        return None
+    med = median(samples)
+    sigma = MAD_TO_SIGMA * median([abs(x - med) for x in samples])
+    return med, sigma, len(samples)
+
+
+def _sum_variance(stats, count):
+    """The variance of the sum of 'count' future durations described by
+    'stats' (see robust_stats())"""
+
+    med, sigma, num_samples = stats
+    return count * sigma ** 2 + \
+        count ** 2 * MEDIAN_VARIANCE_FACTOR * sigma ** 2 / num_samples
+
+
+class ETAModel(object):
+    """A model of the time remaining in a session, built from the ETA
+    estimates and phases recorded in a Results instance."""
+
+    def __init__(self, results):
+        self.exec_stats = dict()
+        for key, etas in results.eta_estimates.iteritems():
+            stats = robust_stats(etas)
+            if stats is not None:
+                self.exec_stats[key] = stats
+
+        samples = dict((phase, []) for phase in PHASES)
+        for by_pexec in results.pexec_phases.itervalues():
+            for phases in by_pexec.itervalues():
+                for phase, secs in phases.iteritems():
+                    if phase in samples:
+                        samples[phase].append(secs)
+        self.phase_stats = dict()
+        for phase, secs in samples.iteritems():
+            stats = robust_stats(secs)
+            if stats is not None:
+                self.phase_stats[phase] = stats
+
+    def run_overhead(self):
+        """The estimated time spent outside of process executions in each
+        run. Phases never yet recorded count as zero."""
+
+        return sum(stats[0] for stats in self.phase_stats.itervalues())
+
+    def key_duration(self, key):
+        """The estimated time for a run of one process execution of 'key',
+        or None if it has not yet run."""
+
+        if key not in self.exec_stats:
+            return None
+        return self.exec_stats[key][0] + self.run_overhead()
+
+    def predict(self, outstanding_exec_counts, skipped_keys=(),
+                pexecs_per_run=1):
+        """Predict the time left for the given numbers of outstanding
+        process executions of each key, run 'pexecs_per_run' at a time.
+        Returns a '(secs, low, high)' triple, where 'low' and 'high' bound
+        the prediction interval, or None if the duration of a key that is
+        not skipped is unknown."""
+
+        secs = 0.0
+        var = 0.0
+        num_execs = 0
+        for key, count in outstanding_exec_counts.iteritems():
+            if count == 0:
+                continue
+            stats = self.exec_stats.get(key)
+            if stats is None:
+                if key in skipped_keys:
+                    continue
+                return None  # Unknown time for a key which is not skipped.
+            num_execs += count
+            # Roughly, as executions of different lengths run together.
+            secs += count * stats[0] / pexecs_per_run
+            var += _sum_variance(stats, count) / pexecs_per_run ** 2
+
+        num_runs = int(math.ceil(num_execs / float(pexecs_per_run)))
+        for stats in self.phase_stats.itervalues():
+            secs += num_runs * stats[0]
+            var += _sum_variance(stats, num_runs)
+
+        margin = INTERVAL_Z * math.sqrt(var)
+        return secs, max(0.0, secs - margin), secs + margin
@@ -0,0 +1,82 @@
+"""Heating the machine, e.g. when it is cooler than at the start of the
+session.
+
+Heat is made by child processes, one per CPU to be loaded, each of which
+alternates between spinning and sleeping so as to keep its CPU busy for a
+given fraction (the "duty cycle") of each short period. Since the spinning is
+timed by the clock, rather than by counting loop iterations, the load doesn't
+depend on how fast the interpreter running Krun is.
+
+This module is also run as a script, for the child processes:
+
+  heater.py <duty cycle> <duration secs>
+"""
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import subprocess32
+
+from logging import debug
+from krun.util import fatal
+
+# The length of one busy/idle cycle. Short enough that the CPU's temperature
+# doesn't follow the cycle, long enough that the cost of sleeping is tiny.
+HEAT_PERIOD_SECS = 0.1
+
+HEATER_SCRIPT = os.path.abspath(__file__).replace(".pyc", ".py")
+
+
+def heat_loop(duty_cycle, duration, period=HEAT_PERIOD_SECS):
+    """Keep the current CPU busy for 'duty_cycle' of each 'period' until
+    'duration' seconds have passed."""
+
+    end = time.time() + duration
+    while True:
+        period_start = time.time()
+        if period_start >= end:
+            break
+        busy_until = min(end, period_start + period * duty_cycle)
+        while time.time() < busy_until:
+            pass
+        idle = min(end, period_start + period) - time.time()
+        if idle > 0:
+            time.sleep(idle)
+
+
+class Heater(object):
+    """Loads a set of CPUs of 'platform' at a chosen duty cycle"""
+
+    def __init__(self, platform):
+        self.platform = platform
+
+    def heater_args(self, cpu, duty_cycle, duration):
+        return self.platform.heater_pin_args(cpu) + \
+            [sys.executable, HEATER_SCRIPT, str(duty_cycle), str(duration)]
+
+    def heat(self, cpus, duty_cycle, duration):
+        """Load each of 'cpus' at 'duty_cycle' (0 < duty_cycle <= 1) for
+        'duration' seconds, returning when done."""
+
+        debug("Heating CPUs %s at duty cycle %s for %.1f secs" %
+              (",".join(str(cpu) for cpu in cpus), duty_cycle, duration))
+        procs = [subprocess32.Popen(self.heater_args(cpu, duty_cycle,
+                                                     duration))
+                 for cpu in cpus]
+        failed = [cpu for cpu, proc in zip(cpus, procs) if proc.wait() != 0]
+        if failed:
+            fatal("Heater process failed on CPUs: %s" %
+                  ", ".join(str(cpu) for cpu in failed))
+
+
+if __name__ == "__main__":
+    try:
+        duty_cycle, duration = float(sys.argv[1]), float(sys.argv[2])
+    except (IndexError, ValueError):
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    heat_loop(duty_cycle, duration)
@@ -0,0 +1,146 @@
+"""Incremental decoding of large JSON files, such as results files.
+
+Decoding a whole results file with json.loads() needs the file's text, and
+every value in it, in memory at once. A JSONStream instead decodes one value
+at a time, and can skip over arrays of numbers (e.g. measurements) much faster
+than it could decode them.
+"""
+
+import json
+import re
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_DECODER = json.JSONDecoder()
+_NON_WS = re.compile(r"[^ \t\n\r]")
+_BRACKETS = re.compile(r"[\[\]]")
+
+
+class JSONStream(object):
+    """Incremental reading of JSON from a file object.
+
+    Only as much of the file is held in memory as is needed to decode the
+    current value."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Read more of the file into the buffer, discarding what has already
+        been consumed. Returns False at the end of the file."""
+
+        if size is None:
+            size = READ_CHUNK_SIZE
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character ("" at the end of
+        the file) without consuming it."""
+
+        while True:
+            match = _NON_WS.search(self.buf, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        """Consume and return the next character, which must be one of
+        'chars'."""
+
+        char = self.peek()
+        if char == "" or char not in chars:
+            raise ValueError("expected one of '%s', not '%s'" % (chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and consume the next value."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # A number might continue beyond the end of the buffer.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # Grow geometrically, so that large values are read in linear time.
+            self._fill(max(READ_CHUNK_SIZE, len(self.buf)))
+
+    def skip_close(self, depth=1):
+        """Consume everything up to and including the bracket which closes the
+        array 'depth' levels up. The arrays must not contain strings (true of
+        the measurement sections), which allows this to be much faster than
+        decoding the arrays' contents."""
+
+        while True:
+            for match in _BRACKETS.finditer(self.buf, self.pos):
+                if match.group() == "[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self.pos = match.end()
+                        return
+            self.pos = len(self.buf)
+            if not self._fill():
+                raise ValueError("unexpected end of file")
+
+    def skip_value(self):
+        """Consume the next value. If it is an array, it must not contain
+        strings (see skip_close())."""
+
+        if self.peek() == "[":
+            self.pos += 1
+            self.skip_close()
+        else:
+            self.value()
+
+
+def iter_object(stream):
+    """Iterate over the keys of the JSON object next in the stream. After each
+    key is yielded, the caller must consume the corresponding value."""
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        yield key
+        if stream.expect(",}") == "}":
+            return
+
+
+def iter_array(stream):
+    """Iterate over the JSON array next in the stream, yielding the index of
+    each element. The caller must consume each element, or may instead
+    abandon the iteration after calling stream.skip_close()."""
+
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.pos += 1
+        return
+    idx = 0
+    while True:
+        yield idx
+        if stream.expect(",]") == "]":
+            return
+        idx += 1
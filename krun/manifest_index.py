@@ -0,0 +1,170 @@
+"""A binary sidecar index for the manifest file.
+
+Deriving Krun's state from the manifest requires a linear scan of the whole
+file, and the manifest has one line per process execution. The index instead
+records the derived state, so that (after each reboot) it can be loaded in
+time proportional to the number of benchmark keys, rather than to the length
+of the schedule. It is enabled with the MANIFEST_INDEX config option.
+
+The manifest remains the authoritative record. The index holds the inode,
+size and modification time of the manifest it was derived from and is ignored
+if they don't match those of the manifest on disk (e.g. if Krun crashed
+between updating the manifest and its index).
+
+The layout of the index (all little-endian) is:
+
+  * INDEX_MAGIC.
+  * A header, packed with _HEADER.
+  * One record per key: a uint16_t length, the key, then _KEY.
+  * One record per temperature sensor: a uint16_t length, the sensor name,
+    then _SENSOR.
+"""
+
+import os
+import struct
+
+INDEX_MAGIC = "KRUNIDX\x01"
+MANIFEST_FLAGS = "OCETS"
+
+# Manifest inode, size and mtime, the index of the next key (-1 if none), then
+# the scalar fields of ManifestManager (-1 for None), then the number of
+# records with each of MANIFEST_FLAGS, then the number of keys and sensors.
+_HEADER = struct.Struct("<QQd10q5qII")
+_SCALAR_FIELDS = ("next_exec_idx", "next_exec_flag_offset", "num_execs_left",
+                  "total_num_execs", "eta_avail_idx", "num_mails_sent",
+                  "num_mails_sent_offset", "num_reboots",
+                  "num_reboots_offset")
+_NAME_LEN = struct.Struct("<H")
+# Outstanding count, completed count, record count (see
+# ManifestManager.next_exec_key_index()) and _KEY_* bits.
+_KEY = struct.Struct("<qqqB")
+_KEY_SKIPPED = 1
+_KEY_NON_SKIPPED = 2
+# Offset in the manifest and temperature.
+_SENSOR = struct.Struct("<qd")
+
+
+def index_filename(manifest_path):
+    return manifest_path + ".idx"
+
+
+def manifest_fingerprint(manifest_path):
+    """Identifies a particular version of a manifest file"""
+
+    st = os.stat(manifest_path)
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+def _pack_name(name):
+    return _NAME_LEN.pack(len(name)) + name
+
+
+def write_manifest_index(manifest):
+    """Write the index for a ManifestManager's current state"""
+
+    keys = sorted(manifest.outstanding_exec_counts)
+    next_key_idx = -1
+    if manifest.next_exec_key is not None:
+        next_key_idx = keys.index(manifest.next_exec_key)
+    scalars = [getattr(manifest, field) for field in _SCALAR_FIELDS]
+    scalars = [-1 if x is None else x for x in scalars]
+    flag_counts = [manifest.flag_counts[flag] for flag in MANIFEST_FLAGS]
+
+    parts = [INDEX_MAGIC,
+             _HEADER.pack(*(list(manifest.fingerprint) + [next_key_idx] +
+                            scalars + flag_counts +
+                            [len(keys), len(manifest.starting_temperatures)]))]
+    for key in keys:
+        bits = 0
+        if key in manifest.skipped_keys:
+            bits |= _KEY_SKIPPED
+        if key in manifest.non_skipped_keys:
+            bits |= _KEY_NON_SKIPPED
+        parts.append(_pack_name(key))
+        parts.append(_KEY.pack(manifest.outstanding_exec_counts[key],
+                               manifest.completed_exec_counts[key],
+                               manifest.key_record_counts[key], bits))
+    for sensor, (offset, temp) in \
+            sorted(manifest.starting_temperatures.iteritems()):
+        parts.append(_pack_name(sensor))
+        parts.append(_SENSOR.pack(offset, temp))
+
+    # Renamed into place so that readers never see a partial index. There is
+    # no need to fsync(), as an index which didn't make it to disk will not
+    # match the manifest and will be ignored.
+    path = index_filename(manifest.path)
+    with open(path + ".tmp", "wb") as fh:
+        fh.write("".join(parts))
+    os.rename(path + ".tmp", path)
+
+
+def read_manifest_index(manifest_path):
+    """Read the index of a manifest file, returning a dict mapping
+    ManifestManager attribute names to values, or None if there is no index
+    or it doesn't match the manifest."""
+
+    try:
+        with open(index_filename(manifest_path), "rb") as fh:
+            data = fh.read()
+        fingerprint = manifest_fingerprint(manifest_path)
+    except (IOError, OSError):
+        return None
+
+    try:
+        if not data.startswith(INDEX_MAGIC):
+            return None
+        pos = len(INDEX_MAGIC)
+        header = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        if tuple(header[:3]) != fingerprint:
+            return None  # Stale.
+        next_key_idx = header[3]
+        scalars = header[4:4 + len(_SCALAR_FIELDS)]
+        flag_counts = header[4 + len(_SCALAR_FIELDS):-2]
+        num_keys, num_sensors = header[-2:]
+
+        state = dict(zip(_SCALAR_FIELDS, scalars))
+        for field in ("next_exec_flag_offset", "num_mails_sent_offset",
+                      "num_reboots_offset"):
+            if state[field] == -1:
+                state[field] = None
+        state["fingerprint"] = fingerprint
+        state["flag_counts"] = dict(zip(MANIFEST_FLAGS, flag_counts))
+        state["outstanding_exec_counts"] = outstanding = {}
+        state["completed_exec_counts"] = completed = {}
+        state["key_record_counts"] = record_counts = {}
+        state["skipped_keys"] = skipped = set()
+        state["non_skipped_keys"] = non_skipped = set()
+        state["starting_temperatures"] = temps = {}
+
+        keys = []
+        for _ in xrange(num_keys):
+            key, pos = _unpack_name(data, pos)
+            outstanding[key], completed[key], record_counts[key], bits = \
+                _KEY.unpack_from(data, pos)
+            pos += _KEY.size
+            if bits & _KEY_SKIPPED:
+                skipped.add(key)
+            if bits & _KEY_NON_SKIPPED:
+                non_skipped.add(key)
+            keys.append(key)
+        for _ in xrange(num_sensors):
+            sensor, pos = _unpack_name(data, pos)
+            temps[sensor] = _SENSOR.unpack_from(data, pos)
+            pos += _SENSOR.size
+        if pos != len(data):
+            return None
+        state["next_exec_key"] = keys[next_key_idx] \
+            if next_key_idx != -1 else None
+    except (struct.error, IndexError):
+        return None  # Corrupt.
+    return state
+
+
+def _unpack_name(data, pos):
+    length, = _NAME_LEN.unpack_from(data, pos)
+    pos += _NAME_LEN.size
+    name = data[pos:pos + length]
+    if len(name) != length:
+        raise struct.error("truncated name")
+    return name, pos + length
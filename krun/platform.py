@@ -18,6 +18,8 @@ import krun.util as util
 from logging import warn, debug, info
 from abc import ABCMeta, abstractmethod, abstractproperty
 from krun.env import EnvChangeSet, EnvChange, EnvChangeAppend
+from krun.heater import Heater
+from krun.thermal import TemperatureSettler, TemperatureTrace
 from krun.vm_defs import BENCHMARK_USER
 
 NICE_PRIORITY = -20
@@ -27,6 +29,19 @@ UTILS_DIR = os.path.join(DIR, "..", "utils")
 SYNC_SLEEP_SECS = 30  # time to wait for sync() to finish
 
 
+def parse_cpu_list(text):
+    """Parse a Linux CPU list (e.g. "0-3,8") into a list of CPU numbers"""
+
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(xrange(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
 class BasePlatform(object):
     __metaclass__ = ABCMeta
 
@@ -54,6 +69,7 @@ class BasePlatform(object):
         # derive thresholds that characterise "too hot".
         self._starting_temperatures = {}  # accessed via property
         self.temperature_thresholds = {}
+        self.temperature_trace = None  # Set by wait_for_temperature_sensors()
         self.find_temperature_sensors()
         if self.get_num_temperature_sensors() == 0 and not self.is_virtual():
             fatal("No usable temperature sensors!")
@@ -111,9 +127,10 @@ class BasePlatform(object):
         self._starting_temperatures = readings_dct
         debug("Set start temperatures: %s" % readings_dct)
 
-    def temp_sensors_within_interval(self):
+    def temp_sensors_within_interval(self, readings=None):
         """Indicates if all temperature sensors are close (within an interval)
-        to their start readings.
+        to their start readings. If 'readings' is None, fresh readings are
+        taken.
 
         Returns tuple: (bool_ok, str_reason_if_false)
 
@@ -126,7 +143,8 @@ class BasePlatform(object):
         desired temperature range.
         """
 
-        readings = self.take_temperature_readings()
+        if readings is None:
+            readings = self.take_temperature_readings()
         debug("start temperatures: %s" % self._starting_temperatures)
         debug("temp reading: %s" % readings)
 
@@ -245,8 +263,10 @@ class BasePlatform(object):
         return rv
 
     def wait_for_temperature_sensors(self, testing=False):
-        """A polling loop waiting for temperature sensors to return (close) to
-        their starting values.
+        """Wait for temperature sensors to return (close) to their starting
+        values, sleeping or heating the machine as needed (see
+        krun.thermal). The readings taken are kept in
+        self.temperature_trace.
 
         When 'testing' is True, only one iteration of the wait loop will
         run (used only in unit tests)."""
@@ -256,25 +276,13 @@ class BasePlatform(object):
             return
 
         if not testing:
-            bail_out_time = time.clock() + self.TEMP_WAIT_SECS_BEFORE_GIVEUP
+            bail_out_time = time.time() + self.TEMP_WAIT_SECS_BEFORE_GIVEUP
         else:
             bail_out_time = 0  # force only one iteration
 
-        while True:
-            flag, reason = self.temp_sensors_within_interval()
-
-            if flag == self.TEMP_OK:
-                break
-            elif flag == self.TEMP_TOO_HOT:
-                self.sleep(1)
-            elif flag == self.TEMP_TOO_COLD:
-                # This takes a variable amount of time, but on a modern
-                # machine it takes only a fraction of a second.
-                util.make_heat()
-
-            if time.clock() >= bail_out_time:
-                break
-
+        self.temperature_trace = TemperatureTrace()
+        settler = TemperatureSettler(self, self.temperature_trace)
+        flag, reason = settler.settle(bail_out_time)
         if flag != self.TEMP_OK:
             fatal("Temperature timeout: %s" % reason)
 
@@ -310,6 +318,9 @@ class BasePlatform(object):
         self.audit["dmesg"] = run_shell_cmd("dmesg")[0]
         self.audit["krun_version"] = util.get_git_version()
         self.audit["cli_args"] = sys.argv
+        # Results from throughput mode must never be mistaken for results
+        # from isolated process executions.
+        self.audit["execution_mode"] = self.config.execution_mode()
 
     def bench_cmdline_adjust(self, args, env_dct):
         """Prepends various arguments to benchmark invocation.
@@ -371,6 +382,46 @@ class BasePlatform(object):
     def pin_process_args(self):
         pass
 
+    def throughput_cpusets(self, num_sets):
+        """Returns 'num_sets' disjoint lists of CPUs, one for each of the
+        process executions run at once in throughput mode (see the
+        THROUGHPUT_PEXECS config option)."""
+        fatal("THROUGHPUT_PEXECS is not supported on this platform")
+
+    def pin_process_to_cpus_args(self, cpus):
+        """Arguments to pin a process to the given list of CPUs"""
+        fatal("THROUGHPUT_PEXECS is not supported on this platform")
+
+    def heater_cpus(self):
+        """The CPUs to load when heating the machine (see the HEATER_CPUS
+        config option). By default, all of them."""
+        if self.config.HEATER_CPUS is not None:
+            return list(self.config.HEATER_CPUS)
+        return range(os.sysconf("SC_NPROCESSORS_ONLN"))
+
+    def heater_pin_args(self, cpu):
+        """Arguments to run a heater process on the given CPU. By default,
+        heater processes are not pinned, and the OS spreads them out."""
+        return []
+
+    def heat(self, duration):
+        """Heat the machine for 'duration' seconds (see krun.heater)"""
+        Heater(self).heat(self.heater_cpus(), self.config.HEATER_DUTY_CYCLE,
+                          duration)
+
+    def init_system_ready(self):
+        """Returns True if the init system has finished starting services
+        (see the "init" readiness detector). By default, there is no way to
+        tell, so assume so."""
+        return True
+
+    def read_cpu_times(self):
+        """Returns an '(idle, total)' pair of the time all CPUs have spent
+        idle and in total since boot, in arbitrary units (see the "cpu-idle"
+        readiness detector)."""
+        fatal("the cpu-idle readiness detector is not supported on this "
+              "platform")
+
     @abstractmethod
     def is_virtual(self):
         """Attempt to decide if Krun is running in a virtual machine.
@@ -574,6 +625,8 @@ class OpenBSDPlatform(UnixLikePlatform):
 
     def check_preliminaries(self):
         self._check_apm_state()
+        if self.config.THROUGHPUT_PEXECS is not None:
+            self.throughput_cpusets(self.config.THROUGHPUT_PEXECS)
 
     def _get_apm_output(self):
         # separate for mocking
@@ -624,6 +677,12 @@ class OpenBSDPlatform(UnixLikePlatform):
             out, _, _ = run_shell_cmd("apm -H")
             self._check_apm_state()  # should work this time
 
+    def read_cpu_times(self):
+        # user, nice, sys, (spin,) intr, idle. Idle is always last.
+        out, _, _ = run_shell_cmd("sysctl -n kern.cp_time")
+        times = [int(x) for x in out.split(",")]
+        return times[-1], sum(times)
+
     def _get_sysctl_sensor_lines(self):
         # separate for test mocking
         out, err, rc = run_shell_cmd(self.FIND_TEMP_SENSORS_CMD, failure_fatal=False)
@@ -741,6 +800,9 @@ class LinuxPlatform(UnixLikePlatform):
     OVERCOMMIT_POLICY_MIB = "vm.overcommit_memory"
     OVERCOMMIT_POLICY_OFF = 2
     THROTTLE_DIRS_FMT = "/sys/devices/system/cpu/cpu%d/thermal_throttle"
+    THREAD_SIBLINGS_FMT = \
+        "/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list"
+    PROC_STAT = "/proc/stat"
 
     # Expected tickless kernel config
     #
@@ -924,6 +986,8 @@ class LinuxPlatform(UnixLikePlatform):
         if self.config.ENABLE_PINNING:
             self._check_cset_shield()
         self._check_overcommit()
+        if self.config.THROUGHPUT_PEXECS is not None:
+            self._check_throughput_cpusets()
 
     def _find_virt_what(self):
         debug("Check virt-what is installed")
@@ -1314,6 +1378,71 @@ class LinuxPlatform(UnixLikePlatform):
         return self.change_user_args("root") + \
             [LinuxPlatform.CSET_CMD, "shield", "-e", "--"]
 
+    def init_system_ready(self):
+        # Only systemd can tell us when it has finished booting. Other init
+        # systems have typically run rc.local (and hence Krun) last anyway.
+        if not find_executable("systemctl"):
+            return True
+        out, _, _ = run_shell_cmd("systemctl is-system-running",
+                                  failure_fatal=False)
+        # "degraded" means booted, but with some service having failed.
+        return out in ("running", "degraded")
+
+    def read_cpu_times(self):
+        # The first line of /proc/stat sums the time spent by all CPUs:
+        # cpu user nice system idle iowait irq softirq steal guest guest_nice
+        # The guest times are already included in user and nice.
+        with open(LinuxPlatform.PROC_STAT) as fh:
+            times = [int(x) for x in fh.readline().split()[1:9]]
+        return times[3] + times[4], sum(times)
+
+    def heater_pin_args(self, cpu):
+        args = []
+        if self.config.ENABLE_PINNING and cpu != 0:
+            # The shielded CPUs can only be used from inside the shield.
+            args = self.pin_process_args()
+        return args + ["taskset", "-c", str(cpu)]
+
+    def _read_thread_siblings(self, cpu):
+        with open(LinuxPlatform.THREAD_SIBLINGS_FMT % cpu) as fh:
+            return parse_cpu_list(fh.read())
+
+    def throughput_cpusets(self, num_sets):
+        """Share the physical cores, except for the boot core, between
+        'num_sets' process executions. Only one logical CPU of each core is
+        used, so that the process executions don't compete via SMT."""
+
+        cpus = []
+        seen_cores = set()
+        for cpu in xrange(self.num_cpus):
+            siblings = tuple(self._read_thread_siblings(cpu))
+            if 0 in siblings or siblings in seen_cores:
+                continue
+            seen_cores.add(siblings)
+            cpus.append(cpu)
+
+        per_set = len(cpus) // num_sets
+        if per_set == 0:
+            fatal("THROUGHPUT_PEXECS=%d, but there are only %d physical "
+                  "cores (excluding the boot core)" % (num_sets, len(cpus)))
+        return [cpus[i * per_set:(i + 1) * per_set]
+                for i in xrange(num_sets)]
+
+    def pin_process_to_cpus_args(self, cpus):
+        # Inside a cset shield (if ENABLE_PINNING), the process can be further
+        # restricted to a subset of the shielded CPUs.
+        return self.change_user_args("root") + \
+            ["taskset", "-c", ",".join(str(cpu) for cpu in cpus)]
+
+    def _check_throughput_cpusets(self):
+        debug("Check CPUs can be shared for throughput mode")
+        if not find_executable("taskset"):
+            fatal("taskset is not installed (needed for THROUGHPUT_PEXECS).")
+        cpusets = self.throughput_cpusets(self.config.THROUGHPUT_PEXECS)
+        info("Throughput mode CPU sets: %s" %
+             ", ".join(",".join(str(cpu) for cpu in cpus)
+                       for cpus in cpusets))
+
     def _check_cset_installed(self):
         debug("Check cset is installed")
 
@@ -0,0 +1,174 @@
+"""Deciding when a freshly booted machine is ready to run benchmarks.
+
+In reboot mode, services started at boot may still be busy when Krun starts.
+Rather than always waiting a fixed amount of time, Krun polls a list of
+readiness detectors (the STARTUP_READINESS_DETECTORS config option), and
+proceeds once all of them have reported the machine as quiet for
+STARTUP_QUIET_SECONDS in a row. No matter what the detectors say, Krun waits
+no longer than STARTUP_MAX_WAIT_SECONDS.
+
+Each detector is given as a spec string of the form "name" or
+"name:argument", e.g. "cpu-idle:98".
+"""
+
+import os
+import time
+
+from logging import debug, info, warn
+
+# How often the detectors are polled.
+POLL_SECONDS = 2
+
+
+class ReadinessDetector(object):
+    """Abstract readiness detector. Detectors may keep state between polls."""
+
+    name = None
+    takes_arg = False  # Whether the spec may have a ":argument" suffix.
+
+    def __init__(self, arg=None):
+        if arg is not None and not self.takes_arg:
+            raise ValueError("readiness detector %s takes no argument" %
+                             self.name)
+        self.arg = arg
+
+    def __str__(self):
+        if self.arg is None:
+            return self.name
+        return "%s:%s" % (self.name, self.arg)
+
+    def is_ready(self, platform):
+        """Poll the detector, returning True if the machine looks quiet."""
+        raise NotImplementedError("abstract")
+
+
+class InitDetector(ReadinessDetector):
+    """The init system has finished starting services."""
+
+    name = "init"
+
+    def is_ready(self, platform):
+        return platform.init_system_ready()
+
+
+class CPUIdleDetector(ReadinessDetector):
+    """The CPUs were idle for at least the given percentage (default 95) of
+    the time since the last poll."""
+
+    name = "cpu-idle"
+    takes_arg = True
+
+    def __init__(self, arg=None):
+        ReadinessDetector.__init__(self, arg)
+        try:
+            self.threshold = float(arg) if arg is not None else 95.0
+        except ValueError:
+            raise ValueError("bad idle percentage: %s" % arg)
+        if not 0 < self.threshold <= 100:
+            raise ValueError("idle percentage must be between 0 and 100")
+        self.last_times = None
+
+    def is_ready(self, platform):
+        times = platform.read_cpu_times()
+        last_times, self.last_times = self.last_times, times
+        if last_times is None:
+            return False  # Nothing to compare with yet.
+        idle = times[0] - last_times[0]
+        total = times[1] - last_times[1]
+        if total <= 0:
+            return True
+        debug("CPUs %.1f%% idle" % (100.0 * idle / total))
+        return 100.0 * idle / total >= self.threshold
+
+
+class LoadDetector(ReadinessDetector):
+    """The one minute load average is at most the given value (default 0.5).
+    The load average reacts slowly, so this is a conservative detector."""
+
+    name = "load"
+    takes_arg = True
+
+    def __init__(self, arg=None):
+        ReadinessDetector.__init__(self, arg)
+        try:
+            self.threshold = float(arg) if arg is not None else 0.5
+        except ValueError:
+            raise ValueError("bad load average: %s" % arg)
+
+    def is_ready(self, platform):
+        return os.getloadavg()[0] <= self.threshold
+
+
+class DmesgDetector(ReadinessDetector):
+    """Nothing has been added to the dmesg buffer since the last poll."""
+
+    name = "dmesg"
+
+    def __init__(self, arg=None):
+        ReadinessDetector.__init__(self, arg)
+        self.last_dmesg = None
+
+    def is_ready(self, platform):
+        dmesg = platform._collect_dmesg_lines()
+        last_dmesg, self.last_dmesg = self.last_dmesg, dmesg
+        return dmesg == last_dmesg
+
+
+READINESS_DETECTORS = dict((cls.name, cls) for cls in
+                           (InitDetector, CPUIdleDetector, LoadDetector,
+                            DmesgDetector))
+DEFAULT_READINESS_DETECTORS = ["init", "cpu-idle", "dmesg"]
+
+
+def get_readiness_detector(spec):
+    """Make a detector from a spec string (e.g. "cpu-idle:98").
+
+    Raises ValueError if the spec is invalid."""
+
+    if ":" in spec:
+        name, arg = spec.split(":", 1)
+    else:
+        name, arg = spec, None
+
+    try:
+        cls = READINESS_DETECTORS[name]
+    except KeyError:
+        raise ValueError("unknown readiness detector '%s'. Choose from: %s" %
+                         (name, ", ".join(sorted(READINESS_DETECTORS))))
+    return cls(arg)
+
+
+def wait_until_ready(platform, config):
+    """Wait until the machine has been quiet for long enough, according to
+    the configured detectors, or until the maximum wait is up. Returns the
+    number of seconds waited."""
+
+    if platform.quick_mode:
+        warn("SIMULATED: wait for the system to come up (--quick)")
+        return 0.0
+
+    detectors = [get_readiness_detector(spec)
+                 for spec in config.STARTUP_READINESS_DETECTORS]
+    start = time.time()
+    quiet_since = None
+    while True:
+        now = time.time()
+        # Poll every detector, even if an earlier one is busy, so that they
+        # all have up-to-date state to compare against next time.
+        busy = [str(detector) for detector in detectors
+                if not detector.is_ready(platform)]
+        if busy:
+            debug("System not yet quiet: %s" % ", ".join(busy))
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = now
+
+        if quiet_since is not None and \
+                now - quiet_since >= config.STARTUP_QUIET_SECONDS:
+            info("System came up after %d seconds" % (now - start))
+            return now - start
+        if now - start >= config.STARTUP_MAX_WAIT_SECONDS:
+            warn("System still busy after %d seconds (%s). Proceeding anyway."
+                 % (now - start, ", ".join(busy) or "quiet window not over"))
+            return now - start
+        platform.sleep(POLL_SECONDS)
@@ -1,9 +1,427 @@
+from krun.adaptive import summarise_pexec
 from krun.audit import Audit
-from logging import debug
-from krun.util import fatal, format_raw_exec_results
+from krun.compression import (codec_for_filename, detect_codec, get_codec,
+                              lzma, DEFAULT_CODEC)
+from logging import debug, warn
+from krun.json_stream import JSONStream, iter_array, iter_object
+from krun.util import fatal, format_raw_exec_results, replace_file_atomically
 
-import bz2  # decent enough compression with Python 2.7 compatibility.
+import array
 import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from functools import partial
+
+
+# The measurement sections of a results file. These are by far the largest
+# parts of the results, so they are only loaded when accessed.
+MEASUREMENT_SECTIONS = ("wallclock_times", "core_cycle_counts",
+                        "aperf_counts", "mperf_counts")
+
+
+class TypedArray(array.array):
+    """The measurements of one process execution (or of one core of one
+    process execution). Stored unboxed, but compares equal to a list of the
+    same values, so that it can be used much like the lists it replaces."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            return self.tolist() == other
+        return array.array.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _counter_array(counts):
+    if isinstance(counts, TypedArray):
+        return counts  # e.g. read from a results channel.
+    try:
+        return TypedArray("L", counts)  # uint64_t on 64-bit platforms.
+    except (TypeError, OverflowError):
+        # Some iterations runners (e.g. Lua) report counts as doubles.
+        return TypedArray("d", counts)
+
+
+def typed_pexec_measurements(section, measurements):
+    """Convert one process execution's worth of measurements for the named
+    section to a compact representation: a TypedArray for wall-clock times, or
+    a list of TypedArrays (one per core) for the per-core counters."""
+
+    if section == "wallclock_times":
+        return TypedArray("d", measurements)
+    else:
+        return [_counter_array(core) for core in measurements]
+
+
+def _json_default(obj):
+    if isinstance(obj, array.array):
+        return obj.tolist()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+# The binary results container is laid out as follows:
+#
+#   * BINARY_RESULTS_MAGIC.
+#   * The length of the header, as a little-endian uint64_t.
+#   * The header: UTF-8 JSON holding every section of the results except the
+#     measurements, plus an "index" section. The index mirrors the structure
+#     of the measurements, but where there would be an array of values there
+#     is instead an [offset, count, kind] column descriptor.
+#   * Padding to an 8-byte boundary, after which the columns start. Column
+#     offsets are relative to this point. Columns are little-endian and each
+#     value is 8 bytes wide. The kind of a column says how to interpret it
+#     ("f64" for a double, "u64" for an unsigned integer).
+#
+# Since the columns are uncompressed and fixed-width, a reader can mmap the
+# file and fetch the measurements of one key without reading the rest.
+BINARY_RESULTS_MAGIC = "KRUNRES\x01"
+BINARY_RESULTS_SUFFIX = ".bin"
+_COLUMN_KIND_TYPECODES = {"f64": "d", "u64": "L"}
+_COLUMN_TYPECODE_KINDS = {"d": "f64", "L": "u64"}
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+def is_binary_results_file(filename):
+    """Returns True if the file is a binary results container."""
+
+    with open(filename, "rb") as f:
+        return f.read(len(BINARY_RESULTS_MAGIC)) == BINARY_RESULTS_MAGIC
+
+
+def write_binary_results(filename, results):
+    """Write a dict of results sections as a binary results container."""
+
+    assert TypedArray("L").itemsize == 8
+
+    header = dict((k, v) for k, v in results.iteritems()
+                  if k not in MEASUREMENT_SECTIONS)
+    columns = []
+    offset = [0]
+
+    def add_column(values):
+        kind = _COLUMN_TYPECODE_KINDS[values.typecode]
+        if sys.byteorder != "little":
+            values = TypedArray(values.typecode, values)
+            values.byteswap()
+        columns.append(values.tostring())
+        desc = [offset[0], len(values), kind]
+        offset[0] += len(columns[-1])
+        return desc
+
+    index = dict()
+    for section in MEASUREMENT_SECTIONS:
+        index[section] = dict()
+        for key, pexecs in results[section].iteritems():
+            key_index = index[section][key] = []
+            for pexec in pexecs:
+                pexec = typed_pexec_measurements(section, pexec)
+                if section == "wallclock_times":
+                    key_index.append(add_column(pexec))
+                else:
+                    key_index.append([add_column(core) for core in pexec])
+    header["index"] = index
+    header["columns_len"] = offset[0]  # Lets readers detect truncation.
+
+    header_bytes = json.dumps(header, sort_keys=True, encoding="utf-8")
+    prelude_len = len(BINARY_RESULTS_MAGIC) + 8 + len(header_bytes)
+    with open(filename, "wb") as f:
+        f.write(BINARY_RESULTS_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.write("\0" * (_align8(prelude_len) - prelude_len))
+        for column in columns:
+            f.write(column)
+
+
+# Set in JSON results files whose measurement sections all come after the
+# other sections (see write_json_results()).
+MEASUREMENTS_LAST_KEY = "measurements_last"
+
+
+def write_json_results(f, results):
+    """Write a dict of results sections to the file object 'f' as JSON.
+
+    The measurement sections are written last, so that a reader can get at
+    the other, much smaller, sections without decompressing the
+    measurements."""
+
+    results = dict(results)
+    results[MEASUREMENTS_LAST_KEY] = True
+    sections = sorted(results, key=lambda s: (s in MEASUREMENT_SECTIONS, s))
+    f.write("{")
+    for idx, section in enumerate(sections):
+        f.write("%s\n %s: %s" % ("," if idx > 0 else "", json.dumps(section),
+                                 json.dumps(results[section], indent=1,
+                                            sort_keys=True, encoding="utf-8",
+                                            default=_json_default)))
+    f.write("\n}")
+
+
+class BinaryResultsReader(object):
+    """Random access to a binary results container via mmap(2)."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            if f.read(len(BINARY_RESULTS_MAGIC)) != BINARY_RESULTS_MAGIC:
+                fatal("not a binary results file: %s" % filename)
+            header_len, = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(header_len))
+            self.index = self.header.pop("index")
+            self.data_start = _align8(len(BINARY_RESULTS_MAGIC) + 8 +
+                                      header_len)
+            # Older containers don't record the length of their columns.
+            columns_len = self.header.pop("columns_len", 0)
+            if os.fstat(f.fileno()).st_size < self.data_start + columns_len:
+                raise ValueError("truncated binary results file")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.map.close()
+
+    def num_pexecs(self, key):
+        return len(self.index["wallclock_times"][key])
+
+    def _read_column(self, desc):
+        offset, count, kind = desc
+        values = TypedArray(_COLUMN_KIND_TYPECODES[kind])
+        start = self.data_start + offset
+        end = start + count * values.itemsize
+        if end > len(self.map):
+            fatal("truncated binary results file: %s" % self.filename)
+        values.fromstring(self.map[start:end])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def read_measurements(self, section, key, pexec_idx):
+        """Read one section's measurements of one process execution"""
+
+        desc = self.index[section][key][pexec_idx]
+        if section == "wallclock_times":
+            return self._read_column(desc)
+        else:
+            return [self._read_column(d) for d in desc]
+
+    def pexec_measurements(self, key, pexec_idx):
+        """Read the measurements of one process execution"""
+
+        return dict((section, self.read_measurements(section, key, pexec_idx))
+                    for section in MEASUREMENT_SECTIONS)
+
+
+class JSONResultsReader(object):
+    """Lazy access to the measurements of a JSON results file.
+
+    Opening the reader decodes the sections other than the measurements. If
+    the measurements come last in the file (see write_json_results()), the
+    reader stops there, and the number of process executions of each key is
+    taken from the pexec_flags section. Otherwise (in older files) the
+    measurements are skipped over without being decoded, counting the process
+    executions. Either way, the measurements are only decoded (by streaming
+    through the file again) when asked for."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = dict()
+        # Maps measurement sections to dicts mapping keys to the number of
+        # process executions of the key.
+        self.index = dict()
+        # Maps keys to dicts mapping measurement sections to the decoded
+        # measurements of the key.
+        self._cache = dict()
+
+        with detect_codec(filename).open(filename, "r") as f:
+            stream = JSONStream(f)
+            for section in iter_object(stream):
+                if section not in MEASUREMENT_SECTIONS:
+                    self.header[section] = stream.value()
+                    continue
+                if self.header.get(MEASUREMENTS_LAST_KEY):
+                    break
+                counts = self.index[section] = dict()
+                for key in iter_object(stream):
+                    counts[key] = 0
+                    for pexec_idx in iter_array(stream):
+                        stream.skip_value()
+                        counts[key] = pexec_idx + 1
+            else:
+                if stream.peek() != "":
+                    raise ValueError("trailing data in results file")
+
+        if self.header.pop(MEASUREMENTS_LAST_KEY, False):
+            counts = dict((key, len(flags)) for key, flags
+                          in self.header["pexec_flags"].iteritems())
+            for section in MEASUREMENT_SECTIONS:
+                self.index[section] = counts
+
+    def close(self):
+        self._cache = dict()
+
+    def num_pexecs(self, key):
+        return self.index["wallclock_times"][key]
+
+    def _read_measurements(self, keys):
+        """Decode the measurements of the given keys, in one pass through the
+        file. Returns a dict mapping keys to dicts mapping sections to lists
+        of process executions' measurements."""
+
+        debug("Decoding measurements of %d key(s) from %s" %
+              (len(keys), self.filename))
+        measurements = dict()
+        remaining = set(self.index)
+        try:
+            with detect_codec(self.filename).open(self.filename, "r") as f:
+                stream = JSONStream(f)
+                for section in iter_object(stream):
+                    if section not in MEASUREMENT_SECTIONS:
+                        stream.value()
+                        continue
+                    for key in iter_object(stream):
+                        if key not in keys:
+                            stream.skip_value()
+                            continue
+                        pexecs = measurements.setdefault(key, dict())[
+                            section] = []
+                        for _ in iter_array(stream):
+                            pexecs.append(typed_pexec_measurements(
+                                section, stream.value()))
+                    remaining.discard(section)
+                    if not remaining:
+                        break  # Don't bother decoding the rest of the file.
+        except RESULTS_READ_ERRORS as e:
+            fatal("can't read measurements from %s: %s" % (self.filename, e))
+        return measurements
+
+    def preload(self):
+        """Decode the measurements of every key not yet decoded, in one pass
+        through the file."""
+
+        missing = set(self.index["wallclock_times"]) - set(self._cache)
+        if missing:
+            self._cache.update(self._read_measurements(missing))
+
+    def pexec_measurements(self, key, pexec_idx):
+        """Read the measurements of one process execution. The first access
+        to a key decodes all of the key's measurements."""
+
+        if key not in self._cache:
+            self._cache.update(self._read_measurements(set([key])))
+        return dict((section, pexecs[pexec_idx]) for section, pexecs
+                    in self._cache[key].iteritems())
+
+
+def journal_filename(results_filename):
+    """Returns the path to the journal accompanying a results file"""
+
+    return results_filename + ".journal"
+
+
+def iter_journal(journal_file):
+    """Iterate over the records of a results journal, yielding pairs of
+    '(header, offset)', where 'offset' is the position of the record's
+    payload in the file.
+
+    The journal is a sequence of records, each of which is a single line
+    JSON header, followed by 'payload_len' bytes of compressed binary data
+    holding the measurements of one process execution (the raw contents of
+    its TypedArrays, see Results._write_journal_record()). A record which was
+    only partially written (e.g. due to a power cut) can only ever appear at
+    the end of the journal, and is ignored."""
+
+    with open(journal_file, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                if not line.endswith("\n"):
+                    raise ValueError("no newline")
+                header = json.loads(line)
+            except ValueError:
+                warn("Ignoring truncated record at end of %s" % journal_file)
+                break
+            offset = f.tell()
+            if offset + header["payload_len"] > file_size:
+                warn("Ignoring truncated record at end of %s" % journal_file)
+                break
+            f.seek(header["payload_len"], os.SEEK_CUR)
+            yield header, offset
+
+
+def unpack_journal_payload(header, payload):
+    """Decode the payload of a journal record (see iter_journal()) into a dict
+    mapping measurement sections to one process execution's measurements."""
+
+    try:
+        codec = get_codec(header.get("codec", DEFAULT_CODEC))
+    except ValueError as e:
+        fatal("can't read results journal: %s" % e)
+    data = codec.decompress(payload)
+    num_iters = header["num_iters"]
+    byteswap = header["byteorder"] != sys.byteorder
+    pos = 0
+    measurements = dict()
+    for section in MEASUREMENT_SECTIONS:
+        typecodes = header["typecodes"][section]
+        if section == "wallclock_times":
+            typecodes = [typecodes]
+        arrays = []
+        for typecode in typecodes:
+            arr = TypedArray(str(typecode))
+            end = pos + num_iters * arr.itemsize
+            arr.fromstring(data[pos:end])
+            if byteswap:
+                arr.byteswap()
+            arrays.append(arr)
+            pos = end
+        if section == "wallclock_times":
+            arrays = arrays[0]
+        measurements[section] = arrays
+    if pos != len(data):
+        fatal("corrupt record in results journal: %s[%d]" %
+              (header["key"], header["pexec_idx"]))
+    return measurements
+
+
+def backup_filename(results_filename):
+    """Returns the path to the backup of the previous generation of a results
+    file (see Config.KEEP_RESULTS_BACKUP)"""
+
+    return results_filename + ".bak"
+
+
+# What reading a corrupt results file may raise. Each decompressor has its
+# own ideas about how to report bad input.
+RESULTS_READ_ERRORS = (IOError, EOFError, ValueError, KeyError, struct.error,
+                       zlib.error)
+if lzma is not None:
+    RESULTS_READ_ERRORS += (lzma.LZMAError,)
+
+
+def _measurement_property(section):
+    def getter(self):
+        self.load_measurements()
+        return self._measurements[section]
+
+    def setter(self, value):
+        # Load first, so that pending process executions don't later get
+        # appended to the new value.
+        self.load_measurements()
+        self._measurements[section] = value
+        self._num_validated = dict()  # Nothing in the new value is checked.
+
+    return property(getter, setter)
 
 
 class Results(object):
@@ -22,19 +440,59 @@ class Results(object):
         self.config = config
         self.platform = platform
 
-        # "bmark:vm:variant" -> [[e0i0, e0i1, ...], [e1i0, e1i1, ...], ...]
-        self.wallclock_times = dict()  # wall-clock times
+        # The measurements, by section name (see MEASUREMENT_SECTIONS):
+        #
+        # wallclock_times:
+        #   "bmark:vm:variant" -> [[e0i0, e0i1, ...], [e1i0, e1i1, ...], ...]
+        #
+        # Secondary, per-core measurements (core_cycle_counts, aperf_counts,
+        # mperf_counts) have the structure as above, but lifted for N
+        # processor cores. i.e. aperf_counts[key][proc_exec#][core#][iter#]
+        #
+        # These are accessed via properties of the same names.
+        self._measurements = dict((s, dict()) for s in MEASUREMENT_SECTIONS)
 
-        # Secondary, per-core measurements
-        # Structure as above, but lifted for N processor cores.
-        # i.e. aperf_counts[core#][proc_exec#][in_proc_iter#]
-        self.core_cycle_counts = dict()
-        self.aperf_counts = dict()
-        self.mperf_counts = dict()
+        # Process executions whose measurements are not yet in
+        # self._measurements, in the order they should be appended. Each is a
+        # (key, fetch) pair, where fetch() returns a dict mapping section
+        # names to the process execution's measurements.
+        self._lazy_pexecs = []
+        # Open journals which lazy process executions are read from, by
+        # file name.
+        self._journal_fhs = dict()
+        # The BinaryResultsReader or JSONResultsReader of the results file,
+        # while some of its measurements are not yet loaded.
+        self._results_reader = None
 
         # Record the flag for each process execution.
         self.pexec_flags = dict()
 
+        # Record the CPUs each process execution was pinned to in throughput
+        # mode (see the THROUGHPUT_PEXECS config option). Process executions
+        # run in isolation have no entry. As this is written out as JSON, the
+        # process execution indices are strings.
+        # Maps "bmark:vm:variant" -> {"pexec_idx": [cpu, cpu, ...], ...}
+        self.pexec_cores = dict()
+
+        # Record how many times the iterations runner called the benchmark
+        # in each of its measured in-process iterations, if more than once
+        # (see the INNER_REPEATS config option). The measurements of such a
+        # process execution are of k calls each, not one.
+        # Maps "bmark:vm:variant" -> {"pexec_idx": k, ...}
+        self.pexec_inner_repeats = dict()
+
+        # Record a summary of each process execution's wall-clock times (see
+        # krun.adaptive.summarise_pexec()), so that the adaptive stopping rule
+        # doesn't need the measurements. Older results files lack these.
+        # Maps "bmark:vm:variant" -> {"pexec_idx": summary, ...}
+        self.pexec_summaries = dict()
+
+        # Record how long each run of Krun spent outside of its process
+        # executions, by phase (see krun.eta.PHASES). In throughput mode, a
+        # batch's phases are recorded against its first process execution.
+        # Maps "bmark:vm:variant" -> {"pexec_idx": {"phase": secs, ...}, ...}
+        self.pexec_phases = dict()
+
         # Record how long execs are taking so we can give the user a rough ETA.
         # Maps "bmark:vm:variant" -> [t_0, t_1, ...]
         self.eta_estimates = dict()
@@ -44,7 +502,23 @@ class Results(object):
         # thus prompting the user to investigate.
         self.error_flag = False
 
+        # Process executions appended since the results were last written
+        # out, as (key, pexec_idx, measurements) triples.
+        # See append_to_journal().
+        self.unjournaled_pexecs = []
+        self.journaled_error_flag = False
+
+        # Process executions whose phases were added to after they were
+        # journaled, as (key, pexec_idx) pairs. See add_pexec_phases().
+        self.unjournaled_phases = []
+
+        # Maps keys to the number of process executions (from the start) whose
+        # measurements have passed integrity checks. See integrity_check().
+        self._num_validated = dict()
+
         # Fill in attributes from the config, platform and prior results.
+        self.filename = results_file
+        self.config_text = None
         if self.config is not None:
             self.filename = self.config.results_filename()
             self.init_from_config()
@@ -62,6 +536,11 @@ class Results(object):
         if not Results.ok_to_instantiate:
             fatal("Results instance loaded prior to a process execution")
 
+    wallclock_times = _measurement_property("wallclock_times")
+    core_cycle_counts = _measurement_property("core_cycle_counts")
+    aperf_counts = _measurement_property("aperf_counts")
+    mperf_counts = _measurement_property("mperf_counts")
+
     @property
     def audit(self):
         return self._audit
@@ -78,31 +557,197 @@ class Results(object):
             for bmark, _ in self.config.BENCHMARKS.items():
                 for variant in vm_info["variants"]:
                     key = ":".join((bmark, vm_name, variant))
-                    self.wallclock_times[key] = []
-                    self.core_cycle_counts[key] = []
-                    self.aperf_counts[key] = []
-                    self.mperf_counts[key] = []
+                    for section in MEASUREMENT_SECTIONS:
+                        self._measurements[section][key] = []
                     self.pexec_flags[key] = []
                     self.eta_estimates[key] = []
 
     def read_from_file(self, results_file):
         """Initialise object from serialised file on disk.
+
+        If the file can't be read (e.g. it is corrupt), but a backup of the
+        previous generation of the file exists (see write_to_file()), then
+        the backup is read instead, along with the journal that was folded
+        into the unreadable generation.
+        """
+        journal_file = journal_filename(results_file)
+        journal_files = [journal_file]
+        try:
+            results = self._read_sections(results_file)
+        except RESULTS_READ_ERRORS as e:
+            backup_file = backup_filename(results_file)
+            if not os.path.exists(backup_file):
+                fatal("can't read %s: %s" % (results_file, e))
+            warn("Can't read %s (%s). Falling back to the previous "
+                 "generation: %s" % (results_file, e, backup_file))
+            try:
+                results = self._read_sections(backup_file)
+            except RESULTS_READ_ERRORS as e:
+                fatal("can't read %s or %s: %s" %
+                      (results_file, backup_file, e))
+            journal_files.insert(0, backup_filename(journal_file))
+
+        config = results.pop("config")
+        self.__dict__.update(results)
+        # Ensure that self.audit and self.config have correct types.
+        self.config_text = config
+        if self.config is not None:
+            self.config.check_config_consistency(config, results_file)
+        self.audit = results["audit"]
+
+        for journal_file in journal_files:
+            if os.path.exists(journal_file):
+                self.replay_journal(journal_file)
+        self.journaled_error_flag = self.error_flag
+
+        # Everything on disk was checked before it was written.
+        self._num_validated = dict((key, len(flags)) for key, flags
+                                   in self.pexec_flags.iteritems())
+
+    def _read_sections(self, results_file):
+        """Read a results file, returning a dict of the sections not held in
+        self._measurements. The measurements are left on disk until
+        accessed."""
+
+        if is_binary_results_file(results_file):
+            reader = BinaryResultsReader(results_file)
+        else:
+            reader = JSONResultsReader(results_file)
+        for section in MEASUREMENT_SECTIONS:
+            if section not in reader.index:  # Older files lack some sections.
+                continue
+            self._measurements[section] = dict(
+                (key, []) for key in reader.index[section])
+        for key in reader.index["wallclock_times"]:
+            for pexec_idx in xrange(reader.num_pexecs(key)):
+                self._lazy_pexecs.append(
+                    (key, partial(reader.pexec_measurements, key, pexec_idx)))
+        self._results_reader = reader
+        return reader.header
+
+    def replay_journal(self, journal_file):
+        """Apply the records of a results journal to this object.
+
+        Only the headers are read here. The payloads are skipped over, and
+        only decompressed if the measurements are accessed.
         """
-        with bz2.BZ2File(results_file, "rb") as f:
-            results = json.loads(f.read())
-            config = results.pop("config")
-            self.__dict__.update(results)
-            # Ensure that self.audit and self.config have correct types.
-            self.config_text = config
-            if self.config is not None:
-                self.config.check_config_consistency(config, results_file)
-            self.audit = results["audit"]
-
-    def integrity_check(self):
-        """Check the results make sense"""
-
-        num_cores = self.platform.num_per_core_measurements
+
+        debug("Replaying results journal: %s" % journal_file)
+        for header, offset in iter_journal(journal_file):
+            self._apply_journal_record(journal_file, header, offset)
+
+    def _apply_journal_record(self, journal_file, header, offset):
+        if header["error_flag"]:
+            self.error_flag = True
+
+        key = header.get("key")
+        if key is None:
+            return  # Record only carries the error flag.
+
+        pexec_idx = header["pexec_idx"]
+        if header.get("phases_update"):
+            # Phases recorded after the process execution was journaled.
+            self.pexec_phases.setdefault(key, dict()).setdefault(
+                str(pexec_idx), dict()).update(header["pexec_phases"])
+            return
+
+        num_pexecs = len(self.pexec_flags[key])
+        if pexec_idx < num_pexecs:
+            # Already folded into the results file by write_to_file(), but
+            # the journal was not removed before Krun was interrupted.
+            return
+        elif pexec_idx > num_pexecs:
+            fatal("results journal skips process executions: %s: %d vs %d" %
+                  (key, pexec_idx, num_pexecs))
+
+        self.pexec_flags[key].append(header["pexec_flag"])
+        if "pexec_cores" in header:
+            self.pexec_cores.setdefault(key, dict())[str(pexec_idx)] = \
+                header["pexec_cores"]
+        if "pexec_inner_repeats" in header:
+            self.pexec_inner_repeats.setdefault(key, dict())[
+                str(pexec_idx)] = header["pexec_inner_repeats"]
+        if "pexec_summary" in header:
+            self.pexec_summaries.setdefault(key, dict())[str(pexec_idx)] = \
+                header["pexec_summary"]
+        if "pexec_phases" in header:
+            self.pexec_phases.setdefault(key, dict())[str(pexec_idx)] = \
+                header["pexec_phases"]
+        self.eta_estimates[key].append(header["eta_estimate"])
+        self._lazy_pexecs.append(
+            (key, partial(self._read_journal_pexec, journal_file, offset,
+                          header)))
+
+    def _read_journal_pexec(self, journal_file, offset, header):
+        fh = self._journal_fhs.get(journal_file)
+        if fh is None:
+            fh = self._journal_fhs[journal_file] = open(journal_file, "rb")
+        fh.seek(offset)
+        return unpack_journal_payload(header, fh.read(header["payload_len"]))
+
+    def load_measurements(self, key=None):
+        """Bring the measurements of process executions into memory. If a key
+        is given, only that key's measurements are loaded, otherwise all are.
+
+        This is called implicitly when the measurements are first accessed.
+        """
+
+        if not self._lazy_pexecs:
+            return
+
+        debug("Loading measurements")
+        if key is None and isinstance(self._results_reader,
+                                      JSONResultsReader):
+            # Decode every key in one pass, rather than one pass per key.
+            self._results_reader.preload()
+        remaining = []
+        for lazy_key, fetch in self._lazy_pexecs:
+            if key is not None and lazy_key != key:
+                remaining.append((lazy_key, fetch))
+                continue
+            measurements = fetch()
+            for section, values in measurements.iteritems():
+                self._measurements[section][lazy_key].append(values)
+        self._lazy_pexecs = remaining
+
+        if not self._lazy_pexecs:
+            # Nothing more to read, so release the underlying files.
+            for fh in self._journal_fhs.itervalues():
+                fh.close()
+            self._journal_fhs = dict()
+            if self._results_reader is not None:
+                self._results_reader.close()
+                self._results_reader = None
+
+    def get_measurements(self, key):
+        """Returns a dict mapping section names to the measurements of the
+        given key. Only the key's measurements are brought into memory."""
+
+        self.load_measurements(key)
+        return dict((section, self._measurements[section][key])
+                    for section in MEASUREMENT_SECTIONS)
+
+    def integrity_check(self, full=False):
+        """Check the results make sense.
+
+        The measurements of each process execution only need checking once,
+        so those already checked (including those loaded from disk, which
+        were checked before they were written) are skipped, unless 'full' is
+        True. The cheap per-key checks are always done."""
+
+        # When there is no platform to say how many cores there should be,
+        # a full check insists that all process executions agree.
+        num_cores = None
+        if self.platform is not None:
+            num_cores = self.platform.num_per_core_measurements
+
         for key in self.wallclock_times.iterkeys():
+            for section_name in ("eta_estimates", "pexec_flags",
+                                 "core_cycle_counts", "aperf_counts",
+                                 "mperf_counts"):
+                if key not in getattr(self, section_name):
+                    fatal("missing key in %s: %s" % (section_name, key))
+
             wct_len = len(self.wallclock_times[key])
             eta_len = len(self.eta_estimates[key])
             cycles_len = len(self.core_cycle_counts[key])
@@ -125,70 +770,304 @@ class Results(object):
             if pexec_flags_len != wct_len:
                 fatal("inconsistent pexec flags length: %s: %d vs %d" % (key, pexec_flags_len, wct_len))
 
-            # Check the length of the different measurements match and that the
-            # number of per-core measurements is consistent.
-            for exec_idx in xrange(len(self.wallclock_times[key])):
-                expect_num_iters = len(self.wallclock_times[key][exec_idx])
-
-                cycles_num_cores = len(self.core_cycle_counts[key][exec_idx])
-                if cycles_num_cores != self.platform.num_per_core_measurements:
-                    fatal("wrong #cores in core_cycle_counts: %s[%d]: %d vs %d" %
-                          (key, exec_idx, num_cores, cycles_num_cores))
-                for core_idx, core in enumerate(self.core_cycle_counts[key][exec_idx]):
-                    core_len = len(core)
-                    if core_len != expect_num_iters:
-                        fatal("inconsistent #iters in core_cycle_counts: "
-                              "%s[%d][%d]. %d vs %d" %
-                              (key, exec_idx, core_idx, core_len, expect_num_iters))
-
-                aperf_num_cores = len(self.aperf_counts[key][exec_idx])
-                if aperf_num_cores != self.platform.num_per_core_measurements:
-                    fatal("wrong #cores in aperf_counts: %s[%d]: %d vs %d" %
-                          (key, exec_idx, num_cores, aperf_num_cores))
-                for core_idx, core in enumerate(self.aperf_counts[key][exec_idx]):
-                    core_len = len(core)
-                    if core_len != expect_num_iters:
-                        fatal("inconsistent #iters in aperf_counts: "
-                              "%s[%d][%d]. %d vs %d" %
-                              (key, exec_idx, core_idx, core_len, expect_num_iters))
-
-                mperf_num_cores = len(self.mperf_counts[key][exec_idx])
-                if mperf_num_cores != self.platform.num_per_core_measurements:
-                    fatal("wrong #cores in mperf_counts: %s[%d]: %d vs %d" %
-                          (key, exec_idx, num_cores, mperf_num_cores))
-                for core_idx, core in enumerate(self.mperf_counts[key][exec_idx]):
-                    core_len = len(core)
-                    if core_len != expect_num_iters:
-                        fatal("inconsistent #iters in mperf_counts: "
-                              "%s[%d][%d]. %d vs %d" %
-                              (key, exec_idx, core_idx, core_len, expect_num_iters))
+            for pexec_idx in self.pexec_cores.get(key, ()):
+                if not 0 <= int(pexec_idx) < wct_len:
+                    fatal("pexec cores for non-existent pexec: %s[%s]" %
+                          (key, pexec_idx))
+
+            for pexec_idx in self.pexec_inner_repeats.get(key, ()):
+                if not 0 <= int(pexec_idx) < wct_len:
+                    fatal("pexec inner repeats for non-existent pexec: "
+                          "%s[%s]" % (key, pexec_idx))
+
+            for pexec_idx in self.pexec_summaries.get(key, ()):
+                if not 0 <= int(pexec_idx) < wct_len:
+                    fatal("pexec summary for non-existent pexec: %s[%s]" %
+                          (key, pexec_idx))
+
+            for pexec_idx in self.pexec_phases.get(key, ()):
+                if not 0 <= int(pexec_idx) < wct_len:
+                    fatal("pexec phases for non-existent pexec: %s[%s]" %
+                          (key, pexec_idx))
+
+            first_idx = 0
+            if not full:
+                first_idx = self._num_validated.get(key, 0)
+            for exec_idx in xrange(first_idx, wct_len):
+                if full:
+                    flag = self.pexec_flags[key][exec_idx]
+                    if flag not in ("C", "E", "T"):
+                        fatal("bad pexec flag: %s[%d]: %s" %
+                              (key, exec_idx, flag))
+                    if num_cores is None:
+                        num_cores = \
+                            len(self.core_cycle_counts[key][exec_idx])
+                self._check_pexec(key, exec_idx,
+                                  self.wallclock_times[key][exec_idx],
+                                  self.core_cycle_counts[key][exec_idx],
+                                  self.aperf_counts[key][exec_idx],
+                                  self.mperf_counts[key][exec_idx],
+                                  num_cores)
+            self._num_validated[key] = wct_len
+
+    def _check_pexec(self, key, exec_idx, wallclock_times, core_cycle_counts,
+                     aperf_counts, mperf_counts, num_cores=None):
+        """Check the length of the different measurements of one process
+        execution match and that the number of per-core measurements is
+        consistent."""
+
+        if num_cores is None:
+            if self.platform is not None:
+                num_cores = self.platform.num_per_core_measurements
+            else:
+                # e.g. when converting a results file. We can still check
+                # that the per-core measurements agree with each other.
+                num_cores = len(core_cycle_counts)
+        expect_num_iters = len(wallclock_times)
+
+        cycles_num_cores = len(core_cycle_counts)
+        if cycles_num_cores != num_cores:
+            fatal("wrong #cores in core_cycle_counts: %s[%d]: %d vs %d" %
+                  (key, exec_idx, num_cores, cycles_num_cores))
+        for core_idx, core in enumerate(core_cycle_counts):
+            core_len = len(core)
+            if core_len != expect_num_iters:
+                fatal("inconsistent #iters in core_cycle_counts: "
+                      "%s[%d][%d]. %d vs %d" %
+                      (key, exec_idx, core_idx, core_len, expect_num_iters))
+
+        aperf_num_cores = len(aperf_counts)
+        if aperf_num_cores != num_cores:
+            fatal("wrong #cores in aperf_counts: %s[%d]: %d vs %d" %
+                  (key, exec_idx, num_cores, aperf_num_cores))
+        for core_idx, core in enumerate(aperf_counts):
+            core_len = len(core)
+            if core_len != expect_num_iters:
+                fatal("inconsistent #iters in aperf_counts: "
+                      "%s[%d][%d]. %d vs %d" %
+                      (key, exec_idx, core_idx, core_len, expect_num_iters))
+
+        mperf_num_cores = len(mperf_counts)
+        if mperf_num_cores != num_cores:
+            fatal("wrong #cores in mperf_counts: %s[%d]: %d vs %d" %
+                  (key, exec_idx, num_cores, mperf_num_cores))
+        for core_idx, core in enumerate(mperf_counts):
+            core_len = len(core)
+            if core_len != expect_num_iters:
+                fatal("inconsistent #iters in mperf_counts: "
+                      "%s[%d][%d]. %d vs %d" %
+                      (key, exec_idx, core_idx, core_len, expect_num_iters))
 
     def write_to_file(self):
-        """Serialise object on disk."""
+        """Serialise object on disk.
+
+        This rewrites the whole results file, folding in (and then removing)
+        any journal. During a benchmarking session, append_to_journal() should
+        be used instead.
+        """
 
         debug("Writing results out to: %s" % self.filename)
         self.integrity_check()
 
+        backup_file = None
+        if self.config is not None and self.config.KEEP_RESULTS_BACKUP:
+            backup_file = backup_filename(self.filename)
+            # The journal is kept alongside the backup (see below), so it
+            # must hold everything that is new in this generation.
+            self.append_to_journal()
+
         to_write = {
-            "config": self.config.text,
+            "config": self.config_text,
             "wallclock_times": self.wallclock_times,
             "core_cycle_counts": self.core_cycle_counts,
             "aperf_counts": self.aperf_counts,
             "mperf_counts": self.mperf_counts,
             "pexec_flags": self.pexec_flags,
+            "pexec_cores": self.pexec_cores,
+            "pexec_inner_repeats": self.pexec_inner_repeats,
+            "pexec_summaries": self.pexec_summaries,
+            "pexec_phases": self.pexec_phases,
             "audit": self.audit.audit,
             "eta_estimates": self.eta_estimates,
             "error_flag": self.error_flag,
         }
-        with bz2.BZ2File(self.filename, "w") as f:
-            f.write(json.dumps(to_write,
-                               indent=1, sort_keys=True, encoding='utf-8'))
+
+        # Write a new generation of the file alongside the old, then swap it
+        # in, so that a crash (or power cut) at any point leaves a complete
+        # results file on disk.
+        tmp_filename = self.filename + ".tmp"
+        if self.filename.endswith(BINARY_RESULTS_SUFFIX):
+            write_binary_results(tmp_filename, to_write)
+        else:
+            with self.codec().open(tmp_filename, "w") as f:
+                write_json_results(f, to_write)
+        replace_file_atomically(tmp_filename, self.filename, backup_file)
+
+        # Everything in the journal is now in the results file. If the
+        # previous generation was kept, so is the journal, as the two together
+        # hold everything in the new generation (see read_from_file()).
+        journal_file = journal_filename(self.filename)
+        if backup_file is None:
+            if os.path.exists(journal_file):
+                os.unlink(journal_file)
+        else:
+            backup_journal_file = backup_filename(journal_file)
+            if os.path.exists(journal_file):
+                os.rename(journal_file, backup_journal_file)
+            elif os.path.exists(backup_journal_file):
+                os.unlink(backup_journal_file)
+        self.unjournaled_pexecs = []
+        self.unjournaled_phases = []
+        self.journaled_error_flag = self.error_flag
+
+    def append_to_journal(self):
+        """Append new process executions to the journal on disk.
+
+        Only the process executions added since the results were loaded (or
+        last written) are checked and written, so the cost is proportional to
+        the size of one process execution, not to the size of the whole
+        results file. Notably, this does not need the measurements of earlier
+        process executions to be loaded.
+        """
+
+        for key, pexec_idx, measurements in self.unjournaled_pexecs:
+            eta_len = len(self.eta_estimates[key])
+            pexec_flags_len = len(self.pexec_flags[key])
+            if eta_len != pexec_flags_len:
+                fatal("inconsistent etas length: %s: %d vs %d" %
+                      (key, eta_len, pexec_flags_len))
+            self._check_pexec(key, pexec_idx,
+                              measurements["wallclock_times"],
+                              measurements["core_cycle_counts"],
+                              measurements["aperf_counts"],
+                              measurements["mperf_counts"])
+            if self._num_validated.get(key, 0) == pexec_idx:
+                self._num_validated[key] = pexec_idx + 1
+
+        if not self.unjournaled_pexecs and not self.unjournaled_phases and \
+                self.error_flag == self.journaled_error_flag:
+            return  # Nothing to do.
+
+        journal_file = journal_filename(self.filename)
+        debug("Appending results to journal: %s" % journal_file)
+        with open(journal_file, "ab") as f:
+            for key, pexec_idx, measurements in self.unjournaled_pexecs:
+                self._write_journal_record(f, key, pexec_idx, measurements)
+            for key, pexec_idx in self.unjournaled_phases:
+                self._write_journal_record(f, key, pexec_idx,
+                                           phases_update=True)
+            if not self.unjournaled_pexecs and not self.unjournaled_phases:
+                self._write_journal_record(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.unjournaled_pexecs = []
+        self.unjournaled_phases = []
+        self.journaled_error_flag = self.error_flag
+
+    def _write_journal_record(self, f, key=None, pexec_idx=None,
+                              measurements=None, phases_update=False):
+        header = {"error_flag": self.error_flag}
+        payload = ""
+        if phases_update:
+            header["key"] = key
+            header["pexec_idx"] = pexec_idx
+            header["phases_update"] = True
+            header["pexec_phases"] = self.get_pexec_phases(key, pexec_idx)
+        elif key is not None:
+            header["key"] = key
+            header["pexec_idx"] = pexec_idx
+            header["pexec_flag"] = self.pexec_flags[key][pexec_idx]
+            cores = self.get_pexec_cores(key, pexec_idx)
+            if cores is not None:
+                header["pexec_cores"] = cores
+            inner_repeats = self.get_pexec_inner_repeats(key, pexec_idx)
+            if inner_repeats != 1:
+                header["pexec_inner_repeats"] = inner_repeats
+            if str(pexec_idx) in self.pexec_summaries.get(key, ()):
+                header["pexec_summary"] = \
+                    self.pexec_summaries[key][str(pexec_idx)]
+            phases = self.get_pexec_phases(key, pexec_idx)
+            if phases is not None:
+                header["pexec_phases"] = phases
+            header["eta_estimate"] = self.eta_estimates[key][pexec_idx]
+
+            # The payload is the raw contents of the TypedArrays, in the order
+            # of MEASUREMENT_SECTIONS. The header records enough to rebuild
+            # them.
+            header["num_iters"] = len(measurements["wallclock_times"])
+            header["byteorder"] = sys.byteorder
+            typecodes = dict()
+            chunks = []
+            for section in MEASUREMENT_SECTIONS:
+                if section == "wallclock_times":
+                    arr = measurements[section]
+                    typecodes[section] = arr.typecode
+                    chunks.append(arr.tostring())
+                else:
+                    typecodes[section] = [a.typecode for a in measurements[section]]
+                    chunks.extend(a.tostring() for a in measurements[section])
+            header["typecodes"] = typecodes
+            codec = self.codec()
+            header["codec"] = str(codec)
+            payload = codec.compress("".join(chunks))
+        header["payload_len"] = len(payload)
+        f.write(json.dumps(header, sort_keys=True) + "\n")
+        f.write(payload)
+
+    def codec(self):
+        """The compression codec to write the results (and journal) with"""
+
+        if self.config is not None:
+            return self.config.codec()
+        # No config to tell us, so go by the file name.
+        return codec_for_filename(self.filename)
+
+    def get_pexec_cores(self, key, pexec_idx):
+        """Return the list of CPUs a process execution was pinned to in
+        throughput mode, or None if it was run in isolation."""
+        return self.pexec_cores.get(key, dict()).get(str(pexec_idx))
+
+    def get_pexec_inner_repeats(self, key, pexec_idx):
+        """Return how many times the benchmark was called in each measured
+        in-process iteration of a process execution."""
+        return self.pexec_inner_repeats.get(key, dict()).get(str(pexec_idx), 1)
+
+    def get_pexec_summary(self, key, pexec_idx):
+        """Return the summary of a process execution's wall-clock times (see
+        krun.adaptive.summarise_pexec()). Older results don't record these,
+        in which case the key's measurements are loaded to compute it."""
+
+        summaries = self.pexec_summaries.get(key, dict())
+        if str(pexec_idx) in summaries:
+            return summaries[str(pexec_idx)]
+        return summarise_pexec(
+            self.get_measurements(key)["wallclock_times"][pexec_idx],
+            self.get_pexec_inner_repeats(key, pexec_idx))
+
+    def get_pexec_phases(self, key, pexec_idx):
+        """Return a dict mapping phases to the seconds spent in them by the
+        run of a process execution, or None if none were recorded."""
+        return self.pexec_phases.get(key, dict()).get(str(pexec_idx))
+
+    def add_pexec_phases(self, key, pexec_idx, phases):
+        """Record the time spent in 'phases' (a dict mapping phase names to
+        seconds) by the run of a process execution, adding to any phases
+        already recorded for it."""
+
+        self.pexec_phases.setdefault(key, dict()).setdefault(
+            str(pexec_idx), dict()).update(phases)
+        if (key, pexec_idx) in self.unjournaled_phases:
+            return
+        for unjournaled_key, unjournaled_idx, _ in self.unjournaled_pexecs:
+            if (unjournaled_key, unjournaled_idx) == (key, pexec_idx):
+                return  # The phases go out with the process execution.
+        self.unjournaled_phases.append((key, pexec_idx))
 
     def jobs_completed(self, key):
         """Return number of executions for which we have data for a given
         benchmark / vm / variant triplet.
         """
-        return len(self.wallclock_times[key])
+        return len(self.pexec_flags[key])
 
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
@@ -199,30 +1078,70 @@ class Results(object):
                 self.aperf_counts == other.aperf_counts and
                 self.mperf_counts == other.mperf_counts and
                 self.pexec_flags == other.pexec_flags and
+                self.pexec_cores == other.pexec_cores and
+                self.pexec_inner_repeats == other.pexec_inner_repeats and
+                self.pexec_summaries == other.pexec_summaries and
+                self.pexec_phases == other.pexec_phases and
                 self.audit == other.audit and
                 self.eta_estimates == other.eta_estimates and
                 self.error_flag == other.error_flag)
 
-    def append_exec_measurements(self, key, measurements, flag):
-        """Unpacks a measurements dict into the Results instance"""
+    def append_exec_measurements(self, key, measurements, flag, cores=None):
+        """Unpacks a measurements dict into the Results instance. 'cores' is
+        the list of CPUs the process execution was pinned to in throughput
+        mode. The dict may say how many times the benchmark was called in
+        each iteration, under "inner_repeats"."""
 
         # Only a subset of flags can arise at this time.
         assert flag in ("C", "E", "T")
 
+        inner_repeats = measurements.get("inner_repeats", 1)
+
         # Consistently format monotonic time doubles
         wallclock_times = format_raw_exec_results(
             measurements["wallclock_times"])
+        measurements = {
+            "wallclock_times": typed_pexec_measurements(
+                "wallclock_times", wallclock_times),
+            "core_cycle_counts": typed_pexec_measurements(
+                "core_cycle_counts", measurements["core_cycle_counts"]),
+            "aperf_counts": typed_pexec_measurements(
+                "aperf_counts", measurements["aperf_counts"]),
+            "mperf_counts": typed_pexec_measurements(
+                "mperf_counts", measurements["mperf_counts"]),
+        }
 
         self.pexec_flags[key].append(flag)
-        self.wallclock_times[key].append(wallclock_times)
-        self.core_cycle_counts[key].append(measurements["core_cycle_counts"])
-        self.aperf_counts[key].append(measurements["aperf_counts"])
-        self.mperf_counts[key].append(measurements["mperf_counts"])
+        if cores is not None:
+            self.pexec_cores.setdefault(key, dict())[
+                str(len(self.pexec_flags[key]) - 1)] = list(cores)
+        if inner_repeats != 1:
+            self.pexec_inner_repeats.setdefault(key, dict())[
+                str(len(self.pexec_flags[key]) - 1)] = inner_repeats
+        self.pexec_summaries.setdefault(key, dict())[
+            str(len(self.pexec_flags[key]) - 1)] = summarise_pexec(
+                measurements["wallclock_times"], inner_repeats)
+        if self._lazy_pexecs:
+            # Earlier process executions are not yet loaded. Queue this one
+            # up behind them.
+            self._lazy_pexecs.append((key, lambda: measurements))
+        else:
+            for section in MEASUREMENT_SECTIONS:
+                self._measurements[section][key].append(measurements[section])
+        self.unjournaled_pexecs.append(
+            (key, len(self.pexec_flags[key]) - 1, measurements))
 
     def dump(self, what):
         if what == "config":
             return unicode(self.config_text)
         if what == "audit":
             return unicode(self.audit)
+        if what == "data":
+            data = dict((section, dict()) for section in MEASUREMENT_SECTIONS)
+            for key in self.pexec_flags:
+                for section, pexecs in self.get_measurements(key).iteritems():
+                    data[section][key] = pexecs
+            return json.dumps(data, sort_keys=True, indent=2,
+                              default=_json_default)
         return json.dumps(getattr(self, what),
-                          sort_keys=True, indent=2)
+                          sort_keys=True, indent=2, default=_json_default)
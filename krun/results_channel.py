@@ -0,0 +1,190 @@
+"""A shared-memory channel through which iterations runners hand their
+measurements to Krun, instead of printing them as JSON.
+
+Before a process execution, Krun makes a file of the layout below, sized for
+the number of in-process iterations, and passes its path to the iterations
+runner in the CHANNEL_ENV environment variable. A runner which supports the
+channel has libkruntime store the measurements in memory of the same layout
+(see krun_init_iters()), and at the end has krun_export_store() write them
+into the channel in one go, marking it complete. Nothing is printed on stdout.
+A runner which doesn't support the channel ignores it and prints JSON as
+before, and Krun falls back to parsing that.
+
+If there is no channel, krun_export_store() prints the measurements on stdout
+as JSON instead, just as runners did before libkruntime stored them. A runner
+may also write the raw bytes on stdout with krun_dump_store(), and Krun parses
+them from there (see parse_measurements()).
+
+For very short benchmarks, Krun may also ask the runner, in INNER_REPEATS_ENV,
+to call the benchmark several times between each pair of krun_measure()s:
+either a fixed number of times, or "auto:<secs>", in which case the runner
+doubles the number of calls (in unmeasured batches, before the first
+iteration) until a batch takes at least <secs> seconds. The runner reads the
+setting with krun_get_inner_repeats() (and krun_next_inner_repeats() in auto
+mode), and passes the number of calls it settled on to
+krun_set_inner_repeats(), which records it in the header.
+
+The file is laid out as follows. All values are native-endian, as Krun and the
+runner share a machine, and 8 bytes wide:
+
+  * The header (HEADER_SIZE bytes): CHANNEL_MAGIC, then uint64_ts: the number
+    of in-process iterations, the number of cores, the state of the channel
+    (one of the STATE_* constants), and how many times the benchmark was
+    called in each iteration (0, from older runners, meaning once). The rest
+    is reserved and zero.
+  * wallclock_times: a double per iteration.
+  * core_cycle_counts, aperf_counts, then mperf_counts: each a uint64_t per
+    core per iteration, core by core (all iterations of core 0, then all
+    iterations of core 1, and so on).
+"""
+
+import errno
+import mmap
+import os
+import struct
+import tempfile
+
+from logging import debug
+from krun.results import TypedArray
+from krun.util import ExecutionFailed
+
+CHANNEL_ENV = "KRUN_RESULTS_CHANNEL"
+INNER_REPEATS_ENV = "KRUN_INNER_REPEATS"
+CHANNEL_MAGIC = "KRUNCHN\x01"
+HEADER_SIZE = 64
+_HEADER_FORMAT = "=8sQQQQ"
+
+# Set by the runner: STATE_ATTACHED if only some iterations were measured,
+# STATE_COMPLETE once every measurement is stored.
+STATE_UNUSED = 0
+STATE_ATTACHED = 1
+STATE_COMPLETE = 2
+
+PER_CORE_SECTIONS = ("core_cycle_counts", "aperf_counts", "mperf_counts")
+
+
+def channel_available():
+    """Returns True if Krun can read a channel on this platform: the counters
+    are read into TypedArrays of unsigned longs, which must be 8 bytes
+    wide."""
+
+    return TypedArray("L").itemsize == 8
+
+
+def channel_size(num_iters, num_cores):
+    return HEADER_SIZE + 8 * num_iters * (1 + len(PER_CORE_SECTIONS) *
+                                          num_cores)
+
+
+def is_channel_data(buf):
+    """Returns True if 'buf' (e.g. a runner's stdout) holds channel data"""
+
+    return buf[:len(CHANNEL_MAGIC)] == CHANNEL_MAGIC
+
+
+def parse_measurements(buf, num_iters=None, num_cores=None):
+    """Parse the channel data in 'buf' (anything supporting the buffer
+    interface) into a measurements dict, as would have been parsed from the
+    runner's JSON, with the runner's inner repeats (see above) under
+    "inner_repeats" if it recorded them. If given, 'num_iters' and
+    'num_cores' must match the header. Returns None if the runner didn't
+    touch the channel, and raises ExecutionFailed if it left it
+    inconsistent."""
+
+    if len(buf) < HEADER_SIZE:
+        raise ExecutionFailed("Results channel data was truncated")
+    magic, got_iters, got_cores, state, inner_repeats = \
+        struct.unpack_from(_HEADER_FORMAT, buf)
+    if state == STATE_UNUSED:
+        return None
+    if magic != CHANNEL_MAGIC or \
+            num_iters not in (None, got_iters) or \
+            num_cores not in (None, got_cores):
+        raise ExecutionFailed("Results channel header was clobbered")
+    if state != STATE_COMPLETE:
+        raise ExecutionFailed(
+            "Benchmark didn't complete its results channel (state=%s)" % state)
+    if len(buf) != channel_size(got_iters, got_cores):
+        raise ExecutionFailed("Results channel has the wrong size")
+
+    # The values are copied out of 'buf' once, straight into the arrays Krun
+    # stores them in, rather than being converted one by one.
+    offset = [HEADER_SIZE]
+
+    def read_column(typecode):
+        values = TypedArray(typecode)
+        values.fromstring(buffer(buf, offset[0], values.itemsize * got_iters))
+        offset[0] += values.itemsize * got_iters
+        return values
+
+    measurements = {"wallclock_times": read_column("d")}
+    for section in PER_CORE_SECTIONS:
+        measurements[section] = [read_column("L") for _ in xrange(got_cores)]
+    if inner_repeats != 0:
+        measurements["inner_repeats"] = int(inner_repeats)
+    return measurements
+
+
+class ResultsChannel(object):
+    """A results channel for one process execution."""
+
+    def __init__(self, num_iters, num_cores):
+        self.num_iters = num_iters
+        self.num_cores = num_cores
+        self.map = None
+
+        fd, self.filename = tempfile.mkstemp(prefix="krunchannel-",
+                                             suffix=".bin")
+        try:
+            header = struct.pack(_HEADER_FORMAT, CHANNEL_MAGIC, num_iters,
+                                 num_cores, STATE_UNUSED, 0)
+            os.write(fd, header)
+            # The arrays are left as zeros, which costs no disk space.
+            os.ftruncate(fd, channel_size(num_iters, num_cores))
+        finally:
+            os.close(fd)
+        debug("Made results channel %s" % self.filename)
+
+    def collect(self):
+        """Map the channel once the runner has finished with it. The
+        measurements can then be read with read_measurements(), and the file
+        removed with unlink()."""
+
+        with open(self.filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= HEADER_SIZE:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def unlink(self):
+        """Remove the channel file, if it still exists. The mapping, if any,
+        stays readable."""
+
+        try:
+            os.unlink(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def close(self):
+        """Unmap and remove the channel, whether or not the measurements were
+        read. Safe to call more than once."""
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.unlink()
+
+    def read_measurements(self):
+        """Returns a measurements dict (as would have been parsed from the
+        runner's JSON) or None if the runner didn't use the channel. Raises
+        ExecutionFailed if the runner left the channel inconsistent."""
+
+        if self.map is None:
+            raise ExecutionFailed("Results channel %s was truncated" %
+                                  self.filename)
+        try:
+            return parse_measurements(self.map, self.num_iters,
+                                      self.num_cores)
+        finally:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,138 @@
+"""Policies for ordering the process executions of a new manifest.
+
+A policy is selected with the SCHEDULE_POLICY config option, which is a spec
+string of the form "name" or "name:argument", e.g. "random:42". Whatever the
+policy, each key gets N_EXECUTIONS process executions. Only the order differs.
+"""
+
+import random
+
+from krun.dump import read_eta_estimates
+from krun.util import fatal
+
+
+class SchedulePolicy(object):
+    """Abstract schedule ordering policy"""
+
+    name = None
+    takes_arg = False  # Whether the spec may have a ":argument" suffix.
+
+    def __init__(self, arg=None):
+        if arg is not None and not self.takes_arg:
+            raise ValueError("schedule policy %s takes no argument" %
+                             self.name)
+        self.arg = arg
+
+    def __str__(self):
+        if self.arg is None:
+            return self.name
+        return "%s:%s" % (self.name, self.arg)
+
+    def order(self, keys, n_executions):
+        """Return a list of keys, one per process execution, in the order in
+        which they should be run. 'keys' is in the order in which
+        ManifestManager.make_schedule() enumerates the config's VMS and
+        BENCHMARKS. These are dictionaries, so this is not necessarily the
+        order in which they are written in the config file."""
+        raise NotImplementedError("abstract")
+
+
+class RoundRobinPolicy(SchedulePolicy):
+    """Run one process execution of each key in turn, N_EXECUTIONS times.
+    This is Krun's traditional order."""
+
+    name = "round-robin"
+
+    def order(self, keys, n_executions):
+        return [key for _ in xrange(n_executions) for key in keys]
+
+
+class RandomPolicy(SchedulePolicy):
+    """As round-robin, but with the keys shuffled differently in each round.
+    The argument is the seed for the random number generator (default 0), so
+    that a given config always gives the same schedule.
+
+    Since each round still runs every key once, the ETA is known as early as
+    with round-robin, but no key is consistently run after (say) the same
+    slow key."""
+
+    name = "random"
+    takes_arg = True
+
+    def __init__(self, arg=None):
+        SchedulePolicy.__init__(self, arg)
+        try:
+            self.seed = int(arg) if arg is not None else 0
+        except ValueError:
+            raise ValueError("bad random seed: %s" % arg)
+
+    def order(self, keys, n_executions):
+        rng = random.Random(self.seed)
+        schedule = []
+        for _ in xrange(n_executions):
+            round_keys = list(keys)
+            rng.shuffle(round_keys)
+            schedule.extend(round_keys)
+        return schedule
+
+
+class BlockedPolicy(SchedulePolicy):
+    """Run all process executions of one key before moving on to the next."""
+
+    name = "blocked"
+
+    def order(self, keys, n_executions):
+        return [key for key in keys for _ in xrange(n_executions)]
+
+
+class ShortestKnownFirstPolicy(SchedulePolicy):
+    """As round-robin, but with each round ordered by the expected duration of
+    a process execution of each key, shortest first. The argument is a
+    results file (e.g. from an earlier session), whose ETA estimates are used
+    for the expected durations. Keys with no estimates run last in each round.
+    Ties, and keys with no estimates, keep the order they have with
+    round-robin."""
+
+    name = "shortest-known-first"
+    takes_arg = True
+
+    def expected_durations(self):
+        if self.arg is None:
+            return {}
+        try:
+            etas = read_eta_estimates(self.arg)
+        except (IOError, OSError, ValueError) as e:
+            fatal("can't read ETA estimates from %s: %s" % (self.arg, e))
+        return dict((key, sum(vals) / len(vals))
+                    for key, vals in etas.iteritems() if vals)
+
+    def order(self, keys, n_executions):
+        durations = self.expected_durations()
+        known = sorted((key for key in keys if key in durations),
+                       key=lambda key: durations[key])
+        round_keys = known + [key for key in keys if key not in durations]
+        return [key for _ in xrange(n_executions) for key in round_keys]
+
+
+SCHEDULE_POLICIES = dict((cls.name, cls) for cls in
+                         (RoundRobinPolicy, RandomPolicy, BlockedPolicy,
+                          ShortestKnownFirstPolicy))
+DEFAULT_SCHEDULE_POLICY = "round-robin"
+
+
+def get_schedule_policy(spec):
+    """Make a policy from a spec string (e.g. "random:42").
+
+    Raises ValueError if the spec is invalid."""
+
+    if ":" in spec:
+        name, arg = spec.split(":", 1)
+    else:
+        name, arg = spec, None
+
+    try:
+        cls = SCHEDULE_POLICIES[name]
+    except KeyError:
+        raise ValueError("unknown schedule policy '%s'. Choose from: %s" %
+                         (name, ", ".join(sorted(SCHEDULE_POLICIES))))
+    return cls(arg)
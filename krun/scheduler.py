@@ -1,15 +1,16 @@
 from krun.time_estimate import TimeEstimateFormatter, now_str
-from krun.results import Results
-from krun import util
+from krun.results import Results, journal_filename
+from krun.manifest_index import (index_filename, manifest_fingerprint,
+                                 read_manifest_index, write_manifest_index,
+                                 MANIFEST_FLAGS)
+from krun import adaptive, calibrate, eta, readiness, util
+from krun.shard import publish_shard_results
 
 from logging import warn, info, error, debug
 
-import os, sys, time
+import copy, os, sys, threading, time
 import krun.util as util
 
-# Wait this many seconds for the init system to finish bringing up services.
-STARTUP_WAIT_SECONDS = 2 * 60
-
 
 def mean(seq):
     if len(seq) == 0:
@@ -33,10 +34,11 @@ class ManifestManager(object):
     # Mandatory manifest header fields (others exist, e.g. start temperatures)
     HEADER_FIELDS = set(["num_reboots", "eta_avail_idx", "num_mails_sent"])
 
-    def __init__(self, config, platform, new_file=False):
+    def __init__(self, config, platform, new_file=False, schedule=None):
         """If new_file is True, write a new manifest file to disk based on the
-        contents of the config file, otherwise parse the (existing) manifest
-        file corresponding with the config file."""
+        contents of the config file (or on 'schedule', if given, see
+        _write_new_manifest()), otherwise parse the (existing) manifest file
+        corresponding with the config file."""
 
         self.platform = platform
 
@@ -45,9 +47,10 @@ class ManifestManager(object):
         self.num_reboots_maxout = 10 ** ManifestManager.NUM_REBOOTS_BYTES - 1
 
         self.path = ManifestManager.get_filename(config)
+        self.use_index = config.MANIFEST_INDEX
         if new_file:
-            self._write_new_manifest(config)
-        self._parse()
+            self._write_new_manifest(config, schedule)
+        self._load()
 
     @staticmethod
     def get_filename(config):
@@ -77,10 +80,59 @@ class ManifestManager(object):
         self.num_reboots_offset = None
         self.starting_temperatures = {} # name -> (offset, degrees C floats)
 
+        # Maps each key to the number of its records before the next
+        # outstanding record (if there is one). See next_exec_key_index().
+        self.key_record_counts = {}
+
+        # The number of records with each flag.
+        self.flag_counts = dict((flag, 0) for flag in MANIFEST_FLAGS)
+
+        # The identity, size and modification time of the manifest file when
+        # it was last parsed or written by this instance.
+        self.fingerprint = None
+
     def _open(self):
         debug("Reading status cookie from %s" % self.path)
         return open(self.path, "r+")
 
+    def _load(self):
+        """Load the state from the index, if enabled and up-to-date, otherwise
+        by parsing the manifest"""
+
+        if self.use_index:
+            state = read_manifest_index(self.path)
+            if state is not None and set(state["starting_temperatures"]) == \
+                    set(self.platform.temp_sensors):
+                debug("Loading manifest state from %s" %
+                      index_filename(self.path))
+                self._reset()
+                self.__dict__.update(state)
+                return
+            debug("Manifest index missing or stale")
+        self._parse()
+
+    def _record_fingerprint(self):
+        """Called whenever the in-memory state and the manifest file are known
+        to agree"""
+
+        self.fingerprint = manifest_fingerprint(self.path)
+        if self.use_index:
+            write_manifest_index(self)
+
+    def _check_fingerprint(self):
+        """The in-memory state is only updated incrementally after it is first
+        parsed from the manifest file, so should the file be changed by
+        something else, it is re-parsed."""
+
+        if manifest_fingerprint(self.path) != self.fingerprint:
+            debug("Manifest file changed on disk, re-parsing")
+            self._parse()
+
+    def reload(self):
+        """Re-parse the manifest file"""
+
+        self._parse()
+
     # In its own method, as it needs a config instance
     def get_total_in_proc_iters(self, config):
         num = 0
@@ -138,9 +190,15 @@ class ManifestManager(object):
                 self.outstanding_exec_counts[key] = 0
             if not key in self.completed_exec_counts:
                 self.completed_exec_counts[key] = 0
+            if key not in self.key_record_counts:
+                self.key_record_counts[key] = 0
+
+            if flag in self.flag_counts:
+                self.flag_counts[flag] += 1
 
             if flag in ["S", "E", "C", "T"]:  # skip, error, completed, timeout
-                pass
+                if self.num_execs_left == 0:  # before first outstanding exec
+                    self.key_record_counts[key] += 1
             elif flag == "O":  # outstanding
                 self.outstanding_exec_counts[key] += 1
                 if self.num_execs_left == 0:  # first outstanding exec
@@ -164,10 +222,12 @@ class ManifestManager(object):
             exec_idx += 1
             offset += len(line)
         fh.close()
+        self._record_fingerprint()
 
     def update_num_mails_sent(self):
         """Increments the num_mails_sent_counter in the manifest file"""
 
+        self._check_fingerprint()
         debug("Update num_mails_sent in manifest: %s -> %s" %
               (self.num_mails_sent, self.num_mails_sent + 1))
         fh = self._open()
@@ -177,12 +237,13 @@ class ManifestManager(object):
         fh.write(ManifestManager.NUM_MAILS_FMT % (new_val))
         fh.close()
 
-        self._reset()
-        self._parse()  # update stats
+        self.num_mails_sent = new_val
+        self._record_fingerprint()
 
     def update_num_reboots(self):
         """Updates the reboot count header in the manifest file."""
 
+        self._check_fingerprint()
         debug("Increment reboot count in manifest")
         fh = self._open()
         fh.seek(self.num_reboots_offset)
@@ -191,8 +252,8 @@ class ManifestManager(object):
         fh.write(ManifestManager.NUM_REBOOTS_FMT % (new_val))
         fh.close()
 
-        self._reset()
-        self._parse()  # update stats
+        self.num_reboots = new_val
+        self._record_fingerprint()
 
     def update(self, flag):
         """Updates the manifest flag for the just-ran execution
@@ -200,25 +261,103 @@ class ManifestManager(object):
         This should only be called once per instance, as krun is expected to
         reboot (or fake reboot) between executions."""
 
+        self._check_fingerprint()
         debug("Update manifest flag: %s" % flag)
+        assert flag in ["S", "E", "C", "T"]
         fh = self._open()
         fh.seek(self.next_exec_flag_offset)
+        expect_line = "O %s\n" % self.next_exec_key
+        if fh.read(len(expect_line)) != expect_line:
+            util.fatal("Manifest record %d is not the expected '%s'" %
+                       (self.next_exec_idx, expect_line.strip()))
+        fh.seek(self.next_exec_flag_offset)
         fh.write(flag)
+
+        # Update the stats to match, rather than re-parsing the whole file.
+        key = self.next_exec_key
+        self.num_execs_left -= 1
+        self.outstanding_exec_counts[key] -= 1
+        self.flag_counts["O"] -= 1
+        self.flag_counts[flag] += 1
+        self.key_record_counts[key] += 1
+        if flag == "S":
+            self.total_num_execs -= 1
+            self.skipped_keys.add(key)
+            if self.outstanding_exec_counts[key] == 0 and \
+                    self.completed_exec_counts[key] == 0:
+                self.non_skipped_keys.discard(key)
+        else:
+            self.completed_exec_counts[key] += 1
+
+        # Then find the next outstanding record, which is usually the next
+        # line. The lines in between are already counted in the stats.
+        exec_idx = self.next_exec_idx + 1
+        offset = self.next_exec_flag_offset + len(expect_line)
+        self.next_exec_key = None
+        self.next_exec_idx = -1
+        self.next_exec_flag_offset = None
+        if self.num_execs_left > 0:
+            fh.seek(offset)
+            for line in fh:
+                next_flag, next_key = line.strip().split(" ")
+                if next_flag == "O":
+                    self.next_exec_key = next_key
+                    self.next_exec_idx = exec_idx
+                    self.next_exec_flag_offset = offset
+                    break
+                self.key_record_counts[next_key] += 1
+                exec_idx += 1
+                offset += len(line)
+            else:
+                util.fatal("Manifest ended unexpectedly")
         fh.close()
+        self._record_fingerprint()
 
-        self._reset()
-        self._parse()  # update stats
+    def skip_outstanding(self, key):
+        """Mark all of the outstanding executions of 'key' as skipped,
+        returning how many there were"""
+
+        self._check_fingerprint()
+        if self.outstanding_exec_counts.get(key, 0) == 0:
+            return 0
+
+        debug("Skip outstanding executions of %s in manifest" % key)
+        expect_line = "O %s\n" % key
+        num_skipped = 0
+        fh = self._open()
+        offset = self.next_exec_flag_offset
+        fh.seek(offset)
+        while True:
+            line = fh.readline()
+            if not line:
+                break
+            if line == expect_line:
+                fh.seek(offset)
+                fh.write("S")
+                fh.seek(offset + len(line))
+                num_skipped += 1
+            offset += len(line)
+        fh.close()
+
+        # The next execution, the ETA index etc. may all have changed, so
+        # it's simplest to re-parse.
+        self._parse()
+        return num_skipped
 
     def set_starting_temperatures(self, dct):
         """Set starting temperatures in manifest header"""
 
+        self._check_fingerprint()
         fh = self._open()
         for sensor, val in dct.iteritems():
             offset, cur_tmp = self.starting_temperatures[sensor]
             assert cur_tmp == 0.0  # shouldn't have been written yet
             fh.seek(offset)
-            fh.write(ManifestManager.START_TEMPERATURE_FMT % val)
+            formatted = ManifestManager.START_TEMPERATURE_FMT % val
+            fh.write(formatted)
+            self.starting_temperatures[sensor] = offset, float(formatted)
         fh.close()
+        self._record_fingerprint()
 
     def __eq__(self, other):
         return (self.next_exec_key == other.next_exec_key and
@@ -232,29 +371,56 @@ class ManifestManager(object):
                 self.non_skipped_keys == other.non_skipped_keys and
                 self.starting_temperatures == other.starting_temperatures)
 
-    def _write_new_manifest(self, config):
-        """Makes the initial manifest file from the config"""
-
+    @staticmethod
+    def make_schedule(config):
+        """Returns the manifest records ("O key" or "S key") for a new
+        session of the config"""
+
+        keys = []
+        for vm_name, vm_info in config.VMS.items():
+            for bmark, param in config.BENCHMARKS.items():
+                for variant in vm_info["variants"]:
+                    key = "%s:%s:%s" % (bmark, vm_name, variant)
+                    if config.should_skip(key):
+                        debug("%s is in skip list. Not scheduling." % key)
+                    keys.append(key)
+
+        policy = config.schedule_policy()
+        debug("Ordering schedule with policy: %s" % policy)
         manifest = []
+        for key in policy.order(keys, config.N_EXECUTIONS):
+            if config.should_skip(key):
+                manifest.append("S " + key)
+            else:
+                manifest.append("O " + key)
+        return manifest
 
-        one_exec_scheduled = False
-        eta_avail_idx = -1
-        for exec_n in xrange(config.N_EXECUTIONS):
-            for vm_name, vm_info in config.VMS.items():
-                for bmark, param in config.BENCHMARKS.items():
-                    for variant in vm_info["variants"]:
-                        key = "%s:%s:%s" % (bmark, vm_name, variant)
-                        if not config.should_skip(key):
-                            manifest.append("O " + key)
-                            if one_exec_scheduled and eta_avail_idx == -1:
-                                # first job of second executions eta becomes known.
-                                eta_avail_idx = len(manifest) - 1
-                        else:
-                            manifest.append("S " + key)
-                            if not one_exec_scheduled:
-                                debug("%s is in skip list. Not scheduling." %
-                                      key)
-            one_exec_scheduled = True
+    @staticmethod
+    def eta_avail_index(schedule):
+        """Returns the index of the manifest record at which the ETA becomes
+        known, or -1 if it never does"""
+
+        # The ETA becomes known once every (non-skipped) key has run once,
+        # i.e. at the first outstanding execution after that.
+        first_idxs = {}
+        for idx, item in enumerate(schedule):
+            if item.startswith("O "):
+                first_idxs.setdefault(item[2:], idx)
+        if first_idxs:
+            for idx in xrange(max(first_idxs.itervalues()) + 1,
+                              len(schedule)):
+                if schedule[idx].startswith("O "):
+                    return idx
+        return -1
+
+    def _write_new_manifest(self, config, schedule=None):
+        """Makes the initial manifest file from the config, or from the
+        given manifest records (see make_schedule())"""
+
+        if schedule is None:
+            schedule = ManifestManager.make_schedule(config)
+        manifest = schedule
+        eta_avail_idx = ManifestManager.eta_avail_index(manifest)
         debug("Writing manifest to %s" % self.path)
 
         # These fields are strictly fixed size, as they are mutated in-place
@@ -262,6 +428,9 @@ class ManifestManager(object):
         num_reboots_str = ManifestManager.NUM_REBOOTS_FMT % 0
         start_temperature_str = ManifestManager.START_TEMPERATURE_FMT % 0
 
+        index_path = index_filename(self.path)
+        if os.path.exists(index_path):
+            os.unlink(index_path)  # From a previous session.
         with open(self.path, "w") as fh:
             fh.write("eta_avail_idx=%s\n" % eta_avail_idx)
             fh.write("num_mails_sent=%s\n" % num_mails_str)
@@ -276,47 +445,51 @@ class ManifestManager(object):
         """Returns the sequential process execution index into the ordered list
         of all process executions sharing the same 'bench:vm:variant' key.
 
-        Although this could have been done at `_parse()` time, it would require
-        a (variable sized) `dict` since we don't know which key we will be
-        counting for until we find the first outstanding (O) record.
-
-        Instead, this method does a pass over the manifest searching for
-        records whose key is `self.next_exec_key`.
+        This is the number of records with key `self.next_exec_key` before
+        the first outstanding record, which is tracked as the manifest is
+        parsed and updated.
 
         This function assumes that there is at least one outstanding job (O
         line) in the manifest. If there is not, it will raise `FatalKrunError`.
         """
 
+        if self.next_exec_key is None:
+            util.fatal("Manifest ended unexpectedly")
+        return self.key_record_counts[self.next_exec_key]
+
+    def peek_outstanding(self, num):
+        """Returns '(key, key_pexec_idx, key_exec_num)' triples for (up to)
+        the next 'num' outstanding executions, in manifest order, where
+        'key_pexec_idx' is as next_exec_key_index() and 'key_exec_num' is the
+        number of executions of the key which will have been run before it.
+
+        The executions stay outstanding until passed to update() in turn."""
+
+        self._check_fingerprint()
+        record_counts = dict(self.key_record_counts)
+        exec_counts = dict(self.completed_exec_counts)
+        execs = []
+        if self.next_exec_key is None:
+            return execs
         fh = self._open()
-        lines = iter(fh)
-        count = 0
-
-        # Skip header
-        for line in lines:
-            strip_line = line.strip()
-            if strip_line == "keys":
+        fh.seek(self.next_exec_flag_offset)
+        for line in fh:
+            if len(execs) == num:
                 break
-        else:
-            util.fatal("Manifest is missing a body")
-
-        # Now count the number of matching keys until the first 'O'
-        # (outstanding) record.
-        for line in lines:
-            flag, key = line.strip().split()
-            if key == self.next_exec_key:
-                if flag == "O":
-                    break
-                count += 1
-        else:
-            util.fatal("Manifest ended unexpectedly")
-
-        return count
+            flag, key = line.strip().split(" ")
+            if flag == "O":
+                execs.append((key, record_counts[key], exec_counts[key]))
+                exec_counts[key] += 1
+            record_counts[key] += 1
+        fh.close()
+        return execs
 
 
 class ExecutionJob(object):
     """Represents a single executions level benchmark run"""
 
-    def __init__(self, sched, vm_name, vm_info, benchmark, variant, parameter, key_pexec_idx):
+    def __init__(self, sched, vm_name, vm_info, benchmark, variant, parameter,
+                 key_pexec_idx, cpus=None, key_exec_num=None):
         self.sched = sched
         self.vm_name, self.vm_info = vm_name, vm_info
         self.benchmark = benchmark
@@ -324,6 +497,12 @@ class ExecutionJob(object):
         self.parameter = parameter
         self.key_pexec_idx = key_pexec_idx
 
+        # In throughput mode, the CPUs to pin to, and the number of executions
+        # of the key before this one (which can't be taken from the manifest,
+        # as the other executions in the batch are not yet recorded there).
+        self.cpus = cpus
+        self.key_exec_num = key_exec_num
+
         # Used in results JSON and ETA dict
         self.key = "%s:%s:%s" % (self.benchmark, self.vm_name, self.variant)
 
@@ -343,6 +522,34 @@ class ExecutionJob(object):
             "mperf_counts": dummy_core_data(),
         }
 
+    def check_harness_floor(self, measurements):
+        """Warn if the iterations are too short to measure reliably, given
+        the overhead of the VM's iterations runner (see krun.calibrate)"""
+
+        calibration = self.sched.calibration
+        ratio = self.sched.config.CALIBRATION_FLOOR_RATIO
+        if calibration is None or ratio is None:
+            return
+        floor = calibrate.near_floor(calibration, self.vm_name,
+                                     measurements["wallclock_times"], ratio)
+        if floor is not None:
+            warn("The iterations of %s take less than %s times the harness "
+                 "overhead of '%s' (%.3fus). Consider setting its "
+                 "INNER_REPEATS" %
+                 (self.key, ratio, self.vm_name, floor * 1e6))
+
+    def check_inner_repeats(self, measurements):
+        """Raise ExecutionFailed unless the iterations runner called the
+        benchmark as many times per iteration as configured (see the
+        INNER_REPEATS config option)"""
+
+        expect = self.sched.config.inner_repeats(self.benchmark)
+        got = measurements.get("inner_repeats", 1)
+        if expect != "auto" and got != expect:
+            raise util.ExecutionFailed(
+                "Benchmark was called %d times per iteration, not %d" %
+                (got, expect))
+
     def __str__(self):
         return self.key
 
@@ -361,58 +568,88 @@ class ExecutionJob(object):
         entry_point = self.sched.config.VARIANTS[self.variant]
         vm_def = self.vm_info["vm_def"]
         vm_def.dry_run = dry_run
+        isolated = self.cpus is None
+        if not isolated:
+            # Other executions are running at the same time, each with its
+            # own copy of the VM definition.
+            vm_def = copy.copy(vm_def)
+            vm_def.pin_cpus = self.cpus
+            vm_def.fresh_user = False
+        vm_def.inner_repeats = self.sched.config.inner_repeats(self.benchmark)
 
         # Set heap limit
         heap_limit_kb = self.sched.config.HEAP_LIMIT
         stack_limit_kb = self.sched.config.STACK_LIMIT
         in_proc_iters = self.vm_info["n_iterations"]
 
-        if not dry_run:
+        # In throughput mode, the scheduler does these once per batch.
+        if not dry_run and isolated:
             self.sched.platform.collect_starting_throttle_counts()
 
         stdout, stderr, rc, envlog_filename, timed_out = \
             vm_def.run_exec(entry_point, in_proc_iters, self.parameter,
                             heap_limit_kb, stack_limit_kb, self.key,
-                            self.key_pexec_idx)
+                            self.key_pexec_idx, sync_disks=isolated)
 
-        if timed_out:
-            measurements = self.empty_measurements
-            instr_data = {}
-            flag = "T"
-        elif not dry_run:
-            try:
-                self.sched.platform.check_throttle_counts(self.sched.manifest)
-                measurements = util.check_and_parse_execution_results(
-                    stdout, stderr, rc, self.sched.config, self.key, instrument=vm_def.instrument)
-                flag = "C"
-            except util.RerunExecution as e:
-                subject = ("Benchmark needs to be re-run: %s (exec_idx=%s)" %
-                           (self.key, self.sched.manifest.next_exec_idx))
-                util.log_and_mail(mailer, warn, subject,
-                                  e.message, manifest=self.sched.manifest,
-                                  bypass_limiter=True)
-                measurements = self.empty_measurements
-                flag = "O"  # i.e. still outstanding
-            except util.ExecutionFailed as e:
-                util.log_and_mail(mailer, error, "Benchmark failure: %s" %
-                                  self.key, e.message,
-                                  manifest=self.sched.manifest)
+        try:
+            if timed_out:
                 measurements = self.empty_measurements
-                flag = "E"
-
-            # Collect instrumentation data
-            if vm_def.instrument and flag == "C":
-                instr_data = vm_def.get_instr_data()
-                for k, v in instr_data.iteritems():
-                    assert len(instr_data[k]) == in_proc_iters
+                instr_data = {}
+                flag = "T"
+            elif not dry_run:
+                try:
+                    if isolated:
+                        self.sched.platform.check_throttle_counts(
+                            self.sched.manifest)
+                    measurements = util.check_and_parse_execution_results(
+                        stdout, stderr, rc, self.sched.config, self.key,
+                        instrument=vm_def.instrument,
+                        channel=vm_def.results_channel)
+                    self.check_inner_repeats(measurements)
+                    flag = "C"
+                    self.check_harness_floor(measurements)
+                except util.RerunExecution as e:
+                    measurements = self.empty_measurements
+                    if isolated:
+                        subject = ("Benchmark needs to be re-run: %s "
+                                   "(exec_idx=%s)" %
+                                   (self.key,
+                                    self.sched.manifest.next_exec_idx))
+                        util.log_and_mail(mailer, warn, subject, e.message,
+                                          manifest=self.sched.manifest,
+                                          bypass_limiter=True)
+                        flag = "O"  # i.e. still outstanding
+                    else:
+                        # The manifest can't record an outstanding execution
+                        # amongst the completed executions of a batch.
+                        util.log_and_mail(mailer, error,
+                                          "Benchmark can't be re-run in "
+                                          "throughput mode: %s" % self.key,
+                                          e.message,
+                                          manifest=self.sched.manifest)
+                        flag = "E"
+                except util.ExecutionFailed as e:
+                    util.log_and_mail(mailer, error, "Benchmark failure: %s" %
+                                      self.key, e.message,
+                                      manifest=self.sched.manifest)
+                    measurements = self.empty_measurements
+                    flag = "E"
+
+                # Collect instrumentation data
+                if vm_def.instrument and flag == "C":
+                    instr_data = vm_def.get_instr_data()
+                    for k, v in instr_data.iteritems():
+                        assert len(instr_data[k]) == in_proc_iters
+                else:
+                    # The benchmark either failed, needs to be re-run, or had
+                    # instrumentation turned off.
+                    instr_data = {}
             else:
-                # The benchmark either failed, needs to be re-run, or had
-                # instrumentation turned off.
+                measurements = self.empty_measurements
                 instr_data = {}
-        else:
-            measurements = self.empty_measurements
-            instr_data = {}
-            flag = "C"
+                flag = "C"
+        finally:
+            vm_def.close_results_channel()
 
         # We print the status *after* benchmarking, so that I/O cannot be
         # committed during benchmarking. In production, we will be rebooting
@@ -429,7 +666,10 @@ class ExecutionJob(object):
         # killed upon timeout, and thus doesn't get a chance to log the
         # environment.
         if not dry_run and flag not in ("O", "T"):
-            key_exec_num = self.sched.manifest.completed_exec_counts[self.key]
+            key_exec_num = self.key_exec_num
+            if key_exec_num is None:
+                key_exec_num = \
+                    self.sched.manifest.completed_exec_counts[self.key]
             util.stash_envlog(envlog_filename, self.sched.config,
                               self.sched.platform, self.key, key_exec_num)
 
@@ -448,6 +688,7 @@ class ExecutionScheduler(object):
         self.dry_run = dry_run
         self.log_path = self.config.log_filename(resume=True)
         self.manifest = ManifestManager(config, platform)
+        self.calibration = calibrate.load_calibration(config)
 
         # Please refrain from adding a results attribute. The results should
         # never be in memory before a process execution runs. Results grow over
@@ -455,31 +696,30 @@ class ExecutionScheduler(object):
         # benchmarks.
 
     def get_estimated_exec_duration(self, key, results):
-        previous_exec_times = results.eta_estimates.get(key)
-        if previous_exec_times:
-            return mean(previous_exec_times)
-        else:
-            return None # we don't know
+        """Estimate how long a run of one process execution of 'key' takes,
+        including reboots, waits and hooks (see krun.eta)"""
+
+        return eta.ETAModel(results).key_duration(key)
 
     def get_estimated_overall_duration(self, results):
-        secs = 0
-        for key, num_execs in self.manifest.outstanding_exec_counts.iteritems():
-            per_exec = self.get_estimated_exec_duration(key, results)
-            if per_exec is not None:
-                secs += self.get_estimated_exec_duration(key, results) * num_execs
-            elif key in self.manifest.skipped_keys:
-                continue
-            else:
-                return None  # Unknown time for a key which is not skipped.
-        return secs
+        """Estimate the time left in the session as a '(secs, low, high)'
+        triple (see ETAModel.predict()), or None if it is not yet known"""
+
+        pexecs_per_run = self.config.THROUGHPUT_PEXECS or 1
+        return eta.ETAModel(results).predict(
+            self.manifest.outstanding_exec_counts, self.manifest.skipped_keys,
+            pexecs_per_run)
 
     def get_exec_estimate_time_formatter(self, key, results):
         return TimeEstimateFormatter(
             self.get_estimated_exec_duration(key, results))
 
     def get_overall_time_estimate_formatter(self, results):
-        return TimeEstimateFormatter(
-            self.get_estimated_overall_duration(results))
+        prediction = self.get_estimated_overall_duration(results)
+        if prediction is None:
+            return TimeEstimateFormatter(None)
+        secs, low, high = prediction
+        return TimeEstimateFormatter(secs, (low, high))
 
     def _make_post_cmd_env(self, results):
         """Prepare an environment dict for post execution hooks"""
@@ -489,48 +729,201 @@ class ExecutionScheduler(object):
         if jobs_until_eta_known > 0:
             eta_val = "Unknown. Known in %d process executions." % \
                 jobs_until_eta_known
+            eta_low = eta_high = eta_val
         else:
-            eta_val = self.get_overall_time_estimate_formatter(results).finish_str
+            tfmt = self.get_overall_time_estimate_formatter(results)
+            eta_val = tfmt.finish_str
+            eta_low = tfmt.finish_low_str
+            eta_high = tfmt.finish_high_str
 
         return {
             "KRUN_RESULTS_FILE": self.config.results_filename(),
+            "KRUN_RESULTS_JOURNAL_FILE":
+                journal_filename(self.config.results_filename()),
             "KRUN_LOG_FILE": self.config.log_filename(resume=True),
             "KRUN_ETA_DATUM": now_str(),
             "KRUN_ETA_VALUE": eta_val,
+            "KRUN_ETA_LOW": eta_low,
+            "KRUN_ETA_HIGH": eta_high,
             "KRUN_MANIFEST_FILE": self.manifest.path,
         }
 
+    def _maybe_stop_key(self, key, results):
+        """Skip the remaining executions of 'key' if its results are already
+        precise enough (see the ADAPTIVE_CI_WIDTH config option)"""
+
+        if self.manifest.outstanding_exec_counts[key] == 0:
+            return
+        # The summaries are recorded with each process execution, so this
+        # doesn't need the key's measurements to be loaded.
+        pexec_flags = results.pexec_flags[key]
+        summaries = [results.get_pexec_summary(key, idx)
+                     for idx in xrange(len(pexec_flags))]
+        stop, width = adaptive.should_stop_summaries(key, pexec_flags,
+                                                     summaries, self.config)
+        if width is not None:
+            debug("Relative CI width of %s: %.4f" % (key, width))
+        if stop:
+            num_skipped = self.manifest.skip_outstanding(key)
+            info("%s is precise enough (relative CI width %.4f), skipping "
+                 "its %d remaining executions" % (key, width, num_skipped))
+
+    def _make_jobs(self):
+        """Make the jobs to run before the next reboot: the next outstanding
+        execution, or in throughput mode, the next THROUGHPUT_PEXECS
+        outstanding executions, each with its own CPUs"""
+
+        num_jobs = self.config.THROUGHPUT_PEXECS
+        if num_jobs is None:
+            execs = [(self.manifest.next_exec_key,
+                      self.manifest.next_exec_key_index(), None)]
+            cpusets = [None]
+        else:
+            execs = self.manifest.peek_outstanding(num_jobs)
+            cpusets = self.platform.throughput_cpusets(num_jobs)
+
+        jobs = []
+        for (key, key_pexec_idx, key_exec_num), cpus in zip(execs, cpusets):
+            bench, vm, variant = key.split(":")
+            jobs.append(ExecutionJob(self, vm, self.config.VMS[vm], bench,
+                                     variant, self.config.BENCHMARKS[bench],
+                                     key_pexec_idx, cpus=cpus,
+                                     key_exec_num=key_exec_num))
+        return jobs
+
+    def _run_jobs(self, jobs):
+        """Run the jobs, returning a (measurements, instr_data, flag,
+        exec_time) tuple for each. In throughput mode, the jobs run at the
+        same time, each in its own thread."""
+
+        if jobs[0].cpus is None:
+            exec_start_time = time.time()
+            measurements, instr_data, flag = \
+                jobs[0].run(self.mailer, self.dry_run)
+            return [(measurements, instr_data, flag,
+                     time.time() - exec_start_time)]
+
+        # Things done before and after each isolated execution are instead
+        # done once for the whole batch.
+        if not self.platform.no_user_change:
+            self.platform.make_fresh_krun_user()
+        self.platform.sync_disks()
+        if not self.dry_run:
+            self.platform.collect_starting_throttle_counts()
+
+        outcomes = [None] * len(jobs)
+        exc_infos = []
+
+        def run_job(idx):
+            try:
+                exec_start_time = time.time()
+                measurements, instr_data, flag = \
+                    jobs[idx].run(self.mailer, self.dry_run)
+                outcomes[idx] = (measurements, instr_data, flag,
+                                 time.time() - exec_start_time)
+            except BaseException:
+                exc_infos.append(sys.exc_info())
+
+        info("Running %d process executions at once: %s" %
+             (len(jobs), ", ".join(
+                 "%s on CPUs %s" % (job.key, ",".join(map(str, job.cpus)))
+                 for job in jobs)))
+        threads = [threading.Thread(target=run_job, args=(idx,))
+                   for idx in xrange(len(jobs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if exc_infos:
+            raise exc_infos[0][0], exc_infos[0][1], exc_infos[0][2]
+
+        if not self.dry_run:
+            try:
+                self.platform.check_throttle_counts(self.manifest)
+            except util.RerunExecution as e:
+                # Too late to re-run anything, but the results are suspect.
+                util.log_and_mail(self.mailer, error,
+                                  "CPU throttled during throughput batch",
+                                  e.message, manifest=self.manifest)
+                outcomes = [
+                    (job.empty_measurements, {}, "E", exec_time)
+                    if flag == "C" else (measurements, instr_data, flag,
+                                         exec_time)
+                    for job, (measurements, instr_data, flag, exec_time)
+                    in zip(jobs, outcomes)]
+        return outcomes
+
+    def _save_results(self, results):
+        """Save the results before the post-execution commands run.
+
+        Normally only the new process executions are appended to the journal,
+        and the results file proper is rewritten once, at the end of the
+        session. If the user opted in with RESULTS_FOLD_INTERVAL, and there
+        are post-execution commands (which may copy KRUN_RESULTS_FILE
+        elsewhere), the journal is folded into the results file first, at most
+        once every RESULTS_FOLD_INTERVAL seconds."""
+
+        interval = self.config.RESULTS_FOLD_INTERVAL
+        results_file = self.config.results_filename()
+        if self.config.POST_EXECUTION_CMDS and interval is not None and \
+                time.time() - os.path.getmtime(results_file) >= interval:
+            results.write_to_file()
+        else:
+            results.append_to_journal()
+
+    def _time_since_results_saved(self):
+        """How long it is since the previous run last saved the results, i.e.
+        roughly how long it took to reboot and start Krun again. None if no
+        results were saved yet."""
+
+        results_file = self.config.results_filename()
+        mtimes = [os.path.getmtime(path) for path in
+                  (journal_filename(results_file), results_file)
+                  if os.path.exists(path)]
+        if not mtimes:
+            return None
+        return max(0.0, time.time() - max(mtimes))
+
     def run(self):
         """Benchmark execution starts here"""
 
+        # Time spent outside of the process executions, by phase. Used for
+        # ETAs (see krun.eta).
+        phases = dict()
+        reboot_secs = self._time_since_results_saved()
+        if reboot_secs is not None:
+            phases["reboot"] = reboot_secs
+
         # In reboot mode, wait for the system to come up before we proceed
+        phases["startup_wait"] = 0.0
         if self.platform.hardware_reboots:
-            debug("Waiting %s seconds for the system to come up." %
-                  str(STARTUP_WAIT_SECONDS))
-            self.platform.sleep(STARTUP_WAIT_SECONDS)
+            debug("Waiting for the system to come up.")
+            phases["startup_wait"] = readiness.wait_until_ready(self.platform,
+                                                                self.config)
 
         # Important that the dmesg is collected after the above startup wait.
         # Otherwise we get spurious dmesg changes.
         self.platform.collect_starting_dmesg()
 
         assert self.manifest.num_execs_left > 0
+        temp_wait_start = time.time()
         self.platform.wait_for_temperature_sensors()
+        phases["temp_wait"] = time.time() - temp_wait_start
 
-        bench, vm, variant = self.manifest.next_exec_key.split(":")
-        key_pexec_idx = self.manifest.next_exec_key_index()
-        job = ExecutionJob(self, vm, self.config.VMS[vm], bench, variant,
-                           self.config.BENCHMARKS[bench], key_pexec_idx)
+        jobs = self._make_jobs()
+        first_exec_idx = self.manifest.next_exec_idx
 
         # Default to error state. This is the value the finally block will see
         # if an exception is raised inside the try block, otherwise it is
-        # re-assigned based on the result of running the benchmark.
-        flag = 'E'
+        # re-assigned based on the result of running the benchmark(s).
+        flags = ['E']
 
         # Run the pre-exec commands, the benchmark and the post-exec commands.
         # These are wrapped in a try/except, so that the post-exec commands
         # are always executed, even if an exception has occurred. We only
         # reboot /after/ the post-exec commands have completed.
         results = None
+        phases_pexec = None  # (key, pexec_idx) the phases are recorded against.
         try:
             # Run the user's pre-process-execution commands. We can't put an
             # ETA estimate in the environment for the pre-commands as we have
@@ -540,24 +933,39 @@ class ExecutionScheduler(object):
             # ensure that post-hooks are only run if pre-hooks ran. We don't,
             # thus avoiding the case where only *part* of the pre-hooks run,
             # but the post-hooks then don't run.
+            pre_hooks_start = time.time()
             util.run_shell_cmd_list(self.config.PRE_EXECUTION_CMDS,)
-
-            # We collect rough execution times separate from real results. The
-            # reason for this is that, even if a benchmark crashes it takes
-            # time and we need to account for this when making estimates. A
-            # crashing benchmark will give an empty list of iteration times,
-            # meaning we can't use 'raw_exec_result' below for estimates.
-            exec_start_time = time.time()
-            measurements, instr_data, flag = job.run(self.mailer, self.dry_run)
-            exec_end_time = time.time()
-
-            # Only now is it OK to load the results file into memory.
+            phases["pre_hooks"] = time.time() - pre_hooks_start
+
+            # Each outcome is a (measurements, instr_data, flag, exec_time)
+            # tuple. We collect rough execution times separate from real
+            # results. The reason for this is that, even if a benchmark
+            # crashes it takes time and we need to account for this when
+            # making estimates. A crashing benchmark will give an empty list
+            # of iteration times, meaning we can't use the measurements for
+            # estimates.
+            outcomes = self._run_jobs(jobs)
+            flags = [outcome[2] for outcome in outcomes]
+
+            # Complete the temperature trace with a reading taken straight
+            # after the process execution(s).
+            trace = self.platform.temperature_trace
+            if trace is not None and not self.platform.temp_sensors:
+                trace = None  # Nothing worth storing.
+            if trace is not None:
+                trace.add(self.platform.take_temperature_readings())
+
+            # Only now is it OK to load the results file into memory. The
+            # measurements of earlier process executions are loaded lazily,
+            # and nothing below needs them, so they stay on disk.
             Results.ok_to_instantiate = True
             results = Results(self.config, self.platform,
                               results_file=self.config.results_filename())
 
-            # Bail early if the process execution needs to be re-run.
-            if flag == "O":
+            # Bail early if the process execution needs to be re-run. This
+            # can't happen in throughput mode.
+            if flags == ["O"]:
+                self._save_results(results)
                 util.run_shell_cmd_list(
                     self.config.POST_EXECUTION_CMDS,
                     extra_env=self._make_post_cmd_env(results)
@@ -567,26 +975,44 @@ class ExecutionScheduler(object):
                 # reboot() does not return
                 raise RuntimeError("reached unreachable code!")
 
-            # Store new result.
-            results.append_exec_measurements(job.key, measurements, flag)
-
-            # Store instrumentation data in a separate file
-            if job.vm_info["vm_def"].instrument:
-                key_exec_num = self.manifest.completed_exec_counts[job.key]
-                util.dump_instr_json(job.key, key_exec_num, self.config, instr_data)
-
-            eta_info = exec_end_time - exec_start_time
-            if self.platform.hardware_reboots:
-                # Add time taken to wait for system to come up if we are in
-                # hardware-reboot mode.
-                eta_info += STARTUP_WAIT_SECONDS
-            results.eta_estimates[job.key].append(eta_info)
-            self.manifest.update(flag)
+            # Store new results, in manifest order.
+            for job, (measurements, instr_data, flag, exec_time) in \
+                    zip(jobs, outcomes):
+                results.append_exec_measurements(job.key, measurements, flag,
+                                                 cores=job.cpus)
+
+                # Store instrumentation data in a separate file
+                if job.vm_info["vm_def"].instrument:
+                    key_exec_num = self.manifest.completed_exec_counts[job.key]
+                    util.dump_instr_json(job.key, key_exec_num, self.config,
+                                         instr_data)
+
+                if trace is not None:
+                    util.dump_temperature_trace(
+                        job.key, self.manifest.completed_exec_counts[job.key],
+                        self.config, trace)
+
+                # The time spent outside of the process execution(s) is
+                # recorded separately, once per run.
+                results.eta_estimates[job.key].append(exec_time)
+                if phases_pexec is None:
+                    phases_pexec = (job.key,
+                                    len(results.pexec_flags[job.key]) - 1)
+                    results.add_pexec_phases(job.key, phases_pexec[1], phases)
+                self.manifest.update(flag)
+
+            # Stopping a key early may move the next execution past the one
+            # at which the ETA becomes known, so remember where we were.
+            next_exec_idx = self.manifest.next_exec_idx
+            if self.config.ADAPTIVE_CI_WIDTH is not None:
+                for job, flag in zip(jobs, flags):
+                    if flag == "C":
+                        self._maybe_stop_key(job.key, results)
         except Exception:
             raise
         finally:
             # Run the user's post-process-execution commands with updated
-            # ETA estimates. Important that this happens *after* dumping
+            # ETA estimates. Important that this happens *after* saving the
             # results, as the user is likely copying intermediate results to
             # another host.
 
@@ -600,20 +1026,35 @@ class ExecutionScheduler(object):
 
             # If errors occured, set error flag in results file
             if self.platform.check_dmesg_for_changes(self.manifest) or \
-                    flag == 'E':
+                    'E' in flags:
                 results.error_flag = True
 
-            results.write_to_file()
+            self._save_results(results)
+            post_hooks_start = time.time()
             util.run_shell_cmd_list(
                 self.config.POST_EXECUTION_CMDS,
                 extra_env=self._make_post_cmd_env(results)
             )
+            if phases_pexec is not None:
+                # This also marks the end of the run for the next run's
+                # "reboot" phase (see _time_since_results_saved()).
+                results.add_pexec_phases(
+                    phases_pexec[0], phases_pexec[1],
+                    {"post_hooks": time.time() - post_hooks_start})
+                results.append_to_journal()
 
         tfmt = self.get_overall_time_estimate_formatter(results)
 
-        if self.manifest.eta_avail_idx == self.manifest.next_exec_idx:
+        # A batch of executions may have stepped over the one at which the
+        # ETA becomes known.
+        eta_avail_idx = self.manifest.eta_avail_idx
+        if eta_avail_idx == next_exec_idx or \
+                first_exec_idx < eta_avail_idx < next_exec_idx:
             # We just found out roughly how long the session has left, mail out.
-            msg = "ETA for current session now known: %s" % tfmt.finish_str
+            msg = "ETA for current session now known: %s " \
+                "(%d%% prediction interval: %s to %s)" % \
+                (tfmt.finish_str, eta.INTERVAL_PERCENT, tfmt.finish_low_str,
+                 tfmt.finish_high_str)
             util.log_and_mail(self.mailer, debug,
                               "ETA for Current Session Available",
                               msg, bypass_limiter=True)
@@ -621,6 +1062,10 @@ class ExecutionScheduler(object):
         info("{:<25s}: {} ({} from now)".format(
             "Estimated completion (whole session)", tfmt.finish_str,
             tfmt.delta_str))
+        if tfmt.finish is not None:
+            info("{:<25s}: {} to {}".format(
+                "%d%% prediction interval" % eta.INTERVAL_PERCENT,
+                tfmt.finish_low_str, tfmt.finish_high_str))
 
         info("%d executions left in scheduler queue" % self.manifest.num_execs_left)
 
@@ -643,7 +1088,8 @@ class ExecutionScheduler(object):
             info("Next execution is '%s(%d)' (%s variant) under '%s'" %
                  (benchmark, self.config.BENCHMARKS[benchmark], variant, vm_name))
 
-            tfmt = self.get_exec_estimate_time_formatter(job.key, results)
+            tfmt = self.get_exec_estimate_time_formatter(jobs[-1].key,
+                                                         results)
             info("{:<35s}: {} ({} from now)".format(
                 "Estimated completion (next execution)",
                 tfmt.finish_str,
@@ -652,6 +1098,10 @@ class ExecutionScheduler(object):
             info("Reboot in preparation for next execution")
             util.reboot(self.manifest, self.platform)
         elif self.manifest.num_execs_left == 0:
+            # Fold the journal into the results file.
+            results.write_to_file()
+            publish_shard_results(self.config, self.manifest)
+
             self.platform.save_power()
             if self.config.ENABLE_PINNING:
                 self.platform.clear_cpu_pinning()
@@ -0,0 +1,312 @@
+"""Sharding a campaign across several (identical) machines.
+
+A coordinator divides the schedule of a campaign into disjoint, contiguous
+ranges of manifest records, one per shard, and writes the plan to a
+directory shared by all of the machines (e.g. over NFS). No network service
+is involved: everything is done with files in the shared directory.
+
+  * Each machine claims a shard when Krun is first invoked with --shard-dir.
+    Claims are made by exclusively creating a claim file, so no two machines
+    can claim the same shard. The machine's manifest is then the whole
+    schedule, with the records outside of its shard marked as skipped. This
+    keeps the process execution indices of each key the same as in an
+    unsharded session.
+  * When a machine finishes its shard, it publishes its results file and
+    manifest to the shared directory.
+  * Once all shards are published, merge_shards() combines the results into
+    one results file, in schedule order.
+
+The layout of the shared directory is:
+
+  plan.json               The config text, schedule and shard ranges.
+  claims/shard-N          Created by the machine which claimed shard N.
+  shard-N/                The published results file and manifest.
+  done/shard-N            Created once shard-N/ is complete.
+"""
+
+import json
+import os
+import shutil
+import socket
+import time
+
+from logging import debug, info
+from krun.results import Results, RESULTS_READ_ERRORS
+from krun.util import audit_mismatch, fatal, replace_file_atomically
+
+PLAN_FILE = "plan.json"
+CLAIMS_DIR = "claims"
+DONE_DIR = "done"
+SHARD_MANIFEST = "krun.manifest"
+
+
+def split_schedule(schedule, num_shards):
+    """Split a schedule (a list of manifest records) into 'num_shards'
+    contiguous '[start, end)' ranges of record indices, with the outstanding
+    records shared as evenly as possible."""
+
+    outstanding = [idx for idx, record in enumerate(schedule)
+                   if record.startswith("O ")]
+    if len(outstanding) < num_shards:
+        raise ValueError("can't split %d process executions into %d shards" %
+                         (len(outstanding), num_shards))
+
+    ranges = []
+    start = 0
+    for shard in xrange(1, num_shards):
+        # Each range ends just before its share of outstanding records.
+        end = outstanding[shard * len(outstanding) // num_shards]
+        ranges.append([start, end])
+        start = end
+    ranges.append([start, len(schedule)])
+    return ranges
+
+
+def shard_filename(config):
+    """The file recording which shard (if any) this machine claimed"""
+
+    assert config.filename.endswith(".krun")
+    return config.filename[:-5] + ".shard"
+
+
+def read_manifest_records(path):
+    """Returns the '(flag, key)' records of a manifest file"""
+
+    with open(path) as fh:
+        for line in fh:
+            if line.strip() == "keys":
+                break
+        return [tuple(line.strip().split(" ")) for line in fh]
+
+
+class ShardCoordinator(object):
+    """The shared directory of a sharded campaign"""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = os.path.abspath(shard_dir)
+        self._plan = None
+
+    def _path(self, *parts):
+        return os.path.join(self.shard_dir, *parts)
+
+    def _shard_name(self, shard):
+        return "shard-%d" % shard
+
+    @property
+    def plan(self):
+        if self._plan is None:
+            try:
+                with open(self._path(PLAN_FILE)) as fh:
+                    self._plan = json.load(fh)
+            except (IOError, ValueError) as e:
+                fatal("can't read shard plan in %s: %s" % (self.shard_dir, e))
+        return self._plan
+
+    @property
+    def num_shards(self):
+        return len(self.plan["ranges"])
+
+    def create_plan(self, config, schedule, num_shards):
+        """Write the plan for sharding 'schedule' (see
+        ManifestManager.make_schedule()) 'num_shards' ways"""
+
+        if os.path.exists(self._path(PLAN_FILE)):
+            fatal("%s already has a shard plan" % self.shard_dir)
+        try:
+            ranges = split_schedule(schedule, num_shards)
+        except ValueError as e:
+            fatal(str(e))
+
+        for dirname in (self.shard_dir, self._path(CLAIMS_DIR),
+                        self._path(DONE_DIR)):
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        plan = {
+            "config": config.text,
+            "results_file": os.path.basename(config.results_filename()),
+            "schedule": schedule,
+            "ranges": ranges,
+        }
+        tmp_filename = self._path(PLAN_FILE + ".tmp")
+        with open(tmp_filename, "w") as fh:
+            json.dump(plan, fh, indent=1)
+        replace_file_atomically(tmp_filename, self._path(PLAN_FILE))
+        self._plan = plan
+        info("Wrote plan for %d shards to %s" % (num_shards, self.shard_dir))
+
+    def claim(self, config):
+        """Claim the first unclaimed shard for this machine, returning its
+        index. Also records the claim next to the config file, so that the
+        results can be published at the end of the session."""
+
+        config.check_config_consistency(self.plan["config"],
+                                        self._path(PLAN_FILE))
+        host = socket.gethostname()
+        for shard in xrange(self.num_shards):
+            claim_file = self._path(CLAIMS_DIR, self._shard_name(shard))
+            try:
+                fd = os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                continue  # Already claimed.
+            os.write(fd, "%s %s\n" %
+                     (host, time.strftime("%Y-%m-%d %H:%M:%S")))
+            os.fsync(fd)
+            os.close(fd)
+            break
+        else:
+            fatal("all %d shards in %s are already claimed" %
+                  (self.num_shards, self.shard_dir))
+
+        with open(shard_filename(config), "w") as fh:
+            json.dump({"shard_dir": self.shard_dir, "shard": shard}, fh)
+        start, end = self.plan["ranges"][shard]
+        info("Claimed shard %d (manifest records %d-%d) of %s" %
+             (shard, start, end - 1, self.shard_dir))
+        return shard
+
+    def shard_schedule(self, shard):
+        """The schedule for one shard: the whole schedule, with the records
+        of the other shards marked as skipped"""
+
+        start, end = self.plan["ranges"][shard]
+        schedule = []
+        for idx, record in enumerate(self.plan["schedule"]):
+            if not start <= idx < end:
+                record = "S " + record[2:]
+            schedule.append(record)
+        return schedule
+
+    def publish(self, shard, results_file, manifest_file):
+        """Copy a finished shard's results file and manifest to the shared
+        directory"""
+
+        shard_name = self._shard_name(shard)
+        out_dir = self._path(shard_name)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        for src, dest in ((results_file, self.plan["results_file"]),
+                          (manifest_file, SHARD_MANIFEST)):
+            dest = os.path.join(out_dir, dest)
+            shutil.copyfile(src, dest + ".tmp")
+            replace_file_atomically(dest + ".tmp", dest)
+        with open(self._path(DONE_DIR, shard_name), "w") as fh:
+            fh.write("%s\n" % socket.gethostname())
+        info("Published results of shard %d to %s" % (shard, out_dir))
+
+    def status(self):
+        """Returns a '(start, end, claimed_by, done)' tuple for each shard,
+        where 'claimed_by' is None if the shard is unclaimed."""
+
+        statuses = []
+        for shard, (start, end) in enumerate(self.plan["ranges"]):
+            shard_name = self._shard_name(shard)
+            claimed_by = None
+            try:
+                with open(self._path(CLAIMS_DIR, shard_name)) as fh:
+                    claimed_by = fh.read().strip()
+            except IOError:
+                pass
+            done = os.path.exists(self._path(DONE_DIR, shard_name))
+            statuses.append((start, end, claimed_by, done))
+        return statuses
+
+    def merge(self, out_file):
+        """Combine the published results of all shards into 'out_file'. The
+        format is chosen by the file name, as for scripts/convert_results.py.
+        """
+
+        Results.ok_to_instantiate = True
+        merged = None
+        for shard, (start, end) in enumerate(self.plan["ranges"]):
+            shard_name = self._shard_name(shard)
+            if not os.path.exists(self._path(DONE_DIR, shard_name)):
+                fatal("shard %d has not been published" % shard)
+            results_file = self._path(shard_name, self.plan["results_file"])
+            debug("Merging %s" % results_file)
+            try:
+                results = Results(None, None, results_file=results_file)
+            except RESULTS_READ_ERRORS as e:
+                fatal("can't read %s: %s" % (results_file, e))
+
+            if merged is None:
+                merged = Results(None, None)
+                merged.config_text = results.config_text
+                merged.audit = results.audit.audit
+                for key in results.pexec_flags:
+                    merged.pexec_flags[key] = []
+                    merged.eta_estimates[key] = []
+                    for section, pexecs in \
+                            merged._measurements.iteritems():
+                        pexecs[key] = []
+            elif results.config_text != merged.config_text:
+                fatal("shard %d was run with a different config" % shard)
+            else:
+                # The same check as when Krun resumes a session: a campaign
+                # is only valid if all shards ran on identical machines.
+                reason = audit_mismatch(merged.audit.audit,
+                                        results.audit.audit)
+                if reason is not None:
+                    fatal("shard %d can't be merged with shard 0: %s. Shards "
+                          "must be run on identical machines in the same "
+                          "execution mode." % (shard, reason))
+            if results.error_flag:
+                merged.error_flag = True
+
+            self._merge_shard(shard, start, end, results, merged)
+
+        merged.filename = out_file
+        merged.write_to_file()
+        info("Merged %d shards into %s" % (self.num_shards, out_file))
+
+    def _merge_shard(self, shard, start, end, results, merged):
+        """Append the process executions of one shard to 'merged', in
+        schedule order"""
+
+        records = read_manifest_records(
+            self._path(self._shard_name(shard), SHARD_MANIFEST))
+        if len(records) != len(self.plan["schedule"]):
+            fatal("shard %d manifest doesn't match the plan" % shard)
+        pexec_idxs = dict((key, 0) for key in results.pexec_flags)
+        for flag, key in records[start:end]:
+            if flag == "O":
+                fatal("shard %d is incomplete" % shard)
+            elif flag == "S":
+                continue
+            idx = pexec_idxs[key]
+            if idx >= len(results.pexec_flags[key]) or \
+                    results.pexec_flags[key][idx] != flag:
+                fatal("shard %d results don't match its manifest: %s[%d]" %
+                      (shard, key, idx))
+            measurements = dict(
+                (section, pexecs[idx]) for section, pexecs
+                in results.get_measurements(key).iteritems())
+            measurements["inner_repeats"] = \
+                results.get_pexec_inner_repeats(key, idx)
+            merged.append_exec_measurements(
+                key, measurements, flag,
+                cores=results.get_pexec_cores(key, idx))
+            phases = results.get_pexec_phases(key, idx)
+            if phases is not None:
+                merged.add_pexec_phases(
+                    key, len(merged.pexec_flags[key]) - 1, phases)
+            merged.eta_estimates[key].append(results.eta_estimates[key][idx])
+            pexec_idxs[key] = idx + 1
+
+        for key, flags in results.pexec_flags.iteritems():
+            if pexec_idxs[key] != len(flags):
+                fatal("shard %d has results missing from its manifest: %s" %
+                      (shard, key))
+
+
+def publish_shard_results(config, manifest):
+    """If this machine is running a shard, publish its results (called at
+    the end of the session)"""
+
+    path = shard_filename(config)
+    if not os.path.exists(path):
+        return
+    with open(path) as fh:
+        claim = json.load(fh)
+    coordinator = ShardCoordinator(claim["shard_dir"])
+    coordinator.publish(claim["shard"], config.results_filename(),
+                        manifest.path)
@@ -0,0 +1,325 @@
+"""Simulating a whole benchmarking session, e.g. to find out how long a config
+will take before committing a machine to it.
+
+The session's manifest is built in memory, just as Krun builds it, and then a
+discrete-event simulation steps through it, one run (i.e. reboot cycle) at a
+time. Each run draws the time spent in each of its phases (see
+krun.eta.PHASES), and the duration of each of its process executions, from
+distributions taken from the results file of an earlier session, or from
+estimates given by the user. Nothing is run on, or changed on, the machine.
+
+Since the durations are random, the session is simulated several times
+("trials"), and the spread of the outcomes reported. The simulation also
+follows the ETA, as Krun would estimate it (see krun.eta), from when it
+becomes known.
+
+The simulation assumes that every process execution runs once: re-runs, and
+benchmarks stopped early by ADAPTIVE_CI_WIDTH, are not modelled.
+"""
+
+import fnmatch
+import heapq
+import random
+from datetime import timedelta
+
+from logging import debug, warn
+
+from krun import eta
+from krun.eta import percentile
+from krun.results import Results
+from krun.scheduler import ManifestManager
+from krun.util import fatal
+
+DEFAULT_TRIALS = 100
+SEED = 0
+
+# Event kinds. A run starts when the previous run has saved its results (or
+# when the session starts), and ends once its post-execution commands have
+# run.
+RUN_START = "run_start"
+PEXEC_END = "pexec_end"
+RUN_END = "run_end"
+
+
+class SampledDuration(object):
+    """Durations drawn from those observed in an earlier session"""
+
+    def __init__(self, samples):
+        assert samples
+        self.samples = list(samples)
+
+    def draw(self, rng):
+        return rng.choice(self.samples)
+
+    def __str__(self):
+        return "%d samples, median %.1fs" % (len(self.samples),
+                                             eta.median(self.samples))
+
+
+class UniformDuration(object):
+    """Durations estimated by the user as a range (or a single value)"""
+
+    def __init__(self, low, high):
+        assert 0 <= low <= high
+        self.low = low
+        self.high = high
+
+    def draw(self, rng):
+        return rng.uniform(self.low, self.high)
+
+    def __str__(self):
+        if self.low == self.high:
+            return "%.1fs" % self.low
+        return "%.1f-%.1fs" % (self.low, self.high)
+
+
+def parse_estimate(spec):
+    """Parse a user's duration estimate of the form 'NAME=SECS' or
+    'NAME=MIN-MAX', where NAME is a phase (see krun.eta.PHASES) or a glob
+    matching benchmark keys. Returns a '(name, duration)' pair, or raises
+    ValueError if 'spec' is malformed."""
+
+    name, sep, secs = spec.partition("=")
+    if not sep or not name:
+        raise ValueError("bad estimate '%s': expected NAME=SECS" % spec)
+    low, sep, high = secs.partition("-")
+    try:
+        low = float(low)
+        high = float(high) if sep else low
+    except ValueError:
+        raise ValueError("bad estimate '%s': expected SECS or MIN-MAX" % spec)
+    if not 0 <= low <= high:
+        raise ValueError("bad estimate '%s': expected 0 <= MIN <= MAX" % spec)
+    return name, UniformDuration(low, high)
+
+
+def session_durations(schedule, results_file=None, estimates=()):
+    """Returns '(exec_durations, phase_durations)' dicts mapping the
+    non-skipped keys of 'schedule' and the phases to duration distributions.
+    Durations come from the results file of an earlier session, overridden
+    by the user's 'estimates' (see parse_estimate()), in order. Phases with
+    neither are left out."""
+
+    keys = sorted(set(record[2:] for record in schedule
+                      if record.startswith("O ")))
+    exec_durations = dict()
+    phase_durations = dict()
+
+    if results_file is not None:
+        debug("Reading durations from %s" % results_file)
+        Results.ok_to_instantiate = True
+        results = Results(None, None, results_file=results_file)
+        for key in keys:
+            if results.eta_estimates.get(key):
+                exec_durations[key] = SampledDuration(
+                    results.eta_estimates[key])
+        samples = dict((phase, []) for phase in eta.PHASES)
+        for by_pexec in results.pexec_phases.itervalues():
+            for phases in by_pexec.itervalues():
+                for phase, secs in phases.iteritems():
+                    if phase in samples:
+                        samples[phase].append(secs)
+        for phase, secs in samples.iteritems():
+            if secs:
+                phase_durations[phase] = SampledDuration(secs)
+
+    for name, duration in estimates:
+        if name in eta.PHASES:
+            phase_durations[name] = duration
+            continue
+        matched = fnmatch.filter(keys, name)
+        if not matched:
+            fatal("estimate '%s' matches no phase or benchmark key" % name)
+        for key in matched:
+            exec_durations[key] = duration
+
+    missing = [key for key in keys if key not in exec_durations]
+    if missing:
+        fatal("no durations known for: %s. Give a results file with some, "
+              "or estimate them with --estimate." % ", ".join(missing))
+    return exec_durations, phase_durations
+
+
+class _SimulatedResults(object):
+    """Stands in for a Results instance, for krun.eta.ETAModel"""
+
+    def __init__(self):
+        self.eta_estimates = dict()
+        self.pexec_phases = dict()
+
+
+class SessionSimulator(object):
+    """Simulates a session of the manifest records 'schedule' (see
+    ManifestManager.make_schedule()), running 'pexecs_per_run' process
+    executions per run (see the THROUGHPUT_PEXECS config option)."""
+
+    def __init__(self, schedule, exec_durations, phase_durations,
+                 pexecs_per_run=1):
+        self.schedule = schedule
+        self.exec_durations = exec_durations
+        self.phase_durations = phase_durations
+        self.eta_avail_idx = ManifestManager.eta_avail_index(schedule)
+
+        # Each run is a list of (manifest index, key) pairs.
+        outstanding = [(idx, record[2:]) for idx, record
+                       in enumerate(schedule) if record.startswith("O ")]
+        self.runs = [outstanding[idx:idx + pexecs_per_run] for idx
+                     in xrange(0, len(outstanding), pexecs_per_run)]
+        self.pexecs_per_run = pexecs_per_run
+
+    def _draw_phase(self, phase, rng):
+        duration = self.phase_durations.get(phase)
+        if duration is None:
+            return 0.0
+        return duration.draw(rng)
+
+    def _predict(self, results, run_idx):
+        """What Krun would predict for the time left after run 'run_idx'"""
+
+        outstanding = dict()
+        for run in self.runs[run_idx + 1:]:
+            for _, key in run:
+                outstanding[key] = outstanding.get(key, 0) + 1
+        return eta.ETAModel(results).predict(outstanding, (),
+                                             self.pexecs_per_run)
+
+    def run_trial(self, rng):
+        """Simulate the session once. Returns a dict of the outcome: the
+        total duration, when the ETA became known (None if never) and what
+        was predicted then, and when each key finished, all in seconds from
+        the start of the session."""
+
+        results = _SimulatedResults()
+        outcome = {
+            "total": None,
+            "eta_known": None,
+            "eta_predicted": None,
+            "key_finish": dict(),
+        }
+        events = []
+        seq = [0]  # Orders simultaneous events.
+
+        def schedule_event(time, kind, data):
+            heapq.heappush(events, (time, seq[0], kind, data))
+            seq[0] += 1
+
+        if self.runs:
+            schedule_event(0.0, RUN_START, 0)
+        while events:
+            now, _, kind, data = heapq.heappop(events)
+            if kind == RUN_START:
+                run_idx = data
+                phases = dict((phase, self._draw_phase(phase, rng))
+                              for phase in eta.PHASES)
+                exec_start = now + sum(phases[phase] for phase in
+                                       ("reboot", "startup_wait", "temp_wait",
+                                        "pre_hooks"))
+                run_end = exec_start
+                for manifest_idx, key in self.runs[run_idx]:
+                    exec_time = self.exec_durations[key].draw(rng)
+                    results.eta_estimates.setdefault(key, []).append(
+                        exec_time)
+                    schedule_event(exec_start + exec_time, PEXEC_END, key)
+                    run_end = max(run_end, exec_start + exec_time)
+                first_key = self.runs[run_idx][0][1]
+                results.pexec_phases.setdefault(first_key, dict())[
+                    str(len(results.eta_estimates[first_key]) - 1)] = phases
+                schedule_event(run_end + phases["post_hooks"], RUN_END,
+                               run_idx)
+            elif kind == PEXEC_END:
+                outcome["key_finish"][data] = now
+            elif kind == RUN_END:
+                run_idx = data
+                if run_idx + 1 < len(self.runs):
+                    next_exec_idx = self.runs[run_idx + 1][0][0]
+                    if outcome["eta_known"] is None and \
+                            0 <= self.eta_avail_idx <= next_exec_idx:
+                        outcome["eta_known"] = now
+                        prediction = self._predict(results, run_idx)
+                        outcome["eta_predicted"] = \
+                            tuple(now + secs for secs in prediction)
+                    schedule_event(now, RUN_START, run_idx + 1)
+                else:
+                    outcome["total"] = now
+        return outcome
+
+    def simulate(self, trials=DEFAULT_TRIALS, seed=SEED):
+        """Run 'trials' trials (see run_trial()), reproducibly for a given
+        'seed'. Returns a list of their outcomes."""
+
+        rng = random.Random(seed)
+        return [self.run_trial(rng) for _ in xrange(trials)]
+
+
+def _fmt_secs(secs):
+    return str(timedelta(seconds=int(round(secs))))
+
+
+def simulate_session(config, results_file=None, estimates=(),
+                     trials=DEFAULT_TRIALS):
+    """Simulate a session of 'config' (for --simulate). Returns a
+    '(simulator, outcomes)' pair."""
+
+    if config.ADAPTIVE_CI_WIDTH is not None:
+        warn("ADAPTIVE_CI_WIDTH is set, but the simulation runs all "
+             "N_EXECUTIONS process executions of each benchmark")
+    schedule = ManifestManager.make_schedule(config)
+    exec_durations, phase_durations = \
+        session_durations(schedule, results_file, estimates)
+    simulator = SessionSimulator(schedule, exec_durations, phase_durations,
+                                 config.THROUGHPUT_PEXECS or 1)
+    return simulator, simulator.simulate(trials)
+
+
+def print_simulation(simulator, outcomes):
+    """Prints the outcome of simulate_session()"""
+
+    print("\nSimulated Session")
+    print("=================\n")
+
+    num_pexecs = sum(len(run) for run in simulator.runs)
+    print("Process executions: %d, in %d runs. Trials: %d.\n" %
+          (num_pexecs, len(simulator.runs), len(outcomes)))
+
+    print("Durations:")
+    for key, duration in sorted(simulator.exec_durations.iteritems()):
+        print("  %s: %s" % (key, duration))
+    for phase in eta.PHASES:
+        duration = simulator.phase_durations.get(phase)
+        print("  (%s): %s" % (phase, duration or "no data, taken as 0"))
+    print("")
+
+    if not num_pexecs:
+        print("Nothing to run: all keys skipped!")
+        return
+
+    totals = [outcome["total"] for outcome in outcomes]
+    print("Total duration: %s (90%% of trials: %s to %s)" %
+          (_fmt_secs(percentile(totals, 50)), _fmt_secs(percentile(totals, 5)),
+           _fmt_secs(percentile(totals, 95))))
+
+    known = [outcome for outcome in outcomes
+             if outcome["eta_known"] is not None]
+    if not known:
+        print("ETA known: never (no benchmark runs more than once)")
+    else:
+        print("ETA known after: %s (at process execution %d)" %
+              (_fmt_secs(percentile([o["eta_known"] for o in known], 50)),
+               len([idx for idx, record in
+                    enumerate(simulator.schedule[:simulator.eta_avail_idx])
+                    if record.startswith("O ")])))
+        predicted = [o["eta_predicted"] for o in known]
+        print("  Predicted duration then: %s (%d%% prediction interval: "
+              "%s to %s)" % (
+                  _fmt_secs(percentile([p[0] for p in predicted], 50)),
+                  eta.INTERVAL_PERCENT,
+                  _fmt_secs(percentile([p[1] for p in predicted], 50)),
+                  _fmt_secs(percentile([p[2] for p in predicted], 50))))
+    print("")
+
+    print("Finish times (median):")
+    finish = dict((key, percentile([o["key_finish"][key] for o in outcomes],
+                                   50))
+                  for key in simulator.exec_durations)
+    for key, secs in sorted(finish.iteritems(), key=lambda item: item[1]):
+        print("  %s: %s" % (key, _fmt_secs(secs)))
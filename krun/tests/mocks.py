@@ -40,6 +40,12 @@ class MockPlatform(BasePlatform):
     def pin_process_args(self):
         return []
 
+    def throughput_cpusets(self, num_sets):
+        return [[cpu + 1] for cpu in xrange(num_sets)]
+
+    def pin_process_to_cpus_args(self, cpus):
+        return ["taskset", "-c", ",".join(str(cpu) for cpu in cpus)]
+
     def change_scheduler_args(self):
         return []
 
@@ -0,0 +1,75 @@
+from krun.adaptive import (bootstrap_ci, relative_ci_width, should_stop,
+                           should_stop_summaries, steady_state_mean,
+                           summarise_pexec)
+
+import random
+
+
+class FakeConfig(object):
+    ADAPTIVE_CI_WIDTH = 0.01
+    ADAPTIVE_MIN_EXECUTIONS = 3
+    ADAPTIVE_CONFIDENCE = 0.99
+
+
+def test_steady_state_mean0001():
+    assert steady_state_mean([10.0, 5.0, 2.0, 2.0]) == 2.0
+    assert steady_state_mean([10.0, 5.0, 2.0, 3.0, 4.0]) == 3.5
+    assert steady_state_mean([7.0]) == 7.0
+
+
+def test_bootstrap_ci0001():
+    rng = random.Random(0)
+    values = [float(x) for x in xrange(1, 11)]
+    lower, upper = bootstrap_ci(values, 0.95, rng)
+    assert 1.0 <= lower < 5.5 < upper <= 10.0
+    assert bootstrap_ci([3.0] * 5, 0.95, rng) == (3.0, 3.0)
+
+
+def test_relative_ci_width0001():
+    pexecs = [[1.0, 1.0], [1.0, 1.1], [1.0, 0.9], [1.0, 1.05]]
+    width = relative_ci_width("a:b:c", pexecs, 0.99)
+    assert 0 < width < 0.2
+    assert width == relative_ci_width("a:b:c", pexecs, 0.99)  # Reproducible.
+    assert relative_ci_width("a:b:c", [[2.0, 1.0]] * 4, 0.99) == 0.0
+
+
+def test_should_stop0001():
+    config = FakeConfig()
+    # Too few completed pexecs: errored ones don't count.
+    assert should_stop("a:b:c", ["C", "C", "E"], [[1.0], [1.0], []],
+                       config) == (False, None)
+    assert should_stop("a:b:c", ["C", "C", "C"], [[1.0], [1.0], [1.0]],
+                       config) == (True, 0.0)
+    stop, width = should_stop("a:b:c", ["C", "C", "C"],
+                              [[1.0], [2.0], [3.0]], config)
+    assert not stop
+    assert width > config.ADAPTIVE_CI_WIDTH
+
+
+def test_should_stop0002():
+    """Process executions which repeated the benchmark differently per
+    iteration are compared per call"""
+
+    config = FakeConfig()
+    pexecs = [[1.0], [2.0], [4.0]]
+    assert should_stop("a:b:c", ["C", "C", "C"], pexecs, config,
+                       [1, 2, 4]) == (True, 0.0)
+    assert not should_stop("a:b:c", ["C", "C", "C"], pexecs, config)[0]
+
+
+def test_summarise_pexec0001():
+    assert summarise_pexec([10.0, 5.0, 2.0, 2.0]) == 2.0
+    assert summarise_pexec([10.0, 5.0, 2.0, 2.0], 4) == 0.5
+    assert summarise_pexec([]) is None
+
+
+def test_should_stop_summaries0001():
+    """Deciding from the summaries agrees with deciding from the wall-clock
+    times"""
+
+    config = FakeConfig()
+    flags = ["C", "E", "C", "C"]
+    pexecs = [[3.0, 1.0], [], [5.0, 2.0], [4.0, 1.5]]
+    summaries = [summarise_pexec(wcts) for wcts in pexecs]
+    assert should_stop_summaries("a:b:c", flags, summaries, config) == \
+        should_stop("a:b:c", flags, pexecs, config)
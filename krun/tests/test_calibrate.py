@@ -0,0 +1,113 @@
+from krun.calibrate import (calibrate, load_calibration, near_floor,
+                            summarise, CALIBRATION_DIR)
+from krun.config import Config
+from krun.scheduler import ExecutionJob
+from krun.tests import BaseKrunTest, TEST_DIR
+from krun.util import FatalKrunError
+import krun.calibrate
+
+import json
+import os
+import pytest
+
+
+def fake_run_exec(wallclock_times, fail=False):
+    """Make a run_exec() for a VM definition, which prints the
+    measurements of a null benchmark run, and records its arguments"""
+
+    calls = []
+
+    def run_exec(entry_point, iterations, param, heap_lim_k, stack_lim_k,
+                 key, key_pexec_idx, force_dir=None, sync_disks=True):
+        calls.append((entry_point.target, iterations, key, force_dir))
+        stdout = json.dumps({
+            "wallclock_times": wallclock_times[:iterations],
+            "core_cycle_counts": [[10] * iterations],
+            "aperf_counts": [[0] * iterations],
+            "mperf_counts": [[0] * iterations],
+        })
+        return stdout, "", 1 if fail else 0, "/nonexistent/envlog", False
+    run_exec.calls = calls
+    return run_exec
+
+
+class FakeScheduler(object):
+    def __init__(self, config, platform, calibration):
+        self.config = config
+        self.platform = platform
+        self.calibration = calibration
+
+
+class TestCalibrate(BaseKrunTest):
+    """Test the harness overhead calibration."""
+
+    def test_summarise0001(self):
+        summary = summarise([4, 1, 3, 2])
+        assert summary == {"n": 4, "min": 1, "max": 4, "mean": 2.5,
+                           "p5": 1, "p50": 2, "p95": 4}
+
+    def test_near_floor0001(self):
+        calibration = {"vms": {"CPython": {"wallclock_times": {"p50": 0.5}}}}
+        assert near_floor(calibration, "CPython", [1, 2, 9], 5) == 0.5
+        assert near_floor(calibration, "CPython", [1, 2, 9], 3) is None
+        assert near_floor(calibration, "CPython", [], 5) is None
+        assert near_floor(calibration, "PyPy", [1, 2, 9], 5) is None
+
+    def test_calibrate0001(self, mock_platform, monkeypatch):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        config.CALIBRATION_ITERATIONS = 3
+        config.CALIBRATION_PEXECS = 2
+        monkeypatch.setattr(krun.calibrate, "get_git_version",
+                            lambda: "abc123")
+        python_run_exec = fake_run_exec([0.1, 0.2, 0.3])
+        java_run_exec = fake_run_exec([0.1, 0.2, 0.3], fail=True)
+        monkeypatch.setattr(config.VMS["CPython"]["vm_def"], "run_exec",
+                            python_run_exec)
+        monkeypatch.setattr(config.VMS["Java"]["vm_def"], "run_exec",
+                            java_run_exec)
+
+        calibration = calibrate(config, mock_platform)
+        assert python_run_exec.calls == [
+            ("null.py", 3, "null:CPython:calibration", CALIBRATION_DIR)] * 2
+        # The Java VM failed, so isn't calibrated.
+        assert calibration["vms"].keys() == ["CPython"]
+        outcome = calibration["vms"]["CPython"]
+        assert outcome["wallclock_times"]["n"] == 6
+        assert outcome["wallclock_times"]["p50"] == 0.2
+        assert outcome["core_cycle_counts"][0]["p50"] == 10
+        assert calibration["iterations"] == 3
+        assert calibration["krun_version"] == "abc123"
+
+        # The outcome is stored in the sidecar, not the results file.
+        assert load_calibration(config) == json.loads(json.dumps(calibration))
+        assert not os.path.exists(config.results_filename())
+        os.unlink(config.calibration_filename())
+        assert load_calibration(config) is None
+
+    def test_load_calibration0001(self):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        with open(config.calibration_filename(), "w") as f:
+            f.write("{")
+        try:
+            with pytest.raises(FatalKrunError):
+                load_calibration(config)
+        finally:
+            os.unlink(config.calibration_filename())
+
+    def test_check_harness_floor0001(self, mock_platform, caplog):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        calibration = {"vms": {"CPython": {"wallclock_times": {"p50": 0.5}}}}
+        sched = FakeScheduler(config, mock_platform, calibration)
+        job = ExecutionJob(sched, "CPython", config.VMS["CPython"], "dummy",
+                           "default-python", 1000, 0)
+
+        job.check_harness_floor({"wallclock_times": [6.0, 6.0]})
+        assert "harness overhead" not in caplog.text
+        job.check_harness_floor({"wallclock_times": [1.0, 1.0]})
+        assert "take less than 10 times the harness overhead of " \
+            "'CPython'" in caplog.text
+
+    def test_config0001(self):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        assert config.calibration_filename().endswith(
+            "example_calibration.json")
@@ -0,0 +1,62 @@
+from krun.compression import (get_codec, detect_codec, codec_for_filename,
+                              Bz2Codec, GzipCodec, NoCodec, XzCodec, lzma)
+from krun.tests import TEST_DIR
+
+import os
+import pytest
+
+CODEC_SPECS = ["bz2", "bz2:1", "gzip", "gzip:1", "gzip:9", "none"]
+if lzma is not None:
+    CODEC_SPECS.extend(["xz", "xz:0"])
+
+
+def test_get_codec0001():
+    codec = get_codec("gzip:3")
+    assert isinstance(codec, GzipCodec)
+    assert codec.level == 3
+    assert str(codec) == "gzip:3"
+
+    codec = get_codec("bz2")
+    assert isinstance(codec, Bz2Codec)
+    assert codec.level == 9
+    assert str(get_codec("none")) == "none"
+
+
+def test_get_codec0002():
+    with pytest.raises(ValueError):
+        get_codec("zip")
+    with pytest.raises(ValueError):
+        get_codec("gzip:10")
+    with pytest.raises(ValueError):
+        get_codec("gzip:fast")
+    with pytest.raises(ValueError):
+        get_codec("none:1")
+
+
+@pytest.mark.skipif(lzma is not None, reason="lzma is available")
+def test_get_codec0003():
+    with pytest.raises(ValueError) as e:
+        get_codec("xz")
+    assert "backports.lzma" in str(e)
+
+
+@pytest.mark.parametrize("spec", CODEC_SPECS)
+def test_codec_round_trip0001(spec):
+    codec = get_codec(spec)
+    data = "".join(chr(i % 256) for i in xrange(10000))
+    assert codec.decompress(codec.compress(data)) == data
+
+
+@pytest.mark.parametrize("spec", CODEC_SPECS)
+def test_codec_detect0001(spec):
+    codec = get_codec(spec)
+    path = os.path.join(TEST_DIR, "codec_test.json" + codec.extension)
+    with codec.open(path, "w") as f:
+        f.write('{"a": 1}')
+
+    detected = detect_codec(path)
+    assert detected.name == codec.name
+    assert codec_for_filename(path).name == codec.name
+    with detected.open(path, "r") as f:
+        assert f.read() == '{"a": 1}'
+    os.unlink(path)
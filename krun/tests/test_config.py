@@ -90,6 +90,13 @@ def test_results_filename():
     # not exact match due to absolute path
     assert example_config.results_filename().endswith("example_results.json.bz2")
 
+    example_config.COMPRESSION_CODEC = "gzip:1"
+    assert example_config.results_filename().endswith("example_results.json.gz")
+    example_config.COMPRESSION_CODEC = "none"
+    assert example_config.results_filename().endswith("example_results.json")
+    example_config.RESULTS_FORMAT = "binary"
+    assert example_config.results_filename().endswith("example_results.bin")
+
 
 def test_skip0001():
     path = os.path.join(TEST_DIR, "skips.krun")
@@ -318,3 +325,18 @@ def test_custom_dmesg_whitelist0003(monkeypatch):
     platform = krun.platform.detect_platform(None, config)
     patterns = [p.pattern for p in platform.get_dmesg_whitelist()]
     assert patterns == platform.default_dmesg_whitelist()
+
+
+def test_inner_repeats0001():
+    config = Config(os.path.join(TEST_DIR, "example.krun"))
+    assert config.inner_repeats("dummy") == 1
+    config.INNER_REPEATS = {"dummy": 16}
+    assert config.inner_repeats("dummy") == 16
+    assert config.inner_repeats("nbody") == 1
+
+
+def test_inner_repeats0002():
+    path = os.path.join(TEST_DIR, "inner_repeats_unsupported.krun")
+    with pytest.raises(FatalKrunError) as e:
+        Config(path)
+    assert "VM 'PHP' can't repeat benchmarks within an iteration" in str(e)
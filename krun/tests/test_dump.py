@@ -0,0 +1,113 @@
+from krun.config import Config
+from krun.dump import dump_results, parse_pexec_range, DumpFilter
+from krun.results import Results
+from krun.tests import TEST_DIR
+from krun.tests.mocks import mock_platform
+from StringIO import StringIO
+
+import json
+import os
+import pytest
+
+KEYS = ["dummy:Java:default-java", "nbody:Java:default-java",
+        "dummy:CPython:default-python", "nbody:CPython:default-python"]
+
+
+def add_pexecs(results, pexec_idx):
+    for key_idx, key in enumerate(KEYS):
+        n = pexec_idx * 10 + key_idx
+        results.append_exec_measurements(key, {
+            "wallclock_times": [n + 0.5, n + 0.25],
+            "core_cycle_counts": [[n, n + 1], [n + 2, n + 3]],
+            "aperf_counts": [[n, n], [n, n]],
+            "mperf_counts": [[n + 1, n + 1], [n + 1, n + 1]],
+        }, "C")
+        results.eta_estimates[key].append(n + 0.75)
+
+
+@pytest.fixture
+def results(mock_platform, monkeypatch):
+    """A results object with three process executions of each key, the last
+    of which is only in the journal"""
+
+    monkeypatch.setattr(Results, 'instantiation_check', lambda self: None)
+    mock_platform.num_per_core_measurements = 2
+    config = Config(os.path.join(TEST_DIR, "example.krun"))
+    results = Results(config, mock_platform)
+    for pexec_idx in xrange(3):
+        add_pexecs(results, pexec_idx)
+        if pexec_idx == 1:
+            results.write_to_file()
+    results.append_to_journal()
+    yield results
+    for filename in (config.results_filename(), results.filename):
+        for filename in (filename, filename + ".journal"):
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+
+def dump(filename, what, flt=None):
+    out = StringIO()
+    dump_results(filename, what, out, flt)
+    return json.loads(out.getvalue())
+
+
+def test_parse_pexec_range0001():
+    assert parse_pexec_range("3") == (3, 4)
+    assert parse_pexec_range("3-5") == (3, 6)
+    assert parse_pexec_range("3-") == (3, None)
+    for spec in ("", "-3", "a", "5-3", "1-2-3"):
+        with pytest.raises(ValueError):
+            parse_pexec_range(spec)
+
+
+def test_dump_filter0001():
+    with pytest.raises(ValueError):
+        DumpFilter(sections=["wallclock_times", "pexec_flags"])
+
+
+@pytest.mark.parametrize("results_format", ["json", "binary"])
+def test_dump_results0001(results, results_format, monkeypatch):
+    """Check the streamed dump agrees with Results.dump(), even when values
+    span the buffer"""
+
+    if results_format == "binary":
+        results.filename = results.filename.replace(".json.bz2", ".bin")
+        results.write_to_file()
+        add_pexecs(results, 3)
+        results.append_to_journal()
+    monkeypatch.setattr("krun.json_stream.READ_CHUNK_SIZE", 7)
+    assert dump(results.filename, "data") == json.loads(results.dump("data"))
+    assert dump(results.filename, "eta_estimates") == \
+        json.loads(results.dump("eta_estimates"))
+
+
+@pytest.mark.parametrize("results_format", ["json", "binary"])
+def test_dump_results0002(results, results_format):
+    """Check filtering by key, process execution and section"""
+
+    if results_format == "binary":
+        results.filename = results.filename.replace(".json.bz2", ".bin")
+        results.write_to_file()
+    flt = DumpFilter("nbody:*", "1-", ["wallclock_times", "mperf_counts"])
+    assert dump(results.filename, "data", flt) == {
+        "mperf_counts": {
+            "nbody:CPython:default-python": [[[14, 14], [14, 14]],
+                                             [[24, 24], [24, 24]]],
+            "nbody:Java:default-java": [[[12, 12], [12, 12]],
+                                        [[22, 22], [22, 22]]],
+        },
+        "wallclock_times": {
+            "nbody:CPython:default-python": [[13.5, 13.25], [23.5, 23.25]],
+            "nbody:Java:default-java": [[11.5, 11.25], [21.5, 21.25]],
+        },
+    }
+
+    flt = DumpFilter("dummy:Java:*", "0")
+    assert dump(results.filename, "eta_estimates", flt) == \
+        {"dummy:Java:default-java": [0.75]}
+    flt = DumpFilter("*", "1", ["core_cycle_counts"])
+    assert dump(results.filename, "data", flt)["core_cycle_counts"] \
+        ["dummy:CPython:default-python"] == [[[12, 13], [14, 15]]]
+    flt = DumpFilter("nonexistent")
+    assert dump(results.filename, "eta_estimates", flt) == {}
@@ -0,0 +1,63 @@
+from krun.eta import ETAModel, median, robust_stats, MAD_TO_SIGMA
+from krun.results import Results
+from krun.tests import BaseKrunTest
+from krun.tests.test_results import no_results_instantiation_check
+
+import pytest
+
+
+def make_results(eta_estimates, pexec_phases):
+    results = Results(None, None)
+    results.eta_estimates = eta_estimates
+    results.pexec_phases = pexec_phases
+    return results
+
+
+class TestETA(BaseKrunTest):
+    """Test the ETA model."""
+
+    def test_median0001(self):
+        assert median([3, 1, 2]) == 2.0
+        assert median([4, 1, 2, 3]) == 2.5
+        with pytest.raises(ValueError):
+            median([])
+
+    def test_robust_stats0001(self):
+        assert robust_stats([]) is None
+        # The outlier doesn't affect the estimates.
+        med, sigma, num = robust_stats([10, 11, 12, 13, 1000])
+        assert med == 12
+        assert sigma == pytest.approx(MAD_TO_SIGMA)
+        assert num == 5
+
+    def test_predict0001(self, no_results_instantiation_check):
+        results = make_results(
+            {"a:vm:v": [10.0, 10.0, 10.0], "b:vm:v": [20.0]},
+            {"a:vm:v": {"0": {"reboot": 60.0, "temp_wait": 5.0},
+                        "1": {"reboot": 600.0, "temp_wait": 5.0},
+                        "2": {"reboot": 70.0, "temp_wait": 5.0}}})
+        model = ETAModel(results)
+        assert model.run_overhead() == 75.0
+        assert model.key_duration("a:vm:v") == 85.0
+        assert model.key_duration("c:vm:v") is None
+
+        secs, low, high = model.predict({"a:vm:v": 2, "b:vm:v": 1})
+        assert secs == 2 * 10 + 20 + 3 * 75
+        # The slow reboot widens the interval, but doesn't move the ETA.
+        assert low < secs < high
+
+        # In throughput mode, the executions run two at a time, in two runs.
+        secs, _, _ = model.predict({"a:vm:v": 2, "b:vm:v": 1},
+                                   pexecs_per_run=2)
+        assert secs == (2 * 10 + 20) / 2.0 + 2 * 75
+
+    def test_predict0002(self, no_results_instantiation_check):
+        """Unknown keys make the ETA unknown, unless they are skipped"""
+
+        results = make_results({"a:vm:v": [10.0]}, {})
+        model = ETAModel(results)
+        assert model.predict({"a:vm:v": 1, "b:vm:v": 1}) is None
+        secs, low, high = model.predict({"a:vm:v": 1, "b:vm:v": 1},
+                                        skipped_keys=set(["b:vm:v"]))
+        # No spread in one sample, and no phases recorded.
+        assert secs == low == high == 10.0
@@ -1,6 +1,6 @@
 from krun.tests import BaseKrunTest
 from krun.util import FatalKrunError
-from krun.platform import BasePlatform
+from krun.platform import BasePlatform, parse_cpu_list
 from krun.tests.mocks import mock_manifest
 import pytest
 import re
@@ -204,3 +204,8 @@ class TestGenericPlatform(BaseKrunTest):
 
         assert mock_platform._check_dmesg_for_changes(
             [], last_dmesg, new_dmesg, mock_manifest)
+
+    def test_parse_cpu_list0001(self):
+        assert parse_cpu_list("0") == [0]
+        assert parse_cpu_list("0,4\n") == [0, 4]
+        assert parse_cpu_list("0-2,8-9") == [0, 1, 2, 8, 9]
@@ -0,0 +1,40 @@
+from krun.heater import Heater, heat_loop
+from krun.tests import BaseKrunTest
+from krun.util import FatalKrunError
+
+import os
+import pytest
+import time
+
+REAL_SLEEP = time.sleep  # Before the no_sleep fixture replaces it.
+
+
+class TestHeater(BaseKrunTest):
+    """Test the duty-cycle heater."""
+
+    def test_heat_loop0001(self, monkeypatch):
+        monkeypatch.setattr(time, "sleep", REAL_SLEEP)
+        start_cpu = sum(os.times()[:2])
+        start = time.time()
+        heat_loop(0.5, 1.0, period=0.05)
+        elapsed = time.time() - start
+        busy = sum(os.times()[:2]) - start_cpu
+        assert 1.0 <= elapsed < 1.2
+        assert 0.35 < busy < 0.65
+
+    def test_heat0001(self, mock_platform):
+        start = time.time()
+        Heater(mock_platform).heat([0, 1], 1.0, 0.2)
+        assert time.time() - start >= 0.2
+
+    def test_heat0002(self, mock_platform, monkeypatch):
+        monkeypatch.setattr(Heater, "heater_args",
+                            lambda self, cpu, duty, duration: ["false"])
+        with pytest.raises(FatalKrunError):
+            Heater(mock_platform).heat([0], 1.0, 0.1)
+
+    def test_heater_cpus0001(self, mock_platform):
+        assert mock_platform.heater_cpus() == \
+            range(os.sysconf("SC_NPROCESSORS_ONLN"))
+        mock_platform.config.HEATER_CPUS = [2, 3]
+        assert mock_platform.heater_cpus() == [2, 3]
@@ -224,6 +224,40 @@ class TestLinuxPlatform(BaseKrunTest):
                   '/usr/bin/sudo', '-u', 'krun', DASH, wrapper_filename]
         assert got == expect
 
+    def test_wrapper_args0003(self, platform):
+        platform.config.ENABLE_PINNING = False
+
+        vm_def = PythonVMDef('/dummy/bin/python')
+        vm_def.set_platform(platform)
+        vm_def.pin_cpus = [2, 3]
+        wrapper_filename = "abcdefg.dash"
+        got = vm_def._wrapper_args(wrapper_filename)
+        expect = ['/usr/bin/sudo', '-u', 'root', '/usr/bin/nice', '-n', '-20',
+                  '/usr/bin/sudo', '-u', 'root', 'taskset', '-c', '2,3',
+                  '/usr/bin/sudo', '-u', 'krun', DASH, wrapper_filename]
+        assert got == expect
+
+    def test_heater_pin_args0001(self, platform):
+        platform.config.ENABLE_PINNING = False
+        assert platform.heater_pin_args(3) == ["taskset", "-c", "3"]
+
+        platform.config.ENABLE_PINNING = True
+        platform.num_cpus = 4
+        assert platform.heater_pin_args(0) == ["taskset", "-c", "0"]
+        assert platform.heater_pin_args(3) == \
+            ['/usr/bin/sudo', '-u', 'root', '/usr/bin/cset', 'shield', '-e',
+             '--', 'taskset', '-c', '3']
+
+    def test_throughput_cpusets0001(self, platform, monkeypatch):
+        # Four cores, each with two hyperthreads.
+        platform.num_cpus = 8
+        monkeypatch.setattr(platform, "_read_thread_siblings",
+                            lambda cpu: [cpu % 4, cpu % 4 + 4])
+        assert platform.throughput_cpusets(1) == [[1, 2, 3]]
+        assert platform.throughput_cpusets(3) == [[1], [2], [3]]
+        with pytest.raises(FatalKrunError):
+            platform.throughput_cpusets(4)
+
     def test_take_temperature_readings0001(self, platform):
         """Test live readings off test machine"""
 
@@ -5,6 +5,7 @@ from krun.config import Config
 from krun.scheduler import ManifestManager
 from krun.util import FatalKrunError
 from krun.tests.mocks import MockPlatform, mock_platform
+from krun.manifest_index import index_filename, read_manifest_index
 
 DEFAULT_MANIFEST = "krun.manifest"
 TEST_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -125,9 +126,10 @@ O dummy:CPython:default-python
 E nbody:CPython:default-python
 """
 
-def _setup(contents):
+def _setup(contents, manifest_index=False):
     class FakeConfig(object):
         filename = os.path.join(TEST_DIR, "manifest_tests.krun")
+        MANIFEST_INDEX = manifest_index
     config = FakeConfig()
 
     with open(ManifestManager.get_filename(config), "w") as fh:
@@ -546,3 +548,175 @@ def test_next_exec_key_index0004():
     manifest = _setup(THIRD_KEY_REP_EXAMPLE_MANIFEST)
     assert manifest.next_exec_key_index() == 2
     _tear_down(manifest.path)
+
+
+def _check_matches_reparse(manifest):
+    fresh = ManifestManager.__new__(ManifestManager)
+    fresh.platform = manifest.platform
+    fresh.path = manifest.path
+    fresh.use_index = False
+    fresh._parse()
+    assert manifest == fresh
+    assert manifest.completed_exec_counts == fresh.completed_exec_counts
+    if manifest.num_execs_left > 0:  # Otherwise meaningless.
+        assert manifest.key_record_counts == fresh.key_record_counts
+    assert manifest.num_reboots == fresh.num_reboots
+    assert manifest.num_mails_sent == fresh.num_mails_sent
+
+
+@pytest.mark.parametrize("contents", [BLANK_EXAMPLE_MANIFEST,
+                                      SKIPS_EXAMPLE_MANIFEST,
+                                      SKIPS_END_EXAMPLE_MANIFEST,
+                                      IRREGULAR_EXAMPLE_MANIFEST])
+def test_update_incremental0001(contents):
+    """Check the incrementally updated state matches a re-parse"""
+
+    manifest = _setup(contents)
+    flags = ["C", "E", "T", "S"]
+    while manifest.num_execs_left > 0:
+        manifest.update(flags[manifest.next_exec_idx % len(flags)])
+        manifest.update_num_reboots()
+        _check_matches_reparse(manifest)
+        if manifest.num_execs_left > 0:
+            key_idx = manifest.next_exec_key_index()
+            _check_matches_reparse(manifest)
+            assert key_idx == manifest.next_exec_key_index()
+    manifest.update_num_mails_sent()
+    _check_matches_reparse(manifest)
+    _tear_down(manifest.path)
+
+
+def test_update_incremental0002():
+    """Check the manifest is re-parsed if it is changed on disk"""
+
+    manifest = _setup(BLANK_EXAMPLE_MANIFEST)
+    with open(manifest.path, "w") as fh:
+        fh.write(IRREGULAR_EXAMPLE_MANIFEST.replace("num_reboots=00000000",
+                                                    "num_reboots=00000005"))
+    manifest.update_num_reboots()
+    assert manifest.num_reboots == 6
+    assert manifest.next_exec_idx == 6
+    manifest.update("C")
+    assert manifest.num_execs_left == 0
+    _check_matches_reparse(manifest)
+    _tear_down(manifest.path)
+
+
+def test_update_skip0001():
+    """Check skipping the last outstanding record of a key"""
+
+    manifest = _setup(SKIPS_EXAMPLE_MANIFEST)
+    for flag in ["C", "C", "S", "S", "C", "C"]:
+        manifest.update(flag)
+    assert manifest.num_execs_left == 0
+    assert manifest.total_num_execs == 4
+    assert manifest.skipped_keys == set(["dummy:Java:default-java",
+                                         "nbody:Java:default-java"])
+    assert manifest.non_skipped_keys == set(["dummy:CPython:default-python",
+                                             "nbody:CPython:default-python"])
+    _check_matches_reparse(manifest)
+    _tear_down(manifest.path)
+
+
+def test_manifest_index0001(monkeypatch):
+    """Check the state can be loaded from the index without parsing"""
+
+    manifest = _setup(IRREGULAR_EXAMPLE_MANIFEST, manifest_index=True)
+    assert os.path.exists(index_filename(manifest.path))
+    manifest.update_num_reboots()
+    manifest.update("C")
+    manifest.update_num_mails_sent()
+
+    def no_parse(self):
+        assert False
+    monkeypatch.setattr(ManifestManager, "_parse", no_parse)
+    loaded = ManifestManager.__new__(ManifestManager)
+    loaded.platform = manifest.platform
+    loaded.path = manifest.path
+    loaded.use_index = True
+    loaded._load()
+    monkeypatch.undo()
+    _check_matches_reparse(loaded)
+    assert loaded.num_reboots == 1
+    assert loaded.num_mails_sent == 1
+    assert loaded.num_execs_left == 0
+    assert loaded.flag_counts == {"O": 0, "C": 4, "E": 2, "T": 0, "S": 2}
+
+    os.unlink(index_filename(manifest.path))
+    _tear_down(manifest.path)
+
+
+def test_manifest_index0002():
+    """Check a stale or corrupt index is ignored"""
+
+    manifest = _setup(BLANK_EXAMPLE_MANIFEST, manifest_index=True)
+    index_path = index_filename(manifest.path)
+    assert read_manifest_index(manifest.path) is not None
+
+    with open(manifest.path, "a") as fh:
+        fh.write("O dummy:Java:default-java\n")
+    assert read_manifest_index(manifest.path) is None
+    manifest._load()
+    assert manifest.num_execs_left == 9
+
+    with open(index_path, "rb") as fh:
+        data = fh.read()
+    with open(index_path, "wb") as fh:
+        fh.write(data[:-3])
+    assert read_manifest_index(manifest.path) is None
+
+    os.unlink(index_path)
+    assert read_manifest_index(manifest.path) is None
+    _tear_down(manifest.path)
+
+
+def test_skip_outstanding0001():
+    """Check skipping the outstanding records of a key"""
+
+    manifest = _setup(BLANK_EXAMPLE_MANIFEST)
+    manifest.update("C")
+    assert manifest.skip_outstanding("dummy:Java:default-java") == 1
+    assert manifest.skip_outstanding("dummy:Java:default-java") == 0
+    assert manifest.num_execs_left == 6
+    assert manifest.total_num_execs == 7
+    assert manifest.outstanding_exec_counts["dummy:Java:default-java"] == 0
+    assert manifest.next_exec_key == "nbody:Java:default-java"
+    assert manifest.flag_counts["S"] == 1
+
+    # Skipping the next key moves the next execution along.
+    assert manifest.skip_outstanding("nbody:Java:default-java") == 2
+    assert manifest.next_exec_key == "dummy:CPython:default-python"
+    assert manifest.next_exec_idx == 2
+    with open(manifest.path) as fh:
+        records = fh.read().splitlines()[4:]
+    assert records == [
+        "C dummy:Java:default-java",
+        "S nbody:Java:default-java",
+        "O dummy:CPython:default-python",
+        "O nbody:CPython:default-python",
+        "S dummy:Java:default-java",
+        "S nbody:Java:default-java",
+        "O dummy:CPython:default-python",
+        "O nbody:CPython:default-python",
+    ]
+    _check_matches_reparse(manifest)
+    _tear_down(manifest.path)
+
+
+def test_peek_outstanding0001():
+    manifest = _setup(SKIPS_EXAMPLE_MANIFEST)
+    manifest.update("C")
+    first = manifest.peek_outstanding(1)
+    assert first == [(manifest.next_exec_key, manifest.next_exec_key_index(),
+                      manifest.completed_exec_counts[manifest.next_exec_key])]
+
+    # Running the peeked executions in turn gives the same indices.
+    peeked = manifest.peek_outstanding(100)
+    assert len(peeked) == manifest.num_execs_left
+    for key, key_pexec_idx, key_exec_num in peeked:
+        assert manifest.next_exec_key == key
+        assert manifest.next_exec_key_index() == key_pexec_idx
+        assert manifest.completed_exec_counts[key] == key_exec_num
+        manifest.update("C")
+    assert manifest.peek_outstanding(2) == []
+    _tear_down(manifest.path)
@@ -0,0 +1,97 @@
+from krun.config import Config
+from krun.readiness import (get_readiness_detector, wait_until_ready,
+                            CPUIdleDetector, DmesgDetector, POLL_SECONDS)
+from krun.tests import BaseKrunTest
+
+import pytest
+import time
+
+
+class FakeClock(object):
+    """Time only passes when the platform sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+class TestReadiness(BaseKrunTest):
+    """Test waiting for the system to come up."""
+
+    @pytest.fixture
+    def clock(self, mock_platform, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(time, "time", clock.time)
+        monkeypatch.setattr(mock_platform, "sleep", clock.sleep)
+        return clock
+
+    def test_get_readiness_detector0001(self):
+        assert str(get_readiness_detector("cpu-idle:98")) == "cpu-idle:98"
+        assert get_readiness_detector("cpu-idle:98").threshold == 98.0
+        assert get_readiness_detector("load").threshold == 0.5
+        for spec in ("nope", "dmesg:1", "cpu-idle:lots", "cpu-idle:101"):
+            with pytest.raises(ValueError):
+                get_readiness_detector(spec)
+
+    def test_cpu_idle0001(self, mock_platform, monkeypatch):
+        times = iter([(0, 0), (90, 100), (180, 200), (279, 300)])
+        monkeypatch.setattr(mock_platform, "read_cpu_times",
+                            lambda: next(times))
+        detector = CPUIdleDetector("95")
+        assert not detector.is_ready(mock_platform)  # No interval yet.
+        assert not detector.is_ready(mock_platform)  # 90% idle.
+        assert not detector.is_ready(mock_platform)  # 90% idle.
+        assert detector.is_ready(mock_platform)  # 99% idle.
+
+    def test_dmesg0001(self, mock_platform, monkeypatch):
+        dmesgs = iter([["a"], ["a"], ["a", "b"], ["a", "b"]])
+        monkeypatch.setattr(mock_platform, "_collect_dmesg_lines",
+                            lambda: next(dmesgs))
+        detector = DmesgDetector()
+        assert [detector.is_ready(mock_platform) for _ in xrange(4)] == \
+            [False, True, False, True]
+
+    def test_wait_until_ready0001(self, mock_platform, monkeypatch, clock):
+        """Stop waiting once the system has been quiet for long enough"""
+
+        # The dmesg changes on each of the first 5 polls.
+        dmesgs = iter([[str(i)] for i in xrange(5)] + [["4"]] * 100)
+        monkeypatch.setattr(mock_platform, "_collect_dmesg_lines",
+                            lambda: next(dmesgs))
+        config = Config()
+        config.STARTUP_READINESS_DETECTORS = ["init", "dmesg"]
+        config.STARTUP_QUIET_SECONDS = 10
+        waited = wait_until_ready(mock_platform, config)
+        assert waited == 5 * POLL_SECONDS + 10
+        assert waited < config.STARTUP_MAX_WAIT_SECONDS
+
+    def test_wait_until_ready0002(self, mock_platform, monkeypatch, clock):
+        """Never wait longer than the maximum"""
+
+        polls = []
+
+        def dmesg():
+            polls.append(None)
+            return [str(len(polls))]
+        monkeypatch.setattr(mock_platform, "_collect_dmesg_lines", dmesg)
+        config = Config()
+        config.STARTUP_READINESS_DETECTORS = ["dmesg"]
+        assert wait_until_ready(mock_platform, config) == \
+            config.STARTUP_MAX_WAIT_SECONDS
+
+    def test_wait_until_ready0003(self, mock_platform, clock):
+        """With no detectors, wait for the quiet window only"""
+
+        config = Config()
+        config.STARTUP_READINESS_DETECTORS = []
+        config.STARTUP_QUIET_SECONDS = 30
+        assert wait_until_ready(mock_platform, config) == 30
+
+    def test_wait_until_ready0004(self, mock_platform):
+        mock_platform.quick_mode = True
+        assert wait_until_ready(mock_platform, Config()) == 0.0
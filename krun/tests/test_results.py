@@ -1,8 +1,12 @@
 from krun.config import Config
-from krun.results import Results
+from krun.results import (Results, TypedArray, is_binary_results_file,
+                          backup_filename, journal_filename,
+                          typed_pexec_measurements, MEASUREMENT_SECTIONS)
 from krun.tests import BaseKrunTest
+from krun.compression import detect_codec
 from krun.util import FatalKrunError
 
+import json
 import os
 import pytest
 
@@ -142,3 +146,700 @@ class TestResults(BaseKrunTest):
 
         expect = "inconsistent #iters in core_cycle_counts: bench:vm:variant[0][0]. 1 vs 2"
         assert expect in caplog.text
+
+    def test_journal0001(self, mock_platform, no_results_instantiation_check):
+        """Check process executions appended to the journal are read back"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        mock_platform.num_per_core_measurements = 1
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+
+        measurements = {
+            "wallclock_times": [1.0, 2.0],
+            "core_cycle_counts": [[3, 4]],
+            "aperf_counts": [[5, 6]],
+            "mperf_counts": [[7, 8]],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(3.0)
+        results0.append_to_journal()
+
+        journal = journal_filename(config.results_filename())
+        assert os.path.exists(journal)
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results0 == results1
+        assert results1.pexec_flags[key] == ["C"]
+
+        # Folding the journal into the results file removes it.
+        results1.write_to_file()
+        assert not os.path.exists(journal)
+        results2 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results0 == results2
+        os.unlink(config.results_filename())
+
+    def test_journal0002(self, mock_platform, no_results_instantiation_check,
+                         caplog):
+        """Check a truncated journal record is ignored, as are records
+        already folded into the results file"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+
+        measurements = {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        for i in xrange(2):
+            results0.append_exec_measurements(key, measurements, "C")
+            results0.eta_estimates[key].append(1.0)
+            results0.append_to_journal()
+
+        # Chop the last few bytes off the journal.
+        journal = journal_filename(config.results_filename())
+        with open(journal, "rb") as f:
+            data = f.read()
+        with open(journal, "wb") as f:
+            f.write(data[:-3])
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results1.pexec_flags[key] == ["C"]
+        assert "Ignoring truncated record" in caplog.text
+
+        # Now pretend Krun stopped after folding, but before removing, the
+        # journal.
+        results1.write_to_file()
+        with open(journal, "wb") as f:
+            f.write(data)
+        results2 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results2.pexec_flags[key] == ["C", "C"]
+
+        os.unlink(journal)
+        os.unlink(config.results_filename())
+
+    @pytest.mark.parametrize("results_format", ["json", "binary"])
+    def test_pexec_cores0001(self, mock_platform, results_format,
+                             no_results_instantiation_check):
+        """Check the CPUs of throughput mode process executions are kept"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FORMAT = results_format
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+
+        measurements = {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        for cores in (None, [1, 2], [3, 4]):
+            results0.append_exec_measurements(key, measurements, "C",
+                                              cores=cores)
+            results0.eta_estimates[key].append(1.0)
+        results0.append_to_journal()
+
+        # Once from the journal, and once folded into the results file.
+        for _ in xrange(2):
+            results1 = Results(config, mock_platform,
+                               results_file=config.results_filename())
+            assert results1 == results0
+            assert results1.get_pexec_cores(key, 0) is None
+            assert results1.get_pexec_cores(key, 1) == [1, 2]
+            assert results1.get_pexec_cores(key, 2) == [3, 4]
+            results1.integrity_check(full=True)
+            results1.write_to_file()
+
+        os.unlink(config.results_filename())
+
+    @pytest.mark.parametrize("results_format", ["json", "binary"])
+    def test_pexec_inner_repeats0001(self, mock_platform, results_format,
+                                     no_results_instantiation_check):
+        """Check the inner repeats of process executions are kept"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FORMAT = results_format
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+
+        for inner_repeats in (None, 1, 64):
+            measurements = {
+                "wallclock_times": [1.0],
+                "core_cycle_counts": [],
+                "aperf_counts": [],
+                "mperf_counts": [],
+            }
+            if inner_repeats is not None:
+                measurements["inner_repeats"] = inner_repeats
+            results0.append_exec_measurements(key, measurements, "C")
+            results0.eta_estimates[key].append(1.0)
+        results0.append_to_journal()
+        # Only process executions which repeated the benchmark are recorded.
+        assert results0.pexec_inner_repeats == {key: {"2": 64}}
+
+        # Once from the journal, and once folded into the results file.
+        for _ in xrange(2):
+            results1 = Results(config, mock_platform,
+                               results_file=config.results_filename())
+            assert results1 == results0
+            assert results1.get_pexec_inner_repeats(key, 0) == 1
+            assert results1.get_pexec_inner_repeats(key, 1) == 1
+            assert results1.get_pexec_inner_repeats(key, 2) == 64
+            results1.integrity_check(full=True)
+            results1.write_to_file()
+
+        os.unlink(config.results_filename())
+
+    @pytest.mark.parametrize("results_format", ["json", "binary"])
+    def test_pexec_phases0001(self, mock_platform, results_format,
+                              no_results_instantiation_check):
+        """Check phases are kept, including those added after the process
+        execution was journaled"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FORMAT = results_format
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+
+        measurements = {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        for _ in xrange(2):
+            results0.append_exec_measurements(key, measurements, "C")
+            results0.eta_estimates[key].append(1.0)
+        results0.add_pexec_phases(key, 1, {"reboot": 60.0})
+        results0.append_to_journal()
+        results0.add_pexec_phases(key, 1, {"post_hooks": 2.5})
+        assert results0.unjournaled_phases == [(key, 1)]
+        results0.append_to_journal()
+
+        # Once from the journal, and once folded into the results file.
+        for _ in xrange(2):
+            results1 = Results(config, mock_platform,
+                               results_file=config.results_filename())
+            assert results1 == results0
+            assert results1.get_pexec_phases(key, 0) is None
+            assert results1.get_pexec_phases(key, 1) == \
+                {"reboot": 60.0, "post_hooks": 2.5}
+            results1.integrity_check(full=True)
+            results1.write_to_file()
+
+        os.unlink(config.results_filename())
+
+    @pytest.mark.parametrize("results_format", ["json", "binary"])
+    def test_pexec_summaries0001(self, mock_platform, results_format,
+                                 no_results_instantiation_check):
+        """Check process execution summaries are recorded, journaled and read
+        back without loading the measurements"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FORMAT = results_format
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        for wcts, inner_repeats in (([4.0, 2.0], 1), ([], 1), ([8.0, 6.0], 2)):
+            results0.append_exec_measurements(key, {
+                "wallclock_times": wcts,
+                "core_cycle_counts": [],
+                "aperf_counts": [],
+                "mperf_counts": [],
+                "inner_repeats": inner_repeats,
+            }, "C")
+            results0.eta_estimates[key].append(1.0)
+            if len(results0.pexec_flags[key]) == 2:
+                results0.write_to_file()
+        results0.append_to_journal()
+        assert [results0.get_pexec_summary(key, idx) for idx in xrange(3)] == \
+            [2.0, None, 3.0]
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert [results1.get_pexec_summary(key, idx) for idx in xrange(3)] == \
+            [2.0, None, 3.0]
+        assert len(results1._lazy_pexecs) == 3
+
+        # Older results don't record the summaries.
+        results1.pexec_summaries = dict()
+        assert results1.get_pexec_summary(key, 2) == 3.0
+
+        os.unlink(journal_filename(config.results_filename()))
+        os.unlink(config.results_filename())
+
+    def test_pexec_phases0002(self, fake_results):
+        """Phases must belong to a process execution"""
+
+        fake_results.pexec_phases = {"bench:vm:variant": {"2": {"reboot": 1}}}
+        with pytest.raises(FatalKrunError):
+            fake_results.integrity_check()
+
+    def test_write_atomic0001(self, mock_platform, caplog,
+                              no_results_instantiation_check):
+        """Check the previous generation of a results file is kept, and read
+        (along with the journal folded into the next generation) if the
+        results file is corrupt"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.KEEP_RESULTS_BACKUP = True
+        key = "dummy:CPython:default-python"
+        results_file = config.results_filename()
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+        assert not os.path.exists(backup_filename(results_file))
+
+        results0.append_exec_measurements(key, {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }, "C")
+        results0.eta_estimates[key].append(1.0)
+        results0.write_to_file()
+        assert not os.path.exists(results_file + ".tmp")
+        backup_journal_file = backup_filename(journal_filename(results_file))
+        assert os.path.exists(backup_journal_file)
+        assert not os.path.exists(journal_filename(results_file))
+
+        # As if the file system had been damaged.
+        with open(results_file, "rb") as f:
+            data = f.read()
+        with open(results_file, "wb") as f:
+            f.write(data[:len(data) / 2])
+
+        results1 = Results(config, mock_platform, results_file=results_file)
+        assert results1.pexec_flags[key] == ["C"]
+        assert results1.wallclock_times[key] == [[1.0]]
+        assert "Falling back to the previous generation" in caplog.text
+
+        os.unlink(backup_filename(results_file))
+        os.unlink(backup_journal_file)
+        with pytest.raises(FatalKrunError):
+            Results(config, mock_platform, results_file=results_file)
+        os.unlink(results_file)
+
+    def test_write_atomic0003(self, mock_platform, caplog,
+                              no_results_instantiation_check):
+        """Check process executions journaled since the last write are kept
+        when falling back to the previous generation"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.KEEP_RESULTS_BACKUP = True
+        key = "dummy:CPython:default-python"
+        results_file = config.results_filename()
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+        for i in xrange(3):
+            results0.append_exec_measurements(key, {
+                "wallclock_times": [float(i)],
+                "core_cycle_counts": [],
+                "aperf_counts": [],
+                "mperf_counts": [],
+            }, "C")
+            results0.eta_estimates[key].append(float(i))
+            results0.append_to_journal()
+            if i == 1:
+                results0.write_to_file()
+
+        with open(results_file, "wb") as f:
+            f.write("garbage")
+        results1 = Results(config, mock_platform, results_file=results_file)
+        assert results1.pexec_flags[key] == ["C", "C", "C"]
+        assert results1.wallclock_times[key] == [[0.0], [1.0], [2.0]]
+
+        for filename in (results_file, backup_filename(results_file),
+                         journal_filename(results_file),
+                         backup_filename(journal_filename(results_file))):
+            os.unlink(filename)
+
+    def test_write_atomic0002(self, mock_platform,
+                              no_results_instantiation_check):
+        """Check a truncated binary results file is detected when opened"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FORMAT = "binary"
+        key = "dummy:CPython:default-python"
+        results_file = config.results_filename()
+        results0 = Results(config, mock_platform)
+        results0.append_exec_measurements(key, {
+            "wallclock_times": [1.0, 2.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }, "C")
+        results0.eta_estimates[key].append(1.0)
+        results0.write_to_file()
+
+        with open(results_file, "rb") as f:
+            data = f.read()
+        with open(results_file, "wb") as f:
+            f.write(data[:-8])
+        with pytest.raises(FatalKrunError):
+            Results(config, mock_platform, results_file=results_file)
+        os.unlink(results_file)
+
+    def test_lazy_measurements0001(self, mock_platform,
+                                   no_results_instantiation_check):
+        """Check measurements in the journal are only loaded on access"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+        for i in xrange(2):
+            measurements = {
+                "wallclock_times": [float(i)],
+                "core_cycle_counts": [],
+                "aperf_counts": [],
+                "mperf_counts": [],
+            }
+            results0.append_exec_measurements(key, measurements, "C")
+            results0.eta_estimates[key].append(float(i))
+        results0.append_to_journal()
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results1.eta_estimates[key] == [0.0, 1.0]
+        assert results1.pexec_flags[key] == ["C", "C"]
+        assert len(results1._lazy_pexecs) == 2
+
+        # Appending a new process execution doesn't force a load either.
+        measurements = {
+            "wallclock_times": [2.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        results1.append_exec_measurements(key, measurements, "E")
+        results1.eta_estimates[key].append(2.0)
+        results1.append_to_journal()
+        assert len(results1._lazy_pexecs) == 3
+
+        assert results1.wallclock_times[key] == [[0.0], [1.0], [2.0]]
+        assert results1._lazy_pexecs == []
+
+        results2 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results1 == results2
+
+        os.unlink(journal_filename(config.results_filename()))
+        os.unlink(config.results_filename())
+
+    def test_lazy_measurements0002(self, mock_platform, monkeypatch,
+                                   no_results_instantiation_check):
+        """Check measurements in a JSON results file are only decoded on
+        access, one key at a time"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        results0 = Results(config, mock_platform)
+        keys = sorted(results0.pexec_flags.keys())
+        for key_idx, key in enumerate(keys):
+            for pexec_idx in xrange(2):
+                val = key_idx * 10 + pexec_idx
+                measurements = {
+                    "wallclock_times": [val + .5, val + .25],
+                    "core_cycle_counts": [],
+                    "aperf_counts": [],
+                    "mperf_counts": [],
+                }
+                results0.append_exec_measurements(key, measurements, "C")
+                results0.eta_estimates[key].append(float(val))
+        results0.write_to_file()
+
+        decoded = []
+
+        def counting_typed_pexec_measurements(section, measurements):
+            decoded.append(section)
+            return typed_pexec_measurements(section, measurements)
+        monkeypatch.setattr("krun.results.typed_pexec_measurements",
+                            counting_typed_pexec_measurements)
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results1.eta_estimates == results0.eta_estimates
+        assert results1.pexec_flags == results0.pexec_flags
+        assert decoded == []
+
+        measurements = results1.get_measurements(keys[1])
+        assert measurements["wallclock_times"] == [[10.5, 10.25],
+                                                   [11.5, 11.25]]
+        assert len(decoded) == 2 * len(MEASUREMENT_SECTIONS)
+
+        assert results1 == results0
+        os.unlink(config.results_filename())
+
+    def test_lazy_measurements0003(self, mock_platform,
+                                   no_results_instantiation_check):
+        """Check older JSON results files, with the measurements first, can
+        still be read"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        measurements = {
+            "wallclock_times": [1.0, 2.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(1.0)
+        results0.write_to_file()
+
+        path = config.results_filename()
+        with detect_codec(path).open(path, "r") as f:
+            sections = json.loads(f.read())
+        del sections["measurements_last"]
+        with detect_codec(path).open(path, "w") as f:
+            f.write(json.dumps(sections, indent=1, sort_keys=True))
+
+        results1 = Results(config, mock_platform, results_file=path)
+        assert len(results1._lazy_pexecs) == 1
+        assert results1.wallclock_times[key] == [[1.0, 2.0]]
+        assert results1 == results0
+        os.unlink(path)
+
+    def test_typed_measurements0001(self, mock_platform,
+                                    no_results_instantiation_check):
+        """Check measurements are stored in typed arrays, and survive a round
+        trip through the journal and the results file"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        mock_platform.num_per_core_measurements = 2
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+        measurements = {
+            "wallclock_times": [1.5, 2.5],
+            "core_cycle_counts": [[2 ** 63, 1], [2, 3]],
+            "aperf_counts": [[4.0, 5.0], [6.0, 7.0]],  # e.g. from Lua.
+            "mperf_counts": [[8, 9], [10, 11]],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(1.0)
+
+        wct = results0.wallclock_times[key][0]
+        assert type(wct) is TypedArray and wct.typecode == "d"
+        cycles = results0.core_cycle_counts[key][0]
+        assert [c.typecode for c in cycles] == ["L", "L"]
+        aperf = results0.aperf_counts[key][0]
+        assert [c.typecode for c in aperf] == ["d", "d"]
+
+        # Typed arrays compare equal to lists, so the shape is unchanged.
+        assert results0.wallclock_times == {key: [[1.5, 2.5]]}
+        assert results0.core_cycle_counts[key][0][0][0] == 2 ** 63
+
+        results0.append_to_journal()
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results0 == results1
+        assert results1.aperf_counts[key][0][1].typecode == "d"
+
+        results1.write_to_file()
+        results2 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results0 == results2
+        assert results2.mperf_counts[key][0][1].typecode == "L"
+        os.unlink(config.results_filename())
+
+    def test_binary_results0001(self, mock_platform,
+                                no_results_instantiation_check):
+        """Check the binary container round trips with the JSON format"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        mock_platform.num_per_core_measurements = 1
+        key = "dummy:Java:default-java"
+        results0 = Results(config, mock_platform)
+        measurements = {
+            "wallclock_times": [1.000726, 0.1],
+            "core_cycle_counts": [[2 ** 64 - 1, 0]],
+            "aperf_counts": [[3.0, 4.0]],
+            "mperf_counts": [[5, 6]],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(1.1)
+        results0.error_flag = True
+        json_path = config.results_filename()
+        results0.write_to_file()
+
+        bin_path = os.path.join(TEST_DIR, "example_results.bin")
+        results1 = Results(None, None, results_file=json_path)
+        results1.filename = bin_path
+        results1.write_to_file()
+        assert is_binary_results_file(bin_path)
+        assert not is_binary_results_file(json_path)
+
+        results2 = Results(config, None, results_file=bin_path)
+        assert results2.eta_estimates == results0.eta_estimates
+        assert results2.dump("config") == results0.dump("config")
+        assert results2 == results0
+        assert results2.aperf_counts[key][0][0].typecode == "d"
+
+        # And back again.
+        os.unlink(json_path)
+        results2.filename = json_path
+        results2.write_to_file()
+        results3 = Results(config, None, results_file=json_path)
+        assert results3 == results0
+
+        os.unlink(bin_path)
+        os.unlink(json_path)
+
+    def test_binary_results0002(self, mock_platform,
+                                no_results_instantiation_check):
+        """Check one key can be fetched from a binary container alone"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        config.RESULTS_FORMAT = "binary"
+        assert config.results_filename().endswith("example_results.bin")
+        mock_platform.num_per_core_measurements = 2
+
+        results0 = Results(config, mock_platform)
+        keys = sorted(results0.pexec_flags.keys())
+        for key_idx, key in enumerate(keys):
+            for pexec_idx in xrange(2):
+                val = key_idx * 10 + pexec_idx
+                measurements = {
+                    "wallclock_times": [val + .5, val + .25],
+                    "core_cycle_counts": [[val, val], [val, val]],
+                    "aperf_counts": [[val, val], [val, val]],
+                    "mperf_counts": [[val, val], [val, val]],
+                }
+                results0.append_exec_measurements(key, measurements, "C")
+                results0.eta_estimates[key].append(float(val))
+        results0.write_to_file()
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        assert results1.pexec_flags == results0.pexec_flags
+        num_lazy = len(results1._lazy_pexecs)
+        assert num_lazy == 2 * len(keys)
+
+        measurements = results1.get_measurements(keys[1])
+        assert measurements["wallclock_times"] == [[10.5, 10.25],
+                                                   [11.5, 11.25]]
+        assert measurements["aperf_counts"][1] == [[11, 11], [11, 11]]
+        assert len(results1._lazy_pexecs) == num_lazy - 2
+
+        assert results1 == results0
+        os.unlink(config.results_filename())
+
+    @pytest.mark.parametrize("spec", ["gzip:1", "none"])
+    def test_compression0001(self, mock_platform, spec,
+                             no_results_instantiation_check):
+        """Check results (and the journal) can use other codecs"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.COMPRESSION_CODEC = spec
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        results0.write_to_file()
+        measurements = {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(1.0)
+        results0.append_to_journal()
+
+        path = config.results_filename()
+        assert path.endswith("one_exec_results.json" +
+                             config.codec().extension)
+        results1 = Results(None, None, results_file=path)
+        assert results1.wallclock_times == results0.wallclock_times
+
+        results1.write_to_file()
+        assert detect_codec(path).name == config.codec().name
+        results2 = Results(config, mock_platform, results_file=path)
+        assert results2 == results0
+        os.unlink(path)
+
+    def test_integrity_check_incremental0001(self, mock_platform, caplog,
+                                             no_results_instantiation_check):
+        """Check only unchecked process executions are checked, unless a
+        full check is requested"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        mock_platform.num_per_core_measurements = 1
+        key = "dummy:CPython:default-python"
+        results0 = Results(config, mock_platform)
+        measurements = {
+            "wallclock_times": [1.0, 2.0],
+            "core_cycle_counts": [[1, 2]],
+            "aperf_counts": [[1, 2]],
+            "mperf_counts": [[1, 2]],
+        }
+        results0.append_exec_measurements(key, measurements, "C")
+        results0.eta_estimates[key].append(1.0)
+        results0.write_to_file()
+
+        results1 = Results(config, mock_platform,
+                           results_file=config.results_filename())
+        # Corrupt the (already checked) first process execution.
+        results1.aperf_counts[key][0][0].pop()
+        results1.integrity_check()
+
+        # But a new process execution is checked.
+        bad = dict(measurements, mperf_counts=[[1]])
+        results1.append_exec_measurements(key, bad, "C")
+        results1.eta_estimates[key].append(1.0)
+        with pytest.raises(FatalKrunError):
+            results1.integrity_check()
+        expect = "inconsistent #iters in mperf_counts: %s[1][0]. 1 vs 2" % key
+        assert expect in caplog.text
+
+        # A full check finds the corruption in the first.
+        results1.mperf_counts[key].pop()
+        results1.wallclock_times[key].pop()
+        results1.core_cycle_counts[key].pop()
+        results1.aperf_counts[key].pop()
+        results1.pexec_flags[key].pop()
+        results1.eta_estimates[key].pop()
+        del results1.pexec_summaries[key]["1"]
+        results1.integrity_check()
+        with pytest.raises(FatalKrunError):
+            results1.integrity_check(full=True)
+        expect = "inconsistent #iters in aperf_counts: %s[0][0]. 1 vs 2" % key
+        assert expect in caplog.text
+
+        os.unlink(config.results_filename())
+
+    def test_integrity_check_full0001(self, caplog,
+                                      no_results_instantiation_check):
+        """Without a platform, a full check insists that all process
+        executions have the same number of cores"""
+
+        results = Results(None, None)
+        results.pexec_flags = {"b:v:x": ["C", "C"]}
+        results.eta_estimates = {"b:v:x": [1.0, 1.0]}
+        results.wallclock_times = {"b:v:x": [[1.0], [1.0]]}
+        results.core_cycle_counts = {"b:v:x": [[[1]], [[1], [1]]]}
+        results.aperf_counts = {"b:v:x": [[[1]], [[1], [1]]]}
+        results.mperf_counts = {"b:v:x": [[[1]], [[1], [1]]]}
+        results.integrity_check()
+        with pytest.raises(FatalKrunError):
+            results.integrity_check(full=True)
+        expect = "wrong #cores in core_cycle_counts: b:v:x[1]: 1 vs 2"
+        assert expect in caplog.text
+
+        results.core_cycle_counts = {"b:v:x": [[[1]], [[1]]]}
+        results.aperf_counts = {"b:v:x": [[[1]], [[1]]]}
+        results.mperf_counts = {"b:v:x": [[[1]], [[1]]]}
+        results.pexec_flags = {"b:v:x": ["C", "X"]}
+        with pytest.raises(FatalKrunError):
+            results.integrity_check(full=True)
+        assert "bad pexec flag: b:v:x[1]: X" in caplog.text
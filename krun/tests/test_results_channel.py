@@ -0,0 +1,263 @@
+from krun.config import Config
+from krun.results_channel import (ResultsChannel, CHANNEL_ENV, CHANNEL_MAGIC,
+                                  HEADER_SIZE, INNER_REPEATS_ENV,
+                                  STATE_ATTACHED, STATE_COMPLETE,
+                                  parse_measurements)
+from krun.tests import BaseKrunTest
+from krun.util import ExecutionFailed, check_and_parse_execution_results
+from krun.vm_defs import PythonVMDef
+from krun import EntryPoint
+
+import json
+import mmap
+import os
+import pytest
+import struct
+
+
+def make_store(wallclock_times, per_core, state=STATE_COMPLETE,
+               inner_repeats=0):
+    """Returns the bytes krun_dump_store() would write on stdout"""
+
+    num_cores = len(per_core[0]) if per_core else 0
+    header = struct.pack("=8sQQQQ", CHANNEL_MAGIC, len(wallclock_times),
+                         num_cores, state, inner_repeats)
+    out = header + "\0" * (HEADER_SIZE - len(header))
+    out += struct.pack("=%dd" % len(wallclock_times), *wallclock_times)
+    for section in per_core:
+        for core in section:
+            out += struct.pack("=%dQ" % len(core), *core)
+    return out
+
+
+def run_fake_runner(channel, wallclock_times, per_core, state=STATE_COMPLETE):
+    """Write to 'channel' as an iterations runner would. 'per_core' is a list
+    of the core cycle, APERF and MPERF counts, each a list per core."""
+
+    with open(channel.filename, "r+b") as f:
+        m = mmap.mmap(f.fileno(), 0)
+        offset = HEADER_SIZE
+        for value in wallclock_times:
+            struct.pack_into("=d", m, offset, value)
+            offset += 8
+        for section in per_core:
+            for core in section:
+                for value in core:
+                    struct.pack_into("=Q", m, offset, value)
+                    offset += 8
+        struct.pack_into("=Q", m, 24, state)
+        m.close()
+
+
+class TestResultsChannel(BaseKrunTest):
+    """Test the shared-memory results channel."""
+
+    def test_read_measurements0001(self):
+        channel = ResultsChannel(2, 2)
+        run_fake_runner(channel, [1.5, 2.5],
+                        [[[1, 2], [3, 4]], [[5, 6], [7, 8]],
+                         [[9, 10], [11, 2 ** 64 - 1]]])
+        channel.collect()
+        channel.unlink()
+        assert not os.path.exists(channel.filename)
+        measurements = channel.read_measurements()
+        assert measurements == {
+            "wallclock_times": [1.5, 2.5],
+            "core_cycle_counts": [[1, 2], [3, 4]],
+            "aperf_counts": [[5, 6], [7, 8]],
+            "mperf_counts": [[9, 10], [11, 2 ** 64 - 1]],
+        }
+
+    def test_read_measurements0002(self):
+        """An untouched channel means the runner printed JSON instead"""
+
+        channel = ResultsChannel(3, 0)
+        channel.collect()
+        assert channel.read_measurements() is None
+        channel.close()
+
+    def test_read_measurements0003(self):
+        channel = ResultsChannel(1, 0)
+        run_fake_runner(channel, [1.0], [], state=STATE_ATTACHED)
+        channel.collect()
+        with pytest.raises(ExecutionFailed) as excinfo:
+            channel.read_measurements()
+        assert "didn't complete" in str(excinfo.value)
+        channel.close()
+
+    def test_read_measurements0004(self):
+        channel = ResultsChannel(1, 0)
+        run_fake_runner(channel, [1.0], [])
+        with open(channel.filename, "r+b") as f:
+            f.write("NOTMAGIC")
+        channel.collect()
+        with pytest.raises(ExecutionFailed) as excinfo:
+            channel.read_measurements()
+        assert "clobbered" in str(excinfo.value)
+        channel.close()
+
+    def test_close0001(self):
+        channel = ResultsChannel(1, 0)
+        run_fake_runner(channel, [1.0], [])
+        channel.collect()
+        assert channel.map is not None
+        channel.close()
+        assert channel.map is None
+        assert not os.path.exists(channel.filename)
+        channel.close()  # already closed
+
+    def test_close0002(self):
+        """A channel which is never collected is still removed"""
+
+        channel = ResultsChannel(1, 0)
+        channel.close()
+        assert not os.path.exists(channel.filename)
+
+    def test_parse_measurements0001(self):
+        buf = make_store([1.5, 2.5], [[[1, 2]], [[3, 4]], [[5, 2 ** 64 - 1]]])
+        assert parse_measurements(buf) == {
+            "wallclock_times": [1.5, 2.5],
+            "core_cycle_counts": [[1, 2]],
+            "aperf_counts": [[3, 4]],
+            "mperf_counts": [[5, 2 ** 64 - 1]],
+        }
+        with pytest.raises(ExecutionFailed) as excinfo:
+            parse_measurements(buf, num_iters=3)
+        assert "clobbered" in str(excinfo.value)
+        with pytest.raises(ExecutionFailed) as excinfo:
+            parse_measurements(buf[:-8])
+        assert "wrong size" in str(excinfo.value)
+
+    def test_parse_measurements0002(self):
+        """The runner's inner repeats are passed on, if it recorded them"""
+
+        buf = make_store([1.5], [[[1]], [[2]], [[3]]], inner_repeats=64)
+        assert parse_measurements(buf)["inner_repeats"] == 64
+        buf = make_store([1.5], [[[1]], [[2]], [[3]]], inner_repeats=1)
+        assert parse_measurements(buf)["inner_repeats"] == 1
+
+    def test_check_and_parse_execution_results0001(self):
+        """The channel is preferred, and JSON is the fallback"""
+
+        config = Config()
+        channel = ResultsChannel(1, 1)
+        run_fake_runner(channel, [3.0], [[[1]], [[2]], [[3]]])
+        channel.collect()
+        js = check_and_parse_execution_results("", "", 0, config, "a:b:c",
+                                               channel=channel)
+        assert js["wallclock_times"] == [3.0]
+        assert js["mperf_counts"] == [[3]]
+        channel.close()
+
+        stdout = json.dumps({
+            "wallclock_times": [4.0],
+            "core_cycle_counts": [[1]],
+            "aperf_counts": [[2]],
+            "mperf_counts": [[3]],
+        })
+        channel = ResultsChannel(1, 1)
+        channel.collect()
+        js = check_and_parse_execution_results(stdout, "", 0, config, "a:b:c",
+                                               channel=channel)
+        assert js == json.loads(stdout)
+        channel.close()
+
+    def test_check_and_parse_execution_results0002(self):
+        """Without a channel, a runner may krun_dump_store() the store on
+        stdout"""
+
+        config = Config()
+        stdout = make_store([5.0], [[[1]], [[2]], [[3]]])
+        js = check_and_parse_execution_results(stdout, "", 0, config, "a:b:c")
+        assert js["wallclock_times"] == [5.0]
+        assert js["core_cycle_counts"] == [[1]]
+
+        stdout = make_store([5.0], [], state=STATE_ATTACHED)
+        with pytest.raises(ExecutionFailed) as excinfo:
+            check_and_parse_execution_results(stdout, "", 0, config, "a:b:c")
+        assert "didn't complete" in str(excinfo.value)
+
+    def test_check_and_parse_execution_results0003(self):
+        config = Config()
+        stdout = make_store([5.0], [[[1]], [[2]], [[3]]], inner_repeats=8)
+        js = check_and_parse_execution_results(stdout, "", 0, config, "a:b:c")
+        assert js["inner_repeats"] == 8
+
+        stdout = json.dumps({
+            "wallclock_times": [4.0],
+            "core_cycle_counts": [[1]],
+            "aperf_counts": [[2]],
+            "mperf_counts": [[3]],
+            "inner_repeats": 0,
+        })
+        with pytest.raises(ExecutionFailed) as excinfo:
+            check_and_parse_execution_results(stdout, "", 0, config, "a:b:c")
+        assert "bad inner repeats" in str(excinfo.value)
+
+    def test_run_exec0001(self, mock_platform, monkeypatch):
+        vm_def = PythonVMDef("/dummy/bin/python")
+        vm_def.set_platform(mock_platform)
+        envs = []
+
+        def fake_bench_cmdline_adjust(args, env_dct):
+            envs.append(env_dct.copy())
+            return args
+        monkeypatch.setattr(mock_platform, "bench_cmdline_adjust",
+                            fake_bench_cmdline_adjust)
+
+        def fake_run_exec_popen(args, stderr_file=None):
+            return "", "", 0, False
+        monkeypatch.setattr(vm_def, "_run_exec_popen", fake_run_exec_popen)
+
+        vm_def.run_exec(EntryPoint("test"), 1, 1, 1, 1, "test:vm:default", 0)
+        channel = vm_def.results_channel
+        assert envs[0][CHANNEL_ENV] == channel.filename
+        assert not os.path.exists(channel.filename)
+        assert channel.read_measurements() is None
+        vm_def.close_results_channel()
+        assert vm_def.results_channel is None
+
+        mock_platform.config.RESULTS_CHANNEL = "json"
+        vm_def.run_exec(EntryPoint("test"), 1, 1, 1, 1, "test:vm:default", 0)
+        assert vm_def.results_channel is None
+        assert CHANNEL_ENV not in envs[1]
+
+    def test_run_exec0002(self, mock_platform, monkeypatch):
+        """The runner is told the inner repeats of the benchmark"""
+
+        vm_def = PythonVMDef("/dummy/bin/python")
+        vm_def.set_platform(mock_platform)
+        envs = []
+
+        def fake_bench_cmdline_adjust(args, env_dct):
+            envs.append(env_dct.copy())
+            return args
+        monkeypatch.setattr(mock_platform, "bench_cmdline_adjust",
+                            fake_bench_cmdline_adjust)
+
+        def fake_run_exec_popen(args, stderr_file=None):
+            return "", "", 0, False
+        monkeypatch.setattr(vm_def, "_run_exec_popen", fake_run_exec_popen)
+
+        for inner_repeats in (1, 16, "auto"):
+            vm_def.inner_repeats = inner_repeats
+            vm_def.run_exec(EntryPoint("test"), 1, 1, 1, 1, "test:vm:default",
+                            0)
+        assert INNER_REPEATS_ENV not in envs[0]
+        assert envs[1][INNER_REPEATS_ENV] == "16"
+        assert envs[2][INNER_REPEATS_ENV] == "auto:0.001"
+
+    def test_run_exec0003(self, mock_platform, monkeypatch):
+        """The channel file is removed even if the execution fails"""
+
+        vm_def = PythonVMDef("/dummy/bin/python")
+        vm_def.set_platform(mock_platform)
+
+        def fake_run_exec_popen(args, stderr_file=None):
+            raise OSError("no such VM")
+        monkeypatch.setattr(vm_def, "_run_exec_popen", fake_run_exec_popen)
+
+        with pytest.raises(OSError):
+            vm_def.run_exec(EntryPoint("test"), 1, 1, 1, 1, "test:vm:default",
+                            0)
+        assert not os.path.exists(vm_def.results_channel.filename)
@@ -0,0 +1,131 @@
+from krun.config import Config
+from krun.results import Results
+from krun.scheduler import ManifestManager
+from krun.schedule_policy import (get_schedule_policy, BlockedPolicy,
+                                  RandomPolicy, RoundRobinPolicy,
+                                  ShortestKnownFirstPolicy)
+from krun.tests import TEST_DIR
+from krun.tests.mocks import mock_platform
+
+import os
+import pytest
+
+KEYS = ["a:vm:x", "b:vm:x", "c:vm:x"]
+
+
+def manifest_keys(manifest):
+    with open(manifest.path) as fh:
+        lines = fh.read().splitlines()
+    return lines[lines.index("keys") + 1:]
+
+
+def test_get_schedule_policy0001():
+    assert isinstance(get_schedule_policy("round-robin"), RoundRobinPolicy)
+    assert isinstance(get_schedule_policy("blocked"), BlockedPolicy)
+    policy = get_schedule_policy("random:42")
+    assert isinstance(policy, RandomPolicy)
+    assert policy.seed == 42
+    assert str(policy) == "random:42"
+    assert get_schedule_policy("random").seed == 0
+    policy = get_schedule_policy("shortest-known-first:x:y.json.bz2")
+    assert isinstance(policy, ShortestKnownFirstPolicy)
+    assert policy.arg == "x:y.json.bz2"
+
+
+def test_get_schedule_policy0002():
+    for spec in ("fastest", "random:x", "blocked:1", "round-robin:1"):
+        with pytest.raises(ValueError):
+            get_schedule_policy(spec)
+
+
+def test_round_robin0001():
+    assert RoundRobinPolicy().order(KEYS, 2) == KEYS + KEYS
+
+
+def test_blocked0001():
+    assert BlockedPolicy().order(KEYS, 2) == \
+        ["a:vm:x", "a:vm:x", "b:vm:x", "b:vm:x", "c:vm:x", "c:vm:x"]
+
+
+def test_random0001():
+    schedule = RandomPolicy("3").order(KEYS, 50)
+    assert schedule == RandomPolicy("3").order(KEYS, 50)  # Reproducible.
+    assert schedule != RandomPolicy("4").order(KEYS, 50)
+    assert schedule != RoundRobinPolicy().order(KEYS, 50)
+    for i in xrange(50):  # Every round runs every key.
+        assert sorted(schedule[i * 3:(i + 1) * 3]) == KEYS
+
+
+def test_shortest_known_first0001(monkeypatch):
+    policy = ShortestKnownFirstPolicy("old_results.json.bz2")
+    monkeypatch.setattr(policy, "expected_durations",
+                        lambda: {"c:vm:x": 1.0, "b:vm:x": 2.0})
+    assert policy.order(KEYS, 2) == ["c:vm:x", "b:vm:x", "a:vm:x"] * 2
+    assert ShortestKnownFirstPolicy().order(KEYS, 1) == KEYS
+
+
+def test_shortest_known_first0002(mock_platform, monkeypatch):
+    """Check expected durations are read from a results file"""
+
+    monkeypatch.setattr(Results, 'instantiation_check', lambda self: None)
+    config = Config(os.path.join(TEST_DIR, "example.krun"))
+    results = Results(config, mock_platform)
+    for key, etas in (("nbody:Java:default-java", [3.0, 5.0]),
+                      ("dummy:CPython:default-python", [1.0])):
+        for eta in etas:
+            results.append_exec_measurements(key, {
+                "wallclock_times": [eta],
+                "core_cycle_counts": [],
+                "aperf_counts": [],
+                "mperf_counts": [],
+            }, "C")
+            results.eta_estimates[key].append(eta)
+    results.write_to_file()
+
+    policy = ShortestKnownFirstPolicy(config.results_filename())
+    assert policy.expected_durations() == {
+        "nbody:Java:default-java": 4.0,
+        "dummy:CPython:default-python": 1.0,
+    }
+    os.unlink(config.results_filename())
+
+
+@pytest.mark.parametrize("spec, eta_avail_idx", [("round-robin", 4),
+                                                 ("random:1", 4),
+                                                 ("blocked", 7)])
+def test_write_new_manifest0001(mock_platform, spec, eta_avail_idx):
+    """Check the policy is used when writing a new manifest"""
+
+    config = Config(os.path.join(TEST_DIR, "example.krun"))
+    manifest = ManifestManager(config, mock_platform, new_file=True)
+    config_order_keys = [record[2:] for record in manifest_keys(manifest)[:4]]
+
+    config.SCHEDULE_POLICY = spec
+    manifest = ManifestManager(config, mock_platform, new_file=True)
+    expect = get_schedule_policy(spec).order(config_order_keys, 2)
+    assert manifest_keys(manifest) == ["O " + key for key in expect]
+    assert manifest.eta_avail_idx == eta_avail_idx
+    os.unlink(manifest.path)
+
+
+def test_write_new_manifest0002(mock_platform):
+    """Check when the ETA becomes known with blocked scheduling and skips"""
+
+    config = Config(os.path.join(TEST_DIR, "example.krun"))
+    config.SCHEDULE_POLICY = "blocked"
+    config.N_EXECUTIONS = 3
+    records = []
+    for key in ("dummy:Java:default-java", "nbody:Java:default-java",
+                "dummy:CPython:default-python",
+                "nbody:CPython:default-python"):
+        config.SKIP = [key]
+        manifest = ManifestManager(config, mock_platform, new_file=True)
+        records = manifest_keys(manifest)
+        skips = [idx for idx, record in enumerate(records)
+                 if record.startswith("S ")]
+        assert len(skips) == 3
+        # Once the last key to be run starts its second pexec.
+        last_key_start = max(idx for idx in xrange(0, 12, 3)
+                             if idx not in skips)
+        assert manifest.eta_avail_idx == last_key_start + 1
+        os.unlink(manifest.path)
@@ -3,7 +3,9 @@ from krun.config import Config
 from krun.scheduler import (mean, ExecutionJob, ExecutionScheduler,
                             ManifestManager)
 from krun.tests import BaseKrunTest
-from krun.results import Results
+from krun.results import Results, TypedArray, journal_filename
+import krun.eta
+import krun.readiness
 import krun.util
 
 import os
@@ -12,6 +14,7 @@ import krun.util as util
 import re
 from krun.tests import TEST_DIR
 from krun.tests.test_results import no_results_instantiation_check
+from krun.tests.test_calibrate import FakeScheduler
 
 
 class _TestReboot(Exception):
@@ -21,7 +24,8 @@ def type_check_results(results):
     for k, execs in results.wallclock_times.iteritems():
         assert type(execs) is list
         for one_exec in execs:
-            assert type(one_exec) is list
+            assert type(one_exec) is TypedArray
+            assert one_exec.typecode == "d"
             assert all([type(x) is float for x in one_exec])
 
     for k, execs in results.eta_estimates.iteritems():
@@ -117,6 +121,9 @@ class TestScheduler(BaseKrunTest):
                           results_file=config.results_filename())
         type_check_results(results)
 
+        # The journal is folded into the results file at the end.
+        assert not os.path.exists(journal_filename(config.results_filename()))
+
         assert len(results.wallclock_times) == 1  # 1 benchmark, 1 vm
         for key, execs in results.wallclock_times.iteritems():
             assert len(execs) == 1
@@ -126,6 +133,52 @@ class TestScheduler(BaseKrunTest):
         os.unlink(config.results_filename())
         os.unlink(sched.manifest.path)
 
+    def test_run_schedule_startup_wait0001(self, monkeypatch, mock_platform,
+                                           no_results_instantiation_check):
+        """In reboot mode, the time spent waiting for the system to come up
+        is recorded as a phase of the run, separately from the execution"""
+
+        monkeypatch.setattr(krun.readiness, "wait_until_ready",
+                            lambda platform, config: 42.0)
+        mock_platform.hardware_reboots = True
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        n_reboots, sched = run_with_captured_reboots(config, mock_platform,
+                                                     monkeypatch)
+        assert n_reboots == 1
+
+        results = Results(config, mock_platform,
+                          results_file=config.results_filename())
+        for key, etas in results.eta_estimates.iteritems():
+            assert len(etas) == 1
+            assert etas[0] < 1.0  # Dry run executions are quick.
+            phases = results.get_pexec_phases(key, 0)
+            assert phases["startup_wait"] == 42.0
+            assert set(phases) == set(krun.eta.PHASES)
+
+        os.unlink(config.results_filename())
+        os.unlink(sched.manifest.path)
+
+    def test_run_schedule_binary0001(self, monkeypatch, mock_platform,
+                                     no_results_instantiation_check):
+        """Run a session storing results in the binary container"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        config.RESULTS_FORMAT = "binary"
+        n_reboots, sched = run_with_captured_reboots(config, mock_platform,
+                                                     monkeypatch)
+        assert sched.manifest.num_execs_left == 0
+        assert config.results_filename().endswith(".bin")
+
+        results = Results(config, mock_platform,
+                          results_file=config.results_filename())
+        type_check_results(results)
+        for key, flags in results.pexec_flags.iteritems():
+            assert len(flags) == 2
+            assert len(results.wallclock_times[key]) == 2
+
+        os.unlink(config.results_filename())
+        os.unlink(sched.manifest.path)
+
     def test_run_schedule0002(self, mock_platform, monkeypatch,
                               no_results_instantiation_check):
         config = Config(os.path.join(TEST_DIR, "example.krun"))
@@ -205,6 +258,86 @@ class TestScheduler(BaseKrunTest):
         os.unlink(config.results_filename())
         os.unlink(sched.manifest.path)
 
+    def test_run_schedule_adaptive0001(self, mock_platform, monkeypatch,
+                                       no_results_instantiation_check):
+        """Check keys stop early once their results are precise enough"""
+
+        def dummy_execjob_run(self, mailer, dryrun=False):
+            measurements = self.make_empty_measurement()
+            if self.benchmark == "nbody":
+                wcts = [1.0, 1.0]  # Perfectly consistent.
+            else:
+                wcts = [1.0, 1.0 + self.key_pexec_idx]
+            measurements["wallclock_times"] = wcts
+            for section in ("core_cycle_counts", "aperf_counts",
+                            "mperf_counts"):
+                measurements[section] = [[1, 1] for _ in
+                                         measurements[section]]
+            return measurements, {}, "C"
+        monkeypatch.setattr(ExecutionJob, 'run', dummy_execjob_run)
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        config.N_EXECUTIONS = 4
+        config.ADAPTIVE_CI_WIDTH = 0.01
+        config.ADAPTIVE_MIN_EXECUTIONS = 2
+        n_reboots, sched = run_with_captured_reboots(config, mock_platform,
+                                                     monkeypatch)
+        assert n_reboots == 12  # nbody stopped after 2 of 4 execs.
+        assert sched.manifest.total_num_execs == 12
+
+        results = Results(config, mock_platform,
+                          results_file=config.results_filename())
+        for key, flags in results.pexec_flags.iteritems():
+            if key.startswith("nbody:"):
+                assert flags == ["C", "C"]
+            else:
+                assert flags == ["C"] * 4
+
+        os.unlink(config.results_filename())
+        os.unlink(sched.manifest.path)
+
+    def test_run_schedule_throughput0001(self, mock_platform, monkeypatch,
+                                         no_results_instantiation_check):
+        """Check executions are run in batches in throughput mode"""
+
+        batches = []
+
+        def dummy_execjob_run(self, mailer, dryrun=False):
+            batches[-1].append((self.key, self.cpus))
+            return self.empty_measurements, {}, "C"
+        monkeypatch.setattr(ExecutionJob, 'run', dummy_execjob_run)
+        real_run_jobs = ExecutionScheduler._run_jobs
+
+        def run_jobs(self, jobs):
+            batches.append([])
+            return real_run_jobs(self, jobs)
+        monkeypatch.setattr(ExecutionScheduler, '_run_jobs', run_jobs)
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        config.THROUGHPUT_PEXECS = 3
+        n_reboots, sched = run_with_captured_reboots(config, mock_platform,
+                                                     monkeypatch)
+        assert n_reboots == 3  # 8 executions in batches of 3, 3 and 2.
+        assert [len(batch) for batch in batches] == [3, 3, 2]
+        for batch in batches:
+            assert sorted(cpus for _, cpus in batch) == \
+                [[cpu] for cpu in xrange(1, len(batch) + 1)]
+        assert sched.manifest.num_execs_left == 0
+
+        results = Results(config, mock_platform,
+                          results_file=config.results_filename())
+        # Each execution is annotated with the CPUs it ran on.
+        pexec_idxs = dict()
+        for batch in batches:
+            for key, cpus in sorted(batch):
+                idx = pexec_idxs.get(key, 0)
+                assert results.get_pexec_cores(key, idx) == cpus
+                pexec_idxs[key] = idx + 1
+        assert sum(pexec_idxs.values()) == 8
+
+        os.unlink(config.results_filename())
+        os.unlink(sched.manifest.path)
+
     def test_num_emails_sent_persists0001(self, monkeypatch, mock_platform,
                                           no_results_instantiation_check):
         make_reboot_raise(monkeypatch)
@@ -275,6 +408,7 @@ class TestScheduler(BaseKrunTest):
 
         os.unlink(sched.manifest.path)
         os.unlink(results_path)
+        os.unlink(journal_filename(results_path))
 
     def test_error_flag_persists0002(self, monkeypatch, mock_platform,
                                      no_results_instantiation_check):
@@ -314,6 +448,7 @@ class TestScheduler(BaseKrunTest):
 
         os.unlink(sched.manifest.path)
         os.unlink(results_path)
+        os.unlink(journal_filename(results_path))
 
     def test_pre_and_post_exec_cmds0001(self, monkeypatch, mock_platform,
                                         no_results_instantiation_check):
@@ -388,6 +523,34 @@ class TestScheduler(BaseKrunTest):
         os.unlink(tmp_file)
         assert got == "pre\npost\n"
 
+    @pytest.mark.parametrize("interval, expect", [(0, "folded"),
+                                                  (3600, "journal"),
+                                                  (None, "journal")])
+    def test_pre_and_post_cmds0004(self, monkeypatch, mock_platform,
+                                   no_results_instantiation_check,
+                                   interval, expect):
+        """Check the journal is folded before the post commands only when
+        RESULTS_FOLD_INTERVAL asks for it"""
+
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        config.RESULTS_FOLD_INTERVAL = interval
+        tmp_file = os.path.join(TEST_DIR, "prepost.txt")
+        config.POST_EXECUTION_CMDS = [
+            "if [ -e $KRUN_RESULTS_JOURNAL_FILE ]; then echo journal > %s; "
+            "else echo folded > %s; fi" % (tmp_file, tmp_file)]
+
+        n_reboots, sched = run_with_captured_reboots(config, mock_platform,
+                                                     monkeypatch)
+        assert n_reboots == 1
+        os.unlink(config.results_filename())
+        os.unlink(sched.manifest.path)
+
+        with open(tmp_file) as fh:
+            got = fh.read()
+
+        os.unlink(tmp_file)
+        assert got == expect + "\n"
+
     def test_boot_loop0001(self, monkeypatch, mock_platform, caplog,
                            no_results_instantiation_check):
         make_reboot_raise(monkeypatch)
@@ -414,6 +577,7 @@ class TestScheduler(BaseKrunTest):
         assert expect in caplog.text
 
         os.unlink(config.results_filename())
+        os.unlink(journal_filename(config.results_filename()))
         os.unlink(sched.manifest.path)
 
     def test_audit_differs0001(self, monkeypatch, mock_platform, caplog,
@@ -443,3 +607,20 @@ class TestScheduler(BaseKrunTest):
 
         os.unlink(sched.manifest.path)
         os.unlink(results_path)
+        os.unlink(journal_filename(results_path))
+
+    def test_check_inner_repeats0001(self, mock_platform):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        sched = FakeScheduler(config, mock_platform, None)
+        job = ExecutionJob(sched, "CPython", config.VMS["CPython"], "dummy",
+                           "default-python", 1000, 0)
+
+        job.check_inner_repeats({})
+        with pytest.raises(krun.util.ExecutionFailed):
+            job.check_inner_repeats({"inner_repeats": 8})
+        config.INNER_REPEATS = {"dummy": 8}
+        job.check_inner_repeats({"inner_repeats": 8})
+        with pytest.raises(krun.util.ExecutionFailed):
+            job.check_inner_repeats({})
+        config.INNER_REPEATS = {"dummy": "auto"}
+        job.check_inner_repeats({"inner_repeats": 512})
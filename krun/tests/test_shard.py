@@ -0,0 +1,170 @@
+from krun.config import Config
+from krun.results import Results
+from krun.scheduler import ExecutionScheduler, ManifestManager
+from krun.shard import (ShardCoordinator, split_schedule, shard_filename,
+                        read_manifest_records)
+from krun.tests import BaseKrunTest, TEST_DIR
+from krun.tests.test_results import no_results_instantiation_check
+from krun.tests.test_scheduler import (make_reboot_raise, no_envlogs,
+                                       _TestReboot)
+from krun.util import FatalKrunError
+import krun.util
+
+import json
+import os
+import pytest
+
+
+def run_shard(coordinator, config, platform, monkeypatch):
+    """Claim and run a shard to completion on this machine, as Krun would
+    with --shard-dir. Returns the index of the shard."""
+
+    no_envlogs(monkeypatch)
+    make_reboot_raise(monkeypatch)
+    krun.util.assign_platform(config, platform)
+
+    shard = coordinator.claim(config)
+    platform.starting_temperatures = platform.take_temperature_readings()
+    manifest = ManifestManager(config, platform, new_file=True,
+                               schedule=coordinator.shard_schedule(shard))
+    manifest.set_starting_temperatures(platform.starting_temperatures)
+    Results(config, platform).write_to_file()
+    while True:
+        sched = ExecutionScheduler(config, platform.mailer, platform,
+                                   dry_run=True)
+        try:
+            sched.run()
+        except _TestReboot:
+            pass
+        else:
+            break
+
+    # Clear up for the next "machine".
+    os.unlink(config.results_filename())
+    os.unlink(manifest.path)
+    os.unlink(shard_filename(config))
+    return shard
+
+
+class TestShard(BaseKrunTest):
+    """Test sharding a campaign across machines."""
+
+    def test_split_schedule0001(self):
+        schedule = ["O a", "S b", "O c", "O a", "S b", "O c", "O d"]
+        assert split_schedule(schedule, 1) == [[0, 7]]
+        assert split_schedule(schedule, 2) == [[0, 3], [3, 7]]
+        assert split_schedule(schedule, 3) == [[0, 2], [2, 5], [5, 7]]
+        with pytest.raises(ValueError):
+            split_schedule(schedule, 6)
+
+    def test_claim0001(self, tmpdir, monkeypatch):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        coordinator = ShardCoordinator(str(tmpdir))
+        schedule = ManifestManager.make_schedule(config)
+        coordinator.create_plan(config, schedule, 2)
+
+        try:
+            assert coordinator.claim(config) == 0
+            with open(shard_filename(config)) as fh:
+                assert json.load(fh) == {"shard_dir": str(tmpdir), "shard": 0}
+            assert coordinator.claim(config) == 1
+            with pytest.raises(FatalKrunError):
+                coordinator.claim(config)
+        finally:
+            os.unlink(shard_filename(config))
+
+        # Together, the shards cover the schedule exactly once.
+        schedules = [coordinator.shard_schedule(shard) for shard in (0, 1)]
+        for idx, record in enumerate(schedule):
+            assert [s[idx] for s in schedules].count(record) == 1
+            assert all(s[idx][2:] == record[2:] for s in schedules)
+        assert [status[2] is not None for status in coordinator.status()] == \
+            [True, True]
+
+    def test_claim0002(self, tmpdir):
+        """A machine must use the same config as the plan"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        coordinator = ShardCoordinator(str(tmpdir))
+        coordinator.create_plan(config, ManifestManager.make_schedule(config),
+                                2)
+        config.text += "# changed\n"
+        with pytest.raises(FatalKrunError):
+            coordinator.claim(config)
+
+    def test_run_and_merge0001(self, tmpdir, mock_platform, monkeypatch,
+                                     no_results_instantiation_check):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        shard_dir = tmpdir.join("shards")
+        coordinator = ShardCoordinator(str(shard_dir))
+        coordinator.create_plan(config, ManifestManager.make_schedule(config),
+                                2)
+
+        for expect_shard in (0, 1):
+            assert run_shard(coordinator, config, mock_platform,
+                             monkeypatch) == expect_shard
+        assert all(status[3] for status in coordinator.status())
+        for shard in (0, 1):
+            records = read_manifest_records(
+                str(shard_dir.join("shard-%d" % shard, "krun.manifest")))
+            assert [flag for flag, _ in records].count("C") == 4
+
+        out_file = str(tmpdir.join("merged_results.json.bz2"))
+        coordinator.merge(out_file)
+        merged = Results(None, None, results_file=out_file)
+        assert merged.config_text == config.text
+        assert len(merged.pexec_flags) == 4
+        for key, flags in merged.pexec_flags.iteritems():
+            assert flags == ["C", "C"]
+            assert len(merged.wallclock_times[key]) == 2
+            assert len(merged.eta_estimates[key]) == 2
+
+    def test_merge_audit0001(self, tmpdir, mock_platform, monkeypatch,
+                                   no_results_instantiation_check):
+        """Shards run on different machines can't be merged"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        coordinator = ShardCoordinator(str(tmpdir.join("shards")))
+        coordinator.create_plan(config, ManifestManager.make_schedule(config),
+                                2)
+        run_shard(coordinator, config, mock_platform, monkeypatch)
+        mock_platform.audit["extra"] = "different machine"
+        run_shard(coordinator, config, mock_platform, monkeypatch)
+
+        with pytest.raises(FatalKrunError):
+            coordinator.merge(str(tmpdir.join("merged_results.json.bz2")))
+
+    def test_merge_audit0002(self, tmpdir, mock_platform, monkeypatch,
+                                   no_results_instantiation_check):
+        """Shards are checked in the same way as resumed sessions: a missing
+        execution mode means isolated, and modes can't be mixed"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        coordinator = ShardCoordinator(str(tmpdir.join("shards")))
+        coordinator.create_plan(config, ManifestManager.make_schedule(config),
+                                2)
+        mock_platform.audit.pop("execution_mode", None)
+        run_shard(coordinator, config, mock_platform, monkeypatch)
+        mock_platform.audit["execution_mode"] = "isolated"
+        run_shard(coordinator, config, mock_platform, monkeypatch)
+        coordinator.merge(str(tmpdir.join("merged_results.json.bz2")))
+
+        results_file = os.path.join(str(tmpdir.join("shards")), "shard-1",
+                                    os.path.basename(
+                                        config.results_filename()))
+        results = Results(None, None, results_file=results_file)
+        results.audit["execution_mode"] = "throughput"
+        results.write_to_file()
+        with pytest.raises(FatalKrunError):
+            coordinator.merge(str(tmpdir.join("merged_results2.json.bz2")))
+
+    def test_merge_incomplete0001(self, tmpdir, mock_platform, monkeypatch,
+                                        no_results_instantiation_check):
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        coordinator = ShardCoordinator(str(tmpdir.join("shards")))
+        coordinator.create_plan(config, ManifestManager.make_schedule(config),
+                                2)
+        run_shard(coordinator, config, mock_platform, monkeypatch)
+
+        with pytest.raises(FatalKrunError):
+            coordinator.merge(str(tmpdir.join("merged_results.json.bz2")))
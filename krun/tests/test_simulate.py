@@ -0,0 +1,119 @@
+from krun.config import Config
+from krun.results import Results
+from krun.scheduler import ManifestManager
+from krun.simulate import (parse_estimate, percentile, session_durations,
+                           simulate_session, SessionSimulator,
+                           UniformDuration)
+from krun.tests import BaseKrunTest, TEST_DIR
+from krun.tests.test_results import no_results_instantiation_check
+from krun.util import FatalKrunError
+
+import os
+import pytest
+import random
+
+
+def fixed(secs):
+    return UniformDuration(secs, secs)
+
+
+class TestSimulate(BaseKrunTest):
+    """Test the session simulator."""
+
+    def test_parse_estimate0001(self):
+        name, duration = parse_estimate("nbody:*:*=30")
+        assert name == "nbody:*:*"
+        assert (duration.low, duration.high) == (30, 30)
+        name, duration = parse_estimate("reboot=60-90.5")
+        assert name == "reboot"
+        assert (duration.low, duration.high) == (60, 90.5)
+        for spec in ("reboot", "=3", "reboot=x", "reboot=9-3"):
+            with pytest.raises(ValueError):
+                parse_estimate(spec)
+
+    def test_percentile0001(self):
+        assert percentile([3, 1, 2, 4], 50) == 2
+        assert percentile([3, 1, 2, 4], 95) == 4
+        assert percentile([7], 5) == 7
+
+    def test_simulate0001(self):
+        """Fixed durations give exact outcomes"""
+
+        schedule = ["O a:vm:v", "S b:vm:v", "O c:vm:v", "O a:vm:v",
+                    "O c:vm:v"]
+        simulator = SessionSimulator(
+            schedule, {"a:vm:v": fixed(10), "c:vm:v": fixed(20)},
+            {"reboot": fixed(60), "post_hooks": fixed(5)})
+        outcome = simulator.run_trial(random.Random(0))
+        # Each run takes 65 seconds plus the process execution.
+        assert outcome["total"] == 4 * 65 + 2 * 10 + 2 * 20
+        assert outcome["key_finish"] == {
+            "a:vm:v": 2 * 65 + 10 + 20 + 60 + 10,
+            "c:vm:v": outcome["total"] - 5,
+        }
+        # Known once "a" and "c" have both run, with no spread.
+        assert outcome["eta_known"] == 2 * 65 + 10 + 20
+        assert outcome["eta_predicted"] == (outcome["total"],) * 3
+
+    def test_simulate0002(self):
+        """In throughput mode, the executions of a run overlap"""
+
+        schedule = ["O a:vm:v", "O c:vm:v", "O a:vm:v", "O c:vm:v"]
+        simulator = SessionSimulator(
+            schedule, {"a:vm:v": fixed(10), "c:vm:v": fixed(20)},
+            {"reboot": fixed(60)}, pexecs_per_run=2)
+        assert len(simulator.runs) == 2
+        outcome = simulator.run_trial(random.Random(0))
+        assert outcome["total"] == 2 * (60 + 20)
+        assert outcome["key_finish"]["a:vm:v"] == 60 + 20 + 60 + 10
+        # Every key has run after the first run.
+        assert outcome["eta_known"] == 80
+
+    def test_simulate0003(self):
+        """The same seed gives the same outcomes"""
+
+        config = Config(os.path.join(TEST_DIR, "example.krun"))
+        estimates = [parse_estimate("*=1-100"),
+                     parse_estimate("reboot=50-70")]
+        outcomes = [simulate_session(config, None, estimates, 5)[1]
+                    for _ in xrange(2)]
+        assert outcomes[0] == outcomes[1]
+        assert len(outcomes[0]) == 5
+
+    def test_session_durations0001(self, mock_platform,
+                                   no_results_instantiation_check):
+        config = Config(os.path.join(TEST_DIR, "one_exec.krun"))
+        key = "dummy:CPython:default-python"
+        results = Results(config, mock_platform)
+        measurements = {
+            "wallclock_times": [1.0],
+            "core_cycle_counts": [],
+            "aperf_counts": [],
+            "mperf_counts": [],
+        }
+        for eta in (3.0, 4.0):
+            results.append_exec_measurements(key, measurements, "C")
+            results.eta_estimates[key].append(eta)
+        results.add_pexec_phases(key, 0, {"reboot": 61.0})
+        results.write_to_file()
+
+        schedule = ManifestManager.make_schedule(config)
+        exec_durations, phase_durations = session_durations(
+            schedule, config.results_filename())
+        assert exec_durations[key].samples == [3.0, 4.0]
+        assert phase_durations.keys() == ["reboot"]
+        assert phase_durations["reboot"].samples == [61.0]
+
+        # Estimates override the results file.
+        exec_durations, _ = session_durations(
+            schedule, config.results_filename(),
+            [parse_estimate("dummy:*=9")])
+        assert exec_durations[key].low == 9
+        os.unlink(config.results_filename())
+
+    def test_session_durations0002(self):
+        schedule = ["O a:vm:v", "O b:vm:v"]
+        with pytest.raises(FatalKrunError):
+            session_durations(schedule, None, [parse_estimate("a:*=1")])
+        with pytest.raises(FatalKrunError):
+            session_durations(schedule, None, [parse_estimate("z:*=1")])
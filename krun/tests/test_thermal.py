@@ -0,0 +1,134 @@
+from krun.config import Config
+from krun.tests import BaseKrunTest
+from krun.thermal import (fit_model, predict_duration, TemperatureTrace,
+                          MIN_STEP_SECS, SLEEP)
+import krun.util as util
+
+import json
+import math
+import pytest
+import time
+
+
+class CoolingMachine(object):
+    """A machine cooling exponentially towards 'ambient' whilst sleeping.
+    Time only passes when the platform sleeps."""
+
+    def __init__(self, start_temp, ambient, rate):
+        self.now = 1000.0
+        self.start_temp = start_temp
+        self.ambient = ambient
+        self.rate = rate
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept.append(secs)
+        self.now += secs
+
+    def take_temperature_readings(self):
+        elapsed = self.now - 1000.0
+        return {"x": self.ambient + (self.start_temp - self.ambient) *
+                math.exp(-self.rate * elapsed)}
+
+
+class TestThermal(BaseKrunTest):
+    """Test the temperature settling controller."""
+
+    def test_fit_model0001(self):
+        # Newtonian cooling: T(t) = 20 + 40 * exp(-0.01t)
+        temp = lambda t: 20 + 40 * math.exp(-0.01 * t)
+        points = [(t, temp(t), t + 1, temp(t + 1)) for t in xrange(0, 50, 5)]
+        a, b = fit_model(points)
+        assert b == pytest.approx(-0.01, rel=0.01)
+        assert -a / b == pytest.approx(20, rel=0.01)
+
+        # So it takes ln(40 / 10) / 0.01 secs to cool from 60 to 30.
+        assert predict_duration((a, b), 60, 30) == \
+            pytest.approx(math.log(4) / 0.01, rel=0.02)
+        # It never gets below ambient...
+        assert predict_duration((a, b), 60, 19) is None
+        # ...or hotter.
+        assert predict_duration((a, b), 30, 40) is None
+
+    def test_fit_model0002(self):
+        assert fit_model([]) is None
+        # Too little data for an exponential model: extrapolate linearly.
+        model = fit_model([(0, 30.0, 2, 31.0)])
+        assert model == (0.5, 0.0)
+        assert predict_duration(model, 31, 35) == 8
+        assert predict_duration(model, 31, 25) is None
+
+    def test_temperature_trace0001(self, monkeypatch):
+        now = [0.0]
+        monkeypatch.setattr(time, "time", lambda: now[0])
+        trace = TemperatureTrace()
+        for temp, action in ((40, SLEEP), (38, SLEEP), (37, None)):
+            trace.add({"x": temp}, action)
+            now[0] += 2
+        assert trace.sensor_points("x", SLEEP) == [(0, 40, 2, 38),
+                                                   (2, 38, 4, 37)]
+        assert trace.sensor_points("y", SLEEP) == []
+        assert trace.to_json()[2] == {"time": 4, "readings": {"x": 37},
+                                      "action": None}
+
+    def test_settle0001(self, mock_platform, monkeypatch):
+        """The controller quickly takes bigger steps than the minimum"""
+
+        machine = CoolingMachine(60.0, 20.0, 0.01)
+        monkeypatch.setattr(time, "time", machine.time)
+        monkeypatch.setattr(mock_platform, "sleep", machine.sleep)
+        monkeypatch.setattr(mock_platform, "take_temperature_readings",
+                            machine.take_temperature_readings)
+        mock_platform.temp_sensors = ["x"]
+        mock_platform.starting_temperatures = {"x": 30.0}
+
+        mock_platform.wait_for_temperature_sensors()
+        # The controller aims for 32 degrees, which it takes 120 seconds to
+        # cool to. Polling each second would take 120 steps.
+        assert 115 < sum(machine.slept) < 130
+        assert len(machine.slept) < 10
+        assert max(machine.slept) > MIN_STEP_SECS
+        samples = mock_platform.temperature_trace.to_json()
+        assert len(samples) == len(machine.slept) + 1
+        assert samples[-1]["action"] is None
+        assert 27 <= samples[-1]["readings"]["x"] <= 33
+
+    def test_settle0002(self, mock_platform, monkeypatch):
+        """Heating is done in predicted steps too"""
+
+        now = [0.0]
+        temp = [20.0]
+        heated = []
+
+        def heat(secs):
+            # Warm towards 70 degrees.
+            heated.append(secs)
+            temp[0] = 70 - (70 - temp[0]) * math.exp(-0.02 * secs)
+            now[0] += secs
+        monkeypatch.setattr(time, "time", lambda: now[0])
+        monkeypatch.setattr(mock_platform, "heat", heat)
+        monkeypatch.setattr(mock_platform, "take_temperature_readings",
+                            lambda: {"x": temp[0]})
+        mock_platform.temp_sensors = ["x"]
+        mock_platform.starting_temperatures = {"x": 30.0}
+
+        mock_platform.wait_for_temperature_sensors()
+        assert 27 <= temp[0] <= 33
+        assert len(heated) < 5
+        assert max(heated) > MIN_STEP_SECS
+
+    def test_dump_temperature_trace0001(self, tmpdir):
+        config = Config()
+        config.filename = str(tmpdir.join("example.krun"))
+        trace = TemperatureTrace()
+        trace.add({"x": 31.0})
+        util.dump_temperature_trace("dummy:CPython:default-python", 3,
+                                    config, trace)
+        path = tmpdir.join("example_temps",
+                           "dummy__CPython__default-python__3.json.bz2")
+        with config.codec().open(str(path), "r") as fh:
+            samples = json.loads(fh.read())
+        assert samples[0]["readings"] == {"x": 31.0}
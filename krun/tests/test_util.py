@@ -3,7 +3,10 @@ from krun.util import (format_raw_exec_results, log_and_mail, fatal,
                        get_git_version, ExecutionFailed,
                        get_session_info, run_shell_cmd_list, FatalKrunError,
                        stash_envlog, dump_instr_json, RerunExecution,
-                       make_instr_dir, read_popen_output_carefully)
+                       make_instr_dir, read_popen_output_carefully,
+                       read_popen_output_polling, monotonic_time,
+                       check_audit_unchanged, audit_mismatch)
+from krun.audit import Audit
 from krun.tests.mocks import MockMailer
 from krun.tests import TEST_DIR
 from krun.config import Config
@@ -11,12 +14,14 @@ from krun.scheduler import ManifestManager
 from krun.tests.mocks import mock_platform, mock_manifest, mock_mailer
 from krun.platform import detect_platform
 from bz2 import BZ2File
+from krun.compression import detect_codec
 
 import json
 import logging
 import pytest
 import os
 import subprocess32
+import sys
 from tempfile import NamedTemporaryFile
 
 
@@ -384,8 +389,111 @@ def test_dump_instr_json0001():
     assert js == instr_data
 
 
+def test_dump_instr_json0002():
+    path = os.path.join(TEST_DIR, "example.krun")
+    config = Config(path)
+    config.COMPRESSION_CODEC = "gzip:1"
+    instr_data = {k: ord(k) for k in "abcdef"}
+
+    make_instr_dir(config)
+    dump_instr_json("bench:vm:variant", 666, config, instr_data)
+
+    dump_dir = os.path.join(TEST_DIR, "example_instr_data")
+    dump_file = os.path.join(dump_dir, "bench__vm__variant__666.json.gz")
+    with detect_codec(dump_file).open(dump_file, "r") as fh:
+        js = json.load(fh)
+
+    os.unlink(dump_file)
+    os.rmdir(dump_dir)
+
+    assert js == instr_data
+
+
 def test_read_popen_output_carefully_0001():
     platform = detect_platform(None, None)
     process = subprocess32.Popen(["/bin/sleep", "5"], stdout=subprocess32.PIPE)
     _, _, _, timed_out = read_popen_output_carefully(process, platform, timeout=1)
     assert timed_out
+
+
+def test_read_popen_output_polling_0001(mock_platform):
+    process = subprocess32.Popen(["/bin/sleep", "5"], stdout=subprocess32.PIPE)
+    _, _, _, timed_out = read_popen_output_polling(process, mock_platform,
+                                                   timeout=1)
+    assert timed_out
+
+
+def test_read_popen_output_polling_0002(mock_platform):
+    """Both readers read large outputs the same"""
+
+    args = [sys.executable, "-c",
+            "import sys; sys.stdout.write('x' * 3000000); "
+            "sys.stderr.write('line\\n' * 1000); sys.exit(3)"]
+    outputs = []
+    for reader in (read_popen_output_carefully, read_popen_output_polling):
+        process = subprocess32.Popen(args, stdout=subprocess32.PIPE,
+                                     stderr=subprocess32.PIPE)
+        outputs.append(reader(process, mock_platform, print_stderr=False,
+                              timeout=30))
+    assert outputs[0] == outputs[1]
+    stdout, stderr, rc, timed_out = outputs[1]
+    assert stdout == "x" * 3000000
+    assert stderr == "line\n" * 1000
+    assert rc == 3
+    assert not timed_out
+
+
+def test_monotonic_time_0001():
+    times = [monotonic_time() for _ in xrange(1000)]
+    assert times == sorted(times)
+
+
+class FakeResults(object):
+    def __init__(self, audit):
+        self.audit = Audit(audit)
+
+
+def test_check_audit_unchanged0001(mock_platform):
+    """The execution mode of a resumed session can't change"""
+
+    mock_platform.audit = {"uname": "MockPlatform",
+                           "execution_mode": "isolated"}
+    check_audit_unchanged(FakeResults(dict(mock_platform.audit)),
+                          mock_platform)
+
+    mock_platform.config.THROUGHPUT_PEXECS = 4
+    mock_platform.audit["execution_mode"] = \
+        mock_platform.config.execution_mode()
+    with pytest.raises(FatalKrunError):
+        check_audit_unchanged(FakeResults({"uname": "MockPlatform",
+                                           "execution_mode": "isolated"}),
+                              mock_platform)
+
+
+def test_check_audit_unchanged0002(mock_platform):
+    """Results from before the execution mode was audited were isolated"""
+
+    mock_platform.audit = {"uname": "MockPlatform",
+                           "execution_mode": "isolated"}
+    check_audit_unchanged(FakeResults({"uname": "MockPlatform"}),
+                          mock_platform)
+
+    mock_platform.config.THROUGHPUT_PEXECS = 2
+    mock_platform.audit["execution_mode"] = \
+        mock_platform.config.execution_mode()
+    with pytest.raises(FatalKrunError):
+        check_audit_unchanged(FakeResults({"uname": "MockPlatform"}),
+                              mock_platform)
+
+
+def test_audit_mismatch0001():
+    audit = {"uname": "MockPlatform", "execution_mode": "isolated"}
+    assert audit_mismatch(audit, dict(audit)) is None
+    # Results from before the execution mode was audited were isolated.
+    assert audit_mismatch({"uname": "MockPlatform"}, audit) is None
+    assert audit_mismatch(audit, {"uname": "MockPlatform",
+                                  "execution_mode": "throughput"}) == \
+        "process executions ran in isolated mode, not throughput mode"
+    assert audit_mismatch(audit, {"uname": "MockPlatform", "extra": "x",
+                                  "execution_mode": "isolated"}) == \
+        "the machines are not identical"
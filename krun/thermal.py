@@ -0,0 +1,162 @@
+"""Bringing the machine back to its starting temperature between process
+executions.
+
+Rather than sleeping (or heating) in small fixed steps, re-reading the
+sensors after each, the settling controller records the trajectory of each
+sensor and fits a first-order (Newtonian) model to it:
+
+  dT/dt = a + b * T
+
+where, when b < 0, the temperature approaches T_inf = -a/b exponentially.
+Separate models are fitted for the periods spent cooling (sleeping) and
+heating, since the machine behaves differently in each. The controller then
+sleeps or heats for as long as the model predicts it will take for the
+furthest out sensor to come back within the allowed interval. Until there is
+enough data to fit a model, it takes small steps.
+
+The trajectory is kept as a TemperatureTrace, which Krun stores for each
+process execution (see util.dump_temperature_trace()), so that thermally
+sensitive benchmarks can be investigated later.
+"""
+
+import math
+import time
+
+from logging import debug
+
+# The controller never acts for less, or more, than this at a time. The upper
+# bound means that a poor model is soon corrected by fresh readings.
+MIN_STEP_SECS = 1
+MAX_STEP_SECS = 30
+
+# The controller aims this far inside the allowed interval, so that noise in
+# the readings doesn't leave a sensor just outside.
+TARGET_MARGIN_DEGREES = 1.0
+
+SLEEP = "sleep"
+HEAT = "heat"
+
+
+class TemperatureTrace(object):
+    """The temperature readings taken while waiting for a process execution,
+    each with the time (in seconds since the trace began) and the action
+    taken afterwards ("sleep", "heat", or None if no action was needed)."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.samples = []
+
+    def add(self, readings, action=None):
+        self.samples.append((time.time() - self.start_time, dict(readings),
+                             action))
+
+    def sensor_points(self, sensor, action):
+        """Returns '(time, temperature, next_time, next_temperature)' tuples
+        for each interval of the given sensor during which 'action' was
+        taken."""
+
+        points = []
+        for (t0, r0, act), (t1, r1, _) in zip(self.samples, self.samples[1:]):
+            if act == action and sensor in r0 and sensor in r1 and t1 > t0:
+                points.append((t0, r0[sensor], t1, r1[sensor]))
+        return points
+
+    def to_json(self):
+        return [{"time": round(t, 3), "readings": readings, "action": action}
+                for t, readings, action in self.samples]
+
+
+def fit_model(points):
+    """Fit 'dT/dt = a + b * T' by least squares to a sensor's intervals (see
+    TemperatureTrace.sensor_points()). Returns '(a, b)', or None if there is
+    too little data. If the temperatures don't vary enough to estimate 'b',
+    it is 0 and 'a' is the mean rate."""
+
+    if not points:
+        return None
+    rates = [(temp1 - temp0) / (t1 - t0) for t0, temp0, t1, temp1 in points]
+    mids = [(temp0 + temp1) / 2.0 for _, temp0, _, temp1 in points]
+    mean_rate = sum(rates) / len(rates)
+    mean_mid = sum(mids) / len(mids)
+    var = sum((m - mean_mid) ** 2 for m in mids)
+    if len(points) < 2 or var < 1e-6:
+        return mean_rate, 0.0
+    b = sum((m - mean_mid) * (r - mean_rate)
+            for m, r in zip(mids, rates)) / var
+    return mean_rate - b * mean_mid, b
+
+
+def predict_duration(model, current, target):
+    """Predict how long it takes to go from temperature 'current' to
+    'target' under 'model'. Returns None if the model says 'target' is never
+    reached."""
+
+    a, b = model
+    if b < 0:
+        limit = -a / b
+        if min(current, limit) < target < max(current, limit):
+            return math.log((target - limit) / (current - limit)) / b
+        return None
+    rate = a + b * current
+    if rate == 0 or (target - current) / rate <= 0:
+        return None
+    return (target - current) / rate
+
+
+class TemperatureSettler(object):
+    """Drives the temperature sensors of 'platform' back within the interval
+    around their starting temperatures."""
+
+    def __init__(self, platform, trace):
+        self.platform = platform
+        self.trace = trace
+
+    def step_duration(self, action, readings):
+        """How long to sleep or heat for, given the current readings"""
+
+        threshold = self.platform.TEMP_THRESHOLD_DEGREES
+        durations = []
+        for sensor, current in readings.iteritems():
+            start = self.platform.starting_temperatures[sensor]
+            if action == SLEEP and current > start + threshold:
+                target = start + threshold - TARGET_MARGIN_DEGREES
+            elif action == HEAT and current < start - threshold:
+                target = start - threshold + TARGET_MARGIN_DEGREES
+            else:
+                continue
+            model = fit_model(self.trace.sensor_points(sensor, action))
+            if model is None:
+                return MIN_STEP_SECS  # Not enough data yet.
+            duration = predict_duration(model, current, target)
+            debug("Sensor %s: model %s predicts %s secs to reach %.1f" %
+                  (sensor, model, duration, target))
+            if duration is None:
+                return MIN_STEP_SECS  # The model is no use; gather more data.
+            durations.append(duration)
+        return min(MAX_STEP_SECS, max([MIN_STEP_SECS] + durations))
+
+    def settle(self, bail_out_time):
+        """Sleep or heat until the sensors are within their intervals, or
+        until 'bail_out_time' (as per time.time()) has passed. Returns the
+        last (flag, reason) of platform.temp_sensors_within_interval()."""
+
+        while True:
+            readings = self.platform.take_temperature_readings()
+            flag, reason = self.platform.temp_sensors_within_interval(readings)
+            if flag == self.platform.TEMP_OK:
+                self.trace.add(readings)
+                break
+
+            action = SLEEP if flag == self.platform.TEMP_TOO_HOT else HEAT
+            self.trace.add(readings, action)
+            duration = min(self.step_duration(action, readings),
+                           max(0, bail_out_time - time.time()))
+            debug("%s for %.1f secs: %s" % (action, duration, reason))
+            if action == SLEEP:
+                self.platform.sleep(duration)
+            elif duration > 0:
+                self.platform.heat(duration)
+
+            if time.time() >= bail_out_time:
+                break
+        return flag, reason
@@ -3,10 +3,12 @@ from krun import ABS_TIME_FORMAT, UNKNOWN_TIME_DELTA, UNKNOWN_ABS_TIME
 import datetime
 
 class TimeEstimateFormatter(object):
-    def __init__(self, seconds):
+    def __init__(self, seconds, interval=None):
         """Generates string representations of time estimates.
         Args:
         seconds -- estimated seconds into the future. None for unknown.
+        interval -- (low, high) seconds bounding the estimate. None for
+                    unknown.
         """
         self.start = datetime.datetime.now()
         if seconds is not None:
@@ -15,6 +17,13 @@ class TimeEstimateFormatter(object):
         else:
             self.delta = None
             self.finish = None
+        if seconds is not None and interval is not None:
+            low, high = interval
+            self.finish_low = self.start + datetime.timedelta(seconds=low)
+            self.finish_high = self.start + datetime.timedelta(seconds=high)
+        else:
+            self.finish_low = None
+            self.finish_high = None
 
     @property
     def start_str(self):
@@ -27,6 +36,20 @@ class TimeEstimateFormatter(object):
         else:
             return UNKNOWN_ABS_TIME
 
+    @property
+    def finish_low_str(self):
+        if self.finish_low is not None:
+            return str(self.finish_low.strftime(ABS_TIME_FORMAT))
+        else:
+            return UNKNOWN_ABS_TIME
+
+    @property
+    def finish_high_str(self):
+        if self.finish_high is not None:
+            return str(self.finish_high.strftime(ABS_TIME_FORMAT))
+        else:
+            return UNKNOWN_ABS_TIME
+
     @property
     def delta_str(self):
         if self.delta is not None:
@@ -1,3 +1,5 @@
+import ctypes
+import ctypes.util
 import json
 import os
 import re
@@ -11,7 +13,6 @@ import time
 from datetime import datetime, timedelta
 import subprocess32  # For timeout support.
 from logging import error, debug, info, warn, root as root_logger
-from bz2 import BZ2File
 from krun.amperf import check_amperf_ratios
 
 FLOAT_FORMAT = ".6f"
@@ -27,6 +28,18 @@ SELECT_TIMEOUT = 1.0
 # than are strictly necessary. In either case we are safe and correct.
 PIPE_BUF_SZ = 1024 * 16
 
+# read_popen_output_polling() asks for this much at a time. A read returns
+# what the pipe holds, so asking for more than the pipe capacity costs
+# nothing, and when the child writes faster than Krun reads, fewer reads are
+# needed.
+POLL_READ_SZ = 1024 * 1024
+
+# clock_gettime(2) clock IDs, which differ between OSs.
+CLOCK_MONOTONIC_IDS = {
+    "linux": 1,
+    "openbsd": 3,
+}
+
 from stat import S_IRUSR, S_IWUSR, S_IRGRP, S_IWGRP, S_IXUSR, S_IXGRP, S_IROTH, S_IXOTH
 INSTR_DIR_MODE = S_IRUSR | S_IWUSR | S_IXUSR \
     | S_IRGRP | S_IWGRP | S_IXGRP \
@@ -45,6 +58,9 @@ BAD_AMPERF_SUBJECT = "Bad APERF/MPERF ratio(s) detected"
 # Keys we expect in each iteration runner's output
 EXPECT_JSON_KEYS = set(["wallclock_times", "core_cycle_counts",
                         "aperf_counts", "mperf_counts"])
+# ...and those it may also emit: how many times it called the benchmark in
+# each iteration (see krun.results_channel).
+OPTIONAL_JSON_KEYS = set(["inner_repeats"])
 
 class ExecutionFailed(Exception):
     pass
@@ -110,6 +126,41 @@ def run_shell_cmd(cmd, failure_fatal=True, extra_env=None):
     return stdout.strip(), stderr.strip(), rc
 
 
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_int64 if sys.platform.startswith("openbsd")
+                 else ctypes.c_long),
+                ("tv_nsec", ctypes.c_long)]
+
+
+def _make_monotonic_clock():
+    """Python 2.7 has no monotonic clock, so call clock_gettime(2) through
+    ctypes. Falls back to time.time() if that can't be done."""
+
+    clock_id = None
+    for prefix, prefix_clock_id in CLOCK_MONOTONIC_IDS.iteritems():
+        if sys.platform.startswith(prefix):
+            clock_id = prefix_clock_id
+    libc_path = ctypes.util.find_library("c")
+    if clock_id is None or libc_path is None:
+        return time.time
+    try:
+        clock_gettime = ctypes.CDLL(libc_path, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    ts = _timespec()
+
+    def monotonic_time():
+        if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+            errno = ctypes.get_errno()
+            fatal("clock_gettime() failed: %s" % os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic_time
+
+# Seconds from an arbitrary point, unaffected by changes to the system clock.
+monotonic_time = _make_monotonic_clock()
+
+
 def run_shell_cmd_list(cmds, failure_fatal=True, extra_env=None):
     """Run a list of shell commands, stopping on first failure."""
 
@@ -231,19 +282,157 @@ def read_popen_output_carefully(process, platform, print_stderr=True, timeout=No
     return stdout, stderr, process.returncode, False
 
 
+class _Poller(object):
+    """select.epoll() where available (Linux), otherwise select.poll(), with
+    timeouts in seconds"""
+
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self.poller = select.epoll()
+            self.events = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+            self.timeout_scale = 1
+            self.no_timeout = -1
+        else:
+            self.poller = select.poll()
+            self.events = select.POLLIN | select.POLLHUP | select.POLLERR
+            self.timeout_scale = 1000
+            self.no_timeout = None
+
+    def register(self, fd):
+        self.poller.register(fd, self.events)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout=None):
+        """Returns the file descriptors which are ready"""
+
+        if timeout is None:
+            timeout = self.no_timeout
+        else:
+            timeout *= self.timeout_scale
+        return [fd for fd, _ in self.poller.poll(timeout)]
+
+    def close(self):
+        if hasattr(self.poller, "close"):
+            self.poller.close()
+
+
+def read_popen_output_polling(process, platform, print_stderr=True,
+                              timeout=None):
+    """As read_popen_output_carefully(), but for children producing a lot of
+    output. The pipes are watched with epoll(2) (or poll(2)), which unlike
+    select(2) has no limit on file descriptor numbers, and are read in large
+    chunks. The timeout is measured by a monotonic clock, so is not upset by
+    changes to the system clock."""
+
+    deadline = None
+    if timeout is not None:
+        deadline = monotonic_time() + timeout
+
+    # Reading into a bytearray, rather than a list of strings, would seem to
+    # save memory, but the output must end up as a string, and converting a
+    # bytearray is an extra copy. With one join at the end, each byte is
+    # copied once by the kernel and once by Krun.
+    chunks = dict()
+    stdout_fd = process.stdout.fileno()
+    platform.unbuffer_fd(stdout_fd)
+    stdout_data = chunks[stdout_fd] = []
+
+    stderr_data = []
+    if process.stderr is None:
+        # stderr was redirected to file, forget it
+        stderr_fd = None
+    else:
+        stderr_fd = process.stderr.fileno()
+        platform.unbuffer_fd(stderr_fd)
+        chunks[stderr_fd] = stderr_data
+
+    if print_stderr:
+        stderr_consumer = print_stderr_linewise(info)
+        stderr_consumer.next() # start the generator
+    else:
+        stderr_consumer = None
+
+    poller = _Poller()
+    try:
+        for fd in chunks:
+            poller.register(fd)
+        open_fds = set(chunks)
+        while open_fds:
+            time_left = None
+            if deadline is not None:
+                time_left = deadline - monotonic_time()
+                if time_left <= 0:
+                    return "".join(stdout_data), "".join(stderr_data), \
+                        None, True
+            for fd in poller.poll(time_left):
+                d = os.read(fd, POLL_READ_SZ)
+                if d == "":  # EOF
+                    poller.unregister(fd)
+                    open_fds.remove(fd)
+                    continue
+                chunks[fd].append(d)
+                if fd == stderr_fd and stderr_consumer is not None:
+                    stderr_consumer.send(d)
+    finally:
+        poller.close()
+
+    # As in read_popen_output_carefully(), stderr and stdout are closed, so
+    # wait for the process to exit.
+    time_left = None
+    if deadline is not None:
+        time_left = deadline - monotonic_time()
+        if time_left <= 0:
+            return "".join(stdout_data), "".join(stderr_data), None, True
+    try:
+        process.wait(time_left)
+    except subprocess32.TimeoutExpired:
+        return "".join(stdout_data), "".join(stderr_data), None, True
+    except Exception as e:
+        fatal("wait() failed on child pipe: %s" % str(e))
+
+    return "".join(stdout_data), "".join(stderr_data), process.returncode, \
+        False
+
+# Ways of reading the output of benchmark processes (see the
+# CHILD_OUTPUT_READER config option).
+CHILD_OUTPUT_READERS = {
+    "select": read_popen_output_carefully,
+    "poll": read_popen_output_polling,
+}
+
+
 def check_and_parse_execution_results(stdout, stderr, rc, config, key,
-                                      sanity_check=False, instrument=False):
+                                      sanity_check=False, instrument=False,
+                                      channel=None):
+    """Check and parse the measurements of a process execution. These are
+    read from the results channel 'channel' (see krun.results_channel) if the
+    iterations runner used it, or from 'stdout' otherwise: as JSON, or as
+    channel data written there by libkruntime's krun_dump_store()."""
+
+    from krun import results_channel
+
     json_exn = None
+    json_data = None
 
     # cset(1) on Linux prints to stdout information about which cpuset a pinned
     # process went to. If this line is present, filter it out.
     stdout = re.sub('^cset: --> last message, executed args into cpuset "/user",'
                     ' new pid is: [0-9]+\n', '', stdout)
 
-    try:
-        json_data = json.loads(stdout)  # expect a list of floats
-    except Exception as e:  # docs don't say what can arise, play safe.
-        json_exn = e
+    if channel is not None and rc == 0:
+        json_data = channel.read_measurements()
+
+    if json_data is None and rc == 0 and \
+            results_channel.is_channel_data(stdout):
+        json_data = results_channel.parse_measurements(stdout)
+
+    if json_data is None:
+        try:
+            json_data = json.loads(stdout)  # expect a list of floats
+        except Exception as e:  # docs don't say what can arise, play safe.
+            json_exn = e
 
     if json_exn or rc != 0:
         # Something went wrong
@@ -274,12 +463,17 @@ def check_and_parse_execution_results(stdout, stderr, rc, config, key,
         raise ExecutionFailed(err_s)
 
     # Check we have the right keys
-    key_set = set(json_data.keys())
+    key_set = set(json_data.keys()) - OPTIONAL_JSON_KEYS
     if key_set != EXPECT_JSON_KEYS:
         err_s = "Benchmark emitted unexpected JSON keys\n"
         err_s += "Expected: %s, got: %s" % (EXPECT_JSON_KEYS, key_set)
         raise ExecutionFailed(err_s)
 
+    inner_repeats = json_data.get("inner_repeats", 1)
+    if not isinstance(inner_repeats, (int, long)) or inner_repeats < 1:
+        raise ExecutionFailed("Benchmark emitted bad inner repeats: %r" %
+                              inner_repeats)
+
     # Check lengths
     expect_len = len(json_data["wallclock_times"])
     remain_keys = EXPECT_JSON_KEYS - set(["wallclock_times"])
@@ -338,9 +532,12 @@ def spawn_sanity_check(platform, entry_point, vm_def,
     try:
         _ = check_and_parse_execution_results(stdout, stderr, rc,
                                               platform.config, key,
-                                              sanity_check=True)
+                                              sanity_check=True,
+                                              channel=vm_def.results_channel)
     except ExecutionFailed as e:
         fatal("%s sanity check failed: %s" % (check_name, e.message))
+    finally:
+        vm_def.close_results_channel()
 
 def assign_platform(config, platform):
     for vm_name, vm_info in config.VMS.items():
@@ -397,19 +594,6 @@ def print_session_info(config):
         print("  No keys skipped")
 
 
-def make_heat():
-    """A loop which spins, attempting to make heat.
-
-    Used when the CPU is too cool to run a benchmark."""
-
-    # Waste cycles with this loop. At the time of writing PyPy is unable to
-    # optimise this away. Heat is a consequence.
-    j = 0
-    for i in xrange(10000000):
-        j += 1
-    assert j == 10000000
-
-
 def get_git_version():
     """Ask the krun checkout for its version. This assumes that Krun is run
     from a git clone. If we decide to package this into (e.g.) PyPI at a later
@@ -458,12 +642,46 @@ def set_instr_dir_perms(config, platform):
     os.chmod(path, INSTR_DIR_MODE)
 
 
+def replace_file_atomically(tmp_filename, filename, backup_filename=None):
+    """Durably move a newly written file into place.
+
+    'tmp_filename' must be in the same directory as 'filename'. Once this
+    returns, 'filename' refers to the new contents. Should the machine crash
+    part way through, 'filename' refers to either the old or the new contents
+    in full, never a mixture. If 'backup_filename' is given, the old contents
+    (if any) are kept there."""
+
+    # Make sure the contents are on disk before they can become visible
+    # under the real name.
+    fd = os.open(tmp_filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    if backup_filename is not None and os.path.exists(filename):
+        if os.path.exists(backup_filename):
+            os.unlink(backup_filename)
+        os.link(filename, backup_filename)
+
+    os.rename(tmp_filename, filename)  # Atomic.
+
+    # And make sure that the rename itself is on disk.
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def dump_instr_json(key, exec_num, config, instr_data):
     """Write per-execution instrumentation data to a separate JSON file.
 
     Assumes the instrumentation directory exists."""
 
-    filename = "%s__%s.json.bz2" % (key.replace(":", "__"), exec_num)
+    codec = config.codec()
+    filename = "%s__%s.json%s" % (key.replace(":", "__"), exec_num,
+                                  codec.extension)
     path = os.path.join(get_instr_json_dir(config), filename)
 
     # The directory was checked to be non-existant when the benchmark session
@@ -471,8 +689,36 @@ def dump_instr_json(key, exec_num, config, instr_data):
     # is written at most once) should not exist either. If it does, the user
     # did something strange.
     assert not os.path.exists(path)
-    with BZ2File(path, "w") as fh:
+    tmp_path = path + ".tmp"
+    with codec.open(tmp_path, "w") as fh:
         fh.write(json.dumps(instr_data))
+    replace_file_atomically(tmp_path, path)
+
+
+def get_temperature_trace_dir(config):
+    assert config.filename.endswith(".krun")
+    config_base = config.filename[:-5]
+    return os.path.join(os.getcwd(), "%s_temps" % config_base)
+
+
+def dump_temperature_trace(key, exec_num, config, trace):
+    """Write the temperature readings taken before (and after) a process
+    execution to a separate JSON file (see krun.thermal.TemperatureTrace)."""
+
+    trace_dir = get_temperature_trace_dir(config)
+    if not os.path.exists(trace_dir):
+        os.mkdir(trace_dir)
+
+    codec = config.codec()
+    filename = "%s__%s.json%s" % (key.replace(":", "__"), exec_num,
+                                  codec.extension)
+    path = os.path.join(trace_dir, filename)
+    # As with dump_instr_json(), each file is written at most once.
+    assert not os.path.exists(path)
+    tmp_path = path + ".tmp"
+    with codec.open(tmp_path, "w") as fh:
+        fh.write(json.dumps(trace.to_json()))
+    replace_file_atomically(tmp_path, path)
 
 
 def get_envlog_dir(config):
@@ -564,18 +810,41 @@ def reboot(manifest, platform, update_count=True):
     _do_reboot(platform)
 
 
+def audit_mismatch(old_audit, new_audit):
+    """Return why results gathered under 'new_audit' can't be combined with
+    those gathered under 'old_audit', or None if they can.
+
+    Both audits are dictionaries."""
+
+    from krun.audit import Audit
+
+    # The execution mode is checked on its own: results files from before it
+    # was audited lack it, and their process executions were isolated.
+    old_audit, new_audit = dict(old_audit), dict(new_audit)
+    old_mode = old_audit.pop("execution_mode", "isolated")
+    new_mode = new_audit.pop("execution_mode", "isolated")
+    if Audit(old_audit) != Audit(new_audit):
+        return "the machines are not identical"
+    if old_mode != new_mode:
+        return ("process executions ran in %s mode, not %s mode" %
+                (old_mode, new_mode))
+    return None
+
+
 def check_audit_unchanged(results, platform):
     """Crash out if the audit in the result doesn't match the one in the
     platform"""
 
-    from krun.audit import Audit
-    if Audit(platform.audit) != results.audit:
-        error_msg = (
-            "You have asked Krun to resume an interrupted benchmark. "
-            "This is only valid if the machine you are using is "
-            "identical to the one on which the last results were "
-            "gathered, which is not the case.")
-        fatal(error_msg)
+    platform_audit = dict(platform.audit)
+    platform_audit["execution_mode"] = platform.config.execution_mode()
+    reason = audit_mismatch(results.audit.audit, platform_audit)
+    if reason is not None:
+        fatal("You have asked Krun to resume an interrupted benchmark. "
+              "This is only valid if the machine you are using is "
+              "identical to the one on which the last results were "
+              "gathered, and the execution mode is unchanged, but %s. Note "
+              "that THROUGHPUT_PEXECS must not change during a session." %
+              reason)
 
 
 def daemonise():
@@ -13,8 +13,10 @@ from abc import ABCMeta, abstractmethod
 from logging import debug, warn
 from krun import EntryPoint
 from krun.util import (fatal, spawn_sanity_check, VM_SANITY_CHECKS_DIR,
-                       read_popen_output_carefully)
+                       CHILD_OUTPUT_READERS)
 from krun.env import EnvChangeAppend, EnvChangeSet, EnvChange
+from krun.results_channel import (CHANNEL_ENV, INNER_REPEATS_ENV,
+                                  ResultsChannel, channel_available)
 from distutils.spawn import find_executable
 
 DIR = os.path.abspath(os.path.dirname(__file__))
@@ -44,6 +46,19 @@ class BaseVMDef(object):
     # Read/write for user and group
     ENVLOG_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IWUSR | stat.S_IWGRP
 
+    # Whether the iterations runner can hand its measurements to Krun through
+    # a results channel (see krun.results_channel) rather than as JSON.
+    SUPPORTS_RESULTS_CHANNEL = False
+
+    # Whether the iterations runner can call the benchmark more than once
+    # per measured in-process iteration (see the INNER_REPEATS config
+    # option), as told by INNER_REPEATS_ENV.
+    SUPPORTS_INNER_REPEATS = False
+
+    # The null benchmark (in calibration_benchmarks/) which measures the
+    # overhead of the iterations runner (see krun.calibrate), if there is one.
+    CALIBRATION_BENCHMARK = None
+
     def __init__(self, iterations_runner, env=None, instrument=False):
         self.iterations_runner = iterations_runner
 
@@ -81,6 +96,21 @@ class BaseVMDef(object):
 
         self.instrument = instrument
 
+        # In throughput mode, process executions run on copies of the VM
+        # definition, each pinned to its own list of CPUs. As these share the
+        # Krun user, the scheduler makes the user fresh, not the VM def.
+        self.pin_cpus = None
+        self.fresh_user = True
+
+        # The results channel of the last process execution, if any. Passed
+        # on to util.check_and_parse_execution_results().
+        self.results_channel = None
+
+        # How many times the iterations runner calls the benchmark in each
+        # measured in-process iteration: a positive integer, or "auto". Set
+        # by the scheduler before each process execution.
+        self.inner_repeats = 1
+
     def _get_benchmark_path(self, benchmark, entry_point, force_dir=None):
         if force_dir is not None:
             # Forcing a directory! Used for sanity checks.
@@ -158,71 +188,123 @@ class BaseVMDef(object):
 
         return wrapper_filename, envlog_filename
 
+    def _use_results_channel(self):
+        return self.SUPPORTS_RESULTS_CHANNEL and \
+            self.config.RESULTS_CHANNEL == "mmap" and channel_available()
+
     def _run_exec(self, args, heap_lim_k, stack_lim_k, key, key_pexec_idx,
-                  bench_env_changes=None, sync_disks=True):
+                  bench_env_changes=None, sync_disks=True, iterations=None):
         """ Deals with actually shelling out """
 
         if bench_env_changes is None:
             bench_env_changes = []
 
-        # Environment *after* user change.
-        # Starts minimal, but user change command (i.e. sudo) may introduce more.
-        new_user_env = {"PATH": "/bin:/usr/bin"}
-
-        # Apply envs
-        self.apply_env_changes(bench_env_changes, new_user_env)
-
-        # Apply platform specific argument transformations.
-        args = self.platform.bench_cmdline_adjust(args, new_user_env)
-
-        # Tack on the debug flag: 0 or 1
-        import logging
-        if logging.getLogger().isEnabledFor(logging.DEBUG):
-            args.append("1")
-        else:
-            args.append("0")
-
-        # Tack on the instrumentation arguments, if required.
-        if self.instrument:
-            args.append(util.get_instr_json_dir(self.config))
-            # we will redirect stderr to this handle
-            stderr_file = open(INST_STDERR_FILE, "w")
-            # Append flags only present in instrumentation mode.
-            args.extend([key, str(key_pexec_idx)])
-
-        else:
-            stderr_file = subprocess32.PIPE
-
-        if self.dry_run:
-            warn("SIMULATED: Benchmark process execution (--dryrun)")
-            return ("", "", 0, None, False)
+        # Iterations runners that know of the results channel need to be
+        # told 'iterations' to use one.
+        self.results_channel = None
+        if not self.dry_run and iterations is not None and \
+                self._use_results_channel():
+            self.results_channel = ResultsChannel(
+                iterations, self.platform.num_per_core_measurements)
+            bench_env_changes = bench_env_changes + [
+                EnvChangeSet(CHANNEL_ENV, self.results_channel.filename)]
+
+        try:
+            if self.inner_repeats != 1:
+                assert self.SUPPORTS_INNER_REPEATS
+                if self.inner_repeats == "auto":
+                    value = "auto:%r" % self.config.INNER_REPEATS_TARGET
+                else:
+                    value = str(self.inner_repeats)
+                bench_env_changes = bench_env_changes + [
+                    EnvChangeSet(INNER_REPEATS_ENV, value)]
+
+            # Environment *after* user change.
+            # Starts minimal, but user change command (i.e. sudo) may introduce
+            # more.
+            new_user_env = {"PATH": "/bin:/usr/bin"}
+
+            # Apply envs
+            self.apply_env_changes(bench_env_changes, new_user_env)
+
+            # Apply platform specific argument transformations.
+            args = self.platform.bench_cmdline_adjust(args, new_user_env)
+
+            # Tack on the debug flag: 0 or 1
+            import logging
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                args.append("1")
+            else:
+                args.append("0")
 
-        if not self.platform.no_user_change:
-            self.platform.make_fresh_krun_user()
-            # If we are in instrumentation mode, grant the Krun user write
-            # access to the instrumentation directory.
+            # Tack on the instrumentation arguments, if required.
             if self.instrument:
-                util.set_instr_dir_perms(self.config, self.platform)
-
-        wrapper_filename, envlog_filename = \
-            self.make_wrapper_script(args, heap_lim_k, stack_lim_k)
-        wrapper_args = self._wrapper_args(wrapper_filename)
-        debug("Execute wrapper: %s" % (" ".join(wrapper_args)))
+                args.append(util.get_instr_json_dir(self.config))
+                # we will redirect stderr to this handle
+                stderr_file = open(INST_STDERR_FILE, "w")
+                # Append flags only present in instrumentation mode.
+                args.extend([key, str(key_pexec_idx)])
 
-        # Do an OS-level sync. Forces pending writes on to the physical disk.
-        # We do this in an attempt to prevent disk commits happening during
-        # benchmarking.
-        if sync_disks:
-            self.platform.sync_disks()
+            else:
+                stderr_file = subprocess32.PIPE
+
+            if self.dry_run:
+                warn("SIMULATED: Benchmark process execution (--dryrun)")
+                return ("", "", 0, None, False)
+
+            if not self.platform.no_user_change:
+                if self.fresh_user:
+                    self.platform.make_fresh_krun_user()
+                # If we are in instrumentation mode, grant the Krun user write
+                # access to the instrumentation directory.
+                if self.instrument:
+                    util.set_instr_dir_perms(self.config, self.platform)
+
+            if self.results_channel is not None:
+                # The runner writes the channel as the Krun user.
+                os.chmod(self.results_channel.filename, BaseVMDef.ENVLOG_MODE)
+                if not self.platform.no_user_change:
+                    chown_args = self.platform.change_user_args("root") + \
+                        ["chown", BENCHMARK_USER, self.results_channel.filename]
+                    util.run_shell_cmd(" ".join(chown_args))
+
+            wrapper_filename, envlog_filename = \
+                self.make_wrapper_script(args, heap_lim_k, stack_lim_k)
+            wrapper_args = self._wrapper_args(wrapper_filename)
+            debug("Execute wrapper: %s" % (" ".join(wrapper_args)))
+
+            # Do an OS-level sync. Forces pending writes on to the physical
+            # disk. We do this in an attempt to prevent disk commits happening
+            # during benchmarking.
+            if sync_disks:
+                self.platform.sync_disks()
+
+            out, err, rc, timed_out = self._run_exec_popen(wrapper_args,
+                                                           stderr_file)
 
-        out, err, rc, timed_out = self._run_exec_popen(wrapper_args, stderr_file)
+            if self.instrument:
+                stderr_file.close()
 
-        if self.instrument:
-            stderr_file.close()
+            if self.results_channel is not None:
+                self.results_channel.collect()
+        finally:
+            # The channel file isn't needed once mapped, and mustn't be left
+            # behind if anything above failed.
+            if self.results_channel is not None:
+                self.results_channel.unlink()
 
         os.unlink(wrapper_filename)
         return out, err, rc, envlog_filename, timed_out
 
+    def close_results_channel(self):
+        """Release the results channel of the last process execution, if it
+        had one. Call this once its measurements have been read, or when they
+        never will be."""
+
+        if self.results_channel is not None:
+            self.results_channel.close()
+            self.results_channel = None
+
     # separate for testing
     def _wrapper_args(self, wrapper_filename):
         """Build arguments used to run the wrapper script"""
@@ -233,6 +315,10 @@ class BaseVMDef(object):
         if self.config.ENABLE_PINNING:
                 wrapper_args += self.platform.pin_process_args()
 
+        if self.pin_cpus is not None:
+            wrapper_args += self.platform.pin_process_to_cpus_args(
+                self.pin_cpus)
+
         if self.platform.no_user_change:
             warn("Not changing user (--no-change-user)")
             # We still have to sudo back to the user who ran krun, as we raised
@@ -263,8 +349,9 @@ class BaseVMDef(object):
         # occurred.
         child_pipe = subprocess32.Popen(args, stdout=subprocess32.PIPE,
                                       stderr=stderr_file, env={})
-        return read_popen_output_carefully(child_pipe, platform=self.platform,
-            timeout=self.config.EXECUTION_TIMEOUT)
+        reader = CHILD_OUTPUT_READERS[self.config.CHILD_OUTPUT_READER]
+        return reader(child_pipe, platform=self.platform,
+                      timeout=self.config.EXECUTION_TIMEOUT)
 
     def sanity_checks(self):
         pass
@@ -311,6 +398,10 @@ class ExternalSuiteVMDef(BaseVMDef):
 class NativeCodeVMDef(BaseVMDef):
     """Not really a "VM definition" at all. Runs native code."""
 
+    SUPPORTS_RESULTS_CHANNEL = True
+    SUPPORTS_INNER_REPEATS = True
+    CALIBRATION_BENCHMARK = "null.so"
+
     def __init__(self, env=None):
         iter_runner = os.path.join(ITERATIONS_RUNNER_DIR,
                                    "iterations_runner_c")
@@ -325,7 +416,8 @@ class NativeCodeVMDef(BaseVMDef):
         args = [self.iterations_runner,
                 benchmark_path, str(iterations), str(param)]
         return self._run_exec(args, heap_lim_k, stack_lim_k, key,
-                              key_pexec_idx, sync_disks=sync_disks)
+                              key_pexec_idx, sync_disks=sync_disks,
+                              iterations=iterations)
 
     def check_benchmark_files(self, benchmark, entry_point):
         benchmark_path = self._get_benchmark_path(benchmark, entry_point)
@@ -351,7 +443,8 @@ class GenericScriptingVMDef(BaseVMDef):
                                                force_dir=force_dir)
         args = [self.vm_path] + self.extra_vm_args + [self.iterations_runner, script_path, str(iterations), str(param)]
         return self._run_exec(args, heap_lim_k, stack_lim_k, key,
-                              key_pexec_idx, sync_disks=sync_disks)
+                              key_pexec_idx, sync_disks=sync_disks,
+                              iterations=iterations)
 
     def sanity_checks(self):
         BaseVMDef.sanity_checks(self)
@@ -366,6 +459,9 @@ class GenericScriptingVMDef(BaseVMDef):
 
 class JavaVMDef(BaseVMDef):
     INSTR_MARKER = "@@@ JDK_EVENTS: "
+    SUPPORTS_RESULTS_CHANNEL = True
+    SUPPORTS_INNER_REPEATS = True
+    CALIBRATION_BENCHMARK = "NullBenchmark"
 
     def __init__(self, vm_path, env=None, instrument=False):
         self.vm_path = vm_path
@@ -398,7 +494,7 @@ class JavaVMDef(BaseVMDef):
         return self._run_exec(args, heap_lim_k, stack_lim_k, key,
                               key_pexec_idx,
                               bench_env_changes=bench_env_changes,
-                              sync_disks=sync_disks)
+                              sync_disks=sync_disks, iterations=iterations)
 
     def sanity_checks(self):
         BaseVMDef.sanity_checks(self)
@@ -500,6 +596,10 @@ class GraalVMDef(JavaVMDef):
         self._check_jvmci_server_enabled()
 
 class PythonVMDef(GenericScriptingVMDef):
+    SUPPORTS_RESULTS_CHANNEL = True
+    SUPPORTS_INNER_REPEATS = True
+    CALIBRATION_BENCHMARK = "null.py"
+
     def __init__(self, vm_path, env=None, instrument=False):
         GenericScriptingVMDef.__init__(self, vm_path, "iterations_runner.py",
                                        env=env, instrument=instrument)
@@ -636,6 +736,10 @@ class PyPyVMDef(PythonVMDef):
 
 
 class LuaVMDef(GenericScriptingVMDef):
+    SUPPORTS_RESULTS_CHANNEL = True
+    SUPPORTS_INNER_REPEATS = True
+    CALIBRATION_BENCHMARK = "null.lua"
+
     def __init__(self, vm_path, env=None):
         GenericScriptingVMDef.__init__(self, vm_path, "iterations_runner.lua",
                                        env=env)
@@ -650,6 +754,9 @@ class LuaVMDef(GenericScriptingVMDef):
                                                 sync_disks=sync_disks)
 
 class PHPVMDef(GenericScriptingVMDef):
+    SUPPORTS_RESULTS_CHANNEL = True
+    CALIBRATION_BENCHMARK = "null.php"
+
     def __init__(self, vm_path, env=None):
         GenericScriptingVMDef.__init__(self, vm_path, "iterations_runner.php",
                                        env=env)
@@ -664,6 +771,9 @@ class PHPVMDef(GenericScriptingVMDef):
                                                 sync_disks=sync_disks)
 
 class RubyVMDef(GenericScriptingVMDef):
+    SUPPORTS_RESULTS_CHANNEL = True
+    CALIBRATION_BENCHMARK = "null.rb"
+
     def __init__(self, vm_path, env=None):
         GenericScriptingVMDef.__init__(self, vm_path, "iterations_runner.rb",
                                        env=env)
@@ -716,6 +826,9 @@ class TruffleRubyVMDef(RubyVMDef):
         self._check_truffle_enabled()
 
 class JavascriptVMDef(GenericScriptingVMDef):
+    SUPPORTS_RESULTS_CHANNEL = True
+    CALIBRATION_BENCHMARK = "null.js"
+
     def __init__(self, vm_path, env=None):
         GenericScriptingVMDef.__init__(self, vm_path, "iterations_runner.js", env=env)
 
@@ -739,7 +852,8 @@ class V8VMDef(JavascriptVMDef):
             [self.iterations_runner, '--', script_path, str(iterations), str(param)]
 
         return self._run_exec(args, heap_lim_k, stack_lim_k, key,
-                              key_pexec_idx, sync_disks=sync_disks)
+                              key_pexec_idx, sync_disks=sync_disks,
+                              iterations=iterations)
 
 
 class SomVMDef(GenericScriptingVMDef):
@@ -17,6 +17,8 @@
 #include <fcntl.h>
 #include <stdint.h>
 #include <stdbool.h>
+#include <string.h>
+#include <limits.h>
 
 #include "libkruntime.h"
 
@@ -52,6 +54,48 @@ static struct krun_data krun_mdata[2];
 /* Number of per-core performance counter measurements */
 static int krun_num_cores = 0;
 
+/*
+ * Per-iteration storage, allocated by krun_init_iters() and filled in by each
+ * krun_measure(1). It is laid out as a Krun results channel (see
+ * krun/results_channel.py), so that it can be handed to Krun as-is: a header,
+ * then the wallclock times, then the core cycle, APERF and MPERF counts, core
+ * by core.
+ */
+#define KRUN_STORE_MAGIC                "KRUNCHN\x01"
+#define KRUN_STORE_MAGIC_SIZE           8
+#define KRUN_STORE_HEADER_SIZE          64
+#define KRUN_STORE_STATE_INCOMPLETE     1
+#define KRUN_STORE_STATE_COMPLETE       2
+#define KRUN_RESULTS_CHANNEL_ENV        "KRUN_RESULTS_CHANNEL"
+
+/*
+ * How many times the iterations runner should call the benchmark in each
+ * measured in-process iteration: a number, or "auto:<secs>" for as many as it
+ * takes for an iteration to take at least <secs> seconds.
+ */
+#define KRUN_INNER_REPEATS_ENV          "KRUN_INNER_REPEATS"
+#define KRUN_INNER_REPEATS_AUTO         "auto:"
+/* So that auto mode ends, even if the benchmark is optimised away */
+#define KRUN_MAX_INNER_REPEATS          (1 << 30)
+
+struct krun_store_header {
+    char        magic[KRUN_STORE_MAGIC_SIZE];
+    uint64_t    num_iters;
+    uint64_t    num_cores;
+    uint64_t    state;
+    uint64_t    inner_repeats;
+};
+
+static char *krun_store = NULL;
+static size_t krun_store_size = 0;
+static int krun_store_iters = 0;
+static int krun_store_next_iter = 0;
+/* Views of the arrays in the storage, as krun_get_deltas() expects */
+static double *krun_store_wallclock = NULL;
+static uint64_t **krun_store_core_cycles = NULL;
+static uint64_t **krun_store_aperf = NULL;
+static uint64_t **krun_store_mperf = NULL;
+
 // Private prototypes
 #ifdef __linux__
 static void     krun_mdata_bounds_check(int mdata_idx);
@@ -61,6 +105,9 @@ static void     krun_core_bounds_check(int core);
 #endif // MSRS
 #endif // __linux__
 void            krun_check_mdata(void);
+static void     krun_store_iteration(void);
+static void     krun_store_finish(void);
+static void     krun_print_store_counts(const char *name, uint64_t **counts);
 
 /* Helper functions */
 void *
@@ -140,11 +187,39 @@ Java_IterationsRunner_JNI_1krun_1init(JNIEnv *e, jclass c) {
     krun_init();
 }
 
+JNIEXPORT void JNICALL
+Java_IterationsRunner_JNI_1krun_1init_1iters(JNIEnv *e, jclass c,
+        jint num_iters) {
+    krun_init_iters(num_iters);
+}
+
 JNIEXPORT void JNICALL
 Java_IterationsRunner_JNI_1krun_1done(JNIEnv *e, jclass c) {
     krun_done();
 }
 
+JNIEXPORT void JNICALL
+Java_IterationsRunner_JNI_1krun_1export_1store(JNIEnv *e, jclass c) {
+    krun_export_store();
+}
+
+JNIEXPORT jint JNICALL
+Java_IterationsRunner_JNI_1krun_1get_1inner_1repeats(JNIEnv *e, jclass c) {
+    return krun_get_inner_repeats();
+}
+
+JNIEXPORT jint JNICALL
+Java_IterationsRunner_JNI_1krun_1next_1inner_1repeats(JNIEnv *e, jclass c,
+        jint inner_repeats, jdouble elapsed) {
+    return krun_next_inner_repeats(inner_repeats, elapsed);
+}
+
+JNIEXPORT void JNICALL
+Java_IterationsRunner_JNI_1krun_1set_1inner_1repeats(JNIEnv *e, jclass c,
+        jint inner_repeats) {
+    krun_set_inner_repeats(inner_repeats);
+}
+
 JNIEXPORT void JNICALL
 Java_IterationsRunner_JNI_1krun_1measure(JNIEnv *e, jclass c, jint mdata_idx) {
     krun_measure(mdata_idx);
@@ -280,9 +355,66 @@ krun_init(void)
 #endif  // __linux__ && defined(MSRS)
 }
 
+/*
+ * As krun_init(), but also allocate storage for the measurements of
+ * 'num_iters' in-process iterations. Each krun_measure(1) then stores the
+ * deltas of its iteration, and krun_export_store() (or krun_dump_store() or
+ * krun_get_store()) hands them over at the end.
+ */
+void
+krun_init_iters(int num_iters)
+{
+    struct krun_store_header *header;
+    uint64_t *counts;
+    int core;
+
+    if (num_iters < 0) {
+        fprintf(stderr, "%s: negative number of iterations\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+
+    krun_init();
+
+    krun_store_size = KRUN_STORE_HEADER_SIZE + sizeof(uint64_t) *
+        (size_t) num_iters * (1 + 3 * (size_t) krun_num_cores);
+    krun_store = krun_xcalloc(krun_store_size, 1);
+    /* Fault in every page now, rather than between iterations */
+    memset(krun_store, 0, krun_store_size);
+
+    header = (struct krun_store_header *) krun_store;
+    memcpy(header->magic, KRUN_STORE_MAGIC, KRUN_STORE_MAGIC_SIZE);
+    header->num_iters = num_iters;
+    header->num_cores = krun_num_cores;
+    header->state = KRUN_STORE_STATE_INCOMPLETE;
+    header->inner_repeats = 1;
+    krun_store_iters = num_iters;
+    krun_store_next_iter = 0;
+
+    krun_store_wallclock = (double *) (krun_store + KRUN_STORE_HEADER_SIZE);
+    counts = (uint64_t *) (krun_store_wallclock + num_iters);
+    krun_store_core_cycles = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
+    krun_store_aperf = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
+    krun_store_mperf = krun_xcalloc(krun_num_cores, sizeof(uint64_t *));
+    for (core = 0; core < krun_num_cores; core++) {
+        krun_store_core_cycles[core] = counts + (size_t) core * num_iters;
+        krun_store_aperf[core] =
+            counts + (size_t) (krun_num_cores + core) * num_iters;
+        krun_store_mperf[core] =
+            counts + (size_t) (2 * krun_num_cores + core) * num_iters;
+    }
+}
+
 void
 krun_done(void)
 {
+    if (krun_store != NULL) {
+        free(krun_store);
+        free(krun_store_core_cycles);
+        free(krun_store_aperf);
+        free(krun_store_mperf);
+        krun_store = NULL;
+    }
+
 #if defined(__linux__) && defined(MSRS)
     int i;
 
@@ -369,6 +501,9 @@ krun_measure(int mdata_idx)
 #endif
     if (mdata_idx == 1) {
         krun_check_mdata();
+        if (krun_store != NULL) {
+            krun_store_iteration();
+        }
     }
 }
 
@@ -479,3 +614,307 @@ krun_get_mperf_double(int mdata_idx, int core)
 {
     return krun_u64_to_double(krun_get_mperf(mdata_idx, core));
 }
+
+/*
+ * Store the deltas between the two measurements (i.e. of one in-process
+ * iteration) at index 'iter' of the caller's arrays. The per-core arguments
+ * are arrays of krun_get_num_cores() arrays, one per core.
+ *
+ * This is equivalent to, but cheaper than, calling the krun_get_*() functions
+ * for each reading and core and subtracting the results. It is especially so
+ * from languages where each call into libkruntime has a cost.
+ */
+void
+krun_get_deltas(int iter, double *wallclock_times, uint64_t **core_cycles,
+    uint64_t **aperf, uint64_t **mperf)
+{
+#if defined(__linux__) && defined(MSRS)
+    struct krun_data *start = &krun_mdata[0], *stop = &krun_mdata[1];
+    int core;
+
+    for (core = 0; core < krun_num_cores; core++) {
+        core_cycles[core][iter] =
+            (stop->core_cycles[core] & krun_pctr_val_mask) -
+            (start->core_cycles[core] & krun_pctr_val_mask);
+        aperf[core][iter] = stop->aperf[core] - start->aperf[core];
+        mperf[core][iter] = stop->mperf[core] - start->mperf[core];
+    }
+#endif // defined(__linux__) && defined(MSRS)
+    wallclock_times[iter] = krun_mdata[1].wallclock - krun_mdata[0].wallclock;
+}
+
+/*
+ * As krun_get_deltas(), but for languages like Lua, where there is no suitable
+ * integer type. A delta which can't be represented exactly as a double causes
+ * an exit(3), as with krun_u64_to_double().
+ */
+void
+krun_get_deltas_double(int iter, double *wallclock_times, double **core_cycles,
+    double **aperf, double **mperf)
+{
+#if defined(__linux__) && defined(MSRS)
+    struct krun_data *start = &krun_mdata[0], *stop = &krun_mdata[1];
+    int core;
+
+    for (core = 0; core < krun_num_cores; core++) {
+        core_cycles[core][iter] = krun_u64_to_double(
+            (stop->core_cycles[core] & krun_pctr_val_mask) -
+            (start->core_cycles[core] & krun_pctr_val_mask));
+        aperf[core][iter] =
+            krun_u64_to_double(stop->aperf[core] - start->aperf[core]);
+        mperf[core][iter] =
+            krun_u64_to_double(stop->mperf[core] - start->mperf[core]);
+    }
+#endif // defined(__linux__) && defined(MSRS)
+    wallclock_times[iter] = krun_mdata[1].wallclock - krun_mdata[0].wallclock;
+}
+
+/*
+ * Store the deltas of the iteration just measured (see krun_init_iters()).
+ */
+static void
+krun_store_iteration(void)
+{
+    if (krun_store_next_iter >= krun_store_iters) {
+        fprintf(stderr, "%s: more iterations measured than "
+                "krun_init_iters() allowed for\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+    krun_get_deltas(krun_store_next_iter++, krun_store_wallclock,
+        krun_store_core_cycles, krun_store_aperf, krun_store_mperf);
+}
+
+/*
+ * Returns how many times Krun asked for the benchmark to be called in each
+ * measured in-process iteration, or 0 in auto mode, where the iterations
+ * runner should find out with krun_next_inner_repeats().
+ */
+int
+krun_get_inner_repeats(void)
+{
+    char *val, *endptr;
+    long inner_repeats;
+
+    val = getenv(KRUN_INNER_REPEATS_ENV);
+    if (val == NULL) {
+        return (1);
+    }
+    if (strncmp(val, KRUN_INNER_REPEATS_AUTO,
+                strlen(KRUN_INNER_REPEATS_AUTO)) == 0) {
+        return (0);
+    }
+
+    errno = 0;
+    inner_repeats = strtol(val, &endptr, 10);
+    if ((errno != 0) || (endptr == val) || (*endptr != 0) ||
+            (inner_repeats < 1) || (inner_repeats > INT_MAX)) {
+        fprintf(stderr, "%s: bad %s: %s\n", __func__, KRUN_INNER_REPEATS_ENV,
+                val);
+        exit(EXIT_FAILURE);
+    }
+    return ((int) inner_repeats);
+}
+
+/*
+ * In auto mode, the iterations runner calls the benchmark in unmeasured
+ * batches, starting with one call, until a batch is long enough. Given that
+ * a batch of 'inner_repeats' calls took 'elapsed' seconds, returns
+ * 'inner_repeats' if it is long enough, and otherwise how many calls the next
+ * batch should make.
+ */
+int
+krun_next_inner_repeats(int inner_repeats, double elapsed)
+{
+    char *val, *endptr;
+    double target;
+
+    val = getenv(KRUN_INNER_REPEATS_ENV);
+    if ((val == NULL) || (strncmp(val, KRUN_INNER_REPEATS_AUTO,
+                strlen(KRUN_INNER_REPEATS_AUTO)) != 0)) {
+        fprintf(stderr, "%s: not in auto mode\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+    val += strlen(KRUN_INNER_REPEATS_AUTO);
+
+    errno = 0;
+    target = strtod(val, &endptr);
+    if ((errno != 0) || (endptr == val) || (*endptr != 0) || (target <= 0)) {
+        fprintf(stderr, "%s: bad %s target: %s\n", __func__,
+                KRUN_INNER_REPEATS_ENV, val);
+        exit(EXIT_FAILURE);
+    }
+
+    if ((elapsed >= target) || (inner_repeats >= KRUN_MAX_INNER_REPEATS)) {
+        return (inner_repeats);
+    }
+    return (inner_repeats * 2);
+}
+
+/*
+ * Record in the storage that the benchmark was called 'inner_repeats' times
+ * in each measured in-process iteration.
+ */
+void
+krun_set_inner_repeats(int inner_repeats)
+{
+    struct krun_store_header *header;
+
+    if (krun_store == NULL) {
+        fprintf(stderr, "%s: krun_init_iters() was not called\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+    if (inner_repeats < 1) {
+        fprintf(stderr, "%s: inner repeats must be positive\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+
+    header = (struct krun_store_header *) krun_store;
+    header->inner_repeats = inner_repeats;
+}
+
+/*
+ * Mark the storage complete, if every iteration was measured.
+ */
+static void
+krun_store_finish(void)
+{
+    struct krun_store_header *header;
+
+    if (krun_store == NULL) {
+        fprintf(stderr, "%s: krun_init_iters() was not called\n", __func__);
+        exit(EXIT_FAILURE);
+    }
+
+    header = (struct krun_store_header *) krun_store;
+    if (krun_store_next_iter == krun_store_iters) {
+        header->state = KRUN_STORE_STATE_COMPLETE;
+    } else {
+        header->state = KRUN_STORE_STATE_INCOMPLETE;
+    }
+}
+
+/*
+ * Returns a pointer to the storage, and its size in bytes in '*size'. The
+ * storage is freed by krun_done().
+ */
+const void *
+krun_get_store(size_t *size)
+{
+    krun_store_finish();
+    *size = krun_store_size;
+    return (krun_store);
+}
+
+/*
+ * Write the storage to the file descriptor 'fd'.
+ */
+void
+krun_dump_store(int fd)
+{
+    const char *buf;
+    size_t size, written = 0;
+    ssize_t n;
+
+    buf = krun_get_store(&size);
+    while (written < size) {
+        n = write(fd, buf + written, size - written);
+        if (n == -1) {
+            if (errno == EINTR) {
+                continue;
+            }
+            perror("write");
+            exit(EXIT_FAILURE);
+        }
+        written += n;
+    }
+}
+
+/*
+ * Print the per-core 'counts' of the storage on stdout as the JSON member
+ * 'name'.
+ */
+static void
+krun_print_store_counts(const char *name, uint64_t **counts)
+{
+    int core, iter_num;
+
+    fprintf(stdout, "\"%s\": [", name);
+    for (core = 0; core < krun_num_cores; core++) {
+        fprintf(stdout, "[");
+        for (iter_num = 0; iter_num < krun_store_iters; iter_num++) {
+            fprintf(stdout, "%" PRIu64, counts[core][iter_num]);
+            if (iter_num < krun_store_iters - 1) {
+                fprintf(stdout, ", ");
+            }
+        }
+        fprintf(stdout, "]");
+        if (core < krun_num_cores - 1) {
+            fprintf(stdout, ", ");
+        }
+    }
+    fprintf(stdout, "]");
+}
+
+/*
+ * Print the storage on stdout as the JSON object that iterations runners
+ * print, with the number of inner repeats under "inner_repeats".
+ */
+void
+krun_print_store_json(void)
+{
+    struct krun_store_header *header;
+    int iter_num;
+
+    krun_store_finish();
+    header = (struct krun_store_header *) krun_store;
+    if (header->state != KRUN_STORE_STATE_COMPLETE) {
+        fprintf(stderr, "%s: only %d of %d iterations were measured\n",
+            __func__, krun_store_next_iter, krun_store_iters);
+        exit(EXIT_FAILURE);
+    }
+
+    fprintf(stdout, "{\"wallclock_times\": [");
+    for (iter_num = 0; iter_num < krun_store_iters; iter_num++) {
+        fprintf(stdout, "%.17g", krun_store_wallclock[iter_num]);
+        if (iter_num < krun_store_iters - 1) {
+            fprintf(stdout, ", ");
+        }
+    }
+    fprintf(stdout, "], ");
+    krun_print_store_counts("core_cycle_counts", krun_store_core_cycles);
+    fprintf(stdout, ", ");
+    krun_print_store_counts("aperf_counts", krun_store_aperf);
+    fprintf(stdout, ", ");
+    krun_print_store_counts("mperf_counts", krun_store_mperf);
+    fprintf(stdout, ", \"inner_repeats\": %" PRIu64 "}\n",
+        header->inner_repeats);
+    fflush(stdout);
+}
+
+/*
+ * Hand the storage to Krun: into the results channel, if Krun made one, and
+ * on stdout as JSON otherwise. This is all an iterations runner need do to
+ * emit its measurements.
+ */
+void
+krun_export_store(void)
+{
+    char *path;
+    int fd;
+
+    path = getenv(KRUN_RESULTS_CHANNEL_ENV);
+    if (path == NULL) {
+        krun_print_store_json();
+        return;
+    }
+
+    if ((fd = open(path, O_WRONLY)) == -1) {
+        perror("open");
+        exit(EXIT_FAILURE);
+    }
+    krun_dump_store(fd);
+    if (close(fd) == -1) {
+        perror("close");
+        exit(EXIT_FAILURE);
+    }
+}
@@ -16,6 +16,7 @@ extern "C" {
 
 // Public API
 void krun_init(void);
+void krun_init_iters(int num_iters);
 void krun_done(void);
 void krun_measure(int mdata_idx);
 double krun_get_wallclock(int mdata_idx);
@@ -25,7 +26,18 @@ uint64_t krun_get_mperf(int mdata_idx, int core);
 double krun_get_core_cycles_double(int mdata_idx, int core);
 double krun_get_aperf_double(int mdata_idx, int core);
 double krun_get_mperf_double(int mdata_idx, int core);
+void krun_get_deltas(int iter, double *wallclock_times, uint64_t **core_cycles,
+    uint64_t **aperf, uint64_t **mperf);
+void krun_get_deltas_double(int iter, double *wallclock_times,
+    double **core_cycles, double **aperf, double **mperf);
 int krun_get_num_cores(void);
+const void *krun_get_store(size_t *size);
+void krun_dump_store(int fd);
+void krun_print_store_json(void);
+void krun_export_store(void);
+int krun_get_inner_repeats(void);
+int krun_next_inner_repeats(int inner_repeats, double elapsed);
+void krun_set_inner_repeats(int inner_repeats);
 void *krun_xcalloc(size_t nmemb, size_t size);
 
 // The are not intended for general public use, but exposed for tests.
@@ -39,7 +51,12 @@ uint64_t krun_read_core_cycles(int core);
 
 #ifdef WITH_JAVA
 JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1init(JNIEnv *e, jclass c);
+JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1init_1iters(JNIEnv *e, jclass c, jint num_iters);
+JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1export_1store(JNIEnv *e, jclass c);
 JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1done(JNIEnv *e, jclass c);
+JNIEXPORT jint JNICALL Java_IterationsRunner_JNI_1krun_1get_1inner_1repeats(JNIEnv *e, jclass c);
+JNIEXPORT jint JNICALL Java_IterationsRunner_JNI_1krun_1next_1inner_1repeats(JNIEnv *e, jclass c, jint inner_repeats, jdouble elapsed);
+JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1set_1inner_1repeats(JNIEnv *e, jclass c, jint inner_repeats);
 JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1measure(JNIEnv *e, jclass c, jint mindex);
 JNIEXPORT jdouble JNICALLJava_IterationsRunner_JNI_1krun_1get_1wallclock(JNIEnv *e, jclass c, jint mindex);
 JNIEXPORT jdouble JNICALLJava_IterationsRunner_JNI_1krun_1clock_1gettime_1monotonic(JNIEnv *e, jclass c);
@@ -47,6 +64,7 @@ JNIEXPORT jlong JNICALL Java_IterationsRunner_JNI_1krun_1get_1core_1cycles(JNIEn
 JNIEXPORT jlong JNICALL Java_IterationsRunner_JNI_1krun_1get_1aperf(JNIEnv *e, jclass c, jint mindex, jint core);
 JNIEXPORT jlong JNICALL Java_IterationsRunner_JNI_1krun_1get_1mperf(JNIEnv *e, jclass c, jint mindex, jint core);
 JNIEXPORT jint JNICALL Java_IterationsRunner_JNI_1krun_1get_1num_1cores(JNIEnv *e, jclass c);
+JNIEXPORT void JNICALL Java_IterationsRunner_JNI_1krun_1get_1deltas(JNIEnv *e, jclass c, jint iter, jdoubleArray wallclock_times, jobjectArray core_cycles, jobjectArray aperf, jobjectArray mperf);
 #endif  // WITH_JAVA
 
 #endif  // __LIBKRUNTIME_H
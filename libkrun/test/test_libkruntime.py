@@ -1,3 +1,4 @@
+import json
 import subprocess32
 import os
 import sys
@@ -16,11 +17,14 @@ PLATFORM = detect_platform(None, None)
 
 MSR_SUPPORT = PLATFORM.num_per_core_measurements > 0
 
-def invoke_c_prog(mode):
+def invoke_c_prog(mode, env=None):
     assert os.path.exists(TEST_PROG_PATH)
 
+    if env is not None:
+        env = dict(os.environ, **env)
     p = subprocess32.Popen(TEST_PROG_PATH + " " + mode,
-        stderr=subprocess32.PIPE, stdout=subprocess32.PIPE, shell=True)
+        stderr=subprocess32.PIPE, stdout=subprocess32.PIPE, shell=True,
+        env=env)
     out, err = p.communicate()
     return p.returncode, out.strip(), err.strip()
 
@@ -155,3 +159,53 @@ class TestLibKrunTime(object):
             expect += 2 * PLATFORM.num_cpus * 2
 
         assert len(dct) == expect
+
+    def test_deltas(self):
+        rv, out, _ = invoke_c_prog("deltas")
+        assert rv == 0
+        dct = parse_keyvals(out, doubles=True)
+        assert dct["wallclock_delta"] >= 0
+        assert dct["mismatches"] == 0
+
+    def test_store(self):
+        rv, out, _ = invoke_c_prog("store")
+        assert rv == 0
+        dct = parse_keyvals(out)
+        assert dct["size"] == 64 + 8 * 2 * (1 + 3 * dct["num_cores"])
+        assert dct["mismatches"] == 0
+
+    def test_export_store(self):
+        """Without a results channel, the store is printed as JSON"""
+
+        rv, out, _ = invoke_c_prog("export_store")
+        assert rv == 0
+        dct = json.loads(out)
+        assert len(dct["wallclock_times"]) == 2
+        num_cores = PLATFORM.num_per_core_measurements
+        for key in "core_cycle_counts", "aperf_counts", "mperf_counts":
+            assert len(dct[key]) == num_cores
+            assert all(len(core) == 2 for core in dct[key])
+        assert dct["inner_repeats"] == 1
+
+    def test_inner_repeats0001(self):
+        rv, out, _ = invoke_c_prog("inner_repeats")
+        assert rv == 0
+        assert parse_keyvals(out) == {"inner_repeats": 1, "stored": 1}
+
+        rv, out, _ = invoke_c_prog("inner_repeats",
+                                   {"KRUN_INNER_REPEATS": "16"})
+        assert rv == 0
+        assert parse_keyvals(out) == {"inner_repeats": 16, "stored": 16}
+
+    def test_inner_repeats0002(self):
+        rv, out, _ = invoke_c_prog("inner_repeats",
+                                   {"KRUN_INNER_REPEATS": "auto:0.5"})
+        assert rv == 0
+        assert parse_keyvals(out) == {"inner_repeats": 0, "next_short": 8,
+                                      "next_long": 4, "stored": 4}
+
+    def test_inner_repeats0003(self):
+        rv, _, err = invoke_c_prog("inner_repeats",
+                                   {"KRUN_INNER_REPEATS": "lots"})
+        assert rv != 0
+        assert "bad KRUN_INNER_REPEATS: lots" in err
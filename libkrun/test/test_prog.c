@@ -20,6 +20,9 @@ void test_mperf(void);
 void test_core_bounds_check(void);
 void test_mdata_index_bounds_check(void);
 void test_read_everything_all_cores(void);
+void test_deltas(void);
+void test_store(void);
+void test_inner_repeats(void);
 
 void usage();
 
@@ -39,6 +42,10 @@ usage()
     printf("  test_prog core_bounds_check\n");
     printf("  test_prog mdata_index_bounds_check\n");
     printf("  test_prog read_everything_all_cores\n");
+    printf("  test_prog deltas\n");
+    printf("  test_prog store\n");
+    printf("  test_prog export_store\n");
+    printf("  test_prog inner_repeats\n");
 }
 
 int
@@ -100,6 +107,26 @@ main(int argc, char **argv)
         krun_init();
         test_read_everything_all_cores();
         krun_done();
+    } else if (strcmp(mode, "deltas") == 0) {
+        krun_init();
+        test_deltas();
+        krun_done();
+    } else if (strcmp(mode, "store") == 0) {
+        krun_init_iters(2);
+        test_store();
+        krun_done();
+    } else if (strcmp(mode, "export_store") == 0) {
+        krun_init_iters(2);
+        krun_measure(0);
+        krun_measure(1);
+        krun_measure(0);
+        krun_measure(1);
+        krun_export_store();
+        krun_done();
+    } else if (strcmp(mode, "inner_repeats") == 0) {
+        krun_init_iters(1);
+        test_inner_repeats();
+        krun_done();
     } else {
         usage();
         rv = EXIT_FAILURE;
@@ -272,3 +299,165 @@ test_read_everything_all_cores(void)
         }
     }
 }
+
+/*
+ * Check krun_get_deltas() and krun_get_deltas_double() agree with the deltas
+ * computed from the individual readings. The deltas are stored at index 1, to
+ * check the 'iter' argument is honoured.
+ */
+void
+test_deltas(void)
+{
+    int num_cores = krun_get_num_cores();
+    int core, mismatches = 0;
+    double wallclock[2], wallclock_d[2];
+    uint64_t **cycles, **aperf, **mperf;
+    double **cycles_d, **aperf_d, **mperf_d;
+
+    cycles = krun_xcalloc(num_cores, sizeof(uint64_t *));
+    aperf = krun_xcalloc(num_cores, sizeof(uint64_t *));
+    mperf = krun_xcalloc(num_cores, sizeof(uint64_t *));
+    cycles_d = krun_xcalloc(num_cores, sizeof(double *));
+    aperf_d = krun_xcalloc(num_cores, sizeof(double *));
+    mperf_d = krun_xcalloc(num_cores, sizeof(double *));
+    for (core = 0; core < num_cores; core++) {
+        cycles[core] = krun_xcalloc(2, sizeof(uint64_t));
+        aperf[core] = krun_xcalloc(2, sizeof(uint64_t));
+        mperf[core] = krun_xcalloc(2, sizeof(uint64_t));
+        cycles_d[core] = krun_xcalloc(2, sizeof(double));
+        aperf_d[core] = krun_xcalloc(2, sizeof(double));
+        mperf_d[core] = krun_xcalloc(2, sizeof(double));
+    }
+
+    krun_measure(0);
+    krun_measure(1);
+    krun_get_deltas(1, wallclock, cycles, aperf, mperf);
+    krun_get_deltas_double(1, wallclock_d, cycles_d, aperf_d, mperf_d);
+
+    if ((wallclock[1] != krun_get_wallclock(1) - krun_get_wallclock(0)) ||
+            (wallclock_d[1] != wallclock[1])) {
+        mismatches++;
+    }
+    for (core = 0; core < num_cores; core++) {
+        if ((cycles[core][1] != krun_get_core_cycles(1, core) -
+                krun_get_core_cycles(0, core)) ||
+                (aperf[core][1] != krun_get_aperf(1, core) -
+                krun_get_aperf(0, core)) ||
+                (mperf[core][1] != krun_get_mperf(1, core) -
+                krun_get_mperf(0, core)) ||
+                (cycles_d[core][1] != (double) cycles[core][1]) ||
+                (aperf_d[core][1] != (double) aperf[core][1]) ||
+                (mperf_d[core][1] != (double) mperf[core][1])) {
+            mismatches++;
+        }
+    }
+
+    printf("wallclock_delta=%f\n", wallclock[1]);
+    printf("mismatches=%d\n", mismatches);
+
+    for (core = 0; core < num_cores; core++) {
+        free(cycles[core]);
+        free(aperf[core]);
+        free(mperf[core]);
+        free(cycles_d[core]);
+        free(aperf_d[core]);
+        free(mperf_d[core]);
+    }
+    free(cycles);
+    free(aperf);
+    free(mperf);
+    free(cycles_d);
+    free(aperf_d);
+    free(mperf_d);
+}
+
+/*
+ * Check the measurements libkruntime stores in krun_measure(1) agree with the
+ * deltas computed from the individual readings, and that the store has the
+ * layout of a Krun results channel (see krun/results_channel.py).
+ */
+void
+test_store(void)
+{
+    int num_cores = krun_get_num_cores();
+    int iter, core, mismatches = 0;
+    size_t size;
+    const char *store;
+    const uint64_t *header, *counts;
+    const double *wallclock;
+    double wallclock_deltas[2];
+    uint64_t *cycle_deltas, *aperf_deltas, *mperf_deltas;
+
+    cycle_deltas = krun_xcalloc(2 * num_cores, sizeof(uint64_t));
+    aperf_deltas = krun_xcalloc(2 * num_cores, sizeof(uint64_t));
+    mperf_deltas = krun_xcalloc(2 * num_cores, sizeof(uint64_t));
+
+    for (iter = 0; iter < 2; iter++) {
+        krun_measure(0);
+        krun_measure(1);
+        wallclock_deltas[iter] = krun_get_wallclock(1) - krun_get_wallclock(0);
+        for (core = 0; core < num_cores; core++) {
+            cycle_deltas[core * 2 + iter] = krun_get_core_cycles(1, core) -
+                krun_get_core_cycles(0, core);
+            aperf_deltas[core * 2 + iter] = krun_get_aperf(1, core) -
+                krun_get_aperf(0, core);
+            mperf_deltas[core * 2 + iter] = krun_get_mperf(1, core) -
+                krun_get_mperf(0, core);
+        }
+    }
+
+    store = krun_get_store(&size);
+    header = (const uint64_t *) (store + 8);
+    wallclock = (const double *) (store + 64);
+    counts = (const uint64_t *) (wallclock + 2);
+
+    if ((memcmp(store, "KRUNCHN\x01", 8) != 0) || (header[0] != 2) ||
+            (header[1] != (uint64_t) num_cores) || (header[2] != 2)) {
+        mismatches++;
+    }
+    for (iter = 0; iter < 2; iter++) {
+        if (wallclock[iter] != wallclock_deltas[iter]) {
+            mismatches++;
+        }
+    }
+    for (core = 0; core < 2 * num_cores; core++) {
+        if ((counts[core] != cycle_deltas[core]) ||
+                (counts[2 * num_cores + core] != aperf_deltas[core]) ||
+                (counts[4 * num_cores + core] != mperf_deltas[core])) {
+            mismatches++;
+        }
+    }
+
+    printf("size=%zu\n", size);
+    printf("num_cores=%d\n", num_cores);
+    printf("mismatches=%d\n", mismatches);
+
+    free(cycle_deltas);
+    free(aperf_deltas);
+    free(mperf_deltas);
+}
+
+/*
+ * Check the inner repeats Krun asks for in KRUN_INNER_REPEATS are read, and
+ * that those the runner settles on are recorded in the store header.
+ */
+void
+test_inner_repeats(void)
+{
+    int inner_repeats;
+    size_t size;
+    const char *store;
+
+    inner_repeats = krun_get_inner_repeats();
+    printf("inner_repeats=%d\n", inner_repeats);
+    if (inner_repeats == 0) {
+        /* Auto mode: a batch of 4 calls is tried, taking 0s, then 1s */
+        printf("next_short=%d\n", krun_next_inner_repeats(4, 0.0));
+        printf("next_long=%d\n", krun_next_inner_repeats(4, 1.0));
+        inner_repeats = 4;
+    }
+    krun_set_inner_repeats(inner_repeats);
+
+    store = krun_get_store(&size);
+    printf("stored=%" PRIu64 "\n", ((const uint64_t *) (store + 8))[3]);
+}
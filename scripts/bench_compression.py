@@ -0,0 +1,120 @@
+#!/usr/bin/env python2.7
+
+"""Benchmark the compression codecs Krun can use for results files.
+
+Usage: bench_compression.py [options] [codec ...]
+
+A synthetic results file is generated, with a shape given by the options, and
+each codec (default: all available codecs at a few levels) is used to
+compress and then decompress it. For each codec, the compression and
+decompression throughput (in MiB/s of uncompressed JSON) and the compression
+ratio are reported.
+
+The default shape (20 keys, 10 process executions, 2000 in-process iterations
+and 4 cores) is a modest campaign. Scale the options up to match yours.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from krun.compression import get_codec, lzma
+
+DEFAULT_CODECS = ["none", "gzip:1", "gzip:6", "gzip:9", "bz2:1", "bz2:9"]
+if lzma is not None:
+    DEFAULT_CODECS.extend(["xz:0", "xz:6"])
+
+MIB = 1024.0 * 1024
+
+
+def make_results(n_keys, n_pexecs, n_iters, n_cores, seed):
+    """Make a dict shaped like a results file, with plausible looking (i.e.
+    noisy, but not random) measurements."""
+
+    rng = random.Random(seed)
+    results = {
+        "config": "# synthetic\n" * 50,
+        "audit": {"uname": "Linux"},
+        "error_flag": False,
+        "wallclock_times": {},
+        "core_cycle_counts": {},
+        "aperf_counts": {},
+        "mperf_counts": {},
+        "pexec_flags": {},
+        "eta_estimates": {},
+    }
+    for key_idx in xrange(n_keys):
+        key = "bench%d:vm:default" % key_idx
+        base = rng.uniform(0.01, 2.0)
+        for section in ("wallclock_times", "core_cycle_counts",
+                        "aperf_counts", "mperf_counts"):
+            results[section][key] = []
+        for pexec_idx in xrange(n_pexecs):
+            wcts = [float("%.6f" % (base * rng.gauss(1.0, 0.01)))
+                    for _ in xrange(n_iters)]
+            results["wallclock_times"][key].append(wcts)
+            for section in ("core_cycle_counts", "aperf_counts",
+                            "mperf_counts"):
+                per_core = []
+                for core_idx in xrange(n_cores):
+                    busy = core_idx == 0
+                    per_core.append([int(t * 3.4e9 if busy else
+                                         rng.randint(1000, 100000))
+                                     for t in wcts])
+                results[section][key].append(per_core)
+        results["pexec_flags"][key] = ["C"] * n_pexecs
+        results["eta_estimates"][key] = [base * n_iters] * n_pexecs
+    return results
+
+
+def bench_codec(codec, data, repeats):
+    best_comp = best_decomp = float("inf")
+    for _ in xrange(repeats):
+        start = time.time()
+        compressed = codec.compress(data)
+        best_comp = min(best_comp, time.time() - start)
+
+        start = time.time()
+        decompressed = codec.decompress(compressed)
+        best_decomp = min(best_decomp, time.time() - start)
+        assert decompressed == data
+    return best_comp, best_decomp, len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark results file compression codecs.")
+    parser.add_argument("--keys", type=int, default=20)
+    parser.add_argument("--pexecs", type=int, default=10)
+    parser.add_argument("--iters", type=int, default=2000)
+    parser.add_argument("--cores", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Repetitions per codec. The best time is used.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("codecs", nargs="*", default=DEFAULT_CODECS,
+                        help="Codec specs, e.g. gzip:6")
+    args = parser.parse_args()
+
+    codecs = [get_codec(spec) for spec in args.codecs]
+
+    sys.stderr.write("Generating synthetic results...\n")
+    results = make_results(args.keys, args.pexecs, args.iters, args.cores,
+                           args.seed)
+    data = json.dumps(results, indent=1, sort_keys=True)
+    print("Uncompressed JSON: %.1f MiB" % (len(data) / MIB))
+    print("")
+    print("%-8s %14s %14s %8s %10s" % ("codec", "comp MiB/s", "decomp MiB/s",
+                                       "ratio", "size MiB"))
+    for codec in codecs:
+        comp, decomp, size = bench_codec(codec, data, args.repeats)
+        print("%-8s %14.1f %14.1f %8.2f %10.2f" % (
+            codec, len(data) / MIB / comp, len(data) / MIB / decomp,
+            float(len(data)) / size, size / MIB))
+
+
+if __name__ == "__main__":
+    main()
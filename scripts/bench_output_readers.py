@@ -0,0 +1,119 @@
+#!/usr/bin/env python2.7
+
+"""Benchmark the ways Krun can read the output of benchmark processes.
+
+Usage: bench_output_readers.py [options] [reader ...]
+
+A child process writes synthetic output (JSON-like text on stdout, and lines
+on stderr, as an instrumented VM would), which is read with each reader
+(default: all of them, see the CHILD_OUTPUT_READER config option). For each
+reader, the throughput (in MiB/s of output) and the peak memory use of the
+process doing the reading are reported. Each read is done in a fresh child
+of this script, so that the peak memory use of one reader doesn't hide that
+of another.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import subprocess32
+from krun.util import CHILD_OUTPUT_READERS
+
+MIB = 1024.0 * 1024
+
+# Writes argv[1] MiB to stdout and argv[2] MiB to stderr, argv[3] bytes at a
+# time, interleaved.
+WRITER = r"""
+import sys
+stdout_left, stderr_left = [int(float(n) * 1024 * 1024) for n in sys.argv[1:3]]
+write_sz = int(sys.argv[3])
+out_chunk = ("[" + "1234.567890, " * (write_sz // 13))[:write_sz]
+err_chunk = ("gc: collected 12345 objects in 0.001234s\n" *
+             (write_sz // 42 + 1))[:write_sz]
+while stdout_left > 0 or stderr_left > 0:
+    if stdout_left > 0:
+        sys.stdout.write(out_chunk[:stdout_left])
+        stdout_left -= write_sz
+    if stderr_left > 0:
+        sys.stderr.write(err_chunk[:stderr_left])
+        stderr_left -= write_sz
+"""
+
+
+class _NullPlatform(object):
+    def unbuffer_fd(self, fd):
+        pass
+
+
+def bench_reader(reader, stdout_mib, stderr_mib, write_sz):
+    """Read the output of a writer with 'reader' in a forked child,
+    returning '(secs, bytes read, peak RSS KiB)'"""
+
+    result_r, result_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(result_r)
+        proc = subprocess32.Popen(
+            [sys.executable, "-c", WRITER, str(stdout_mib), str(stderr_mib),
+             str(write_sz)], stdout=subprocess32.PIPE, stderr=subprocess32.PIPE)
+        start = time.time()
+        stdout, stderr, rc, _ = reader(proc, _NullPlatform(),
+                                       print_stderr=False)
+        elapsed = time.time() - start
+        assert rc == 0
+        os.write(result_w, "%r %d" % (elapsed, len(stdout) + len(stderr)))
+        os._exit(0)
+
+    os.close(result_w)
+    with os.fdopen(result_r) as f:
+        result = f.read()
+    _, status, rusage = os.wait4(pid, 0)
+    if status != 0:
+        sys.exit("reader failed")
+    elapsed, num_bytes = result.split()
+    maxrss = rusage.ru_maxrss
+    if sys.platform.startswith("darwin"):
+        maxrss /= 1024  # Bytes, not KiB.
+    return float(elapsed), int(num_bytes), maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark child output readers.")
+    parser.add_argument("--stdout-mib", type=float, default=64)
+    parser.add_argument("--stderr-mib", type=float, default=16)
+    parser.add_argument("--write-size", type=int, default=4096,
+                        help="Bytes the child writes at a time.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Repetitions per reader. The best time is used.")
+    parser.add_argument("readers", nargs="*",
+                        default=sorted(CHILD_OUTPUT_READERS),
+                        help="Readers, e.g. poll")
+    args = parser.parse_args()
+
+    for name in args.readers:
+        if name not in CHILD_OUTPUT_READERS:
+            sys.exit("unknown reader: %s" % name)
+
+    print("Output: %.1f MiB stdout, %.1f MiB stderr, in %d byte writes" %
+          (args.stdout_mib, args.stderr_mib, args.write_size))
+    print("")
+    print("%-8s %10s %14s" % ("reader", "MiB/s", "peak RSS MiB"))
+    for name in args.readers:
+        best, peak = float("inf"), 0
+        for _ in xrange(args.repeats):
+            elapsed, num_bytes, maxrss = bench_reader(
+                CHILD_OUTPUT_READERS[name], args.stdout_mib,
+                args.stderr_mib, args.write_size)
+            best = min(best, elapsed)
+            peak = max(peak, maxrss)
+        print("%-8s %10.1f %14.1f" % (name, num_bytes / MIB / best,
+                                      peak / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,12 +20,25 @@ from collections import OrderedDict
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from krun.amperf import check_amperf_ratios
+from krun.results import Results
 
 
 TOLERANCES = [(i + 1) * 0.0005 for i in xrange(80)]
 
 
-def analyse_amperf(jsn, busy_thresh, output_filename):
+def iter_pexecs(results):
+    """Yield (aperfs, mperfs, wc_times) for each process execution, fetching
+    the measurements one key at a time."""
+
+    for bench in results.pexec_flags:
+        measurements = results.get_measurements(bench)
+        for pexec_idx in xrange(len(measurements["wallclock_times"])):
+            yield (measurements["aperf_counts"][pexec_idx],
+                   measurements["mperf_counts"][pexec_idx],
+                   measurements["wallclock_times"][pexec_idx])
+
+
+def analyse_amperf(results, busy_thresh, output_filename):
     # Each of these maps a tolerance to a count
     bad_pexecs = OrderedDict()
     bad_iters = OrderedDict()
@@ -33,7 +46,7 @@ def analyse_amperf(jsn, busy_thresh, output_filename):
         # The totals are the same on eacch iteration, so it's OK to use the
         # value from the final iteration
         total_pexecs, total_iters, bad_pexecs[tol], bad_iters[tol] = \
-            _analyse_amperf(jsn, busy_thresh, tol)
+            _analyse_amperf(results, busy_thresh, tol)
 
     bad_pexecs_xs, bad_pexecs_ys = zip(*bad_pexecs.iteritems())
     bad_iters_xs, bad_iters_ys = zip(*bad_iters.iteritems())
@@ -42,7 +55,7 @@ def analyse_amperf(jsn, busy_thresh, output_filename):
     bad_pexecs_xs, bad_pexecs_ys = list(bad_pexecs_xs), list(bad_pexecs_ys)
     bad_iters_xs, bad_iters_ys = list(bad_iters_xs), list(bad_iters_ys)
 
-    ratios = _collect_busy_ratios(jsn, busy_thresh)
+    ratios = _collect_busy_ratios(results, busy_thresh)
 
     dct = {
         "bad_pexecs": [bad_pexecs_xs, bad_pexecs_ys],
@@ -56,7 +69,7 @@ def analyse_amperf(jsn, busy_thresh, output_filename):
         json.dump(dct, fh, indent=2)
 
 
-def _analyse_amperf(jsn, busy_thresh, tol):
+def _analyse_amperf(results, busy_thresh, tol):
     """Returns the number of bad process executions and in-process
     iterations"""
 
@@ -67,42 +80,34 @@ def _analyse_amperf(jsn, busy_thresh, tol):
 
     sys.stdout.write("\ntolerance: %8.5f: " % tol)
     bounds = 1.0 - tol, 1.0 + tol
-    for bench in jsn["wallclock_times"]:
+    for aperfs, mperfs, wc_times in iter_pexecs(results):
         sys.stdout.write(".")
         sys.stdout.flush()
-        for pexec_idx in xrange(len(jsn["wallclock_times"][bench])):
-            total_pexecs += 1
-            aperfs = jsn["aperf_counts"][bench][pexec_idx]
-            mperfs = jsn["mperf_counts"][bench][pexec_idx]
-            wc_times = jsn["wallclock_times"][bench][pexec_idx]
-            total_iters += len(wc_times)
-            res = check_amperf_ratios(aperfs, mperfs, wc_times, busy_thresh,
-                                      bounds)
-            bad_iters = set()
-            for core in res:
-                # iterate different types of badness
-                for idxs in core.violations.itervalues():
-                    bad_iters.update(idxs)
-            if len(bad_iters) > 0:
-                num_bad_pexecs += 1
-            num_bad_iters += len(bad_iters)
+        total_pexecs += 1
+        total_iters += len(wc_times)
+        res = check_amperf_ratios(aperfs, mperfs, wc_times, busy_thresh,
+                                  bounds)
+        bad_iters = set()
+        for core in res:
+            # iterate different types of badness
+            for idxs in core.violations.itervalues():
+                bad_iters.update(idxs)
+        if len(bad_iters) > 0:
+            num_bad_pexecs += 1
+        num_bad_iters += len(bad_iters)
     return total_pexecs, total_iters, num_bad_pexecs, num_bad_iters
 
 
-def _collect_busy_ratios(jsn, busy_thresh):
+def _collect_busy_ratios(results, busy_thresh):
     ratios = []
-    for bench in jsn["wallclock_times"]:
-        bounds = 0, 2  # irrelevant for this mode really.
-        for pexec_idx in xrange(len(jsn["wallclock_times"][bench])):
-            aperfs = jsn["aperf_counts"][bench][pexec_idx]
-            mperfs = jsn["mperf_counts"][bench][pexec_idx]
-            wc_times = jsn["wallclock_times"][bench][pexec_idx]
-            res = check_amperf_ratios(aperfs, mperfs, wc_times, busy_thresh,
-                                      bounds)
-            for core_res in res:
-                for busy, ratio in zip(core_res.busy_iters, core_res.vals):
-                    if busy:
-                        ratios.append(ratio)
+    bounds = 0, 2  # irrelevant for this mode really.
+    for aperfs, mperfs, wc_times in iter_pexecs(results):
+        res = check_amperf_ratios(aperfs, mperfs, wc_times, busy_thresh,
+                                  bounds)
+        for core_res in res:
+            for busy, ratio in zip(core_res.busy_iters, core_res.vals):
+                if busy:
+                    ratios.append(ratio)
     return ratios
 
 
@@ -160,6 +165,14 @@ def plot_dropoff(jsn, output_filename):
     plt.savefig(output_filename)
 
 
+def load_results(filename):
+    """Load a Krun results file, in any of the formats Krun can write. The
+    measurements are only read from disk as they are needed."""
+
+    Results.ok_to_instantiate = True
+    return Results(None, None, results_file=filename)
+
+
 def load_json(filename, bzip=True):
     if bzip:
         fn = bz2.BZ2File
@@ -193,10 +206,10 @@ if __name__ == "__main__":
             busy_thresh = int(sys.argv[3])
         except IndexError:
             usage()
-        jsn = load_json(filename)
+        results = load_results(filename)
         output_filename = "%s-amstats-%s.json" % (filename[:dot_index],
                                                   busy_thresh)
-        analyse_amperf(jsn, busy_thresh, output_filename)
+        analyse_amperf(results, busy_thresh, output_filename)
     elif mode == "plot-dropoff":
         jsn = load_json(filename, bzip=False)
         output_filename = "%s-dropoff.pdf" % filename[:dot_index]
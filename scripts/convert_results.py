@@ -0,0 +1,34 @@
+#!/usr/bin/env python2.7
+
+"""Convert a Krun results file between the formats Krun can write.
+
+Usage: convert_results.py <input results file> <output results file>
+
+The output format is chosen by the extension of the output file name:
+`.json.bz2`, `.json.gz`, `.json.xz` or `.json` for the archival JSON format
+(compressed accordingly), or `.bin` for the binary container. The input
+format is detected automatically. Conversion is lossless in all directions.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from krun.results import Results
+
+
+def usage():
+    print(__doc__)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        in_filename, out_filename = sys.argv[1:]
+    except ValueError:
+        usage()
+
+    Results.ok_to_instantiate = True
+    results = Results(None, None, results_file=in_filename)
+    results.filename = out_filename
+    results.write_to_file()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python2.7
+
+"""Report the progress of a Krun session.
+
+Usage: progress.py <manifest file>
+
+Prints the number of completed (C), outstanding (O), errored (E) and timed
+out (T) process executions, and the percentage of non-skipped process
+executions which have been run. If the session uses a manifest index (see the
+MANIFEST_INDEX config option), and the index is up-to-date, only the index is
+read, otherwise the whole manifest is scanned (as scripts/progress.awk does).
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from krun.manifest_index import MANIFEST_FLAGS, read_manifest_index
+
+
+def usage():
+    print(__doc__)
+    sys.exit(1)
+
+
+def scan_manifest(path):
+    flag_counts = dict((flag, 0) for flag in MANIFEST_FLAGS)
+    with open(path) as fh:
+        for line in fh:
+            if line.strip() == "keys":
+                break
+        for line in fh:
+            flag_counts[line.split(" ", 1)[0]] += 1
+    return flag_counts
+
+
+if __name__ == "__main__":
+    try:
+        path, = sys.argv[1:]
+    except ValueError:
+        usage()
+
+    state = read_manifest_index(path)
+    if state is not None:
+        flag_counts = state["flag_counts"]
+    else:
+        flag_counts = scan_manifest(path)
+
+    num_run = flag_counts["C"] + flag_counts["E"] + flag_counts["T"]
+    total = num_run + flag_counts["O"]
+    percent = 100.0 * num_run / total if total else 100.0
+    print("C=%d  O=%d  E=%d  T=%d   %.2f%%" %
+          (flag_counts["C"], flag_counts["O"], flag_counts["E"],
+           flag_counts["T"], percent))
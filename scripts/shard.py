@@ -0,0 +1,76 @@
+#!/usr/bin/env python2.7
+
+"""Shard a Krun campaign across several identical machines.
+
+Usage: shard.py plan <config.krun> <shard dir> <num shards>
+       shard.py status <shard dir>
+       shard.py merge <shard dir> <output results file>
+
+`plan` divides the campaign's process executions into <num shards> disjoint
+shards, writing the plan to <shard dir>, which must be shared by all of the
+machines (e.g. over NFS). Each machine then runs `krun.py --shard-dir <shard
+dir> <config.krun>`, which claims a shard and runs only its process
+executions. At the end of the session, each machine copies its results back
+to <shard dir>.
+
+`status` shows which shards are claimed and finished.
+
+`merge` combines the results of all shards, once finished, into a single
+results file. The format is chosen by the extension of the output file name
+(see convert_results.py). The merge fails if the machines' audits differ.
+"""
+
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from krun.config import Config
+from krun.scheduler import ManifestManager
+from krun.shard import ShardCoordinator
+
+
+def usage():
+    print(__doc__)
+    sys.exit(1)
+
+
+def plan(config_filename, shard_dir, num_shards):
+    try:
+        num_shards = int(num_shards)
+    except ValueError:
+        usage()
+    config = Config(config_filename)
+    ShardCoordinator(shard_dir).create_plan(
+        config, ManifestManager.make_schedule(config), num_shards)
+
+
+def status(shard_dir):
+    for shard, (start, end, claimed_by, done) in \
+            enumerate(ShardCoordinator(shard_dir).status()):
+        if done:
+            state = "done"
+        elif claimed_by is not None:
+            state = "running"
+        else:
+            state = "unclaimed"
+        print("shard-%d: records %d-%d, %s%s" % (
+            shard, start, end - 1, state,
+            "" if claimed_by is None else " (%s)" % claimed_by))
+
+
+def merge(shard_dir, out_filename):
+    ShardCoordinator(shard_dir).merge(out_filename)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=logging.INFO)
+    commands = {"plan": (plan, 3), "status": (status, 1), "merge": (merge, 2)}
+    try:
+        func, num_args = commands[sys.argv[1]]
+    except (IndexError, KeyError):
+        usage()
+    if len(sys.argv) != num_args + 2:
+        usage()
+    func(*sys.argv[2:])